@@ -2,6 +2,7 @@
 Este módulo define el agente encargado de realizar llamadas a la API de InfoSubvenciones.
 """
 import logging
+import os
 from services.graph_state import GraphState
 
 
@@ -15,6 +16,12 @@ class ApiCallerAgent:
     """
     def __init__(self, infosubvenciones_service):
         self.infosubvenciones_service = infosubvenciones_service
+        # Detalles que necesita el resumen de búsqueda antes de continuar;
+        # el resto se cancela para no esperar a toda la página.
+        self.max_enriched_items = int(os.environ.get('SEARCH_SUMMARY_MAX_ENRICHED', '50'))
+        self.enrich_timeout = float(os.environ.get('SEARCH_SUMMARY_ENRICH_TIMEOUT', '15'))
+        # Resultados máximos que se recorren entre todas las páginas.
+        self.harvest_max_items = int(os.environ.get('SEARCH_HARVEST_MAX_ITEMS', '200'))
 
     def get_details(self, state: GraphState) -> dict:
         """
@@ -63,12 +70,14 @@ class ApiCallerAgent:
                 "last_stream_event_node": node_name
             }
 
-    def search(self, state: GraphState) -> dict:
+    def search(self, state: GraphState, cancelado=None) -> dict:
         """
         Realiza una búsqueda de convocatorias basada en los parámetros del estado.
 
         Args:
             state (GraphState): El estado actual del grafo que contiene los parámetros de búsqueda.
+            cancelado (threading.Event): Si se activa, se interrumpen el
+                recorrido de páginas y la descarga de detalles.
 
         Returns:
             dict: Un diccionario con los resultados de la búsqueda o un mensaje de error.
@@ -86,14 +95,21 @@ class ApiCallerAgent:
             }
 
         try:
-            data = self.infosubvenciones_service.buscar_convocatorias(params)
+            busqueda = self.infosubvenciones_service.abrir_busqueda(
+                params, max_items=self.harvest_max_items, hibrida=True,
+                cancelado=cancelado
+            )
+            data = busqueda.pagina
+            data['convocatoriasDetails'] = busqueda.take(
+                self.max_enriched_items, timeout=self.enrich_timeout
+            )
             total_elements_available = 0
 
             if isinstance(data, dict):
                 total_elements_available = data.get('totalElements', 0)
-                # Aseguramos que 'itemCount' refleje el total de elementos encontrados
-                # para dar una idea completa de la magnitud de los resultados.
-                data['itemCount'] = total_elements_available
+                # 'itemCount' refleja los elementos realmente recuperados;
+                # 'totalElements' conserva el total que anuncia la API.
+                data['itemCount'] = len(data.get('content') or [])
             else:
                 return {
                     "api_response_data": {
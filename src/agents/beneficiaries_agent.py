@@ -9,6 +9,7 @@ import json
 from typing import Any
 from services.graph_state import GraphState
 from services.infosubvenciones_service import info_subvenciones_service
+from services.beneficiarios_analytics import beneficiarios_analytics
 
 
 logger = logging.getLogger(__name__)
@@ -27,6 +28,8 @@ class BeneficiariesAgent:
     def __init__(self):
         """Inicializa el agente y el servicio de subvenciones."""
         self.infosubvenciones_service = info_subvenciones_service
+        # Caché columnar por año: sólo se piden a la API los años que faltan.
+        self.analytics = beneficiarios_analytics
         self.node_name = "get_beneficiaries_node"
 
     def _parse_years(self, extracted_years_str: str) -> list[int]:
@@ -148,9 +151,7 @@ class BeneficiariesAgent:
 
         try:
             logger.info("%s: Consultando la API para los años: %s", self.node_name, target_years)
-            api_response = self.infosubvenciones_service.obtener_beneficiarios_por_anno(
-                target_years
-            )
+            api_response = self.analytics.tabla(target_years).registros
             self._process_api_response(api_response, api_data)
 
         except Exception as e:  # pylint: disable=broad-exception-caught
@@ -0,0 +1,76 @@
+"""
+Este módulo define el ConcessionsAgent, responsable de buscar concesiones y
+ayudas de estado (por NIF/CIF, convocatoria o referencia SA) a través del
+servicio de subvenciones.
+"""
+import logging
+import os
+from services.graph_state import GraphState
+from services.infosubvenciones_service import info_subvenciones_service
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = {
+    "BUSCAR_CONCESIONES": "concesiones/busqueda",
+    "BUSCAR_AYUDAS_ESTADO": "ayudasestado/busqueda",
+}
+
+
+# pylint: disable=too-few-public-methods
+class ConcessionsAgent:
+    """
+    Agente que recorre todas las páginas de una búsqueda de concesiones o de
+    ayudas de estado, hasta CONCESIONES_CHAT_MAX_ITEMS registros.
+    """
+    def __init__(self, max_items: int = None):
+        """Inicializa el agente y el servicio de subvenciones."""
+        self.infosubvenciones_service = info_subvenciones_service
+        self.max_items = max_items or int(
+            os.environ.get('CONCESIONES_CHAT_MAX_ITEMS', '1000'))
+
+    def search_concessions(self, state: GraphState) -> dict:
+        """
+        Busca concesiones o ayudas de estado según la intención del estado.
+
+        Args:
+            state: El estado actual del grafo, que contiene los parámetros de la API.
+
+        Returns:
+            Un diccionario con los registros obtenidos o un mensaje de error.
+        """
+        node_name = "search_concessions_node"
+        params = state.get("api_call_params")
+        if not params:
+            logger.warning("%s: No se proporcionaron filtros para la búsqueda.", node_name)
+            return {
+                "error_message": ("Por favor, indica un NIF/CIF, un número de "
+                                  "convocatoria o una referencia de ayuda de estado."),
+                "last_stream_event_node": node_name
+            }
+
+        endpoint = ENDPOINTS.get(state.get("intent"), "concesiones/busqueda")
+        try:
+            logger.info("%s: Recorriendo %s con params: %s", node_name, endpoint, params)
+            paginador = self.infosubvenciones_service.iterar_registros(
+                endpoint, params, max_items=self.max_items
+            )
+            registros = list(paginador)
+            logger.info("%s: %d registros en %d páginas (completo: %s).", node_name,
+                        len(registros), paginador.paginas, paginador.completo)
+            return {
+                "api_response_data": {
+                    "content": registros,
+                    "totalElements": paginador.total_elements or len(registros),
+                    "harvestCompleto": paginador.completo
+                },
+                "last_stream_event_node": node_name
+            }
+
+        # pylint: disable=broad-exception-caught
+        except Exception as e:
+            error_msg = f"Error crítico al llamar a la API de concesiones: {e}"
+            logger.error(error_msg, exc_info=True)
+            return {
+                "error_message": error_msg,
+                "last_stream_event_node": node_name
+            }
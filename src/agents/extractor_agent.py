@@ -4,34 +4,192 @@ para extraer información clave como la intención, identificadores,
 parámetros de búsqueda y otros datos relevantes utilizando un modelo de lenguaje.
 """
 import logging
+import os
+from typing import Optional
 from services.graph_state import GraphState
 from services.gemini_helpers import (
     generate_content_non_stream,
     parse_json_from_text,
 )
+from services.concesiones_export import normalizar_nif
+from services.intent_router import VALID_INTENTS, intent_router
 
 logger = logging.getLogger(__name__)
 
 
+def _validate_convocatoria_id(id_text: str) -> tuple:
+    """
+    Valida el ID devuelto por el modelo.
+
+    Returns:
+        Tupla (id, mensaje de error); uno de los dos es None.
+    """
+    if id_text.startswith("ERROR_"):
+        return None, f"Error del modelo al extraer ID: {id_text}"
+    extracted_id = id_text.strip()
+    if extracted_id == "NO_ID" or not extracted_id:
+        return None, "No pude identificar el número de la convocatoria en tu consulta."
+    logger.info("ID de convocatoria extraído: %s", extracted_id)
+    return extracted_id, None
+
+
+def _build_search_params(parsed_json: dict, query: str, node_name: str) -> tuple:
+    """
+    Construye los parámetros de búsqueda de convocatorias a partir del JSON
+    del modelo, usando la consulta original si no hay descripción.
+
+    Returns:
+        Tupla (api_params, mensaje de error); uno de los dos es None.
+    """
+    if not parsed_json:
+        return None, "No se pudieron determinar parámetros de búsqueda válidos."
+    api_params = {
+        'page': parsed_json.get('page', '0'),
+        'pageSize': parsed_json.get('pageSize', '50'),
+        'descripcion': (parsed_json.get('descripcion') or '').strip(),
+        'descripcionTipoBusqueda': parsed_json.get(
+            'descripcionTipoBusqueda', '1'
+        ) or '1'
+    }
+    if parsed_json.get('fechaDesde'):
+        api_params['fechaDesde'] = parsed_json['fechaDesde']
+    if parsed_json.get('fechaHasta'):
+        api_params['fechaHasta'] = parsed_json['fechaHasta']
+
+    if not api_params['descripcion'] and query:
+        logger.info(
+            "%s: Descripción vacía, usando consulta original '%s'.",
+            node_name, query
+        )
+        api_params['descripcion'] = query
+    if not api_params['descripcion']:
+        return None, "No se proporcionó un término de búsqueda."
+    return api_params, None
+
+
+def _validate_years(years) -> tuple:
+    """
+    Valida los años devueltos por el modelo (cadena "2022,2023" o lista).
+
+    Returns:
+        Tupla (años separados por comas, mensaje de error); uno de los dos es None.
+    """
+    if isinstance(years, list):
+        years = ",".join(str(y) for y in years)
+    if not isinstance(years, str) or not years.strip():
+        return None, ("No pude identificar ningún año en tu consulta. "
+                      "Por favor, sé más claro (ej: 'beneficiarios de 2023').")
+    logger.info("Años extraídos: %s", years)
+    return years, None
+
+
+def _build_party_params(parsed_json: dict) -> tuple:
+    """
+    Construye los parámetros de búsqueda de partidos políticos.
+
+    Returns:
+        Tupla (api_params, mensaje de error); uno de los dos es None.
+    """
+    if not parsed_json or not parsed_json.get("beneficiario"):
+        return None, "No pude identificar el nombre del partido en tu consulta."
+    return {
+        "nombre": parsed_json.get("beneficiario"),
+        "fechaDesde": parsed_json.get("fechaDesde", ""),
+        "fechaHasta": parsed_json.get("fechaHasta", "")
+    }, None
+
+
+def _build_concession_params(parsed_json: dict, intent: str) -> tuple:
+    """
+    Construye los filtros de búsqueda de concesiones o de ayudas de estado:
+    un NIF/CIF, un número de convocatoria o (sólo en ayudas de estado) una
+    referencia SA, más las fechas opcionales.
+
+    Returns:
+        Tupla (api_params, mensaje de error); uno de los dos es None.
+    """
+    parsed_json = parsed_json or {}
+    api_params = {}
+    nif = normalizar_nif(str(parsed_json.get("nifCif") or ""))
+    if nif:
+        api_params["nifCif"] = nif
+    numero = str(parsed_json.get("numeroConvocatoria") or "").strip()
+    if numero.isdigit():
+        api_params["numeroConvocatoria"] = numero
+    if intent == "BUSCAR_AYUDAS_ESTADO":
+        referencia = "".join(c for c in str(parsed_json.get("ayudaEstado") or "")
+                             if c.isdigit())
+        if referencia:
+            api_params["ayudaEstado"] = referencia
+    if not api_params:
+        return None, ("No pude identificar un NIF/CIF, un número de convocatoria "
+                      "ni una referencia de ayuda de estado en tu consulta.")
+    for clave in ("fechaDesde", "fechaHasta"):
+        if parsed_json.get(clave):
+            api_params[clave] = parsed_json[clave]
+    return api_params, None
+
+
 class ExtractorAgent:
     """
     Agente que utiliza un modelo de lenguaje para extraer datos estructurados
     de las consultas del usuario y del historial de chat.
     """
-    def __init__(self, model, prompts: dict):
+    def __init__(self, model, prompts: dict, router=None):
         """
         Inicializa el agente con un modelo y plantillas de prompts.
 
         Args:
             model: El modelo de lenguaje a utilizar para la extracción.
             prompts (dict): Un diccionario de plantillas de prompts.
+            router: Enrutador local de intenciones; por defecto el compartido.
         """
         self._model = model
         self.prompts = prompts
+        self.router = router or intent_router
+        # Con la extracción fusionada, una sola llamada al LLM devuelve la
+        # intención y los datos que necesita.
+        self.fused_extraction = (
+            os.environ.get('EXTRACTION_FUSED', '0') == '1'
+            and not prompts.get('intent_and_slots', 'ERROR').startswith('ERROR')
+        )
 
     def determine_intent(self, state: GraphState) -> dict:
         """
         Determina la intención principal de la consulta del usuario.
+        Consulta primero el enrutador local y sólo recurre al LLM si éste
+        no alcanza la confianza mínima.
+
+        Args:
+            state: El estado actual del grafo.
+
+        Returns:
+            Un diccionario con la intención determinada y, si el enrutador
+            los ha resuelto, los datos extraídos (ID o años).
+        """
+        logger.info("Nodo: determine_intent_node, Consulta: %s", state['original_query'])
+        return self.route_intent_locally(state) or self.classify_intent(state)
+
+    def route_intent_locally(self, state: GraphState) -> Optional[dict]:
+        """
+        Intenta resolver la intención (y sus datos) con el enrutador local.
+
+        Returns:
+            La actualización del estado, o None si hay que consultar al LLM.
+        """
+        original_query = state['original_query']
+        decision = self.router.route(original_query)
+        if decision is None:
+            return None
+        logger.info("Intención resuelta localmente (%s, %.2f): %s para '%s'",
+                    decision.origen, decision.confidence, decision.intent,
+                    original_query)
+        return {"intent": decision.intent, **decision.slots,
+                "last_stream_event_node": "determine_intent_node"}
+
+    def classify_intent(self, state: GraphState) -> dict:
+        """
+        Determina la intención con el LLM (y sus datos, en modo fusionado).
 
         Args:
             state: El estado actual del grafo.
@@ -41,31 +199,70 @@ class ExtractorAgent:
         """
         node_name = "determine_intent_node"
         original_query = state['original_query']
-        logger.info("Nodo: %s, Consulta: %s", node_name, original_query)
+        if self.fused_extraction:
+            return self._determine_intent_and_slots(state, node_name)
 
         prompt = self.prompts['orchestrator'] \
             .replace('FORMATTED_CHAT_HISTORY', state['formatted_chat_history']) \
             .replace('ORIGINAL_QUERY', original_query)
 
-        intent_response = generate_content_non_stream(self._model, prompt)
+        intent_response = generate_content_non_stream(
+            self._model, prompt, cache_template='orchestrator', cache_query=original_query
+        )
         intent = intent_response.strip()
         logger.info("Intención determinada: %s para '%s'", intent, original_query)
 
-        valid_intents = [
-            "OBTENER_CONVOCATORIA_DETALLES",
-            "BUSCAR_CONVOCATORIAS_GENERAL",
-            "BUSCAR_BENEFICIARIOS_POR_ANNO",
-            "GENERAL_CONVERSATION",
-            "BUSCAR_PARTIDOS_POLITICOS"
-        ]
-        if intent not in valid_intents:
+        if intent not in VALID_INTENTS:
             logger.warning(
                 "Intención no válida '%s', usando GENERAL_CONVERSATION por defecto.",
                 intent
             )
             intent = "GENERAL_CONVERSATION"
+        else:
+            self.router.record(original_query, intent)
         return {"intent": intent, "last_stream_event_node": node_name}
 
+    def _determine_intent_and_slots(self, state: GraphState, node_name: str) -> dict:
+        """
+        Determina la intención y extrae sus datos en una única llamada al LLM.
+        Los datos que no superan la validación se dejan vacíos para que el
+        grafo los extraiga con el nodo específico de la intención.
+        """
+        original_query = state['original_query']
+        prompt = self.prompts['intent_and_slots'] \
+            .replace('FORMATTED_CHAT_HISTORY', state['formatted_chat_history']) \
+            .replace('ORIGINAL_QUERY', original_query)
+        response_text = generate_content_non_stream(
+            self._model, prompt, cache_template='extract_intent_and_slots',
+            cache_query=original_query
+        )
+        parsed_json = parse_json_from_text(response_text, default_if_error={})
+        logger.info("Intención y datos extraídos (fusionado): %s", parsed_json)
+
+        intent = (parsed_json.get("intent") or "").strip()
+        if intent not in VALID_INTENTS:
+            logger.warning(
+                "Intención no válida '%s', usando GENERAL_CONVERSATION por defecto.",
+                intent
+            )
+            return {"intent": "GENERAL_CONVERSATION", "last_stream_event_node": node_name}
+        self.router.record(original_query, intent)
+
+        result = {"intent": intent, "last_stream_event_node": node_name}
+        if intent == "OBTENER_CONVOCATORIA_DETALLES":
+            result["extracted_convocatoria_id"], _ = _validate_convocatoria_id(
+                str(parsed_json.get("convocatoria_id") or ""))
+        elif intent == "BUSCAR_CONVOCATORIAS_GENERAL":
+            result["api_call_params"], _ = _build_search_params(
+                parsed_json, original_query, node_name)
+        elif intent == "BUSCAR_BENEFICIARIOS_POR_ANNO":
+            result["extracted_years"], _ = _validate_years(parsed_json.get("years"))
+        elif intent == "BUSCAR_PARTIDOS_POLITICOS":
+            result["api_call_params"], _ = _build_party_params(parsed_json)
+        elif intent in ("BUSCAR_CONCESIONES", "BUSCAR_AYUDAS_ESTADO"):
+            result["api_call_params"], _ = _build_concession_params(parsed_json, intent)
+        return result
+
     def extract_convocatoria_id(self, state: GraphState) -> dict:
         """
         Extrae un ID de convocatoria de la consulta del usuario.
@@ -81,19 +278,10 @@ class ExtractorAgent:
             .replace('FORMATTED_CHAT_HISTORY', state['formatted_chat_history']) \
             .replace('ORIGINAL_QUERY', state['original_query'])
 
-        id_text = generate_content_non_stream(self._model, prompt)
-        error_msg, extracted_id = None, None
-
-        if id_text.startswith("ERROR_"):
-            error_msg = f"Error del modelo al extraer ID: {id_text}"
-        else:
-            extracted_id = id_text.strip()
-            if extracted_id == "NO_ID" or not extracted_id:
-                error_msg = ("No pude identificar el número de la convocatoria "
-                             "en tu consulta.")
-                extracted_id = None
-            else:
-                logger.info("ID de convocatoria extraído: %s", extracted_id)
+        id_text = generate_content_non_stream(
+            self._model, prompt, cache_template='convocatoria_extractor'
+        )
+        extracted_id, error_msg = _validate_convocatoria_id(id_text)
 
         return {
             "extracted_convocatoria_id": extracted_id,
@@ -135,42 +323,18 @@ class ExtractorAgent:
             "Prompt para extracción (extract_search_params):\n%s", prompt
         )
 
-        params_text = generate_content_non_stream(self._model, prompt)
+        params_text = generate_content_non_stream(
+            self._model, prompt, cache_template='extract_params', cache_query=query
+        )
         parsed_json = parse_json_from_text(params_text, default_if_error={})
         logger.info(
             "Parámetros parseados del LLM (extract_search_params): %s", parsed_json
         )
 
-        api_params, error_msg = None, None
-
-        if not parsed_json:
-            error_msg = "No se pudieron determinar parámetros de búsqueda válidos."
+        api_params, error_msg = _build_search_params(parsed_json, query, node_name)
+        if error_msg:
             logger.warning("%s: %s (LLM output: '%s')",
-                         node_name, error_msg, params_text)
-        else:
-            api_params = {
-                'page': parsed_json.get('page', '0'),
-                'pageSize': parsed_json.get('pageSize', '50'),
-                'descripcion': parsed_json.get('descripcion', '').strip(),
-                'descripcionTipoBusqueda': parsed_json.get(
-                    'descripcionTipoBusqueda', '1'
-                )
-            }
-            if parsed_json.get('fechaDesde'):
-                api_params['fechaDesde'] = parsed_json['fechaDesde']
-            if parsed_json.get('fechaHasta'):
-                api_params['fechaHasta'] = parsed_json['fechaHasta']
-
-            if not api_params['descripcion'] and query:
-                logger.info(
-                    "%s: Descripción vacía, usando consulta original '%s'.",
-                    node_name, query
-                )
-                api_params['descripcion'] = query
-            if not api_params['descripcion']:
-                error_msg = "No se proporcionó un término de búsqueda."
-                logger.warning("%s: %s", node_name, error_msg)
-                api_params = None
+                           node_name, error_msg, params_text)
 
         if error_msg and not api_params:
             logger.warning(
@@ -205,15 +369,9 @@ class ExtractorAgent:
             .replace('ORIGINAL_QUERY', original_query)
         logger.info("Prompt para extracción de años: %s", prompt)
 
-        extracted_years = generate_content_non_stream(self._model, prompt)
-        error_msg = None
-
-        if not isinstance(extracted_years, str) or not extracted_years:
-            error_msg = ("No pude identificar ningún año en tu consulta. "
-                         "Por favor, sé más claro (ej: 'beneficiarios de 2023').")
-            extracted_years = None
-        else:
-            logger.info("Años extraídos: %s", extracted_years)
+        extracted_years, error_msg = _validate_years(
+            generate_content_non_stream(self._model, prompt, cache_template='extract_years')
+        )
 
         return {
             "extracted_years": extracted_years,
@@ -238,23 +396,47 @@ class ExtractorAgent:
             node_name, query
         )
         prompt = self.prompts['extract_party_params'].replace('ORIGINAL_QUERY', query)
-        params_text = generate_content_non_stream(self._model, prompt)
+        params_text = generate_content_non_stream(
+            self._model, prompt, cache_template='extract_party_params'
+        )
         parsed_json = parse_json_from_text(params_text, default_if_error={})
         logger.info(
             "Params extraídos del LLM (extract_party_params): %s", parsed_json
         )
 
-        if not parsed_json or not parsed_json.get("beneficiario"):
-            return {
-                "error_message": ("No pude identificar el nombre del partido en tu "
-                                "consulta."),
-                "last_stream_event_node": node_name
-            }
-        return {
-            "api_call_params": {
-                "nombre": parsed_json.get("beneficiario"),
-                "fechaDesde": parsed_json.get("fechaDesde", ""),
-                "fechaHasta": parsed_json.get("fechaHasta", "")
-            },
-            "last_stream_event_node": node_name
-        }
+        api_params, error_msg = _build_party_params(parsed_json)
+        if error_msg:
+            return {"error_message": error_msg, "last_stream_event_node": node_name}
+        return {"api_call_params": api_params, "last_stream_event_node": node_name}
+
+    def extract_concession_params(self, state: GraphState) -> dict:
+        """
+        Extrae los filtros para buscar concesiones o ayudas de estado.
+
+        Args:
+            state: El estado actual del grafo.
+
+        Returns:
+            Un diccionario con los parámetros para la API o un mensaje de error.
+        """
+        node_name = "extract_concession_params_node"
+        query = state['original_query']
+        logger.info(
+            "Nodo: %s, extrayendo params para buscar concesiones de: '%s'",
+            node_name, query
+        )
+        prompt = self.prompts['extract_concession_params'] \
+            .replace('FORMATTED_CHAT_HISTORY', state['formatted_chat_history']) \
+            .replace('ORIGINAL_QUERY', query)
+        params_text = generate_content_non_stream(
+            self._model, prompt, cache_template='extract_concession_params'
+        )
+        parsed_json = parse_json_from_text(params_text, default_if_error={})
+        logger.info(
+            "Params extraídos del LLM (extract_concession_params): %s", parsed_json
+        )
+
+        api_params, error_msg = _build_concession_params(parsed_json, state["intent"])
+        if error_msg:
+            return {"error_message": error_msg, "last_stream_event_node": node_name}
+        return {"api_call_params": api_params, "last_stream_event_node": node_name}
@@ -6,6 +6,7 @@ el estado del grafo.
 import logging
 import json
 import re
+from services.context_builder import context_builder, importe
 from services.graph_state import GraphState
 
 logger = logging.getLogger(__name__)
@@ -18,11 +19,12 @@ class GeneratorAgent:
     """
 
     def __init__(self, model, prompts: dict, llm_helper_non_stream: callable,
-                 llm_helper_stream: callable = None):
+                 llm_helper_stream: callable = None, digest_store=None):
         self._model = model
         self.prompts = prompts
         self._call_llm_non_stream = llm_helper_non_stream
         self._call_llm_stream = llm_helper_stream
+        self.digest_store = digest_store
 
     def _prepare_response_state(self, state: GraphState, prompt_key: str,
                                 node_name: str, replacements: dict) -> dict:
@@ -58,9 +60,11 @@ class GeneratorAgent:
         logger.info("Nodo: %s (preparando para stream)", node_name)
 
         detalles = state.get("api_response_data")
-        detalles_texto = json.dumps(
-            detalles, ensure_ascii=False, indent=2
-        ) if detalles else "No se encontró la convocatoria."
+        if detalles:
+            detalles_texto, _ = context_builder.pack_object('detailed_response', detalles)
+            detalles_texto += self._digest_texto(state.get("extracted_convocatoria_id"))
+        else:
+            detalles_texto = "No se encontró la convocatoria."
 
         replacements = {
             "CHAT_HISTORY": state['formatted_chat_history'],
@@ -71,6 +75,22 @@ class GeneratorAgent:
             state, 'detailed_response', node_name, replacements
         )
 
+    def _digest_texto(self, numero) -> str:
+        """
+        Digest precalculado de la convocatoria (fechas, presupuesto, requisitos
+        de las bases reguladoras) para añadir a los detalles, o "" si aún no
+        existe; en ese caso queda registrada la petición para calcularlo.
+        """
+        if self.digest_store is None or not numero or numero == "NO_ID":
+            return ""
+        digest = self.digest_store.solicitar(numero)
+        if not digest:
+            return ""
+        digest = {k: v for k, v in digest.items() if k not in ("creado", "con_bases")}
+        logger.info("Usando el digest precalculado de la convocatoria %s.", numero)
+        return ("\n\nResumen precalculado de las bases reguladoras (JSON):\n"
+                + json.dumps(digest, ensure_ascii=False))
+
     def generate_search_summary(self, state: GraphState) -> dict:
         """
         Prepara un resumen de los resultados de búsqueda de convocatorias.
@@ -82,25 +102,36 @@ class GeneratorAgent:
         num_items = resultados.get('itemCount', 0) if isinstance(
             resultados, dict
         ) else 0
+        total_items = resultados.get('totalElements', num_items) if isinstance(
+            resultados, dict
+        ) else 0
 
         resumen_str = "No se encontraron resultados."
-        convocatorias_details = resultados.get('convocatoriasDetails')
-        print("convocatorias_details: ", convocatorias_details)
+        convocatorias_details = resultados.get('convocatoriasDetails') or {}
         if num_items > 0 and isinstance(resultados.get('content'), list):
-            items = []
-            for item in resultados['content']:
+            def render(item):
                 id_ = str(item.get('id'))
-                items.append(
+                # Puede faltar el detalle si no llegó dentro del límite de espera.
+                detalle = convocatorias_details.get(id_, {})
+                return (
                     f"ID: {id_}, "
                     f"Num. Convocatoria: {item.get('numeroConvocatoria')}, "
                     f"Fecha: {item.get('fechaRecepcion')}, "
                     f"Título: {item.get('descripcion')}, "
                     f"Entidad: {item.get('nivel2')}"
-                    f"Región: {convocatorias_details[id_].get('regiones')}, "
-                    f"Presupuesto Total (en Euros): {convocatorias_details[id_].get('presupuestoTotal', 'N/A')}, "
-                    f"Tipos de Beneficiarios: {convocatorias_details[id_].get('tiposBeneficiarios', [])}"
+                    f"Región: {detalle.get('regiones', 'N/A')}, "
+                    f"Presupuesto Total (en Euros): {detalle.get('presupuestoTotal', 'N/A')}, "
+                    f"Tipos de Beneficiarios: {detalle.get('tiposBeneficiarios', [])}"
                 )
-            resumen_str = "\n".join(items) if items else "Info no disponible."
+            # Las filas ya vienen ordenadas por relevancia; se incluyen las
+            # que caben en el presupuesto de tokens.
+            resumen_str, report = context_builder.pack_rows(
+                'search_summary', resultados['content'], render=render
+            )
+            resumen_str = resumen_str or "Info no disponible."
+            if total_items > report.filas_incluidas:
+                resumen_str += (f"\n(Se muestran los primeros {report.filas_incluidas} de "
+                                f"{total_items} resultados.)")
 
         replacements = {
             "CHAT_HISTORY_STR": state['formatted_chat_history'],
@@ -109,7 +140,7 @@ class GeneratorAgent:
                 state.get("api_call_params", {}), ensure_ascii=False
             ),
             "RESUMEN_PARA_PROMPT_STR": resumen_str,
-            "{num_items}": str(num_items)
+            "{num_items}": str(total_items)
         }
         return self._prepare_response_state(
             state, 'search_summary', node_name, replacements
@@ -138,9 +169,15 @@ class GeneratorAgent:
         logger.info("Nodo: %s (preparando para stream)", node_name)
 
         beneficiaries_data = state.get("api_response_data")
-        data_json = json.dumps(
-            beneficiaries_data, ensure_ascii=False, indent=2
-        ) if beneficiaries_data else "{}"
+        data_json = "{}"
+        if isinstance(beneficiaries_data, dict) and beneficiaries_data:
+            # Cada año conserva sus beneficiarios de mayor importe.
+            data_json, report = context_builder.pack_groups(
+                'beneficiaries_summary', beneficiaries_data, sort_key=importe
+            )
+            if report.recortado:
+                data_json += (f"\n(Se muestran los {report.filas_incluidas} beneficiarios "
+                              f"de mayor importe de {report.filas_totales}.)")
 
         replacements = {
             "ORIGINAL_QUERY": state['original_query'],
@@ -158,9 +195,18 @@ class GeneratorAgent:
         logger.info("Nodo: %s (preparando para stream)", node_name)
 
         parties_data = state.get("api_response_data")
-        data_json = json.dumps(
-            parties_data, ensure_ascii=False, indent=2
-        ) if parties_data else "{}"
+        data_json = "{}"
+        if parties_data:
+            if isinstance(parties_data, list):
+                parties_data = {"content": parties_data}
+            datos = {k: v for k, v in parties_data.items()
+                     if k in ("content", "totalElements")}
+            data_json, report = context_builder.pack_groups(
+                'parties_summary', datos, sort_key=importe
+            )
+            if report.recortado:
+                data_json += (f"\n(Se muestran las {report.filas_incluidas} concesiones "
+                              f"de mayor importe de {report.filas_totales}.)")
 
         replacements = {
             "ORIGINAL_QUERY": state['original_query'],
@@ -169,3 +215,29 @@ class GeneratorAgent:
         return self._prepare_response_state(
             state, 'parties_summary', node_name, replacements
         )
+
+    def generate_concessions_summary(self, state: GraphState) -> dict:
+        """
+        Prepara un resumen de las concesiones o ayudas de estado encontradas.
+        """
+        node_name = "generate_concessions_summary_node"
+        logger.info("Nodo: %s (preparando para stream)", node_name)
+
+        data_json = "{}"
+        datos = state.get("api_response_data")
+        if datos:
+            datos = {k: v for k, v in datos.items() if k in ("content", "totalElements")}
+            data_json, report = context_builder.pack_groups(
+                'concessions_summary', datos, sort_key=importe
+            )
+            if report.recortado:
+                data_json += (f"\n(Se muestran los {report.filas_incluidas} registros "
+                              f"de mayor importe de {report.filas_totales}.)")
+
+        replacements = {
+            "ORIGINAL_QUERY": state['original_query'],
+            "CONCESSIONS_DATA_JSON": data_json
+        }
+        return self._prepare_response_state(
+            state, 'concessions_summary', node_name, replacements
+        )
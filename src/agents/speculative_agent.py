@@ -0,0 +1,119 @@
+"""
+Este módulo define el SpeculativeIntentAgent, que solapa la clasificación de
+la intención con la extracción de parámetros de búsqueda y la llamada a la
+API de búsqueda.
+
+Mientras el LLM decide la intención, un pool propio ejecuta de forma
+especulativa la rama más probable (búsqueda de convocatorias). Si la
+intención ganadora es la búsqueda, el nodo devuelve ya los parámetros y los
+resultados; si no, la especulación se cancela o se descarta.
+
+La especulación no corre en el pool compartido: la búsqueda espera a las
+páginas y detalles que ella misma encola allí, y bloquear a un worker del
+pool esperando a otros puede agotarlo.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from services.graph_state import GraphState
+
+logger = logging.getLogger(__name__)
+
+SPECULATED_INTENT = "BUSCAR_CONVOCATORIAS_GENERAL"
+SPECULATIVE_WORKERS = int(os.environ.get('SPECULATIVE_WORKERS', '4'))
+
+
+# pylint: disable=too-few-public-methods
+class SpeculativeIntentAgent:
+    """
+    Sustituye al nodo de intención del ExtractorAgent cuando la ejecución
+    especulativa está activada (SPECULATIVE_EXECUTION=1).
+    """
+
+    def __init__(self, extractor, api_caller):
+        """
+        Args:
+            extractor: ExtractorAgent que clasifica y extrae.
+            api_caller: ApiCallerAgent que lanza la búsqueda.
+        """
+        self.extractor = extractor
+        self.api_caller = api_caller
+        self.speculate_api = os.environ.get('SPECULATIVE_API_CALL', '1') == '1'
+        self.timeout = float(os.environ.get('SPECULATIVE_TIMEOUT', '30'))
+        self._lock = threading.Lock()
+        self._stats = {"used": 0, "discarded": 0, "failed": 0, "skipped": 0}
+        self._executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS,
+                                            thread_name_prefix="especulacion")
+        # Con todos los hilos ocupados no se especula: se encolaría tarde.
+        self._slots = threading.BoundedSemaphore(SPECULATIVE_WORKERS)
+
+    def _speculate(self, state: GraphState, cancelled: threading.Event) -> dict:
+        """Extrae los parámetros de búsqueda y, si procede, llama a la API."""
+        try:
+            update = self.extractor.extract_search_params(state)
+            params = update.get("api_call_params")
+            if cancelled.is_set() or not self.speculate_api or not params:
+                return update
+            return {**update, **self.api_caller.search({**state, **update}, cancelled)}
+        finally:
+            self._slots.release()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def determine_intent(self, state: GraphState) -> dict:
+        """
+        Determina la intención mientras especula con la rama de búsqueda.
+
+        Args:
+            state: El estado actual del grafo.
+
+        Returns:
+            La intención y, si ganó la búsqueda, sus parámetros y resultados.
+        """
+        logger.info("Nodo: determine_intent_node (especulativo), Consulta: %s",
+                    state['original_query'])
+        local = self.extractor.route_intent_locally(state)
+        if local is not None or self.extractor.fused_extraction:
+            return local or self.extractor.classify_intent(state)
+
+        cancelled = threading.Event()
+        if not self._slots.acquire(blocking=False):
+            logger.warning("Pool de especulación ocupado; se clasifica sin especular.")
+            self._count("skipped")
+            return self.extractor.classify_intent(state)
+        future = self._executor.submit(self._speculate, state, cancelled)
+
+        result = self.extractor.classify_intent(state)
+        if result.get("intent") != SPECULATED_INTENT:
+            cancelled.set()
+            if future.cancel():
+                self._slots.release()  # No llegó a empezar.
+            self._count("discarded")
+            logger.info("Especulación descartada: la intención es %s.", result.get("intent"))
+            return result
+        try:
+            speculated = future.result(timeout=self.timeout)
+        except (FuturesTimeoutError, CancelledError) as e:
+            logger.warning("La especulación no terminó a tiempo: %s", e)
+            cancelled.set()
+            self._count("failed")
+            return result
+        # pylint: disable=broad-exception-caught
+        except Exception as e:
+            logger.error("Error en la rama especulativa: %s", e, exc_info=True)
+            self._count("failed")
+            return result
+        self._count("used")
+        return {**speculated, **result}
+
+    def stats(self) -> dict:
+        """
+        Devuelve cuántas especulaciones se usaron, descartaron, fallaron o no
+        se lanzaron por falta de hilos.
+        """
+        with self._lock:
+            return dict(self._stats)
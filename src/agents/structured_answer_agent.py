@@ -0,0 +1,311 @@
+"""
+Este módulo define el StructuredAnswerAgent, que responde a las consultas de
+beneficiarios por año, de partidos políticos y de concesiones sin pasar los
+datos por el LLM.
+
+Las tablas Markdown y los agregados (los N mayores importes, totales por año
+y por beneficiario, variaciones interanuales) se generan directamente a
+partir de la salida de BeneficiariesAgent (vía la caché columnar de
+`beneficiarios_analytics`), de PoliticalPartiesAgent y de ConcessionsAgent,
+de modo que el usuario ve los datos al instante. Opcionalmente, el LLM añade después de la tabla un breve
+comentario a partir de los agregados, no de los datos completos.
+"""
+import logging
+import os
+from collections import defaultdict
+from typing import Any, Iterable, List, Optional
+from services.beneficiarios_analytics import beneficiarios_analytics
+from services.context_builder import importe
+from services.graph_state import GraphState
+
+logger = logging.getLogger(__name__)
+
+
+def formatear_importe(valor: float) -> str:
+    """Formatea un importe en euros con separadores españoles (1.234,56 €)."""
+    texto = f"{valor:,.2f}".replace(",", "_").replace(".", ",").replace("_", ".")
+    return f"{texto} €"
+
+
+def _celda(valor: Any) -> str:
+    """Escapa un valor para usarlo como celda de una tabla Markdown."""
+    if valor is None:
+        return ""
+    return " ".join(str(valor).split()).replace("|", "\\|")
+
+
+def tabla_markdown(cabecera: List[str], filas: Iterable[List[Any]]) -> str:
+    """Construye una tabla Markdown a partir de la cabecera y las filas."""
+    lineas = ["| " + " | ".join(cabecera) + " |",
+              "|" + "|".join("---" for _ in cabecera) + "|"]
+    lineas.extend("| " + " | ".join(_celda(v) for v in fila) + " |" for fila in filas)
+    return "\n".join(lineas)
+
+
+def _anno(fecha: Optional[str]) -> str:
+    """Año de una fecha ISO (YYYY-MM-DD) o española (DD/MM/YYYY)."""
+    if not fecha:
+        return "N/D"
+    fecha = str(fecha)
+    return fecha[:4] if fecha[:4].isdigit() else fecha[-4:]
+
+
+def _variacion(fila: dict) -> str:
+    """Variación interanual de un total ("+12,5 %"), o "" sin año anterior."""
+    pct = fila.get("variacion_pct")
+    if pct is None:
+        return ""
+    return f"{pct:+.1f} %".replace(".", ",")
+
+
+class StructuredAnswerAgent:
+    """
+    Sustituye a los nodos de resumen de beneficiarios, de partidos y de
+    concesiones del GeneratorAgent cuando las respuestas estructuradas
+    están activadas (STRUCTURED_ANSWERS=1).
+    """
+
+    def __init__(self, prompts: dict, top_n: int = None, narrative: bool = None):
+        """
+        Args:
+            prompts: Plantillas de prompts; usa 'table_narrative'.
+            top_n: Filas máximas de cada tabla.
+            narrative: Si se pide al LLM un comentario tras la tabla.
+        """
+        env = os.environ.get
+        self.prompts = prompts
+        self.top_n = top_n or int(env('STRUCTURED_TOP_N', '20'))
+        if narrative is None:
+            narrative = env('STRUCTURED_NARRATIVE', '1') == '1'
+        prompt = prompts.get("table_narrative") or ""
+        self.narrative = narrative and not prompt.startswith("ERROR")
+
+    def _response_state(self, state: GraphState, node_name: str,
+                        tabla: str, agregados: str) -> dict:
+        """
+        Devuelve la tabla como respuesta directa o, con comentario, como
+        prefijo del stream del LLM.
+        """
+        if not self.narrative or not agregados:
+            return {
+                "agent_response_text": tabla,
+                "stream_generation_prompt": None,
+                "stream_prefix_text": None,
+                "stream_completed_successfully": True,
+                "error_message": state.get("error_message"),
+                "last_stream_event_node": node_name
+            }
+        prompt_text = (self.prompts["table_narrative"]
+                       .replace("ORIGINAL_QUERY", state['original_query'])
+                       .replace("AGREGADOS_TEXTO", agregados))
+        return {
+            "agent_response_text": None,
+            "stream_generation_prompt": prompt_text,
+            "stream_generation_node_name": "generate_table_narrative_node",
+            "stream_prefix_text": tabla + "\n\n",
+            "stream_completed_successfully": True,
+            "error_message": state.get("error_message"),
+            "last_stream_event_node": node_name
+        }
+
+    def generate_beneficiaries_summary(self, state: GraphState) -> dict:
+        """
+        Genera una tabla por año con los beneficiarios de mayor importe, los
+        totales por año con su variación interanual y percentiles y, si hay
+        varios años, los mayores beneficiarios del periodo.
+        """
+        node_name = "generate_beneficiaries_summary_node"
+        logger.info("Nodo: %s (respuesta estructurada)", node_name)
+
+        datos = state.get("api_response_data")
+        if not isinstance(datos, dict) or not datos:
+            tabla = "No se encontraron datos de beneficiarios."
+            return self._response_state(state, node_name, tabla, "")
+
+        con_datos = [int(anno) for anno, filas in datos.items()
+                     if str(anno).isdigit() and isinstance(filas, list) and filas]
+        # Agregados vectorizados sobre la caché columnar que acaba de llenar
+        # BeneficiariesAgent (cacheados por conjunto de años).
+        informe = beneficiarios_analytics.informe(con_datos, self.top_n) if con_datos else {}
+        por_anno = {fila["anno"]: fila for fila in informe.get("por_anno", [])}
+
+        secciones = []
+        for anno in sorted(datos, key=lambda a: (not str(a).isdigit(), str(a))):
+            secciones.append(f"### Beneficiarios {anno}")
+            resumen = por_anno.get(int(anno)) if str(anno).isdigit() else None
+            if not resumen:
+                filas = datos[anno]
+                secciones.append(str(filas) if filas and not isinstance(filas, list) else
+                                 f"No se encontraron datos para el año {anno}.")
+                continue
+            secciones.append(tabla_markdown(
+                ["#", "Beneficiario", "Importe"],
+                ([i, nombre, formatear_importe(total)] for i, (nombre, total, _)
+                 in enumerate(informe["top_por_anno"][int(anno)], start=1))
+            ))
+            if resumen["beneficiarios"] > self.top_n:
+                secciones.append(f"_Se muestran los {self.top_n} mayores importes de "
+                                 f"{resumen['beneficiarios']} beneficiarios._")
+
+        if len(por_anno) > 1:
+            secciones.append("### Totales por año")
+            secciones.append(tabla_markdown(
+                ["Año", "Beneficiarios", "Importe total", "Variación", "Mediana", "P90"],
+                ([f["anno"], f["beneficiarios"], formatear_importe(f["total"]),
+                  _variacion(f), formatear_importe(f["percentiles"]["p50"]),
+                  formatear_importe(f["percentiles"]["p90"])] for f in por_anno.values())
+            ))
+        if informe.get("top_periodo"):
+            secciones.append(f"### Mayores beneficiarios {min(por_anno)}-{max(por_anno)}")
+            secciones.append(tabla_markdown(
+                ["#", "Beneficiario", "Importe total", "Registros"],
+                ([i, nombre, formatear_importe(total), n] for i, (nombre, total, n)
+                 in enumerate(informe["top_periodo"], start=1))
+            ))
+
+        agregados = "\n".join(
+            f"- {f['anno']}: {f['beneficiarios']} beneficiarios, total "
+            f"{formatear_importe(f['total'])} ({_variacion(f) or 'sin año anterior'}); "
+            f"mediana {formatear_importe(f['percentiles']['p50'])}; mayor importe: "
+            f"{informe['top_por_anno'][f['anno']][0][0]} "
+            f"({formatear_importe(informe['top_por_anno'][f['anno']][0][1])})"
+            for f in por_anno.values()
+        )
+        if informe.get("top_periodo"):
+            nombre, total, _ = informe["top_periodo"][0]
+            agregados += (f"\n- Mayor beneficiario del periodo: {nombre} "
+                          f"({formatear_importe(total)})")
+        return self._response_state(state, node_name, "\n\n".join(secciones), agregados)
+
+    def generate_parties_summary(self, state: GraphState) -> dict:
+        """
+        Genera la tabla de concesiones a partidos políticos ordenada por
+        importe y los totales de cada beneficiario por año.
+        """
+        node_name = "generate_parties_summary_node"
+        logger.info("Nodo: %s (respuesta estructurada)", node_name)
+
+        datos = state.get("api_response_data")
+        filas = datos if isinstance(datos, list) else (datos or {}).get("content") or []
+        if not filas:
+            tabla = "No se encontraron concesiones a partidos políticos para tu consulta."
+            return self._response_state(state, node_name, tabla, "")
+
+        ordenadas = sorted(filas, key=importe, reverse=True)
+
+        def beneficiario(fila):
+            nombre = fila.get("beneficiario") or ""
+            return f"[{nombre}]({fila['urlBR']})" if fila.get("urlBR") else nombre
+
+        secciones = [tabla_markdown(
+            ["Fecha", "Beneficiario", "Convocatoria", "Nivel", "Importe"],
+            ([f.get("fechaConcesion"), beneficiario(f), f.get("convocatoria"),
+              f.get("nivel2") or f.get("nivel1"), formatear_importe(importe(f))]
+             for f in ordenadas[:self.top_n])
+        )]
+        total_elements = (datos.get("totalElements") if isinstance(datos, dict)
+                          else None) or len(filas)
+        if total_elements > min(len(ordenadas), self.top_n):
+            secciones.append(f"_Se muestran las {min(len(ordenadas), self.top_n)} "
+                             f"concesiones de mayor importe de {total_elements}._")
+
+        totales = defaultdict(float)
+        for fila in ordenadas:
+            totales[(fila.get("beneficiario") or "N/D",
+                     _anno(fila.get("fechaConcesion")))] += importe(fila)
+        claves = sorted(totales, key=lambda k: (k[1], -totales[k]))
+        secciones.append("### Importe total por beneficiario y año")
+        secciones.append(tabla_markdown(
+            ["Año", "Beneficiario", "Importe total"],
+            ([anno, nombre, formatear_importe(totales[(nombre, anno)])]
+             for nombre, anno in claves)
+        ))
+        agregados = "\n".join(
+            f"- {anno}, {nombre}: {formatear_importe(totales[(nombre, anno)])}"
+            for nombre, anno in claves[:self.top_n]
+        )
+        agregados += (f"\n- Concesiones: {len(filas)}; importe total "
+                      f"{formatear_importe(sum(totales.values()))}")
+        return self._response_state(state, node_name, "\n\n".join(secciones), agregados)
+
+    def generate_concessions_summary(self, state: GraphState) -> dict:
+        """
+        Genera la tabla de concesiones (o de ayudas de estado) ordenada por
+        importe y los totales por año y por beneficiario.
+        """
+        node_name = "generate_concessions_summary_node"
+        logger.info("Nodo: %s (respuesta estructurada)", node_name)
+
+        ayudas_estado = state.get("intent") == "BUSCAR_AYUDAS_ESTADO"
+        datos = state.get("api_response_data") or {}
+        filas = datos.get("content") or []
+        if not filas:
+            tabla = ("No se encontraron ayudas de estado para tu consulta." if ayudas_estado
+                     else "No se encontraron concesiones para tu consulta.")
+            return self._response_state(state, node_name, tabla, "")
+
+        ordenadas = sorted(filas, key=importe, reverse=True)
+        if ayudas_estado:
+            def referencia(fila):
+                sa = fila.get("ayudaEstado") or ""
+                return f"[{sa}]({fila['urlAyudaEstado']})" if fila.get("urlAyudaEstado") else sa
+
+            tabla = tabla_markdown(
+                ["Beneficiario", "Convocatoria", "Objetivo", "Ayuda de Estado", "Importe"],
+                ([f.get("beneficiario"), f.get("convocatoria"), f.get("objetivo"),
+                  referencia(f), formatear_importe(importe(f))]
+                 for f in ordenadas[:self.top_n])
+            )
+        else:
+            def equivalente(fila):
+                valor = fila.get("ayudaEquivalente")
+                return formatear_importe(valor) if isinstance(valor, (int, float)) else ""
+
+            tabla = tabla_markdown(
+                ["Fecha", "Beneficiario", "Convocatoria", "Instrumento", "Importe",
+                 "Ayuda equivalente"],
+                ([f.get("fechaConcesion"), f.get("beneficiario"), f.get("convocatoria"),
+                  f.get("instrumento"), formatear_importe(importe(f)), equivalente(f)]
+                 for f in ordenadas[:self.top_n])
+            )
+        secciones = [tabla]
+        total_elements = datos.get("totalElements") or len(filas)
+        mostradas = min(len(ordenadas), self.top_n)
+        if total_elements > mostradas:
+            secciones.append(f"_Se muestran los {mostradas} registros de mayor importe "
+                             f"de {total_elements}._")
+        if not datos.get("harvestCompleto", True):
+            secciones.append(f"_Los totales se calculan sobre los {len(filas)} "
+                             f"primeros registros._")
+
+        por_anno = defaultdict(lambda: [0, 0.0])
+        por_beneficiario = defaultdict(float)
+        for fila in filas:
+            acumulado = por_anno[_anno(fila.get("fechaConcesion"))]
+            acumulado[0] += 1
+            acumulado[1] += importe(fila)
+            por_beneficiario[fila.get("beneficiario") or "N/D"] += importe(fila)
+        annos = sorted(por_anno)
+        secciones.append("### Importe total por año")
+        secciones.append(tabla_markdown(
+            ["Año", "Registros", "Importe total"],
+            ([anno, por_anno[anno][0], formatear_importe(por_anno[anno][1])]
+             for anno in annos)
+        ))
+        mayores = sorted(por_beneficiario.items(), key=lambda par: -par[1])[:self.top_n]
+        if len(por_beneficiario) > 1:
+            secciones.append("### Mayores beneficiarios")
+            secciones.append(tabla_markdown(
+                ["#", "Beneficiario", "Importe total"],
+                ([i, nombre, formatear_importe(total)]
+                 for i, (nombre, total) in enumerate(mayores, 1))
+            ))
+        agregados = "\n".join(
+            f"- {anno}: {por_anno[anno][0]} registros, "
+            f"{formatear_importe(por_anno[anno][1])}" for anno in annos
+        )
+        agregados += "".join(f"\n- {nombre}: {formatear_importe(total)}"
+                             for nombre, total in mayores[:5])
+        agregados += (f"\n- Registros: {len(filas)} de {total_elements}; importe total "
+                      f"{formatear_importe(sum(por_beneficiario.values()))}")
+        return self._response_state(state, node_name, "\n\n".join(secciones), agregados)
@@ -0,0 +1,191 @@
+"""
+Punto de entrada ASGI de la aplicación.
+
+`/api/chat` se sirve de forma nativa y asíncrona: el grafo (de nodos
+síncronos) se recorre en un executor propio de CHAT_GRAPH_WORKERS hilos y la
+respuesta de Gemini se retransmite con su cliente asíncrono, de modo que la
+espera al LLM, la más larga, no ocupa un hilo por conversación. El resto de rutas (`/api/buscar`, `/api/convocatoria`,
+`/api/metrics`, la interfaz web...) siguen siendo las de la aplicación
+Flask, servidas a través de `asgiref.wsgi.WsgiToAsgi`.
+
+Uso (desde `src/`):
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+import logging
+import uuid
+from asgiref.wsgi import WsgiToAsgi
+
+# pylint: disable=import-error,wrong-import-position
+import main
+from services.session_store import session_store
+
+logger = logging.getLogger(__name__)
+
+CHAT_PATH = "/api/chat"
+_TEXT_HEADERS = [(b"content-type", b"text/plain; charset=utf-8")]
+
+flask_app = WsgiToAsgi(main.app)
+
+
+async def _read_body(receive) -> bytes:
+    """Lee el cuerpo completo de la petición."""
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return body
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _send_text(send, text: str, status: int):
+    await send({"type": "http.response.start", "status": status,
+                "headers": _TEXT_HEADERS})
+    await send({"type": "http.response.body", "body": text.encode("utf-8")})
+
+
+async def _watch_disconnect(receive, disconnected: asyncio.Event):
+    """Marca el evento cuando el cliente cierra la conexión."""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            disconnected.set()
+            return
+
+
+async def _stream_response(receive, send, ai_response, thread_id: str, consulta: str):
+    """Retransmite el stream del LLM y guarda la respuesta al terminar."""
+    await send({"type": "http.response.start", "status": 200,
+                "headers": _TEXT_HEADERS})
+    disconnected = asyncio.Event()
+    watcher = asyncio.create_task(_watch_disconnect(receive, disconnected))
+    chunks = []
+    try:
+        async for chunk in ai_response:
+            if disconnected.is_set():
+                logger.info("Cliente desconectado; se detiene el stream (Thread: %s).",
+                            thread_id)
+                break
+            chunks.append(chunk)
+            await send({"type": "http.response.body",
+                        "body": chunk.encode("utf-8"), "more_body": True})
+    # pylint: disable=broad-exception-caught
+    except Exception as e:
+        logger.error("Error durante el streaming: %s", e, exc_info=True)
+        await send({"type": "http.response.body", "more_body": True,
+                    "body": " Lo siento, ha ocurrido un error al generar la respuesta."
+                            .encode("utf-8")})
+    finally:
+        watcher.cancel()
+        await ai_response.aclose()
+        await asyncio.to_thread(main.update_chat_history, thread_id, consulta,
+                                "".join(chunks))
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _stream_events(receive, send, agent, consulta: str, thread_id: str,
+                         chat_history):
+    """Versión asíncrona de la respuesta SSE de `main`."""
+    headers = [(b"content-type", b"text/event-stream; charset=utf-8")]
+    headers += [(k.lower().encode(), v.encode()) for k, v in main.SSE_HEADERS.items()]
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+    disconnected = asyncio.Event()
+    watcher = asyncio.create_task(_watch_disconnect(receive, disconnected))
+    eventos = agent.astream_chat_events(consulta, chat_history, thread_id)
+    tokens = []
+    try:
+        async for evento in eventos:
+            if disconnected.is_set():
+                break
+            if evento["tipo"] == "token":
+                tokens.append(evento["texto"])
+            await send({"type": "http.response.body", "more_body": True,
+                        "body": main.sse_event(evento).encode("utf-8")})
+        else:
+            await send({"type": "http.response.body", "more_body": True,
+                        "body": main.sse_event({"tipo": "fin", "thread_id": thread_id})
+                        .encode("utf-8")})
+    # pylint: disable=broad-exception-caught
+    except Exception as e:
+        logger.error("Error durante el streaming de eventos: %s", e, exc_info=True)
+        await send({"type": "http.response.body", "more_body": True,
+                    "body": main.sse_event(main.SSE_ERROR).encode("utf-8")})
+    finally:
+        watcher.cancel()
+        await eventos.aclose()
+        await asyncio.to_thread(main.update_chat_history, thread_id, consulta,
+                                "".join(tokens))
+    await send({"type": "http.response.body", "body": b""})
+
+
+def _accepts_events(scope) -> bool:
+    accept = dict(scope.get("headers") or []).get(b"accept", b"")
+    return b"text/event-stream" in accept
+
+
+async def procesar_chat(scope, receive, send):
+    """Versión asíncrona de `main.procesar_chat`."""
+    agent = main.langgraph_agent_instance
+    if not agent:
+        await _send_text(send, "El servicio de chat inteligente no está disponible.", 503)
+        return
+    try:
+        data = json.loads(await _read_body(receive) or b"{}")
+        consulta = data.get('consulta', '')
+        client_thread_id = data.get('thread_id') or str(uuid.uuid4())
+        if not consulta:
+            await _send_text(send, "La consulta es obligatoria", 400)
+            return
+
+        current_chat_history = await asyncio.to_thread(session_store.get, client_thread_id)
+        # Con "Accept: text/event-stream" se envían eventos de progreso.
+        eventos = _accepts_events(scope)
+        if not eventos:
+            ai_response = await agent.aprocess_chat_query(
+                consulta, current_chat_history, client_thread_id
+            )
+    except (ValueError, AttributeError) as e:
+        logger.error("Petición no válida en %s: %s", CHAT_PATH, e)
+        await _send_text(send, "Petición no válida.", 400)
+        return
+    # pylint: disable=broad-exception-caught
+    except Exception as e:
+        logger.error("Error crítico en %s (ASGI): %s", CHAT_PATH, e, exc_info=True)
+        await _send_text(send, "Ocurrió un error interno al procesar tu consulta. "
+                               "Por favor, inténtalo de nuevo más tarde.", 500)
+        return
+
+    if eventos:
+        await _stream_events(receive, send, agent, consulta, client_thread_id,
+                             current_chat_history)
+        return
+    if isinstance(ai_response, str):
+        await asyncio.to_thread(main.update_chat_history, client_thread_id,
+                                consulta, ai_response)
+        if not ai_response.strip():
+            ai_response = "No se pudo generar una respuesta. Inténtalo de nuevo."
+        await _send_text(send, ai_response, 200)
+        return
+    logger.info("Respuesta en modo stream (ASGI) para la consulta: '%s' (Thread: %s)",
+                consulta, client_thread_id)
+    await _stream_response(receive, send, ai_response, client_thread_id, consulta)
+
+
+async def app(scope, receive, send):
+    """Aplicación ASGI: chat nativo y el resto de rutas a través de Flask."""
+    if (scope["type"] == "http" and scope["path"] == CHAT_PATH
+            and scope["method"] == "POST"):
+        await procesar_chat(scope, receive, send)
+    elif scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    else:
+        await flask_app(scope, receive, send)
@@ -4,7 +4,9 @@ Este módulo define la estructura y el flujo de control del grafo de LangGraph.
 Contiene las funciones de enrutamiento condicional y la función principal
 para construir el grafo que orquesta a los agentes.
 """
+import functools
 import logging
+from langgraph.config import get_stream_writer
 from langgraph.graph import END, StateGraph
 from services.graph_state import GraphState
 
@@ -14,6 +16,8 @@ logger = logging.getLogger(__name__)
 def should_extract(state: GraphState) -> str:
     """
     Decide el siguiente nodo de extracción basado en la intención determinada.
+    Si los datos necesarios ya se extrajeron al determinar la intención, salta
+    directamente a la llamada a la API.
 
     Args:
         state: El estado actual del grafo.
@@ -23,19 +27,37 @@ def should_extract(state: GraphState) -> str:
     """
     if state.get("error_message"):
         return "error_handler"
+    if slots_filled(state):
+        return should_call_api(state)
     intent_map = {
         "OBTENER_CONVOCATORIA_DETALLES": "extract_convocatoria_id_node",
         "BUSCAR_CONVOCATORIAS_GENERAL": "extract_search_params_node",
         "BUSCAR_BENEFICIARIOS_POR_ANNO": "extract_years_node",
         "BUSCAR_PARTIDOS_POLITICOS": "extract_party_params_node",
+        "BUSCAR_CONCESIONES": "extract_concession_params_node",
+        "BUSCAR_AYUDAS_ESTADO": "extract_concession_params_node",
         "GENERAL_CONVERSATION": "generate_general_response_node"
     }
     return intent_map.get(state["intent"], "error_handler")
 
 
+def slots_filled(state: GraphState) -> bool:
+    """Indica si ya están los datos que necesita la llamada a la API de la intención."""
+    intent = state.get("intent")
+    if intent == "OBTENER_CONVOCATORIA_DETALLES":
+        return bool(state.get("extracted_convocatoria_id"))
+    if intent == "BUSCAR_BENEFICIARIOS_POR_ANNO":
+        return bool(state.get("extracted_years"))
+    if intent in ("BUSCAR_CONVOCATORIAS_GENERAL", "BUSCAR_PARTIDOS_POLITICOS",
+                  "BUSCAR_CONCESIONES", "BUSCAR_AYUDAS_ESTADO"):
+        return bool(state.get("api_call_params"))
+    return False
+
+
 def should_call_api(state: GraphState) -> str:
     """
-    Decide qué nodo de llamada a la API ejecutar basado en la intención.
+    Decide qué nodo de llamada a la API ejecutar basado en la intención,
+    o el generador de respuesta si los datos ya están en el estado.
 
     Args:
         state: El estado actual del grafo.
@@ -45,6 +67,9 @@ def should_call_api(state: GraphState) -> str:
     """
     if state.get("error_message"):
         return "error_handler"
+    if state.get("api_response_data") is not None:
+        # La llamada ya se hizo de forma especulativa junto a la intención.
+        return should_generate_response(state)
 
     intent = state["intent"]
     if intent == "OBTENER_CONVOCATORIA_DETALLES":
@@ -55,6 +80,8 @@ def should_call_api(state: GraphState) -> str:
         return "get_beneficiaries_node"
     if intent == "BUSCAR_PARTIDOS_POLITICOS":
         return "search_political_parties_node"
+    if intent in ("BUSCAR_CONCESIONES", "BUSCAR_AYUDAS_ESTADO"):
+        return "search_concessions_node"
     return "error_handler"
 
 
@@ -81,9 +108,23 @@ def should_generate_response(state: GraphState) -> str:
         return "generate_beneficiaries_summary_node"
     if intent == "BUSCAR_PARTIDOS_POLITICOS":
         return "generate_parties_summary_node"
+    if intent in ("BUSCAR_CONCESIONES", "BUSCAR_AYUDAS_ESTADO"):
+        return "generate_concessions_summary_node"
     return "error_handler"
 
 
+def notify_start(node_name: str, node_fn):
+    """
+    Envuelve un nodo para que emita un evento de inicio cuando el grafo se
+    ejecuta con stream_mode="custom" (sin efecto con invoke).
+    """
+    @functools.wraps(node_fn)
+    def wrapper(state: GraphState) -> dict:
+        get_stream_writer()({"tipo": "nodo", "nodo": node_name, "estado": "inicio"})
+        return node_fn(state)
+    return wrapper
+
+
 def build_agent_graph(agents: dict) -> StateGraph:
     """
     Construye y configura el StateGraph con todos los nodos y aristas.
@@ -95,34 +136,47 @@ def build_agent_graph(agents: dict) -> StateGraph:
         Una instancia del StateGraph compilado.
     """
     workflow = StateGraph(GraphState)
+
+    def add_node(node_name: str, node_fn):
+        workflow.add_node(node_name, notify_start(node_name, node_fn))
+
     # Añadir nodos
-    workflow.add_node("determine_intent_node", agents['extractor'].determine_intent)
-    workflow.add_node("extract_convocatoria_id_node",
-                      agents['extractor'].extract_convocatoria_id)
-    workflow.add_node("extract_search_params_node",
-                      agents['extractor'].extract_search_params)
-    workflow.add_node("call_infosubvenciones_get_details_node",
-                      agents['api_caller'].get_details)
-    workflow.add_node("call_infosubvenciones_search_node",
-                      agents['api_caller'].search)
-    workflow.add_node("generate_detailed_response_node",
-                      agents['generator'].generate_detailed_response)
-    workflow.add_node("generate_search_summary_node",
-                      agents['generator'].generate_search_summary)
-    workflow.add_node("generate_general_response_node",
-                      agents['generator'].generate_general_response)
-    workflow.add_node("error_handler", agents['error_handler'].handle_error)
-    workflow.add_node("extract_party_params_node",
-                      agents['extractor'].extract_party_params)
-    workflow.add_node("search_political_parties_node",
-                      agents['political_parties'].search_parties)
-    workflow.add_node("generate_parties_summary_node",
-                      agents['generator'].generate_parties_summary)
-    workflow.add_node("extract_years_node", agents['extractor'].extract_years)
-    workflow.add_node("get_beneficiaries_node",
-                      agents['beneficiaries'].get_beneficiaries_by_year)
-    workflow.add_node("generate_beneficiaries_summary_node",
-                      agents['generator'].generate_beneficiaries_summary)
+    # Con ejecución especulativa, el nodo de intención solapa la búsqueda.
+    intent_agent = agents.get('speculative') or agents['extractor']
+    add_node("determine_intent_node", intent_agent.determine_intent)
+    # Con respuestas estructuradas, las tablas no pasan por el LLM.
+    summary_agent = agents.get('structured') or agents['generator']
+    add_node("extract_convocatoria_id_node",
+             agents['extractor'].extract_convocatoria_id)
+    add_node("extract_search_params_node",
+             agents['extractor'].extract_search_params)
+    add_node("call_infosubvenciones_get_details_node",
+             agents['api_caller'].get_details)
+    add_node("call_infosubvenciones_search_node",
+             agents['api_caller'].search)
+    add_node("generate_detailed_response_node",
+             agents['generator'].generate_detailed_response)
+    add_node("generate_search_summary_node",
+             agents['generator'].generate_search_summary)
+    add_node("generate_general_response_node",
+             agents['generator'].generate_general_response)
+    add_node("error_handler", agents['error_handler'].handle_error)
+    add_node("extract_party_params_node",
+             agents['extractor'].extract_party_params)
+    add_node("search_political_parties_node",
+             agents['political_parties'].search_parties)
+    add_node("generate_parties_summary_node",
+             summary_agent.generate_parties_summary)
+    add_node("extract_years_node", agents['extractor'].extract_years)
+    add_node("get_beneficiaries_node",
+             agents['beneficiaries'].get_beneficiaries_by_year)
+    add_node("generate_beneficiaries_summary_node",
+             summary_agent.generate_beneficiaries_summary)
+    add_node("extract_concession_params_node",
+             agents['extractor'].extract_concession_params)
+    add_node("search_concessions_node", agents['concessions'].search_concessions)
+    add_node("generate_concessions_summary_node",
+             summary_agent.generate_concessions_summary)
 
     # Definir aristas y punto de entrada
     workflow.set_entry_point("determine_intent_node")
@@ -142,12 +196,17 @@ def build_agent_graph(agents: dict) -> StateGraph:
         "extract_party_params_node", should_call_api)
     workflow.add_conditional_edges(
         "search_political_parties_node", should_generate_response)
+    workflow.add_conditional_edges(
+        "extract_concession_params_node", should_call_api)
+    workflow.add_conditional_edges(
+        "search_concessions_node", should_generate_response)
 
     # Todos los nodos finales terminan el grafo
     end_nodes = [
         "generate_detailed_response_node", "generate_search_summary_node",
         "generate_general_response_node", "error_handler",
-        "generate_beneficiaries_summary_node", "generate_parties_summary_node"
+        "generate_beneficiaries_summary_node", "generate_parties_summary_node",
+        "generate_concessions_summary_node"
     ]
     for node_name in end_nodes:
         workflow.add_edge(node_name, END)
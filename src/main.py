@@ -2,6 +2,7 @@
 Módulo principal de la aplicación Flask para gestionar
 """
 from collections.abc import Iterable
+import json
 import logging
 import os
 import sys
@@ -19,8 +20,15 @@ sys.path.insert(0, project_root)
 
 # pylint: disable=import-error,wrong-import-position
 from services.gemini_helpers import configure_gemini
-from services.infosubvenciones_service import info_subvenciones_service
+from services.infosubvenciones_service import (ApiServiceError,
+                                               info_subvenciones_service)
 from services.langgraph_service import LangGraphService
+from services.worker_pool import pool_metrics
+from services.intent_router import intent_router
+from services.llm_cache import llm_response_cache
+from services.context_builder import context_builder
+from services.session_store import session_store
+from services.beneficiarios_analytics import beneficiarios_analytics
 
 # Cargar variables de entorno desde .env
 load_dotenv()
@@ -48,8 +56,6 @@ else:
         "GEMINI_API_KEY no encontrada. El servicio de chat no estará disponible."
     )
 
-# Almacenamiento en memoria para los historiales de chat
-chat_histories = {}
 
 
 @app.before_request
@@ -71,9 +77,8 @@ def index():
     return render_template('index.html')
 
 
-@app.route('/api/buscar', methods=['GET'])
-def buscar_convocatorias_api():
-    """API endpoint para buscar convocatorias de subvenciones."""
+def _parametros_busqueda() -> dict:
+    """Construye los parámetros de búsqueda a partir de la query string."""
     # '1': todas las palabras, '2': cualquiera, '0': frase exacta
     descripcion_tipo_busqueda = request.args.get('descripcionTipoBusqueda', '1')
     params = {
@@ -86,7 +91,13 @@ def buscar_convocatorias_api():
         'tipoAdministracion': request.args.get('tipoAdministracion', '')
     }
     # Eliminar parámetros vacíos para no enviarlos a la API externa
-    params = {k: v for k, v in params.items() if v}
+    return {k: v for k, v in params.items() if v}
+
+
+@app.route('/api/buscar', methods=['GET'])
+def buscar_convocatorias_api():
+    """API endpoint para buscar convocatorias de subvenciones."""
+    params = _parametros_busqueda()
     try:
         resultados = info_subvenciones_service.buscar_convocatorias(params)
         return jsonify(resultados)
@@ -94,6 +105,38 @@ def buscar_convocatorias_api():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/buscar/stream', methods=['GET'])
+def buscar_convocatorias_stream_api():
+    """
+    API endpoint que devuelve la búsqueda como NDJSON: primero la página base
+    ('pagina'), después un evento 'detalle' por cada convocatoria enriquecida
+    según llega, y un evento 'fin' al terminar. Las búsquedas amplias se
+    sirven desde la exportación CSV en cuanto está descargada.
+    """
+    params = _parametros_busqueda()
+    try:
+        busqueda = info_subvenciones_service.abrir_busqueda(params, exportacion=True)
+    except ApiServiceError as e:
+        return jsonify({'error': str(e)}), 502
+
+    def generar_eventos():
+        enviados = 0
+        try:
+            yield json.dumps({'tipo': 'pagina', 'data': busqueda.pagina},
+                             ensure_ascii=False) + "\n"
+            for id_conv, detalle in busqueda:
+                enviados += 1
+                yield json.dumps({'tipo': 'detalle', 'id': id_conv,
+                                  'detalle': detalle}, ensure_ascii=False) + "\n"
+            yield json.dumps({'tipo': 'fin', 'enriquecidos': enviados}) + "\n"
+        finally:
+            # Si el cliente se desconecta, no seguir descargando detalles.
+            busqueda.close()
+
+    return Response(stream_with_context(generar_eventos()),
+                    mimetype='application/x-ndjson; charset=utf-8')
+
+
 @app.route('/api/convocatoria/<id_conv>', methods=['GET'])
 def obtener_convocatoria_api(id_conv):
     """API endpoint para obtener el detalle de una convocatoria específica."""
@@ -105,17 +148,84 @@ def obtener_convocatoria_api(id_conv):
         return jsonify({'error': str(e)}), 500
 
 
-def _update_chat_history(thread_id, query, response):
+@app.route('/api/metrics', methods=['GET'])
+def metricas_api():
+    """API endpoint con métricas internas de los servicios."""
+    return jsonify({
+        'http_pool': info_subvenciones_service.pool_stats(),
+        'convocatorias_cache': info_subvenciones_service.cache.stats(),
+        'convocatorias_export': info_subvenciones_service.export_stats(),
+        'worker_pool': pool_metrics(),
+        'convocatorias_mirror': (info_subvenciones_service.mirror.stats()
+                                 if info_subvenciones_service.mirror else None),
+        'busqueda_texto': (info_subvenciones_service.text_index.stats()
+                           if info_subvenciones_service.text_index else None),
+        'busqueda_semantica': (info_subvenciones_service.semantic_index.stats()
+                               if info_subvenciones_service.semantic_index else None),
+        'intent_router': intent_router.stats(),
+        'llm_cache': llm_response_cache.stats(),
+        'context_builder': context_builder.stats(),
+        'session_store': session_store.stats(),
+        'beneficiarios_analytics': beneficiarios_analytics.stats(),
+        'history_compactor': (langgraph_agent_instance.compactor.stats()
+                              if langgraph_agent_instance else None),
+        'checkpointer': (langgraph_agent_instance.memory.stats()
+                         if langgraph_agent_instance else None),
+        'digests': (langgraph_agent_instance.digest_worker.stats()
+                    if langgraph_agent_instance
+                    and langgraph_agent_instance.digest_worker else None),
+        'speculative_execution': (langgraph_agent_instance.speculative.stats()
+                                  if langgraph_agent_instance
+                                  and langgraph_agent_instance.speculative else None)
+    })
+
+
+def update_chat_history(thread_id, query, response):
     """Función auxiliar para actualizar el historial de chat."""
     if not response or not response.strip():
         return  # No actualizar si la respuesta está vacía
 
-    new_entry = (query, response.strip())
-    history = chat_histories.get(thread_id, [])
-    history.append(new_entry)
+    # El almacén conserva los últimos SESSION_MAX_TURNS pares.
+    session_store.append(thread_id, query, response.strip())
+    if langgraph_agent_instance:
+        # Resume los turnos antiguos en segundo plano, tras enviar la respuesta.
+        langgraph_agent_instance.compactor.schedule(thread_id)
+
 
-    max_history_length = 10  # Últimas 5 interacciones (5 pares)
-    chat_histories[thread_id] = history[-max_history_length:]
+def sse_event(evento: dict) -> str:
+    """Serializa un evento de progreso del chat en formato Server-Sent Events."""
+    return (f"event: {evento['tipo']}\n"
+            f"data: {json.dumps(evento, ensure_ascii=False, default=str)}\n\n")
+
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+SSE_ERROR = {'tipo': 'error',
+             'mensaje': 'Lo siento, ha ocurrido un error al generar la respuesta.'}
+
+
+def _chat_events_response(consulta, thread_id, chat_history):
+    """
+    Respuesta SSE de /api/chat: progreso del grafo, resultados parciales y
+    fragmentos de la respuesta, terminando con un evento 'fin'.
+    """
+    def generar_eventos():
+        tokens = []
+        try:
+            for evento in langgraph_agent_instance.stream_chat_events(
+                    consulta, chat_history, thread_id):
+                if evento['tipo'] == 'token':
+                    tokens.append(evento['texto'])
+                yield sse_event(evento)
+            yield sse_event({'tipo': 'fin', 'thread_id': thread_id})
+        # pylint: disable=broad-exception-caught
+        except Exception as e:
+            app.logger.error("Error durante el streaming de eventos: %s", e, exc_info=True)
+            yield sse_event(SSE_ERROR)
+        finally:
+            update_chat_history(thread_id, consulta, "".join(tokens))
+
+    return Response(stream_with_context(generar_eventos()),
+                    mimetype='text/event-stream; charset=utf-8', headers=SSE_HEADERS)
 
 
 @app.route('/api/chat', methods=['POST'])
@@ -135,13 +245,14 @@ def procesar_chat():
         consulta = data.get('consulta', '')
         client_thread_id = data.get('thread_id') or str(uuid.uuid4())
 
-        if client_thread_id not in chat_histories:
-            chat_histories[client_thread_id] = []
-
         if not consulta:
             return Response("La consulta es obligatoria", mimetype='text/plain', status=400)
 
-        current_chat_history = chat_histories.get(client_thread_id, [])
+        current_chat_history = session_store.get(client_thread_id)
+        # Con "Accept: text/event-stream" se envían eventos de progreso.
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            return _chat_events_response(consulta, client_thread_id, current_chat_history)
+
         ai_response = langgraph_agent_instance.process_chat_query(
             consulta, current_chat_history, client_thread_id
         )
@@ -164,7 +275,7 @@ def procesar_chat():
                     yield " Lo siento, ha ocurrido un error al generar la respuesta."
                 finally:
                     accumulated = "".join(full_response_chunks)
-                    _update_chat_history(client_thread_id, consulta, accumulated)
+                    update_chat_history(client_thread_id, consulta, accumulated)
 
             return Response(
                 stream_with_context(generate_and_accumulate_stream()),
@@ -173,7 +284,7 @@ def procesar_chat():
 
         # Caso 2: La respuesta es una cadena de texto normal
         if isinstance(ai_response, str):
-            _update_chat_history(client_thread_id, consulta, ai_response)
+            update_chat_history(client_thread_id, consulta, ai_response)
             if not ai_response.strip():
                 log_msg = (
                     "LangGraph devolvió una respuesta vacía (no-stream) para "
@@ -1,16 +1,17 @@
 """
 # info_convocatoria_mcp.py
 """
-import io
+import asyncio
 import logging
 from urllib.parse import urljoin
 import os
-import PyPDF2
+import aiohttp
 from fastmcp import FastMCP
-import requests
 from bs4 import BeautifulSoup
 from google import genai
 from dotenv import load_dotenv
+from pdf_ingestion import TIMEOUT, IngestionPipeline
+from summarizer import MapReduceSummarizer
 
 # Configuración del logger
 logging.basicConfig(level=logging.INFO)
@@ -23,32 +24,26 @@ server = FastMCP("MyAssistantServer")
 
 gemini_client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
 
-def get_pdf_content(url: str) -> str:
+# Descargas concurrentes, caché en disco por URL+ETag y extracción en procesos.
+pipeline = IngestionPipeline()
+# Resumen por fragmentos, en paralelo y con los parciales cacheados en disco.
+summarizer = MapReduceSummarizer(gemini_client, os.environ["GEMINI_MODEL"], pipeline.cache)
+
+
+async def get_pdf_content(url: str) -> str:
     """
     Función para obtener el contenido de un PDF desde una URL.
     
     :param url: URL del PDF a descargar.
     :return: Contenido del PDF como string.
     """
-    logger.info("Iniciando extracción de PDF desde:  %s", url)
-    response = requests.get(url, timeout=15)
-    pdf_io_bytes = io.BytesIO(response.content)
-    text_list = []
-    pdf = PyPDF2.PdfReader(pdf_io_bytes)
-
-    num_pages = len(pdf.pages)
-    logger.info("PDF obtenido con %s páginas.", num_pages)
-
-    for page in range(num_pages):
-        page_text = pdf.pages[page].extract_text()
-        text_list.append(page_text)
-    text = "\n".join(text_list)
-    return text
+    documento, = await pipeline.ingerir([url])
+    return documento.texto
 
 
 # 3. Usar la instancia 'server' para los decoradores
 @server.tool
-def get_info_convo(url: str) -> str:
+async def get_info_convo(url: str) -> str:
     """
     Herramienta para obtener el contenido de texto y todos los enlaces de una URL
     en un único string.
@@ -59,57 +54,59 @@ def get_info_convo(url: str) -> str:
     """
     try:
         logger.info("Obteniendo información de la URL: %s", url)
-        response = requests.get(url, timeout=15)
-        response.raise_for_status()  # Lanza un error si la solicitud HTTP falla
-
-        soup = BeautifulSoup(response.content, 'html.parser')
-        # 1. Extraer todo el texto de la página de forma limpia
-        page_text = soup.get_text(separator=' ', strip=True)
-
-        # 2. Encontrar todos los enlaces únicos
-        unique_links = set()
-        for a_tag in soup.find_all('a', href=True):
-            href = a_tag['href'].strip()
-            # Ignorar enlaces vacíos o que solo son anclas en la misma página
-            if href and not href.startswith('#'):
-                # Convertir enlaces relativos (ej: /contacto) a absolutos
-                full_url = urljoin(url, href)
-                unique_links.add(full_url)
-        # 3. Formatear la lista de enlaces como un string
-        # Usamos '\n' para que cada enlace aparezca en una nueva línea
-        filtered_links = {link for link in unique_links if "pdf" in link.lower()}
-
-        # 4. Si hay enlaces a PDFs, extraer su contenido
-        pdf_content = '\n'.join([get_pdf_content(link) for link in filtered_links])
-
-        # 5. Combinar el texto y los enlaces en un solo string de salida
-        final_output = (
-            f"{page_text}\n\n"
-            f"\n\n--- CONTENIDO DE LOS PDFS ---\n"
-            f"{pdf_content}"
-        )
-        logger.info("Contenido obtenido y combinado correctamente, procediendo al resumen.")
-        return summarise_via_llm(final_output)
-
-    except requests.exceptions.RequestException as e:
+        async with aiohttp.ClientSession(timeout=TIMEOUT) as session:
+            async with session.get(url) as response:
+                response.raise_for_status()  # Lanza un error si la solicitud HTTP falla
+                html = await response.read()
+
+            soup = BeautifulSoup(html, 'html.parser')
+            # 1. Extraer todo el texto de la página de forma limpia
+            page_text = soup.get_text(separator=' ', strip=True)
+
+            # 2. Encontrar todos los enlaces únicos, en orden de aparición
+            unique_links = {}
+            for a_tag in soup.find_all('a', href=True):
+                href = a_tag['href'].strip()
+                # Ignorar enlaces vacíos o que solo son anclas en la misma página
+                if href and not href.startswith('#'):
+                    # Convertir enlaces relativos (ej: /contacto) a absolutos
+                    full_url = urljoin(url, href)
+                    unique_links[full_url] = None
+            filtered_links = [link for link in unique_links if "pdf" in link.lower()]
+
+            # 3. Descargar y extraer los PDFs en paralelo (con caché y límites)
+            documentos = await pipeline.ingerir(filtered_links, session)
+
+        # 4. Resumir la página y cada PDF como secciones independientes
+        secciones = [("la página web", page_text)]
+        secciones += [(f"el PDF {doc.url}", doc.texto) for doc in documentos if doc.texto]
+        fallidos = [doc.url for doc in documentos if doc.error]
+        nota = "(No se pudieron leer: " + ", ".join(fallidos) + ")" if fallidos else None
+        logger.info("Contenido obtenido correctamente (%d PDFs, %d desde caché), "
+                    "procediendo al resumen.", len(documentos),
+                    sum(doc.origen == "cache" for doc in documentos))
+        return await summarise_via_llm(secciones, nota)
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         error_message = f"Error al procesar la URL {url}: {e}"
         logger.error(error_message)
         return error_message
 
-def summarise_via_llm(text: str) -> str:
+async def summarise_via_llm(secciones: list, nota: str = None) -> str:
     """
-    Función para resumir un texto usando el modelo LLM de Mistral.
-    
-    :param text: Texto a resumir.
+    Función para resumir la página y sus PDFs usando Gemini.
+
+    Los textos largos se resumen por fragmentos (map-reduce) para no exceder
+    la ventana de contexto del modelo.
+
+    :param secciones: Pares (título, texto) de la página y de cada PDF.
+    :param nota: Aviso que se añade al texto a resumir (p. ej. PDFs ilegibles).
     :return: Resumen del texto.
     """
     logger.info("Enviando texto al LLM para resumen.")
-    response = gemini_client.models.generate_content(
-        model=os.environ["GEMINI_MODEL"],
-        contents="Dado el siguiente texto, por favor, proporciona un resumen, tanto de la página web como de los PDFs incluidos:\n\n" + text
-    )
+    resumen = await summarizer.resumir(secciones, nota)
     logger.info("Resumen obtenido correctamente.")
-    return response.text
+    return resumen
 
 # 4. Ejecutar la instancia del servidor que ya tiene las herramientas registradas
 if __name__ == "__main__":
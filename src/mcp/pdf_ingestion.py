@@ -0,0 +1,280 @@
+"""
+# pdf_ingestion.py
+
+Pipeline de ingesta de las páginas de bases reguladoras y de los PDFs que
+enlazan, para el servidor MCP.
+
+- Descargas concurrentes (asyncio + aiohttp) acotadas por un semáforo.
+- Caché en disco direccionada por contenido: por cada URL se guarda su ETag /
+  Last-Modified y el hash del contenido; el texto extraído se guarda por hash,
+  de modo que una URL sin cambios (304) o un PDF repetido no se reprocesan.
+- Extracción de texto por rangos de páginas en un pool de procesos.
+- Límites de tamaño y de páginas por documento.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional
+import aiohttp
+import PyPDF2
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENCY = int(os.environ.get('PDF_MAX_CONCURRENCY', '4'))
+MAX_BYTES = int(os.environ.get('PDF_MAX_BYTES', str(20 * 1024 * 1024)))
+MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', '150'))
+MAX_DOCS = int(os.environ.get('PDF_MAX_DOCS', '10'))
+EXTRACT_WORKERS = int(os.environ.get('PDF_EXTRACT_WORKERS', str(os.cpu_count() or 2)))
+CACHE_DIR = os.environ.get('PDF_CACHE_DIR', os.path.join(tempfile.gettempdir(),
+                                                         'convocatorias_documentos'))
+TIMEOUT = aiohttp.ClientTimeout(total=float(os.environ.get('PDF_TIMEOUT', '60')),
+                                sock_connect=10)
+# Por debajo de este número de páginas no compensa repartir la extracción.
+MIN_PAGES_PER_WORKER = 8
+
+
+class Documento(NamedTuple):
+    """Texto de un documento descargado y de dónde se ha obtenido."""
+    url: str
+    texto: str
+    paginas: int
+    origen: str  # "red", "cache" o "error"
+    error: Optional[str] = None
+
+
+class DocumentoDemasiadoGrandeError(Exception):
+    """El documento supera PDF_MAX_BYTES."""
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _extract_page_range(pdf_bytes: bytes, inicio: int, fin: int) -> List[str]:
+    """Extrae el texto de las páginas [inicio, fin) (se ejecuta en otro proceso)."""
+    return _textos_paginas(PyPDF2.PdfReader(io.BytesIO(pdf_bytes)), inicio, fin)
+
+
+def _textos_paginas(pdf: PyPDF2.PdfReader, inicio: int, fin: int) -> List[str]:
+    textos = []
+    for numero in range(inicio, fin):
+        try:
+            textos.append(pdf.pages[numero].extract_text() or "")
+        # pylint: disable=broad-exception-caught
+        except Exception as e:
+            textos.append(f"[Página {numero + 1} ilegible: {e}]")
+    return textos
+
+
+def _contar_paginas(pdf_bytes: bytes, max_pages: int, min_reparto: int) -> tuple:
+    """
+    Cuenta las páginas de un PDF (fuera del bucle de eventos) y, si son menos
+    de `min_reparto`, extrae ya su texto para no volver a parsearlo.
+
+    Returns:
+        (páginas totales, textos de las primeras `max_pages` páginas o None).
+    """
+    pdf = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    total = len(pdf.pages)
+    paginas = min(total, max_pages)
+    if paginas >= min_reparto:
+        return total, None
+    return total, _textos_paginas(pdf, 0, paginas)
+
+
+class DocumentCache:
+    """
+    Caché en disco: `urls/<sha(url)>.json` guarda ETag, Last-Modified y el
+    hash del contenido; `textos/<sha(contenido)>.txt` el texto extraído.
+    """
+
+    def __init__(self, directorio: str = CACHE_DIR):
+        self.directorio = directorio
+        os.makedirs(os.path.join(directorio, "urls"), exist_ok=True)
+        os.makedirs(os.path.join(directorio, "textos"), exist_ok=True)
+
+    def _ruta_url(self, url: str) -> str:
+        return os.path.join(self.directorio, "urls", _sha256(url.encode()) + ".json")
+
+    def _ruta_texto(self, sha: str) -> str:
+        return os.path.join(self.directorio, "textos", sha + ".txt")
+
+    def meta(self, url: str) -> Optional[dict]:
+        """Validadores HTTP y hash del contenido guardados para una URL."""
+        try:
+            with open(self._ruta_url(url), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def texto(self, sha: str) -> Optional[str]:
+        """Texto extraído de un contenido, si ya se procesó."""
+        try:
+            with open(self._ruta_texto(sha), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def guardar(self, url: str, sha: str, texto: str, etag: str = None,
+                last_modified: str = None, paginas: int = 0):
+        """Guarda el texto por hash de contenido y los validadores de la URL."""
+        ruta = self._ruta_texto(sha)
+        if not os.path.exists(ruta):
+            self._escribir(ruta, texto)
+        self._escribir(self._ruta_url(url), json.dumps({
+            "url": url, "sha256": sha, "etag": etag,
+            "last_modified": last_modified, "paginas": paginas
+        }))
+
+    def resumen(self, clave: str) -> Optional[str]:
+        """Resumen guardado para una clave (hash del fragmento resumido)."""
+        try:
+            with open(os.path.join(self.directorio, "resumenes", clave + ".txt"),
+                      encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def guardar_resumen(self, clave: str, texto: str):
+        """Guarda el resumen de un fragmento."""
+        os.makedirs(os.path.join(self.directorio, "resumenes"), exist_ok=True)
+        self._escribir(os.path.join(self.directorio, "resumenes", clave + ".txt"), texto)
+
+    @staticmethod
+    def _escribir(ruta: str, contenido: str):
+        # Escritura atómica: otro proceso nunca ve un fichero a medias.
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            f.write(contenido)
+        os.replace(temporal, ruta)
+
+
+class IngestionPipeline:
+    """Descarga y extrae el texto de varios documentos en paralelo."""
+
+    def __init__(self, cache: DocumentCache = None, max_concurrency: int = MAX_CONCURRENCY,
+                 executor: ProcessPoolExecutor = None):
+        self.cache = cache or DocumentCache()
+        self.max_concurrency = max_concurrency
+        self._executor = executor
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Pool de procesos para la extracción, creado la primera vez que se usa."""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS)
+        return self._executor
+
+    async def _descargar(self, session: aiohttp.ClientSession, url: str,
+                         meta: Optional[dict]) -> Optional[tuple]:
+        """
+        Descarga una URL respetando PDF_MAX_BYTES.
+
+        Returns:
+            (contenido, etag, last_modified) o None si no ha cambiado (304).
+        """
+        headers = {}
+        if meta and self.cache.texto(meta["sha256"]) is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304:
+                return None
+            response.raise_for_status()
+            if (response.content_length or 0) > MAX_BYTES:
+                raise DocumentoDemasiadoGrandeError(
+                    f"{response.content_length} bytes (máximo {MAX_BYTES})")
+            contenido = bytearray()
+            async for bloque in response.content.iter_chunked(64 * 1024):
+                contenido.extend(bloque)
+                if len(contenido) > MAX_BYTES:
+                    raise DocumentoDemasiadoGrandeError(f"más de {MAX_BYTES} bytes")
+            return (bytes(contenido), response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"))
+
+    async def extraer_pdf(self, contenido: bytes) -> tuple:
+        """
+        Extrae el texto de un PDF repartiendo rangos de páginas entre procesos.
+
+        Returns:
+            (texto, número de páginas procesadas).
+        """
+        # Parsear el PDF para contarlo bloquearía el bucle de eventos; si no
+        # hay que repartirlo, el mismo hilo extrae el texto de paso.
+        min_reparto = 2 * MIN_PAGES_PER_WORKER if EXTRACT_WORKERS > 1 else MAX_PAGES + 1
+        total, textos = await asyncio.to_thread(_contar_paginas, contenido,
+                                                MAX_PAGES, min_reparto)
+        paginas = min(total, MAX_PAGES)
+        if paginas < total:
+            logger.warning("PDF de %d páginas: se procesan sólo %d.", total, paginas)
+        if textos is None:
+            trozos = min(EXTRACT_WORKERS, paginas // MIN_PAGES_PER_WORKER)
+            loop = asyncio.get_running_loop()
+            limites = [paginas * i // trozos for i in range(trozos + 1)]
+            partes = await asyncio.gather(*(
+                loop.run_in_executor(self.executor, _extract_page_range,
+                                     contenido, limites[i], limites[i + 1])
+                for i in range(trozos)
+            ))
+            textos = [texto for parte in partes for texto in parte]
+        return "\n".join(textos), paginas
+
+    async def _ingerir(self, session: aiohttp.ClientSession, semaforo: asyncio.Semaphore,
+                       url: str) -> Documento:
+        meta = self.cache.meta(url)
+        try:
+            async with semaforo:
+                descarga = await self._descargar(session, url, meta)
+            if descarga is None:
+                logger.info("Documento sin cambios (304), desde caché: %s", url)
+                return Documento(url, self.cache.texto(meta["sha256"]),
+                                 meta.get("paginas", 0), "cache")
+            contenido, etag, last_modified = descarga
+            sha = _sha256(contenido)
+            texto = self.cache.texto(sha)
+            if texto is not None:
+                logger.info("Contenido ya procesado (%s), desde caché: %s", sha[:12], url)
+                paginas = (meta or {}).get("paginas", 0)
+                self.cache.guardar(url, sha, texto, etag, last_modified, paginas)
+                return Documento(url, texto, paginas, "cache")
+            texto, paginas = await self.extraer_pdf(contenido)
+            self.cache.guardar(url, sha, texto, etag, last_modified, paginas)
+            logger.info("PDF procesado: %s (%d páginas).", url, paginas)
+            return Documento(url, texto, paginas, "red")
+        # pylint: disable=broad-exception-caught
+        except Exception as e:
+            logger.error("No se pudo procesar el documento %s: %s", url, e)
+            return Documento(url, "", 0, "error", str(e))
+
+    async def ingerir(self, urls: List[str],
+                      session: aiohttp.ClientSession = None) -> List[Documento]:
+        """
+        Descarga y extrae hasta PDF_MAX_DOCS documentos en paralelo.
+
+        Args:
+            urls: URLs de los documentos, en orden de prioridad.
+            session: Sesión HTTP a reutilizar; si no se indica, se abre una.
+        """
+        urls = list(dict.fromkeys(urls))
+        if len(urls) > MAX_DOCS:
+            logger.warning("%d documentos enlazados: se procesan sólo %d.", len(urls), MAX_DOCS)
+            urls = urls[:MAX_DOCS]
+        if session is None:
+            async with aiohttp.ClientSession(timeout=TIMEOUT) as session:
+                return await self.ingerir(urls, session)
+        semaforo = asyncio.Semaphore(self.max_concurrency)
+        return list(await asyncio.gather(*(self._ingerir(session, semaforo, url)
+                                           for url in urls)))
+
+    def close(self):
+        """Libera el pool de procesos."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
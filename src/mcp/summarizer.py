@@ -0,0 +1,206 @@
+"""
+# summarizer.py
+
+Resumen map-reduce de los textos largos que obtiene el scraper MCP.
+
+- Cada sección (la página web y cada PDF) se divide por separado en
+  fragmentos de como mucho SUMMARY_CHUNK_TOKENS tokens, cortando por párrafos,
+  de modo que los fragmentos de un documento no dependen de los demás.
+- Los fragmentos se resumen en paralelo con un máximo de
+  SUMMARY_MAX_CONCURRENCY llamadas simultáneas a Gemini.
+- Los resúmenes parciales se combinan por niveles, en grupos que caben en una
+  llamada, hasta obtener el resumen final (como mucho SUMMARY_MAX_REDUCE_LEVELS
+  niveles; si aún no cabe, se recorta).
+- Cada resumen se guarda en disco por el hash de su entrada: si cambia un PDF,
+  sólo se vuelven a resumir sus fragmentos.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import os
+from typing import List, Optional, Tuple
+from pdf_ingestion import DocumentCache
+
+logger = logging.getLogger(__name__)
+
+CHUNK_TOKENS = int(os.environ.get('SUMMARY_CHUNK_TOKENS', '6000'))
+MAX_CONCURRENCY = int(os.environ.get('SUMMARY_MAX_CONCURRENCY', '4'))
+MAX_REDUCE_LEVELS = int(os.environ.get('SUMMARY_MAX_REDUCE_LEVELS', '4'))
+CHARS_PER_TOKEN = float(os.environ.get('CONTEXT_CHARS_PER_TOKEN', '3.5'))
+# Versión de las plantillas: cambiarla invalida los resúmenes guardados.
+PROMPT_VERSION = "1"
+
+MAP_PROMPT = (
+    "Resume el siguiente fragmento de {titulo} (parte {parte} de {partes}). "
+    "Conserva literalmente importes, plazos, fechas, requisitos, beneficiarios "
+    "y referencias normativas; omite el texto accesorio.\n\n{texto}"
+)
+REDUCE_PROMPT = (
+    "Los siguientes textos son resúmenes parciales y consecutivos de una "
+    "convocatoria. Combínalos en un único resumen sin repeticiones, conservando "
+    "importes, plazos, fechas y requisitos.\n\n{texto}"
+)
+FINAL_PROMPT = (
+    "Dado el siguiente texto, por favor, proporciona un resumen, tanto de la "
+    "página web como de los PDFs incluidos:\n\n{texto}"
+)
+
+
+def count_tokens(text: str) -> int:
+    """Estimación rápida de tokens (caracteres / CONTEXT_CHARS_PER_TOKEN)."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def split_chunks(texto: str, max_tokens: int = CHUNK_TOKENS) -> List[str]:
+    """
+    Divide un texto en fragmentos de como mucho `max_tokens`, cortando por
+    líneas (y, si una línea no cabe, por caracteres).
+    """
+    max_chars = max(1, int(max_tokens * CHARS_PER_TOKEN))
+    fragmentos, actual, longitud = [], [], 0
+    for linea in texto.splitlines():
+        while len(linea) > max_chars:
+            fragmentos.append(linea[:max_chars])
+            linea = linea[max_chars:]
+        if actual and longitud + len(linea) + 1 > max_chars:
+            fragmentos.append("\n".join(actual))
+            actual, longitud = [], 0
+        actual.append(linea)
+        longitud += len(linea) + 1
+    if actual:
+        fragmentos.append("\n".join(actual))
+    return [f for f in fragmentos if f.strip()]
+
+
+class MapReduceSummarizer:
+    """Resume secciones de cualquier longitud con llamadas acotadas a Gemini."""
+
+    def __init__(self, client, model: str, cache: DocumentCache = None,
+                 chunk_tokens: int = CHUNK_TOKENS, max_concurrency: int = MAX_CONCURRENCY,
+                 max_reduce_levels: int = MAX_REDUCE_LEVELS):
+        """
+        Args:
+            client: Cliente de `google.genai`.
+            model: Modelo de Gemini con el que se resume.
+            cache: Caché en disco donde se guardan los resúmenes parciales.
+            chunk_tokens: Tokens máximos de entrada por llamada.
+            max_concurrency: Llamadas simultáneas al LLM.
+            max_reduce_levels: Niveles máximos de combinación de parciales.
+        """
+        self.client = client
+        self.model = model
+        self.cache = cache or DocumentCache()
+        self.chunk_tokens = chunk_tokens
+        self.max_concurrency = max_concurrency
+        self.max_reduce_levels = max_reduce_levels
+
+    def _clave(self, prompt: str) -> str:
+        return hashlib.sha256(
+            f"{PROMPT_VERSION}\x00{self.model}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    async def _generar(self, prompt: str, semaforo: asyncio.Semaphore) -> str:
+        """Llama al LLM, salvo que ya se haya resumido exactamente el mismo prompt."""
+        clave = self._clave(prompt)
+        guardado = self.cache.resumen(clave)
+        if guardado is not None:
+            return guardado
+        async with semaforo:
+            response = await self.client.aio.models.generate_content(
+                model=self.model, contents=prompt)
+        texto = (response.text or "").strip()
+        if texto:
+            self.cache.guardar_resumen(clave, texto)
+        return texto
+
+    async def _map(self, titulo: str, fragmentos: List[str],
+                   semaforo: asyncio.Semaphore) -> List[str]:
+        """Resume cada fragmento de una sección; los que fallan quedan marcados."""
+        resultados = await asyncio.gather(*(
+            self._generar(MAP_PROMPT.format(titulo=titulo, parte=i + 1,
+                                            partes=len(fragmentos), texto=fragmento),
+                          semaforo)
+            for i, fragmento in enumerate(fragmentos)
+        ), return_exceptions=True)
+        parciales = []
+        for i, resultado in enumerate(resultados):
+            if isinstance(resultado, Exception):
+                logger.error("No se pudo resumir la parte %d de %s: %s", i + 1, titulo,
+                             resultado)
+                parciales.append(f"[Parte {i + 1} de {titulo} no disponible]")
+            else:
+                parciales.append(resultado)
+        return parciales
+
+    def _agrupar(self, textos: List[str]) -> List[List[str]]:
+        """Agrupa textos consecutivos en lotes que caben en una llamada."""
+        grupos, actual, tokens = [], [], 0
+        for texto in textos:
+            n = count_tokens(texto)
+            if actual and tokens + n > self.chunk_tokens:
+                grupos.append(actual)
+                actual, tokens = [], 0
+            actual.append(texto)
+            tokens += n
+        if actual:
+            grupos.append(actual)
+        return grupos
+
+    async def _reduce(self, parciales: List[str], semaforo: asyncio.Semaphore) -> str:
+        """
+        Combina resúmenes parciales por niveles hasta que caben en una llamada.
+        Si el LLM devuelve textos demasiado largos y tras max_reduce_levels
+        niveles aún no caben, el resultado se recorta a chunk_tokens.
+        """
+        nivel = 0
+        while count_tokens("\n\n".join(parciales)) > self.chunk_tokens:
+            if nivel >= self.max_reduce_levels:
+                logger.warning("Tras %d niveles los resúmenes parciales no caben en una "
+                               "llamada; se recortan a %d tokens.", nivel,
+                               self.chunk_tokens)
+                return split_chunks("\n\n".join(parciales), self.chunk_tokens)[0]
+            grupos = self._agrupar(parciales)
+            if len(grupos) == len(parciales):
+                # Ningún par cabe junto: se recortan para garantizar el avance.
+                limite = self.chunk_tokens // 2
+                grupos = self._agrupar([split_chunks(p, limite)[0] for p in parciales])
+            nivel += 1
+            logger.info("Combinando %d resúmenes parciales en %d (nivel %d).",
+                        len(parciales), len(grupos), nivel)
+            parciales = list(await asyncio.gather(*(
+                self._generar(REDUCE_PROMPT.format(texto="\n\n".join(grupo)), semaforo)
+                for grupo in grupos
+            )))
+        return "\n\n".join(parciales)
+
+    async def resumir(self, secciones: List[Tuple[str, str]],
+                      nota: Optional[str] = None) -> str:
+        """
+        Resume la página y sus documentos.
+
+        Args:
+            secciones: Pares (título, texto), p. ej. la página web y cada PDF.
+            nota: Texto breve que se añade tal cual al prompt final.
+
+        Returns:
+            El resumen final.
+        """
+        semaforo = asyncio.Semaphore(self.max_concurrency)
+        secciones = [(titulo, texto) for titulo, texto in secciones if texto.strip()]
+        completo = "\n\n".join(f"--- {titulo} ---\n{texto}" for titulo, texto in secciones)
+        if count_tokens(completo) > self.chunk_tokens:
+            # Lista de pares: dos secciones pueden compartir título.
+            fragmentos = [(titulo, split_chunks(texto, self.chunk_tokens))
+                          for titulo, texto in secciones]
+            logger.info("Texto de %d tokens: se resume en %d fragmentos.",
+                        count_tokens(completo), sum(len(f) for _, f in fragmentos))
+            parciales = await asyncio.gather(*(
+                self._map(titulo, partes, semaforo) for titulo, partes in fragmentos
+            ))
+            completo = await self._reduce(
+                [f"--- {titulo} ({i + 1}/{len(partes)}) ---\n{parte}"
+                 for (titulo, _), partes in zip(fragmentos, parciales)
+                 for i, parte in enumerate(partes)], semaforo)
+        if nota:
+            completo += f"\n\n{nota}"
+        return await self._generar(FINAL_PROMPT.format(texto=completo), semaforo)
@@ -0,0 +1,443 @@
+"""
+Este módulo proporciona el cliente asíncrono (asyncio + aiohttp) de la API
+del Sistema Nacional de Ayudas y Subvenciones.
+
+Es el único cliente de los endpoints JSON: `InfosubvencionesService` (espejo,
+exportación, paginadores) delega en él la búsqueda, los detalles cacheados y
+el resto de peticiones mediante `run_sync` y `submit_async`, que ejecutan las
+corrutinas en un bucle de fondo compartido. Así todas las peticiones del
+proceso comparten un único semáforo global, y el límite de concurrencia
+contra la API no es por llamada sino por proceso.
+"""
+import asyncio
+import copy
+import logging
+import os
+import random
+import threading
+import weakref
+from collections import Counter
+from concurrent.futures import Future
+from typing import Any, Dict, Iterable, List, Optional
+import aiohttp
+from .infosubvenciones_service import (DEFAULT_TIMEOUTS, FALLBACK_TIMEOUT,
+                                       RETRY_STATUS_CODES, ApiServiceError,
+                                       ConvocatoriaNoEncontradaError,
+                                       info_subvenciones_service,
+                                       resumen_detalle)
+from .worker_pool import ServicioSaturadoError, get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENCY = int(os.environ.get('INFOSUBVENCIONES_ASYNC_CONCURRENCY', '20'))
+MAX_JITTER = float(os.environ.get('INFOSUBVENCIONES_RETRY_JITTER', '0.5'))
+
+# Un semáforo por bucle de eventos: asyncio no permite compartirlos entre
+# bucles. En la práctica hay un único bucle por proceso (el de fondo de
+# run_sync), así que el límite es global.
+_semaphores = weakref.WeakKeyDictionary()
+_semaphores_lock = threading.Lock()
+
+
+def _global_semaphore() -> asyncio.Semaphore:
+    """Devuelve el semáforo global asociado al bucle de eventos actual."""
+    loop = asyncio.get_running_loop()
+    with _semaphores_lock:
+        semaphore = _semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+            _semaphores[loop] = semaphore
+        return semaphore
+
+
+def _encode_params(params: Optional[dict]) -> List[tuple]:
+    """
+    Convierte los parámetros al formato que acepta aiohttp: las listas se
+    envían como claves repetidas (igual que hace requests) y los booleanos
+    como texto.
+    """
+    encoded = []
+    for key, value in (params or {}).items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        for item in values:
+            if isinstance(item, bool):
+                item = str(item).lower()
+            encoded.append((key, str(item)))
+    return encoded
+
+
+def _retry_after(response: aiohttp.ClientResponse) -> Optional[float]:
+    """Segundos de la cabecera Retry-After, si la trae en ese formato."""
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", "")))
+    except ValueError:
+        return None
+
+
+class _RetryableStatus(Exception):
+    """Respuesta HTTP con un código que merece reintento (429/5xx)."""
+
+    def __init__(self, status: int, retry_after: Optional[float]):
+        super().__init__(status)
+        self.retry_after = retry_after
+
+
+class AsyncInfosubvencionesService:
+    """
+    Cliente asíncrono de la API de InfoSubvenciones con los mismos métodos
+    que `InfosubvencionesService`, más `gather_details` para descargar muchos
+    detalles respetando el límite global de concurrencia.
+    """
+    # pylint: disable=too-many-arguments,too-many-instance-attributes
+    def __init__(self, base_url: str, pool_maxsize: int, max_retries: int,
+                 backoff_factor: float, timeouts: dict = None, cache=None):
+        """
+        Args:
+            base_url (str): URL base de la API.
+            pool_maxsize (int): Conexiones keep-alive máximas por host.
+            max_retries (int): Reintentos ante errores 5xx/429 o de conexión.
+            backoff_factor (float): Factor del backoff exponencial entre reintentos.
+            timeouts (dict): Timeouts (conexión, lectura) por endpoint.
+            cache (ConvocatoriaCache): Caché de detalles, la del servicio síncrono.
+        """
+        self.base_url = base_url
+        self.cache = cache
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self._sessions = weakref.WeakKeyDictionary()
+        self._stats_lock = threading.Lock()
+        self._stats = Counter()
+        # Descargas de detalle en curso por número: los fallos de caché
+        # simultáneos de una misma convocatoria comparten una sola petición.
+        self._cargando = {}
+
+    def _session(self) -> aiohttp.ClientSession:
+        """Devuelve la sesión HTTP del bucle actual, creándola si no existe."""
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_maxsize,
+                limit_per_host=self.pool_maxsize,
+                keepalive_timeout=30
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Accept": "application/json"}
+            )
+            self._sessions[loop] = session
+        return session
+
+    def _backoff(self, attempt: int) -> float:
+        """Espera exponencial con jitter antes del reintento `attempt`."""
+        return self.backoff_factor * (2 ** attempt) + random.uniform(0, MAX_JITTER)
+
+    def _contar(self, nombre: str, cantidad: int = 1):
+        with self._stats_lock:
+            self._stats[nombre] += cantidad
+
+    async def _get_json(self, endpoint: str, params=None) -> Any:
+        """
+        Realiza un GET contra la API respetando el límite de tasa de la
+        familia del endpoint y el semáforo global, y reintenta ante errores
+        5xx/429 (respetando Retry-After) o de conexión.
+
+        Raises:
+            ApiServiceError: Si el limitador de tasa está saturado.
+            aiohttp.ClientResponseError: Si la API responde con un error definitivo.
+            aiohttp.ClientError: Si falla la conexión tras agotar los reintentos.
+        """
+        url = f"{self.base_url}/{endpoint}"
+        connect, read = self.timeouts.get(endpoint, FALLBACK_TIMEOUT)
+        timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        query = _encode_params(params)
+        attempt = 0
+        while True:
+            try:
+                await asyncio.sleep(get_rate_limiter(endpoint).reserve())
+                self._contar("esperando")
+                async with _global_semaphore():
+                    self._contar("esperando", -1)
+                    self._contar("en_vuelo")
+                    try:
+                        async with self._session().get(
+                            url, params=query, timeout=timeout
+                        ) as response:
+                            self._contar("peticiones")
+                            if (response.status in RETRY_STATUS_CODES
+                                    and attempt < self.max_retries):
+                                raise _RetryableStatus(response.status,
+                                                       _retry_after(response))
+                            response.raise_for_status()
+                            return await response.json(content_type=None)
+                    finally:
+                        self._contar("en_vuelo", -1)
+            except ServicioSaturadoError as e:
+                logger.warning("Petición a %s rechazada: %s", endpoint, e)
+                raise ApiServiceError(str(e)) from e
+            except (_RetryableStatus, aiohttp.ClientConnectionError,
+                    asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise aiohttp.ClientError(str(e)) from e
+                delay = self._backoff(attempt)
+                if isinstance(e, _RetryableStatus) and e.retry_after is not None:
+                    delay = max(delay, e.retry_after)
+                attempt += 1
+                self._contar("reintentos")
+                logger.warning("Reintentando %s en %.2fs (intento %d): %s",
+                               endpoint, delay, attempt, e)
+                await asyncio.sleep(delay)
+
+    async def buscar_pagina(self, params) -> dict:
+        """
+        Obtiene una página de `/convocatorias/busqueda` (sin detalles).
+        Args:
+            params (dict): Diccionario con los parámetros de búsqueda.
+        Returns:
+            dict: Respuesta JSON de la API.
+        """
+        endpoint = "convocatorias/busqueda"
+        logger.info("Buscando convocatorias con params: %s y URL: %s",
+                    params, f"{self.base_url}/{endpoint}")
+        try:
+            return await self._get_json(endpoint, params)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Error en la petición de búsqueda: %s", e)
+            raise ApiServiceError("No se pudo buscar convocatorias") from e
+
+    async def buscar_convocatorias(self, params, pagina: dict = None) -> dict:
+        """
+        Busca convocatorias y recupera los detalles de cada resultado en paralelo.
+        Args:
+            params (dict): Diccionario con los parámetros de búsqueda.
+            pagina (dict): Página ya obtenida (p. ej. del espejo); si se
+                indica, sólo se añaden los detalles.
+        Returns:
+            dict: Resultados de la búsqueda con detalle de cada convocatoria.
+        """
+        data = pagina if pagina is not None else await self.buscar_pagina(params)
+        numeros = [
+            item.get("numeroConvocatoria")
+            for item in data.get("content") or []
+            if item.get("numeroConvocatoria") is not None
+        ]
+        details = await self.gather_details(numeros)
+        data["convocatoriasDetails"] = {
+            str(detalle['id']): resumen_detalle(detalle)
+            for detalle in details.values()
+        }
+        return data
+
+    async def gather_details(self, ids: Iterable[str]) -> Dict[str, dict]:
+        """
+        Descarga los detalles de varias convocatorias en paralelo. La
+        concurrencia la limita el semáforo global, no esta llamada.
+        Args:
+            ids (Iterable[str]): Números de convocatoria.
+        Returns:
+            dict: Detalle por número de convocatoria; las que fallan se omiten.
+        """
+        ids = list(dict.fromkeys(str(i) for i in ids))
+        results = await asyncio.gather(
+            *(self.obtener_convocatoria(num) for num in ids),
+            return_exceptions=True
+        )
+        details = {}
+        for num, result in zip(ids, results):
+            if isinstance(result, ApiServiceError):
+                logger.error("Error al obtener convocatoria %s: %s", num, result)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                details[num] = result
+        return details
+
+    async def obtener_convocatoria(self, id_convocatoria) -> dict:
+        """
+        Obtiene los detalles de una convocatoria, usando la caché compartida.
+        Args:
+            id_convocatoria (str): ID de la convocatoria a consultar.
+        Returns:
+            dict: Detalles de la convocatoria.
+        Raises:
+            ConvocatoriaNoEncontradaError: Si la API responde (o respondió) 404.
+        """
+        clave = str(id_convocatoria)
+        state, value = self.cache.peek(clave)
+        self.cache.record(state)
+        if state == "negative":
+            raise ConvocatoriaNoEncontradaError(value)
+        if state == "stale" and self.cache.begin_revalidation(clave):
+            asyncio.get_running_loop().create_task(self._refrescar_convocatoria(clave))
+        if state not in ("fresh", "stale"):
+            tarea = self._cargando.get(clave)
+            if tarea is None:
+                tarea = asyncio.get_running_loop().create_task(
+                    self._cargar_convocatoria(clave))
+                self._cargando[clave] = tarea
+                tarea.add_done_callback(lambda _t: self._cargando.pop(clave, None))
+            value = await asyncio.shield(tarea)
+        # Copia para que los llamadores no alteren la entrada cacheada.
+        return copy.deepcopy(value)
+
+    async def _cargar_convocatoria(self, id_convocatoria: str) -> dict:
+        """Descarga una convocatoria y guarda el resultado (o el 404) en la caché."""
+        try:
+            data = await self.descargar_convocatoria(id_convocatoria)
+        except ConvocatoriaNoEncontradaError as e:
+            self.cache.put(id_convocatoria, str(e), negative=True)
+            raise
+        except ApiServiceError:
+            self.cache.record_load_error()
+            raise
+        self.cache.put(id_convocatoria, data)
+        return data
+
+    async def _refrescar_convocatoria(self, id_convocatoria: str):
+        """Refresca en segundo plano una entrada caducada de la caché."""
+        try:
+            await self._cargar_convocatoria(id_convocatoria)
+        except ApiServiceError as e:
+            logger.warning("Fallo al refrescar la convocatoria %s: %s",
+                           id_convocatoria, e)
+        finally:
+            self.cache.end_revalidation(id_convocatoria)
+
+    async def descargar_convocatoria(self, id_convocatoria) -> dict:
+        """
+        Descarga de la API los detalles de una convocatoria, sin caché.
+        Raises:
+            ConvocatoriaNoEncontradaError: Si la API responde 404.
+            ApiServiceError: Ante cualquier otro error.
+        """
+        try:
+            return await self._get_json("convocatorias", {"numConv": id_convocatoria})
+        except aiohttp.ClientResponseError as e:
+            if e.status == 404:
+                raise ConvocatoriaNoEncontradaError(
+                    f"No existe la convocatoria {id_convocatoria}"
+                ) from e
+            logger.error("Error al obtener convocatoria %s: %s", id_convocatoria, e)
+            raise ApiServiceError(
+                f"Error al obtener detalles de la convocatoria: {str(e)}"
+            ) from e
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Error al obtener convocatoria %s: %s", id_convocatoria, e)
+            raise ApiServiceError(
+                f"Error al obtener detalles de la convocatoria: {str(e)}"
+            ) from e
+
+    async def obtener_beneficiarios_por_anno(self, lista_annos) -> Any:
+        """
+        Obtiene los beneficiarios dada una lista de años.
+        Args:
+            lista_annos (list): Lista de años para consultar.
+        Returns:
+            dict: Beneficiarios por año.
+        """
+        params = {"anios": list(map(int, lista_annos))}
+        logger.info("Obteniendo beneficiarios para años: %s", lista_annos)
+        try:
+            return await self._get_json("grandesbeneficiarios/busqueda", params)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Error al obtener beneficiarios por año: %s", str(e))
+            raise ApiServiceError(
+                f"Error al comunicarse con la API de Infosubvenciones: {str(e)}"
+            ) from e
+
+    async def buscar_partidos_politicos(self, params) -> Any:
+        """
+        Busca partidos políticos en la API utilizando los parámetros proporcionados.
+        Args:
+            params (dict): Diccionario con los parámetros de búsqueda.
+        Returns:
+            dict: Resultados de la búsqueda de partidos políticos.
+        """
+        logger.info("Buscando partidos políticos con params: %s", params)
+        return await self.buscar_registros("partidospoliticos/busqueda", params)
+
+    async def buscar_registros(self, endpoint: str, params: dict) -> dict:
+        """
+        Obtiene una página de un endpoint de búsqueda de registros
+        (concesiones, ayudas de estado, partidos políticos...).
+        Args:
+            endpoint (str): Ruta relativa a la URL base.
+            params (dict): Filtros de la búsqueda.
+        Returns:
+            dict: Respuesta JSON de la API.
+        """
+        try:
+            return await self._get_json(endpoint, params)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Error al buscar en %s: %s", endpoint, str(e))
+            raise ApiServiceError(
+                f"Error al comunicarse con la API de Infosubvenciones: {str(e)}"
+            ) from e
+
+    def stats(self) -> dict:
+        """
+        Devuelve las métricas del cliente.
+
+        Returns:
+            dict: Peticiones en vuelo, esperando al semáforo, hechas y
+            reintentadas, y el límite global de concurrencia.
+        """
+        with self._stats_lock:
+            stats = {"en_vuelo": 0, "esperando": 0, "peticiones": 0, "reintentos": 0,
+                     **self._stats}
+        stats["limite"] = MAX_CONCURRENCY
+        return stats
+
+    async def close(self):
+        """Cierra la sesión HTTP del bucle actual."""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+
+class _BackgroundLoop:
+    """Bucle de eventos en un hilo daemon, compartido por los llamadores síncronos."""
+
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def get(self) -> asyncio.AbstractEventLoop:
+        """Devuelve el bucle de fondo, arrancándolo la primera vez."""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    name="infosubvenciones-async-loop", daemon=True
+                ).start()
+            return self._loop
+
+
+_background_loop = _BackgroundLoop()
+
+
+def run_sync(coro, timeout: float = None) -> Any:
+    """
+    Ejecuta una corrutina en el bucle de fondo compartido y espera su resultado.
+
+    Todos los hilos que usan esta función comparten el mismo bucle y, por
+    tanto, el mismo semáforo global de concurrencia.
+    """
+    return submit_async(coro).result(timeout=timeout)
+
+
+def submit_async(coro) -> Future:
+    """
+    Lanza una corrutina en el bucle de fondo compartido sin esperarla.
+
+    Returns:
+        concurrent.futures.Future: Su resultado; cancelarlo cancela la corrutina.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop.get())
+
+
+# El mismo cliente en el que delega el servicio síncrono.
+async_info_subvenciones_service = info_subvenciones_service.api
@@ -0,0 +1,333 @@
+"""
+Este módulo agrega en memoria, en formato columnar (NumPy), los registros de
+grandes beneficiarios (`/grandesbeneficiarios/busqueda`). Las concesiones no
+se cargan aquí.
+
+Cada año descargado se convierte una sola vez en columnas (año, importe y
+códigos de beneficiario, órgano y región) y se guarda en caché; una consulta de varios años concatena las columnas de
+los años ya descargados y sólo pide a la API los que faltan. Las
+agrupaciones, el top-N, las variaciones interanuales y los percentiles se
+calculan de forma vectorizada (`np.bincount`, `np.unique`), y el informe de
+cada conjunto de años también queda en caché.
+"""
+import logging
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+import numpy as np
+from cachetools import TTLCache
+from .context_builder import importe
+
+logger = logging.getLogger(__name__)
+
+SIN_DATO = "N/D"
+# Columnas categóricas y los campos de la API de los que se toman, por orden.
+CAMPOS_CATEGORICOS = {
+    "beneficiario": ("beneficiario", "nifCif"),
+    "organo": ("organo", "nivel3", "convocante"),
+    "region": ("region", "nivel2"),
+}
+
+
+def _anno_registro(registro: dict) -> int:
+    """Año de un registro: 'ejercicio' o el de la fecha de concesión (0 si no hay)."""
+    valor = registro.get("ejercicio")
+    if valor is None:
+        fecha = str(registro.get("fechaConcesion") or "")
+        valor = fecha[:4] if fecha[:4].isdigit() else fecha[-4:]
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _categoria(registro: dict, campos: Sequence[str]) -> str:
+    for campo in campos:
+        valor = registro.get(campo)
+        if valor not in (None, ""):
+            return " ".join(str(valor).split())
+    return SIN_DATO
+
+
+class Vocabulario:
+    """Códigos enteros de los valores de una columna categórica, compartidos entre tablas."""
+
+    def __init__(self):
+        self._codigos: Dict[str, int] = {}
+        self._valores: List[str] = []
+        self._array = np.array([], dtype=object)
+        self._lock = threading.Lock()
+
+    def codificar(self, valores: Iterable[str]) -> np.ndarray:
+        """Códigos de esos valores, asignando uno nuevo a los no vistos."""
+        with self._lock:
+            codigos = self._codigos
+            for valor in valores:
+                if valor not in codigos:
+                    codigos[valor] = len(self._valores)
+                    self._valores.append(valor)
+            return np.fromiter((codigos[v] for v in valores), dtype=np.int32)
+
+    def valores(self) -> np.ndarray:
+        """Valores indexados por código."""
+        with self._lock:
+            if len(self._array) != len(self._valores):
+                self._array = np.array(self._valores, dtype=object)
+            return self._array
+
+    def __len__(self) -> int:
+        return len(self._valores)
+
+
+class ColumnarTable:
+    """Registros en columnas NumPy, con las categóricas codificadas como enteros."""
+
+    def __init__(self, annos: np.ndarray, importes: np.ndarray,
+                 categorias: Dict[str, tuple], registros: List[dict]):
+        """
+        Args:
+            annos: Año de cada registro (int32).
+            importes: Importe de cada registro (float64).
+            categorias: Por columna, (códigos int32, Vocabulario).
+            registros: Registros originales, en el mismo orden.
+        """
+        self.annos = annos
+        self.importes = importes
+        self.categorias = categorias
+        self.registros = registros
+
+    @classmethod
+    def from_registros(cls, registros: Iterable[dict],
+                       vocabularios: Dict[str, Vocabulario] = None) -> "ColumnarTable":
+        """
+        Convierte los registros de la API en columnas.
+
+        Args:
+            registros: Registros de la API.
+            vocabularios: Vocabularios por columna; compartirlos permite
+                concatenar tablas sin recodificar.
+        """
+        registros = [r for r in registros if isinstance(r, dict)]
+        vocabularios = vocabularios or {c: Vocabulario() for c in CAMPOS_CATEGORICOS}
+        annos = np.fromiter((_anno_registro(r) for r in registros), dtype=np.int32,
+                            count=len(registros))
+        importes = np.fromiter((importe(r) for r in registros), dtype=np.float64,
+                               count=len(registros))
+        categorias = {
+            columna: (vocabularios[columna].codificar(
+                [_categoria(r, campos) for r in registros]), vocabularios[columna])
+            for columna, campos in CAMPOS_CATEGORICOS.items()
+        }
+        return cls(annos, importes, categorias, registros)
+
+    @classmethod
+    def concat(cls, tablas: Sequence["ColumnarTable"]) -> "ColumnarTable":
+        """Une varias tablas (recodificando sólo si no comparten vocabulario)."""
+        tablas = [t for t in tablas if len(t)]
+        if len(tablas) == 1:
+            return tablas[0]
+        if not tablas:
+            return cls.from_registros([])
+        categorias = {}
+        for columna in CAMPOS_CATEGORICOS:
+            vocabulario = tablas[0].categorias[columna][1]
+            partes = []
+            for tabla in tablas:
+                codigos, propio = tabla.categorias[columna]
+                if propio is not vocabulario:
+                    codigos = vocabulario.codificar(propio.valores()[codigos].tolist())
+                partes.append(codigos)
+            categorias[columna] = (np.concatenate(partes), vocabulario)
+        return cls(np.concatenate([t.annos for t in tablas]),
+                   np.concatenate([t.importes for t in tablas]),
+                   categorias, [r for t in tablas for r in t.registros])
+
+    def seleccionar(self, indices: np.ndarray) -> "ColumnarTable":
+        """Subtabla con esas filas, sin volver a leer los registros."""
+        return ColumnarTable(
+            self.annos[indices], self.importes[indices],
+            {columna: (codigos[indices], vocabulario)
+             for columna, (codigos, vocabulario) in self.categorias.items()},
+            [self.registros[i] for i in indices])
+
+    def __len__(self) -> int:
+        return len(self.importes)
+
+    def _mascara(self, annos: Optional[Iterable[int]]) -> np.ndarray:
+        if annos is None:
+            return np.ones(len(self), dtype=bool)
+        return np.isin(self.annos, np.fromiter(annos, dtype=np.int32))
+
+    def agrupar(self, columna: str, annos: Iterable[int] = None) -> tuple:
+        """
+        Agrupa por una columna categórica.
+
+        Returns:
+            (valores, importe total, número de registros), alineados.
+        """
+        codigos, vocabulario = self.categorias[columna]
+        valores = vocabulario.valores()
+        mascara = self._mascara(annos)
+        totales = np.bincount(codigos[mascara], weights=self.importes[mascara],
+                              minlength=len(valores))
+        cuentas = np.bincount(codigos[mascara], minlength=len(valores))
+        return valores, totales, cuentas
+
+    def top(self, columna: str, n: int, annos: Iterable[int] = None) -> List[tuple]:
+        """Los `n` valores de mayor importe total: [(valor, total, registros)]."""
+        valores, totales, cuentas = self.agrupar(columna, annos)
+        presentes = np.flatnonzero(cuentas)
+        if len(presentes) > n:
+            presentes = presentes[np.argpartition(-totales[presentes], n - 1)[:n]]
+        orden = presentes[np.argsort(-totales[presentes], kind="stable")]
+        return [(valores[i], float(totales[i]), int(cuentas[i])) for i in orden]
+
+    def por_anno(self, percentiles: Sequence[float] = (50, 90, 99)) -> List[dict]:
+        """
+        Totales por año con su variación interanual y los percentiles del
+        importe por registro.
+        """
+        if not len(self):
+            return []
+        annos, inverso = np.unique(self.annos, return_inverse=True)
+        totales = np.bincount(inverso, weights=self.importes)
+        cuentas = np.bincount(inverso)
+        codigos = self.categorias["beneficiario"][0]
+        # Beneficiarios distintos por año: pares (año, beneficiario) únicos.
+        pares = np.unique(inverso.astype(np.int64) * (codigos.max() + 1) + codigos)
+        distintos = np.bincount(pares // (codigos.max() + 1), minlength=len(annos))
+        orden = np.argsort(inverso, kind="stable")
+        grupos = np.split(self.importes[orden], np.cumsum(cuentas)[:-1])
+        filas = []
+        for i, anno in enumerate(annos):
+            fila = {"anno": int(anno), "registros": int(cuentas[i]),
+                    "beneficiarios": int(distintos[i]), "total": float(totales[i]),
+                    "percentiles": dict(zip(
+                        (f"p{int(q)}" for q in percentiles),
+                        (float(v) for v in np.percentile(grupos[i], percentiles))))}
+            if i and annos[i - 1] == anno - 1:
+                anterior = totales[i - 1]
+                fila["variacion"] = float(totales[i] - anterior)
+                fila["variacion_pct"] = (float((totales[i] - anterior) / anterior * 100)
+                                         if anterior else None)
+            filas.append(fila)
+        return filas
+
+
+class BeneficiariosAnalytics:
+    """Caché columnar de grandes beneficiarios por año e informes por conjunto de años."""
+
+    def __init__(self, service=None, ttl: float = None, maxsize: int = None):
+        """
+        Args:
+            service: InfosubvencionesService; por defecto, el compartido.
+            ttl: Segundos durante los que se reutiliza un año descargado.
+            maxsize: Años (e informes) máximos en caché.
+        """
+        env = os.environ.get
+        self._service = service
+        ttl = ttl or float(env('BENEFICIARIOS_CACHE_TTL', '86400'))
+        maxsize = maxsize or int(env('BENEFICIARIOS_CACHE_MAXSIZE', '32'))
+        self._annos = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._informes = TTLCache(maxsize=maxsize * 4, ttl=ttl)
+        self.max_vocabulario = int(env('BENEFICIARIOS_VOCAB_MAX', '500000'))
+        self._vocabularios = {c: Vocabulario() for c in CAMPOS_CATEGORICOS}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def service(self):
+        """Servicio con el que se descargan los años que faltan."""
+        if self._service is None:
+            # pylint: disable=import-outside-toplevel
+            from .infosubvenciones_service import info_subvenciones_service
+            self._service = info_subvenciones_service
+        return self._service
+
+    def _vocabularios_vigentes(self) -> Dict[str, Vocabulario]:
+        """
+        Vocabularios para las tablas nuevas. Los valores no se olvidan nunca,
+        así que se empiezan de cero cuando la caché de años se vacía o alguno
+        supera BENEFICIARIOS_VOCAB_MAX; las tablas ya cacheadas conservan el
+        suyo y `concat` recodifica al mezclarlas. Llamar con el cerrojo.
+        """
+        self._annos.expire()
+        if any(len(v) for v in self._vocabularios.values()) and (
+                not self._annos
+                or any(len(v) > self.max_vocabulario for v in self._vocabularios.values())):
+            logger.info("Beneficiarios: se renuevan los vocabularios (%s valores).",
+                        {c: len(v) for c, v in self._vocabularios.items()})
+            self._vocabularios = {c: Vocabulario() for c in CAMPOS_CATEGORICOS}
+        return self._vocabularios
+
+    def tabla(self, annos: Iterable[int]) -> ColumnarTable:
+        """
+        Tabla columnar de esos años; sólo se piden a la API los que no están
+        en caché (en una única llamada).
+        """
+        annos = sorted(set(map(int, annos)))
+        with self._lock:
+            faltan = [a for a in annos if a not in self._annos]
+            self._hits += len(annos) - len(faltan)
+            self._misses += len(faltan)
+            vocabularios = self._vocabularios_vigentes() if faltan else None
+        if faltan:
+            respuesta = self.service.obtener_beneficiarios_por_anno(faltan)
+            registros = (respuesta.get("content") if isinstance(respuesta, dict)
+                         else respuesta) or []
+            completa = ColumnarTable.from_registros(registros, vocabularios)
+            with self._lock:
+                for anno in faltan:
+                    self._annos[anno] = completa.seleccionar(
+                        np.flatnonzero(completa.annos == anno))
+            logger.info("Beneficiarios: %d registros descargados para %s.",
+                        len(completa), faltan)
+        with self._lock:
+            return ColumnarTable.concat([self._annos[a] for a in annos if a in self._annos])
+
+    def registros_por_anno(self, annos: Iterable[int]) -> Dict[int, List[dict]]:
+        """Registros originales agrupados por año, servidos desde la caché."""
+        tabla = self.tabla(annos)
+        resultado = {int(a): [] for a in annos}
+        for anno, registro in zip(tabla.annos.tolist(), tabla.registros):
+            if anno in resultado:
+                resultado[anno].append(registro)
+        return resultado
+
+    def informe(self, annos: Iterable[int], top_n: int = 20) -> Dict[str, Any]:
+        """
+        Agregados de un conjunto de años (cacheados por conjunto):
+        totales por año con variación interanual y percentiles, top-N por
+        año, top-N del periodo y totales por órgano y región si constan.
+        """
+        clave = (tuple(sorted(set(map(int, annos)))), top_n)
+        with self._lock:
+            if clave in self._informes:
+                return self._informes[clave]
+        tabla = self.tabla(clave[0])
+        informe = {
+            "annos": list(clave[0]),
+            "por_anno": tabla.por_anno(),
+            "top_por_anno": {a: tabla.top("beneficiario", top_n, [a]) for a in clave[0]},
+            "top_periodo": (tabla.top("beneficiario", top_n)
+                            if len(clave[0]) > 1 else []),
+        }
+        for columna in ("organo", "region"):
+            grupos = tabla.top(columna, top_n)
+            if any(valor != SIN_DATO for valor, _, _ in grupos):
+                informe[f"por_{columna}"] = grupos
+        with self._lock:
+            self._informes[clave] = informe
+        return informe
+
+    def stats(self) -> dict:
+        """Años e informes en caché y aciertos de la caché por año."""
+        with self._lock:
+            return {"annos_cacheados": sorted(self._annos.keys()),
+                    "informes_cacheados": len(self._informes),
+                    "vocabularios": {c: len(v) for c, v in self._vocabularios.items()},
+                    "hits": self._hits, "misses": self._misses}
+
+
+beneficiarios_analytics = BeneficiariosAnalytics()
@@ -0,0 +1,545 @@
+"""
+Este módulo mantiene un índice vectorial local de convocatorias para
+búsquedas semánticas (sinónimos y paráfrasis que la búsqueda por palabras de
+la API no encuentra).
+
+Los vectores se guardan en disco como matrices NumPy mapeadas en memoria
+(índice plano, producto escalar sobre vectores normalizados), y se calculan
+por lotes a partir del espejo local con un embedder intercambiable:
+
+- 'hashing' (por defecto): hashing de stems y n-gramas; sin modelo ni red.
+- 'sentence-transformers': modelo local en CPU (dependencia opcional).
+- 'gemini': API de embeddings de Gemini.
+
+Uso (desde `src/`):
+    python -m services.busqueda_semantica reindex [--rebuild]
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import threading
+import zlib
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from .busqueda_texto import analizar
+from .convocatorias_mirror import SUPPORTED_PARAMS, _parse_fecha_api, fechas_validas
+
+try:
+    import fcntl
+except ImportError:  # Sin flock (Windows) sólo se serializan los hilos.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Constante de la fusión por rango recíproco (RRF).
+RRF_K = 60
+
+
+def texto_convocatoria(item: dict) -> str:
+    """Texto que se vectoriza de una convocatoria: título y clasificación."""
+    partes = (item.get("descripcion"), item.get("descripcionLeng"),
+              item.get("nivel1"), item.get("nivel2"), item.get("nivel3"))
+    return ". ".join(p for p in partes if p)
+
+
+def _max_fecha_item(actual: Optional[str], item: dict) -> Optional[str]:
+    """Máximo entre `actual` y la fecha de recepción (ISO) del item."""
+    fecha = (item.get("fechaRecepcion") or "")[:10]
+    return fecha if fecha and (actual is None or fecha > actual) else actual
+
+
+def _normalizar_filas(matriz: np.ndarray) -> np.ndarray:
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return (matriz / normas).astype(np.float32)
+
+
+class HashingEmbedder:
+    """
+    Embedder sin modelo: proyecta stems y n-gramas de caracteres en un
+    vector de tamaño fijo mediante hashing con signo.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.nombre = f"hashing-{dim}"
+
+    def _rasgos(self, texto: str) -> List[str]:
+        stems = analizar(texto)
+        rasgos = list(stems)
+        for stem in stems:
+            marcado = f"#{stem}#"
+            rasgos.extend(marcado[i:i + 4] for i in range(len(marcado) - 3))
+        return rasgos
+
+    def embed(self, textos: List[str], consulta: bool = False) -> np.ndarray:
+        """Devuelve una matriz (len(textos), dim) de vectores normalizados."""
+        del consulta  # Documentos y consultas se vectorizan igual.
+        matriz = np.zeros((len(textos), self.dim), dtype=np.float32)
+        for fila, texto in enumerate(textos):
+            for rasgo in self._rasgos(texto):
+                h = zlib.crc32(rasgo.encode("utf-8"))
+                matriz[fila, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return _normalizar_filas(matriz)
+
+
+class SentenceTransformerEmbedder:
+    """Embedder con un modelo local de sentence-transformers (CPU)."""
+
+    def __init__(self, model_name: str = None):
+        # pylint: disable=import-outside-toplevel
+        from sentence_transformers import SentenceTransformer
+        model_name = model_name or "paraphrase-multilingual-MiniLM-L12-v2"
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self._model.get_sentence_embedding_dimension()
+        self.nombre = f"st-{model_name}"
+
+    def embed(self, textos: List[str], consulta: bool = False) -> np.ndarray:
+        """Devuelve una matriz (len(textos), dim) de vectores normalizados."""
+        del consulta
+        vectores = self._model.encode(textos, batch_size=64, convert_to_numpy=True)
+        return _normalizar_filas(np.asarray(vectores, dtype=np.float32))
+
+
+class GeminiEmbedder:
+    """Embedder con la API de embeddings de Gemini."""
+
+    def __init__(self, model_name: str = None):
+        model_name = model_name or "models/text-embedding-004"
+        self.model_name = model_name
+        self.dim = 768
+        self.nombre = f"gemini-{model_name}"
+
+    def embed(self, textos: List[str], consulta: bool = False) -> np.ndarray:
+        """Devuelve una matriz (len(textos), dim) de vectores normalizados."""
+        # pylint: disable=import-outside-toplevel
+        import google.generativeai as genai
+        resultado = genai.embed_content(
+            model=self.model_name, content=textos,
+            task_type="retrieval_query" if consulta else "retrieval_document"
+        )
+        return _normalizar_filas(np.asarray(resultado["embedding"], dtype=np.float32))
+
+
+def build_embedder(nombre: str = None, model_name: str = None):
+    """Crea el embedder indicado por SEMANTIC_EMBEDDER."""
+    nombre = nombre or os.environ.get('SEMANTIC_EMBEDDER', 'hashing')
+    model_name = model_name or os.environ.get('SEMANTIC_EMBEDDING_MODEL')
+    if nombre == "gemini":
+        return GeminiEmbedder(model_name)
+    if nombre == "sentence-transformers":
+        return SentenceTransformerEmbedder(model_name)
+    if nombre != "hashing":
+        logger.warning("Embedder desconocido '%s'; se usa 'hashing'.", nombre)
+    return HashingEmbedder()
+
+
+class VectorIndex:
+    """
+    Índice vectorial plano guardado en disco (vectores float32 e ids int64
+    mapeados en memoria). Las altas se añaden al final de los ficheros y las
+    actualizaciones sobrescriben la fila existente.
+
+    Los ficheros de datos nunca se truncan mientras están publicados: una
+    reconstrucción escribe una generación nueva (`vectores.<n>.f32`,
+    `ids.<n>.i64`) y la publica sustituyendo `meta.json` con `os.replace`.
+    Cada proceso comprueba antes de buscar si `meta.json` o el fichero de ids
+    han cambiado y, en ese caso, vuelve a mapearlos; hasta entonces sus mapas
+    de la generación anterior siguen siendo válidos. Las escrituras se
+    serializan entre procesos con un cerrojo de fichero.
+    """
+
+    def __init__(self, directorio: str, embedder=None):
+        """
+        Args:
+            directorio: Carpeta donde se guardan los ficheros del índice.
+            embedder: Embedder a usar; por defecto el de SEMANTIC_EMBEDDER.
+        """
+        self.directorio = directorio
+        self.embedder = embedder or build_embedder()
+        self._lock = threading.RLock()
+        self._escritor = threading.RLock()
+        self._escrituras = 0
+        self._cerrojo = None
+        self._ruta_meta = os.path.join(directorio, "meta.json")
+        self._ruta_cerrojo = os.path.join(directorio, ".escritura.lock")
+        os.makedirs(directorio, exist_ok=True)
+        self.meta = {}
+        self.compatible = True
+        self._firma_meta = None
+        self._tam_ids = None
+        self._vectores = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._fila_de: Dict[int, int] = {}
+        with self._escritura():
+            if not self.meta.get("embedder"):
+                self.reset()
+        if not self.compatible:
+            # No se reconstruye aquí: otros procesos pueden estar usándolo.
+            logger.warning("El índice semántico usa el embedder %s y el configurado es %s; "
+                           "no se usará hasta ejecutar `reindex --rebuild`.",
+                           self.meta.get("embedder"), self.embedder.nombre)
+
+    def _rutas(self, generacion: int) -> Tuple[str, str]:
+        """Rutas (vectores, ids) de una generación; la 0 conserva los nombres originales."""
+        if not generacion:
+            return (os.path.join(self.directorio, "vectores.f32"),
+                    os.path.join(self.directorio, "ids.i64"))
+        return (os.path.join(self.directorio, f"vectores.{generacion}.f32"),
+                os.path.join(self.directorio, f"ids.{generacion}.i64"))
+
+    def _leer_meta(self) -> dict:
+        try:
+            with open(self._ruta_meta, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _guardar_meta(self):
+        tmp = f"{self._ruta_meta}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self._ruta_meta)
+
+    @contextlib.contextmanager
+    def _escritura(self):
+        """Cerrojo de escritura, reentrante, entre hilos y entre procesos."""
+        with self._escritor:
+            if self._escrituras == 0:
+                # pylint: disable=consider-using-with
+                self._cerrojo = open(self._ruta_cerrojo, "a", encoding="utf-8")
+                if fcntl is not None:
+                    fcntl.flock(self._cerrojo, fcntl.LOCK_EX)
+            self._escrituras += 1
+            try:
+                self._refrescar()
+                yield
+            finally:
+                self._escrituras -= 1
+                if self._escrituras == 0:
+                    self._cerrojo.close()  # Libera también el flock.
+                    self._cerrojo = None
+
+    def _refrescar(self):
+        """Vuelve a leer `meta.json` y a mapear los ficheros si han cambiado en disco."""
+        try:
+            estado = os.stat(self._ruta_meta)
+            firma = (estado.st_ino, estado.st_mtime_ns, estado.st_size)
+        except OSError:
+            firma = None
+        with self._lock:
+            if firma != self._firma_meta:
+                anterior = (self.meta.get("generacion"), self.meta.get("embedder"))
+                self.meta = self._leer_meta()
+                self._firma_meta = firma
+                self.compatible = self.meta.get("embedder") in (None, self.embedder.nombre)
+                if (self.meta.get("generacion"), self.meta.get("embedder")) != anterior:
+                    self._tam_ids = None
+            try:
+                tam_ids = os.path.getsize(self._rutas(self.meta.get("generacion", 0))[1])
+            except OSError:
+                tam_ids = 0
+            if tam_ids != self._tam_ids:
+                self._abrir(tam_ids)
+
+    def _abrir(self, tam_ids: int):
+        """(Re)abre los ficheros de la generación publicada mapeados en memoria."""
+        dim = self.embedder.dim
+        ruta_vectores, ruta_ids = self._rutas(self.meta.get("generacion", 0))
+        n = tam_ids // 8 if self.compatible else 0
+        if n:
+            # Los vectores se escriben antes que los ids: nunca hay menos.
+            n = min(n, os.path.getsize(ruta_vectores) // (4 * dim))
+        if n:
+            self._vectores = np.memmap(ruta_vectores, dtype=np.float32,
+                                       mode="r+", shape=(n, dim))
+            self._ids = np.memmap(ruta_ids, dtype=np.int64, mode="r", shape=(n,))
+        else:
+            self._vectores = np.zeros((0, dim), dtype=np.float32)
+            self._ids = np.zeros(0, dtype=np.int64)
+        self._fila_de = {int(id_): fila for fila, id_ in enumerate(self._ids)}
+        self._tam_ids = tam_ids
+
+    def _anadir(self, generacion: int, ids: List[int], vectores: List[np.ndarray]):
+        """Añade filas al final de los ficheros de una generación."""
+        ruta_vectores, ruta_ids = self._rutas(generacion)
+        filas = os.path.getsize(ruta_ids) // 8
+        if os.path.getsize(ruta_vectores) > filas * 4 * self.embedder.dim:
+            # Restos de un alta interrumpida, fuera de lo que nadie mapea.
+            os.truncate(ruta_vectores, filas * 4 * self.embedder.dim)
+        # Se escriben primero los vectores: un id sin vector nunca llega a ser
+        # visible si el proceso muere a medias.
+        with open(ruta_vectores, "ab") as f:
+            f.write(np.asarray(vectores, dtype=np.float32).tobytes())
+        with open(ruta_ids, "ab") as f:
+            f.write(np.asarray(ids, dtype=np.int64).tobytes())
+
+    def _publicar(self, generacion: int, marca_agua: Optional[str]):
+        """Publica una generación sustituyendo `meta.json` y borra la anterior."""
+        anterior = self.meta.get("generacion", 0) if self.meta.get("embedder") else None
+        self.meta = {"embedder": self.embedder.nombre, "dim": self.embedder.dim,
+                     "marca_agua": marca_agua, "generacion": generacion}
+        self._guardar_meta()
+        if anterior is not None and anterior != generacion:
+            for ruta in self._rutas(anterior):
+                try:
+                    # Los procesos que aún la tienen mapeada la siguen leyendo.
+                    os.remove(ruta)
+                except OSError:
+                    pass
+        with self._lock:
+            self._firma_meta = self._tam_ids = None
+        self._refrescar()
+
+    def _nueva_generacion(self) -> int:
+        """Crea vacíos los ficheros de una generación aún no publicada."""
+        generacion = int(self.meta.get("generacion", 0)) + 1
+        for ruta in self._rutas(generacion):
+            open(ruta, "wb").close()  # pylint: disable=consider-using-with
+        return generacion
+
+    def reset(self):
+        """Publica un índice vacío con el embedder actual."""
+        with self._escritura():
+            self._publicar(self._nueva_generacion(), None)
+
+    def __len__(self) -> int:
+        self._refrescar()
+        return len(self._ids)
+
+    def indexar(self, items: List[dict]) -> int:
+        """
+        Vectoriza un lote de convocatorias y lo añade (o actualiza) en el índice.
+
+        Returns:
+            Número de convocatorias vectorizadas.
+        """
+        items = [item for item in items if item.get("id") is not None]
+        if not items:
+            return 0
+        with self._escritura():
+            if not self.compatible:
+                logger.warning("Índice semántico de otro embedder; no se indexa.")
+                return 0
+            vectores = self.embedder.embed([texto_convocatoria(i) for i in items])
+            with self._lock:
+                nuevos_ids, nuevos_vectores = [], []
+                for item, vector in zip(items, vectores):
+                    fila = self._fila_de.get(int(item["id"]))
+                    if fila is None:
+                        nuevos_ids.append(int(item["id"]))
+                        nuevos_vectores.append(vector)
+                    else:
+                        self._vectores[fila] = vector
+                if isinstance(self._vectores, np.memmap):
+                    self._vectores.flush()
+            if nuevos_ids:
+                self._anadir(self.meta.get("generacion", 0), nuevos_ids, nuevos_vectores)
+                self._refrescar()
+        return len(items)
+
+    def buscar(self, texto: str, k: int = 10) -> List[Tuple[int, float]]:
+        """
+        Devuelve los `k` ids más similares al texto con su similitud coseno,
+        de mayor a menor.
+        """
+        self._refrescar()
+        with self._lock:
+            vectores, ids = self._vectores, self._ids
+        if not len(ids) or not texto.strip():
+            return []
+        consulta = self.embedder.embed([texto], consulta=True)[0]
+        scores = np.empty(len(ids), dtype=np.float32)
+        bloque = 65536  # Acota la memoria usada al recorrer el fichero.
+        for inicio in range(0, len(ids), bloque):
+            scores[inicio:inicio + bloque] = vectores[inicio:inicio + bloque] @ consulta
+        k = min(k, len(ids))
+        mejores = np.argpartition(-scores, k - 1)[:k]
+        mejores = mejores[np.argsort(-scores[mejores])]
+        return [(int(ids[i]), float(scores[i])) for i in mejores]
+
+    def sincronizar_desde_espejo(self, mirror, batch_size: int = None) -> int:
+        """
+        Vectoriza por lotes las filas del espejo posteriores a la marca de
+        agua del índice (con un día de solape). Si el índice es de otro
+        embedder, lo reconstruye.
+
+        Returns:
+            Número de convocatorias vectorizadas.
+        """
+        batch_size = batch_size or int(os.environ.get('SEMANTIC_BATCH_SIZE', '256'))
+        with self._escritura():
+            if not self.compatible:
+                return self.reconstruir(mirror, batch_size)
+            marca = self.meta.get("marca_agua")
+            desde = (date.fromisoformat(marca) - timedelta(days=1)).isoformat() \
+                if marca else None
+            total, lote, max_fecha = 0, [], marca
+            for item in mirror.iterar_filas(desde):
+                lote.append(item)
+                max_fecha = _max_fecha_item(max_fecha, item)
+                if len(lote) >= batch_size:
+                    total += self.indexar(lote)
+                    lote = []
+            total += self.indexar(lote)
+            with self._lock:
+                self.meta["marca_agua"] = max_fecha
+                self._guardar_meta()
+        logger.info("Índice semántico: %d convocatorias vectorizadas.", total)
+        return total
+
+    def reconstruir(self, mirror, batch_size: int = None) -> int:
+        """
+        Vectoriza el espejo entero en una generación nueva de ficheros y la
+        publica al terminar; mientras tanto se sigue buscando en la actual.
+
+        Returns:
+            Número de convocatorias vectorizadas.
+        """
+        batch_size = batch_size or int(os.environ.get('SEMANTIC_BATCH_SIZE', '256'))
+        with self._escritura():
+            generacion = self._nueva_generacion()
+            total, lote, max_fecha = 0, [], None
+            for item in mirror.iterar_filas():
+                if item.get("id") is None:
+                    continue
+                lote.append(item)
+                max_fecha = _max_fecha_item(max_fecha, item)
+                if len(lote) >= batch_size:
+                    total += self._vectorizar_en(generacion, lote)
+                    lote = []
+            total += self._vectorizar_en(generacion, lote)
+            self._publicar(generacion, max_fecha)
+        logger.info("Índice semántico reconstruido: %d convocatorias.", total)
+        return total
+
+    def _vectorizar_en(self, generacion: int, items: List[dict]) -> int:
+        """Vectoriza un lote y lo añade a una generación aún no publicada."""
+        if not items:
+            return 0
+        vectores = self.embedder.embed([texto_convocatoria(i) for i in items])
+        self._anadir(generacion, [int(i["id"]) for i in items], list(vectores))
+        return len(items)
+
+    def stats(self) -> dict:
+        """Devuelve el tamaño y la configuración del índice."""
+        return {"convocatorias": len(self), "embedder": self.meta.get("embedder"),
+                "dim": self.meta.get("dim"), "marca_agua": self.meta.get("marca_agua"),
+                "generacion": self.meta.get("generacion", 0),
+                "compatible": self.compatible}
+
+
+class HybridRetriever:
+    """
+    Combina los resultados de la API con los del índice semántico mediante
+    fusión por rango recíproco (RRF). Los resultados sólo semánticos se
+    recuperan del espejo local.
+    """
+
+    def __init__(self, index: VectorIndex, mirror, top_k: int = None,
+                 min_score: float = None):
+        self.index = index
+        self.mirror = mirror
+        self.top_k = top_k or int(os.environ.get('SEMANTIC_HYBRID_TOP_K', '20'))
+        self.min_score = min_score if min_score is not None else float(
+            os.environ.get('SEMANTIC_MIN_SCORE', '0.3'))
+
+    def admite(self, params: dict) -> bool:
+        """
+        La fusión sólo es segura si la búsqueda es por texto y el espejo
+        sabe aplicar el resto de filtros a los resultados semánticos.
+        """
+        claves = {k for k, v in params.items() if v not in (None, "")}
+        return ("descripcion" in claves and claves <= SUPPORTED_PARAMS
+                and fechas_validas(params))
+
+    def _en_rango(self, item: dict, params: dict) -> bool:
+        fecha = (item.get("fechaRecepcion") or "")[:10]
+        if params.get("fechaDesde") and fecha < _parse_fecha_api(
+                params["fechaDesde"]).isoformat():
+            return False
+        if params.get("fechaHasta") and fecha > _parse_fecha_api(
+                params["fechaHasta"]).isoformat():
+            return False
+        return True
+
+    def fusionar(self, data: dict, params: dict) -> dict:
+        """
+        Añade a una respuesta de búsqueda las convocatorias semánticamente
+        similares y reordena el contenido por RRF.
+
+        Args:
+            data: Respuesta de `/convocatorias/busqueda` (o equivalente).
+            params: Parámetros de la búsqueda.
+        Returns:
+            Copia de `data` con el contenido fusionado, 'totalElements'
+            ampliado con los resultados nuevos y 'resultadosSemanticos'.
+        """
+        vecinos = [(id_, s) for id_, s in self.index.buscar(
+            params["descripcion"], self.top_k * 2) if s >= self.min_score]
+        if not vecinos:
+            return data
+        items_espejo = self.mirror.obtener([id_ for id_, _ in vecinos])
+        semanticos = [items_espejo[id_] for id_, _ in vecinos
+                      if id_ in items_espejo and self._en_rango(items_espejo[id_], params)]
+        semanticos = semanticos[:self.top_k]
+
+        puntos: Dict[int, float] = {}
+        por_id: Dict[int, dict] = {}
+        for ranking in (data.get("content") or [], semanticos):
+            for pos, item in enumerate(ranking):
+                puntos[item["id"]] = puntos.get(item["id"], 0.0) + 1.0 / (RRF_K + pos + 1)
+                por_id.setdefault(item["id"], item)
+        nuevos = len(por_id) - len(data.get("content") or [])
+        fusion = dict(data)
+        fusion["content"] = [por_id[id_] for id_ in
+                             sorted(por_id, key=puntos.get, reverse=True)]
+        fusion["totalElements"] = (data.get("totalElements") or 0) + nuevos
+        fusion["resultadosSemanticos"] = nuevos
+        return fusion
+
+
+def build_semantic_index(directorio: Optional[str] = None) -> Optional[VectorIndex]:
+    """Crea el índice de SEMANTIC_INDEX_DIR, o None si no está configurado."""
+    directorio = directorio or os.environ.get('SEMANTIC_INDEX_DIR')
+    if not directorio:
+        return None
+    try:
+        return VectorIndex(directorio)
+    except ImportError as e:
+        logger.error("No se pudo cargar el embedder del índice semántico: %s", e)
+        return None
+
+
+def main():
+    """Punto de entrada de la línea de comandos del índice semántico."""
+    # pylint: disable=import-outside-toplevel
+    from .infosubvenciones_service import info_subvenciones_service
+
+    parser = argparse.ArgumentParser(description="Índice semántico de convocatorias")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    reindex = sub.add_parser("reindex", help="Vectoriza las novedades del espejo local")
+    reindex.add_argument("--rebuild", action="store_true",
+                         help="Descarta el índice y lo vectoriza entero")
+    sub.add_parser("estado", help="Muestra el estado del índice")
+    args = parser.parse_args()
+
+    index = info_subvenciones_service.semantic_index
+    if index is None:
+        parser.error("Define SEMANTIC_INDEX_DIR con la carpeta del índice.")
+    if args.comando == "reindex":
+        if info_subvenciones_service.mirror is None:
+            parser.error("La vectorización necesita CONVOCATORIAS_MIRROR_DB.")
+        if args.rebuild:
+            index.reconstruir(info_subvenciones_service.mirror)
+        else:
+            index.sincronizar_desde_espejo(info_subvenciones_service.mirror)
+    print(json.dumps(index.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
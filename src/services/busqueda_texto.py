@@ -0,0 +1,328 @@
+"""
+Este módulo mantiene un índice de texto completo (SQLite FTS5) sobre las
+convocatorias, con análisis para español: plegado de tildes, palabras vacías
+y un stemmer ligero, y ordenación por relevancia BM25.
+
+El índice se alimenta de forma incremental con los resultados de
+`/convocatorias/busqueda` que pasan por el servicio y, si existe, con el
+espejo local. También admite el texto de las bases reguladoras de cada
+convocatoria.
+
+Las búsquedas sólo se responden desde el índice cuando se ha puesto al día
+con un espejo fresco (`make sync`): lo ingerido desde resultados sueltos de
+la API es parcial, así que sin espejo el índice nunca responde y sólo sirve
+para acumular texto.
+
+Uso (desde `src/`):
+    python -m services.busqueda_texto reindex
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from typing import Iterable, List, Optional
+from .convocatorias_mirror import _parse_fecha_api, fechas_validas, normalizar_texto
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_PARAMS = {
+    "page", "pageSize", "descripcion", "descripcionTipoBusqueda",
+    "fechaDesde", "fechaHasta"
+}
+# Pesos BM25 de las columnas (descripcion, niveles, bases).
+BM25_WEIGHTS = (10.0, 2.0, 1.0)
+
+STOPWORDS_ES = frozenset("""
+a al ante bajo con contra de del desde durante e el en entre hacia hasta la
+las le les lo los mediante o para por que se segun sin sobre su sus tras u un
+una unas unos y convocatoria convocatorias
+""".split())
+
+# Sufijos derivativos; se prueban en orden y se quita el primero que encaje.
+_SUFIJOS = (
+    "izaciones", "amientos", "imientos", "izacion", "aciones", "uciones",
+    "amiento", "imiento", "adores", "ancias", "encias", "idades", "mente",
+    "acion", "ucion", "adora", "ancia", "encia", "ismos", "istas", "ables",
+    "ibles", "idad", "ador", "ismo", "ista", "able", "ible", "ivos", "ivas",
+    "ivo", "iva"
+)
+_TOKEN_RE = re.compile(r"[a-z0-9ñ]+")
+
+
+def stem_es(palabra: str) -> str:
+    """
+    Stemmer ligero para español: elimina sufijos derivativos frecuentes,
+    el plural y la vocal final de género. No pretende ser lingüísticamente
+    exacto, sólo agrupar variantes (ayuda/ayudas, digital/digitalización).
+    """
+    if len(palabra) <= 3 or palabra.isdigit():
+        return palabra
+    for sufijo in _SUFIJOS:
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= 4:
+            palabra = palabra[:-len(sufijo)]
+            break
+    if palabra.endswith("es") and len(palabra) > 5:
+        palabra = palabra[:-2]
+    elif palabra.endswith("s") and len(palabra) > 4:
+        palabra = palabra[:-1]
+    if palabra[-1] in "aeo" and len(palabra) > 4:
+        palabra = palabra[:-1]
+    return palabra
+
+
+def analizar(texto: str) -> List[str]:
+    """Tokeniza, pliega tildes, quita palabras vacías y aplica el stemmer."""
+    tokens = _TOKEN_RE.findall(normalizar_texto(texto))
+    return [stem_es(t) for t in tokens if t not in STOPWORDS_ES]
+
+
+class FullTextIndex:
+    """Índice FTS5 de convocatorias con análisis para español."""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Ruta de la base de datos SQLite del índice.
+        """
+        self.path = path
+        self.max_age = float(os.environ.get('CONVOCATORIAS_MIRROR_MAX_AGE', '26')) * 3600
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS convocatorias_fts USING fts5("
+                " descripcion, niveles, bases,"
+                " tokenize = 'unicode61 remove_diacritics 2');"
+                "CREATE TABLE IF NOT EXISTS convocatorias_fts_docs ("
+                " id INTEGER PRIMARY KEY,"
+                " numero TEXT,"
+                " fecha_recepcion TEXT,"
+                " datos TEXT NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS idx_fts_docs_numero"
+                " ON convocatorias_fts_docs (numero);"
+                "CREATE TABLE IF NOT EXISTS convocatorias_fts_estado ("
+                " clave TEXT PRIMARY KEY, valor TEXT NOT NULL);"
+            )
+            self._conn.commit()
+
+    def _get_estado(self, clave: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT valor FROM convocatorias_fts_estado WHERE clave = ?", (clave,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set_estado(self, clave: str, valor: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO convocatorias_fts_estado (clave, valor) "
+                "VALUES (?, ?)", (clave, valor)
+            )
+            self._conn.commit()
+
+    def is_fresh(self) -> bool:
+        """
+        Indica si el índice se ha puesto al día con un espejo fresco hace
+        menos de `max_age`; sólo entonces se considera completo. Requiere el
+        espejo: la ingesta de resultados de la API no lo marca como fresco.
+        """
+        ultima = self._get_estado("ultima_sync")
+        return ultima is not None and time.time() - float(ultima) < self.max_age
+
+    # --- Ingesta ---
+
+    def indexar(self, items: Iterable[dict]) -> int:
+        """
+        Añade o actualiza convocatorias tal como las devuelve la API,
+        conservando el texto de bases reguladoras ya indexado.
+
+        Returns:
+            Número de convocatorias indexadas.
+        """
+        n = 0
+        with self._lock:
+            for item in items:
+                id_ = item.get("id")
+                if id_ is None:
+                    continue
+                row = self._conn.execute(
+                    "SELECT bases FROM convocatorias_fts WHERE rowid = ?", (id_,)
+                ).fetchone()
+                self._conn.execute("DELETE FROM convocatorias_fts WHERE rowid = ?", (id_,))
+                niveles = " ".join(
+                    filter(None, (item.get("nivel1"), item.get("nivel2"), item.get("nivel3")))
+                )
+                self._conn.execute(
+                    "INSERT INTO convocatorias_fts (rowid, descripcion, niveles, bases) "
+                    "VALUES (?, ?, ?, ?)",
+                    (id_, " ".join(analizar(item.get("descripcion"))),
+                     " ".join(analizar(niveles)), row[0] if row else "")
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO convocatorias_fts_docs "
+                    "(id, numero, fecha_recepcion, datos) VALUES (?, ?, ?, ?)",
+                    (id_, item.get("numeroConvocatoria"),
+                     (item.get("fechaRecepcion") or "")[:10] or None,
+                     json.dumps(item, ensure_ascii=False))
+                )
+                n += 1
+            self._conn.commit()
+        return n
+
+    def actualizar_bases(self, numero_convocatoria: str, texto: str) -> bool:
+        """
+        Indexa el texto de las bases reguladoras de una convocatoria ya indexada.
+
+        Returns:
+            True si la convocatoria estaba en el índice.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT d.id, f.descripcion, f.niveles FROM convocatorias_fts_docs d "
+                "JOIN convocatorias_fts f ON f.rowid = d.id WHERE d.numero = ?",
+                (str(numero_convocatoria),)
+            ).fetchone()
+            if row is None:
+                return False
+            self._conn.execute("DELETE FROM convocatorias_fts WHERE rowid = ?", (row[0],))
+            self._conn.execute(
+                "INSERT INTO convocatorias_fts (rowid, descripcion, niveles, bases) "
+                "VALUES (?, ?, ?, ?)", (row[0], row[1], row[2], " ".join(analizar(texto)))
+            )
+            self._conn.commit()
+        return True
+
+    def sincronizar_desde_espejo(self, mirror) -> int:
+        """
+        Indexa las filas del espejo posteriores a la marca de agua del índice
+        (con un día de solape) y, si el espejo está al día, marca el índice
+        como fresco.
+
+        Returns:
+            Número de convocatorias indexadas.
+        """
+        marca = self._get_estado("marca_agua")
+        desde = (date.fromisoformat(marca) - timedelta(days=1)).isoformat() if marca else None
+        total, lote, max_fecha = 0, [], marca
+        for item in mirror.iterar_filas(desde):
+            lote.append(item)
+            fecha = (item.get("fechaRecepcion") or "")[:10]
+            if fecha and (max_fecha is None or fecha > max_fecha):
+                max_fecha = fecha
+            if len(lote) >= 1000:
+                total += self.indexar(lote)
+                lote = []
+        total += self.indexar(lote)
+        if max_fecha:
+            self._set_estado("marca_agua", max_fecha)
+        if mirror.is_fresh():
+            self._set_estado("ultima_sync", str(time.time()))
+        logger.info("Índice de texto: %d convocatorias indexadas desde el espejo.", total)
+        return total
+
+    # --- Consultas ---
+
+    def can_answer(self, params: dict) -> bool:
+        """Indica si el índice está al día y admite la búsqueda pedida."""
+        claves = {k for k, v in params.items() if v not in (None, "")}
+        return ("descripcion" in claves and claves <= SUPPORTED_PARAMS
+                and fechas_validas(params) and self.is_fresh())
+
+    @staticmethod
+    def _consulta_fts(descripcion: str, tipo: str) -> Optional[str]:
+        """Traduce la descripción y su modo de búsqueda a sintaxis FTS5."""
+        terminos = analizar(descripcion)
+        if not terminos:
+            return None
+        if tipo == "0":
+            return '"' + " ".join(terminos) + '"'
+        union = " AND " if tipo == "1" else " OR "
+        return union.join(f'"{t}"' for t in terminos)
+
+    def buscar(self, params: dict) -> dict:
+        """
+        Responde una búsqueda con el formato de `/convocatorias/busqueda`,
+        ordenando por relevancia BM25 y, a igualdad, por fecha.
+        """
+        consulta = self._consulta_fts(
+            params.get("descripcion", ""), str(params.get("descripcionTipoBusqueda", "1"))
+        )
+        page = int(params.get("page") or 0)
+        page_size = int(params.get("pageSize") or 10)
+        if consulta is None:
+            return {"content": [], "totalElements": 0, "totalPages": 0,
+                    "number": page, "size": page_size, "origen": "indice"}
+
+        condiciones, valores = ["convocatorias_fts MATCH ?"], [consulta]
+        if params.get("fechaDesde"):
+            condiciones.append("d.fecha_recepcion >= ?")
+            valores.append(_parse_fecha_api(params["fechaDesde"]).isoformat())
+        if params.get("fechaHasta"):
+            condiciones.append("d.fecha_recepcion <= ?")
+            valores.append(_parse_fecha_api(params["fechaHasta"]).isoformat())
+        where = " AND ".join(condiciones)
+        desde = "FROM convocatorias_fts JOIN convocatorias_fts_docs d " \
+                "ON d.id = convocatorias_fts.rowid"
+        pesos = ", ".join(str(p) for p in BM25_WEIGHTS)
+        with self._lock:
+            total = self._conn.execute(
+                f"SELECT COUNT(*) {desde} WHERE {where}", valores
+            ).fetchone()[0]
+            filas = self._conn.execute(
+                f"SELECT d.datos {desde} WHERE {where} "
+                f"ORDER BY bm25(convocatorias_fts, {pesos}), d.fecha_recepcion DESC "
+                "LIMIT ? OFFSET ?",
+                [*valores, page_size, page * page_size]
+            ).fetchall()
+        return {
+            "content": [json.loads(fila[0]) for fila in filas],
+            "totalElements": total,
+            "totalPages": math.ceil(total / page_size) if page_size else 0,
+            "number": page,
+            "size": page_size,
+            "origen": "indice"
+        }
+
+    def stats(self) -> dict:
+        """Devuelve el tamaño y el estado del índice."""
+        with self._lock:
+            total = self._conn.execute(
+                "SELECT COUNT(*) FROM convocatorias_fts_docs").fetchone()[0]
+        return {
+            "convocatorias": total,
+            "marca_agua": self._get_estado("marca_agua"),
+            "fresco": self.is_fresh()
+        }
+
+
+def main():
+    """Punto de entrada de la línea de comandos del índice de texto."""
+    # pylint: disable=import-outside-toplevel
+    from .infosubvenciones_service import info_subvenciones_service
+
+    parser = argparse.ArgumentParser(description="Índice de texto de convocatorias")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("reindex", help="Indexa las novedades del espejo local")
+    sub.add_parser("estado", help="Muestra el estado del índice")
+    args = parser.parse_args()
+
+    index = info_subvenciones_service.text_index
+    if index is None:
+        parser.error("Define BUSQUEDA_TEXTO_DB o CONVOCATORIAS_MIRROR_DB.")
+    if args.comando == "reindex":
+        if info_subvenciones_service.mirror is None:
+            parser.error("La reindexación necesita CONVOCATORIAS_MIRROR_DB.")
+        index.sincronizar_desde_espejo(info_subvenciones_service.mirror)
+    print(json.dumps(index.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,320 @@
+"""
+Este módulo descarga en bloque concesiones y ayudas de estado de la API y
+las guarda en un fichero columnar local.
+
+Las páginas de cada búsqueda se piden en paralelo (`iterar_registros`), los
+NIF de una lista se procesan a la vez y los registros se escriben en cuanto
+llegan, por grupos de filas: la memoria no crece con el tamaño del
+resultado. Con `pyarrow` instalado se escribe Parquet; sin él, CSV.
+
+Uso (desde `src/`):
+    python -m services.concesiones_export nifs FICHERO --salida concesiones.parquet
+    python -m services.concesiones_export buscar --nif B35236355 --salida x.parquet
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ROW_GROUP = int(os.environ.get('EXPORT_ROW_GROUP', '50000'))
+NIF_CONCURRENCY = int(os.environ.get('EXPORT_NIF_CONCURRENCY', '4'))
+# Registros que un NIF entrega de una vez al hilo que escribe.
+LOTE = 1000
+
+# Columnas y tipos de cada endpoint; las que falten en un registro quedan vacías.
+COLUMNAS = {
+    "concesiones/busqueda": {
+        "id": "int", "codConcesion": "str", "idConvocatoria": "int",
+        "numeroConvocatoria": "str", "convocatoria": "str", "nivel1": "str",
+        "nivel2": "str", "nivel3": "str", "fechaConcesion": "str",
+        "idPersona": "int", "beneficiario": "str", "instrumento": "str",
+        "importe": "float", "ayudaEquivalente": "float", "urlBR": "str",
+        "tieneProyecto": "bool",
+    },
+    "ayudasestado/busqueda": {
+        "idConcesion": "int", "numeroConvocatoria": "str", "convocatoria": "str",
+        "convocante": "str", "reglamento": "str", "objetivo": "str",
+        "instrumento": "str", "fechaConcesion": "str", "beneficiario": "str",
+        "importe": "float", "ayudaEquivalente": "float", "ayudaEstado": "str",
+        "urlAyudaEstado": "str",
+    },
+}
+
+
+def normalizar_nif(texto: str) -> str:
+    """NIF/CIF en mayúsculas y sin espacios, guiones ni puntos."""
+    return "".join(c for c in (texto or "").upper() if c.isalnum())
+
+
+def leer_nifs(ruta: str) -> List[str]:
+    """Lee una lista de NIF (uno por línea; admite '#' y columnas extra)."""
+    nifs = []
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            linea = linea.split("#", 1)[0].replace(";", ",").split(",", 1)[0]
+            nif = normalizar_nif(linea)
+            if nif:
+                nifs.append(nif)
+    return list(dict.fromkeys(nifs))
+
+
+def _convertir(valor, tipo: str):
+    """Convierte un valor de la API al tipo de su columna (None si no encaja)."""
+    if valor is None or valor == "":
+        return None
+    try:
+        if tipo == "int":
+            return int(valor)
+        if tipo == "float":
+            return float(valor)
+        if tipo == "bool":
+            return valor if isinstance(valor, bool) else str(valor).lower() == "true"
+    except (TypeError, ValueError):
+        return None
+    return str(valor)
+
+
+class EscritorRegistros:
+    """
+    Escribe registros en un fichero Parquet (un grupo de filas cada
+    `filas_por_grupo`) o, si falta `pyarrow` o la ruta no es .parquet, en CSV.
+    El fichero se escribe con otro nombre y se renombra al cerrar.
+    """
+
+    def __init__(self, ruta: str, columnas: dict, filas_por_grupo: int = ROW_GROUP):
+        self.columnas = {"nifConsultado": "str", **columnas}
+        self.filas_por_grupo = max(1, filas_por_grupo)
+        self.formato = "parquet" if ruta.endswith(".parquet") else "csv"
+        if self.formato == "parquet":
+            try:
+                # pylint: disable=import-outside-toplevel
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError as e:
+                logger.warning("Falta 'pyarrow' (%s); se exporta en CSV.", e)
+                self.formato = "csv"
+                ruta = os.path.splitext(ruta)[0] + ".csv"
+            else:
+                self._pa = pyarrow
+                self._pq = pyarrow.parquet
+        self.ruta = ruta
+        self.filas = 0
+        self._temporal = f"{ruta}.{os.getpid()}.tmp"
+        self._buffer = []
+        if self.formato == "parquet":
+            tipos = {"int": self._pa.int64(), "float": self._pa.float64(),
+                     "bool": self._pa.bool_(), "str": self._pa.string()}
+            self._schema = self._pa.schema(
+                [(nombre, tipos[tipo]) for nombre, tipo in self.columnas.items()])
+            self._writer = self._pq.ParquetWriter(self._temporal, self._schema)
+        else:
+            self._fichero = open(self._temporal, "w", encoding="utf-8", newline="")
+            self._writer = csv.writer(self._fichero)
+            self._writer.writerow(self.columnas)
+
+    def escribir(self, registros: Iterable[dict], nif: Optional[str] = None):
+        """Añade registros; se vuelcan a disco al completar un grupo de filas."""
+        for registro in registros:
+            self._buffer.append([
+                nif if nombre == "nifConsultado" else _convertir(registro.get(nombre), tipo)
+                for nombre, tipo in self.columnas.items()
+            ])
+            if len(self._buffer) >= self.filas_por_grupo:
+                self._volcar()
+
+    def _volcar(self):
+        if not self._buffer:
+            return
+        if self.formato == "parquet":
+            columnas = {nombre: [fila[i] for fila in self._buffer]
+                        for i, nombre in enumerate(self.columnas)}
+            self._writer.write_table(
+                self._pa.Table.from_pydict(columnas, schema=self._schema))
+        else:
+            self._writer.writerows(self._buffer)
+        self.filas += len(self._buffer)
+        self._buffer = []
+
+    def close(self):
+        """Vuelca lo pendiente y publica el fichero con su nombre definitivo."""
+        self._volcar()
+        if self.formato == "parquet":
+            self._writer.close()
+        else:
+            self._fichero.close()
+        os.replace(self._temporal, self.ruta)
+
+    def abort(self):
+        """Descarta el fichero a medio escribir."""
+        try:
+            if self.formato == "parquet":
+                self._writer.close()
+            else:
+                self._fichero.close()
+        finally:
+            if os.path.exists(self._temporal):
+                os.remove(self._temporal)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def exportar_busqueda(service, endpoint: str, params: dict, ruta: str) -> dict:
+    """
+    Descarga todos los registros de una búsqueda y los escribe en `ruta`.
+
+    Returns:
+        dict: Fichero escrito, registros y si la descarga fue completa.
+    """
+    paginador = service.iterar_registros(endpoint, params)
+    with EscritorRegistros(ruta, COLUMNAS[endpoint]) as escritor:
+        escritor.escribir(paginador, params.get("nifCif"))
+    return {"fichero": escritor.ruta, "registros": escritor.filas,
+            "paginas": paginador.paginas, "completo": paginador.completo}
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+def exportar_nifs(service, nifs: List[str], ruta: str,
+                  endpoint: str = "concesiones/busqueda", params: dict = None,
+                  concurrencia: int = None) -> dict:
+    """
+    Descarga los registros de cada NIF de la lista, varios NIF a la vez, y
+    los escribe en un único fichero con la columna `nifConsultado`.
+
+    Args:
+        service: InfosubvencionesService.
+        nifs: NIF/CIF a consultar.
+        ruta: Fichero de salida (.parquet o .csv).
+        endpoint: Uno de ENDPOINTS_REGISTROS.
+        params: Filtros comunes a todos los NIF (p. ej. fechaDesde).
+        concurrencia: NIF que se descargan a la vez.
+
+    Returns:
+        dict: Fichero, registros totales y, por NIF, registros y errores.
+    """
+    concurrencia = concurrencia or NIF_CONCURRENCY
+    nifs = list(dict.fromkeys(normalizar_nif(n) for n in nifs if normalizar_nif(n)))
+    cola = queue.Queue(maxsize=concurrencia * 4)
+    cancelado = threading.Event()
+
+    def poner(elemento) -> bool:
+        while not cancelado.is_set():
+            try:
+                cola.put(elemento, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def descargar(nif: str):
+        # Cada NIF entrega lotes a la cola y termina con (nif, None, estado).
+        estado = {"completo": False, "error": None}
+        try:
+            paginador = service.iterar_registros(endpoint, {**(params or {}), "nifCif": nif})
+            lote = []
+            for registro in paginador:
+                lote.append(registro)
+                if len(lote) >= LOTE:
+                    if not poner((nif, lote, None)):
+                        return
+                    lote = []
+            if lote and not poner((nif, lote, None)):
+                return
+            estado["completo"] = paginador.completo
+        # pylint: disable=broad-exception-caught
+        except Exception as e:
+            logger.error("No se pudieron descargar los registros del NIF %s: %s", nif, e)
+            estado["error"] = str(e)
+        finally:
+            poner((nif, None, estado))
+
+    resumen = {nif: {"registros": 0} for nif in nifs}
+    pendientes = len(nifs)
+    with ThreadPoolExecutor(max_workers=concurrencia,
+                            thread_name_prefix="export-nif") as executor:
+        try:
+            with EscritorRegistros(ruta, COLUMNAS[endpoint]) as escritor:
+                for nif in nifs:
+                    executor.submit(descargar, nif)
+                while pendientes:
+                    nif, lote, estado = cola.get()
+                    if lote is None:
+                        resumen[nif].update(estado)
+                        pendientes -= 1
+                        logger.info("NIF %s: %d registros (%d NIF pendientes).",
+                                    nif, resumen[nif]["registros"], pendientes)
+                        continue
+                    escritor.escribir(lote, nif)
+                    resumen[nif]["registros"] += len(lote)
+        finally:
+            cancelado.set()
+    return {
+        "fichero": escritor.ruta,
+        "registros": sum(r["registros"] for r in resumen.values()),
+        "nifs": len(nifs),
+        "incompletos": sorted(nif for nif, r in resumen.items() if not r["completo"]),
+        "detalle": resumen,
+    }
+
+
+def main():
+    """Punto de entrada de la línea de comandos de la exportación."""
+    # pylint: disable=import-outside-toplevel
+    from .infosubvenciones_service import info_subvenciones_service
+
+    parser = argparse.ArgumentParser(description="Exportación de concesiones")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    por_nifs = sub.add_parser("nifs", help="Concesiones de una lista de NIF")
+    por_nifs.add_argument("fichero", help="Fichero con un NIF por línea")
+    buscar = sub.add_parser("buscar", help="Todas las concesiones de una búsqueda")
+    buscar.add_argument("--nif", help="NIF/CIF del beneficiario")
+    buscar.add_argument("--convocatoria", help="Número BDNS de la convocatoria")
+    buscar.add_argument("--sa", help="Referencia de ayuda de estado (SA Number)")
+    for comando in (por_nifs, buscar):
+        comando.add_argument("--salida", required=True, help="Fichero .parquet o .csv")
+        comando.add_argument("--ayudas-estado", action="store_true",
+                             help="Consulta /ayudasestado en lugar de /concesiones")
+        comando.add_argument("--desde", help="Fecha mínima DD/MM/YYYY")
+        comando.add_argument("--hasta", help="Fecha máxima DD/MM/YYYY")
+    args = parser.parse_args()
+
+    endpoint = "ayudasestado/busqueda" if args.ayudas_estado else "concesiones/busqueda"
+    params = {clave: valor for clave, valor in (("fechaDesde", args.desde),
+                                                ("fechaHasta", args.hasta)) if valor}
+    if args.comando == "nifs":
+        resultado = exportar_nifs(info_subvenciones_service, leer_nifs(args.fichero),
+                                  args.salida, endpoint, params)
+        completo = not resultado["incompletos"]
+        del resultado["detalle"]
+    else:
+        for clave, valor in (("nifCif", normalizar_nif(args.nif or "")),
+                             ("numeroConvocatoria", args.convocatoria),
+                             ("ayudaEstado", args.sa)):
+            if valor:
+                params[clave] = valor
+        if not set(params) - {"fechaDesde", "fechaHasta"}:
+            parser.error("Indica --nif, --convocatoria o --sa.")
+        resultado = exportar_busqueda(info_subvenciones_service, endpoint, params,
+                                      args.salida)
+        completo = resultado["completo"]
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+    sys.exit(0 if completo else 1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,228 @@
+"""
+Este módulo empaqueta los datos de la API en los prompts de generación
+respetando un presupuesto de tokens por prompt.
+
+Elimina campos nulos o irrelevantes, serializa en JSON compacto, ordena las
+filas por relevancia (o importe) y descarta las que no caben, informando de
+cuánto se ha recortado.
+"""
+import json
+import logging
+import math
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Presupuesto de tokens por defecto de cada prompt (CONTEXT_BUDGET_<NOMBRE>).
+DEFAULT_BUDGETS = {
+    "detailed_response": 6000,
+    "search_summary": 6000,
+    "beneficiaries_summary": 4000,
+    "parties_summary": 4000,
+    "concessions_summary": 4000,
+}
+# Campos que no aportan nada a la respuesta del modelo.
+IRRELEVANT_FIELDS = frozenset({
+    "idPersona", "idConvocatoria", "codigoInvente", "tieneProyecto",
+    "mrr", "descripcionLeng", "advertencia"
+})
+# Campos con el importe de una concesión o beneficiario, por preferencia.
+IMPORTE_FIELDS = ("importe", "importeTotal", "ayudaEquivalente", "ayudaETotal")
+# Longitud máxima de un texto suelto cuando el objeto no cabe en el presupuesto.
+MAX_TEXT_CHARS = 600
+
+
+class ContextReport(NamedTuple):
+    """Resultado del empaquetado: filas incluidas y tokens usados o recortados."""
+    filas_totales: int
+    filas_incluidas: int
+    tokens: int
+    tokens_recortados: int
+
+    @property
+    def recortado(self) -> bool:
+        """Indica si se ha dejado fuera alguna parte de los datos."""
+        return self.tokens_recortados > 0
+
+
+def count_tokens(text: str) -> int:
+    """Estimación rápida de tokens (caracteres / CONTEXT_CHARS_PER_TOKEN)."""
+    chars_per_token = float(os.environ.get('CONTEXT_CHARS_PER_TOKEN', '3.5'))
+    return math.ceil(len(text) / chars_per_token)
+
+
+def compact_json(value: Any) -> str:
+    """Serializa en JSON sin espacios ni sangría."""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def prune(value: Any, drop: Iterable[str] = IRRELEVANT_FIELDS) -> Any:
+    """Elimina recursivamente los valores vacíos y los campos irrelevantes."""
+    drop = frozenset(drop)
+    if isinstance(value, dict):
+        limpio = {}
+        for key, item in value.items():
+            if key in drop:
+                continue
+            item = prune(item, drop)
+            if item not in (None, "", [], {}):
+                limpio[key] = item
+        return limpio
+    if isinstance(value, list):
+        return [v for v in (prune(i, drop) for i in value) if v not in (None, "", [], {})]
+    return value
+
+
+def importe(item: dict) -> float:
+    """Importe de una fila (0 si no tiene ninguno numérico)."""
+    for field in IMPORTE_FIELDS:
+        valor = item.get(field)
+        if isinstance(valor, (int, float)):
+            return float(valor)
+    return 0.0
+
+
+def _truncate_texts(value: Any, max_chars: int) -> Any:
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars] + "…"
+    if isinstance(value, dict):
+        return {k: _truncate_texts(v, max_chars) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_truncate_texts(v, max_chars) for v in value]
+    return value
+
+
+class ContextBuilder:
+    """Empaqueta datos para los prompts y acumula métricas de recorte."""
+
+    def __init__(self, budgets: Dict[str, int] = None):
+        """
+        Args:
+            budgets: Presupuesto de tokens por nombre de prompt.
+        """
+        self.budgets = {
+            name: int(os.environ.get(f"CONTEXT_BUDGET_{name.upper()}", tokens))
+            for name, tokens in DEFAULT_BUDGETS.items()
+        }
+        self.budgets.update(budgets or {})
+        self._lock = threading.Lock()
+        self._stats = {"prompts": 0, "prompts_recortados": 0,
+                       "tokens": 0, "tokens_recortados": 0}
+
+    def budget(self, name: str) -> int:
+        """Presupuesto de tokens del prompt `name`."""
+        return self.budgets.get(name, max(DEFAULT_BUDGETS.values()))
+
+    def _record(self, name: str, report: ContextReport) -> ContextReport:
+        with self._lock:
+            self._stats["prompts"] += 1
+            self._stats["prompts_recortados"] += int(report.recortado)
+            self._stats["tokens"] += report.tokens
+            self._stats["tokens_recortados"] += report.tokens_recortados
+        if report.recortado:
+            logger.info("Contexto '%s' recortado: %d/%d filas, %d tokens (-%d).",
+                        name, report.filas_incluidas, report.filas_totales,
+                        report.tokens, report.tokens_recortados)
+        return report
+
+    def pack_rows(self, name: str, rows: List[Any],
+                  render: Callable[[Any], str] = compact_json,
+                  sort_key: Optional[Callable[[Any], float]] = None,
+                  separator: str = "\n") -> tuple:
+        """
+        Incluye filas, por orden de relevancia, hasta agotar el presupuesto.
+
+        Args:
+            name: Nombre del prompt (determina el presupuesto).
+            rows: Filas a incluir.
+            render: Convierte una fila en texto.
+            sort_key: Si se indica, ordena las filas de mayor a menor por esta clave.
+            separator: Separador entre filas.
+        Returns:
+            Tupla (texto, ContextReport).
+        """
+        if sort_key is not None:
+            rows = sorted(rows, key=sort_key, reverse=True)
+        budget = self.budget(name)
+        partes, usados, recortados = [], 0, 0
+        for indice, row in enumerate(rows):
+            texto = render(row)
+            coste = count_tokens(texto + separator)
+            if usados + coste > budget:
+                # Se corta en la primera fila que no cabe: saltarla y meter
+                # otras menores rompería el orden de relevancia.
+                recortados = coste + sum(count_tokens(render(r) + separator)
+                                         for r in rows[indice + 1:])
+                break
+            partes.append(texto)
+            usados += coste
+        report = ContextReport(len(rows), len(partes), usados, recortados)
+        return separator.join(partes), self._record(name, report)
+
+    def pack_groups(self, name: str, groups: Dict[Any, Any],
+                    sort_key: Optional[Callable[[Any], float]] = None) -> tuple:
+        """
+        Empaqueta un diccionario de grupos de filas (p. ej. beneficiarios por
+        año) repartiendo el presupuesto por turnos entre grupos, de modo que
+        todos conserven sus filas más relevantes.
+
+        Returns:
+            Tupla (JSON compacto, ContextReport).
+        """
+        listas = {k: sorted((prune(r) for r in v), key=sort_key, reverse=True)
+                  if sort_key else [prune(r) for r in v]
+                  for k, v in groups.items() if isinstance(v, list)}
+        resultado = {k: (v if not isinstance(v, list) else []) for k, v in groups.items()}
+        budget = self.budget(name)
+        usados = count_tokens(compact_json(resultado))
+        total = sum(len(v) for v in listas.values())
+        incluidas, recortados = 0, 0
+        posicion = 0
+        while any(posicion < len(v) for v in listas.values()):
+            for key, filas in listas.items():
+                if posicion >= len(filas):
+                    continue
+                coste = count_tokens(compact_json(filas[posicion]) + ",")
+                if usados + coste > budget:
+                    # El grupo se cierra en su primera fila que no cabe.
+                    recortados += coste + sum(count_tokens(compact_json(f) + ",")
+                                              for f in filas[posicion + 1:])
+                    del filas[posicion:]
+                    continue
+                resultado[key].append(filas[posicion])
+                usados += coste
+                incluidas += 1
+            posicion += 1
+        report = ContextReport(total, incluidas, usados, recortados)
+        return compact_json(resultado), self._record(name, report)
+
+    def pack_object(self, name: str, value: Any) -> tuple:
+        """
+        Empaqueta un objeto (p. ej. el detalle de una convocatoria). Si no
+        cabe, acorta los textos largos y, como último recurso, recorta el JSON.
+
+        Returns:
+            Tupla (JSON compacto, ContextReport).
+        """
+        value = prune(value)
+        texto = compact_json(value)
+        original = count_tokens(texto)
+        budget = self.budget(name)
+        if original > budget:
+            texto = compact_json(_truncate_texts(value, MAX_TEXT_CHARS))
+        if count_tokens(texto) > budget:
+            chars_per_token = len(texto) / max(count_tokens(texto), 1)
+            texto = texto[:int(budget * chars_per_token)] + "…"
+        tokens = count_tokens(texto)
+        report = ContextReport(1, 1, tokens, max(original - tokens, 0))
+        return texto, self._record(name, report)
+
+    def stats(self) -> dict:
+        """Devuelve cuántos prompts y tokens se han recortado."""
+        with self._lock:
+            return {**self._stats, "budgets": dict(self.budgets)}
+
+
+context_builder = ContextBuilder()
@@ -0,0 +1,348 @@
+"""
+Este módulo proporciona una caché de dos niveles para los detalles de
+convocatorias de la API de InfoSubvenciones.
+
+El primer nivel es una LRU en memoria acotada en tamaño; el segundo, opcional,
+es una base de datos SQLite en disco que comparten todos los workers del
+servidor. Soporta TTL, stale-while-revalidate y caché negativa de 404. Los
+refrescos en segundo plano se ejecutan en el pool compartido y las descargas
+simultáneas de una misma clave se comparten.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, NamedTuple, Optional, Tuple
+from cachetools import LRUCache
+from .worker_pool import ServicioSaturadoError, shared_executor
+
+logger = logging.getLogger(__name__)
+
+# Cada cuántas escrituras se purgan del nivel SQLite las entradas caducadas.
+PURGE_EVERY = 500
+
+
+class CacheEntry(NamedTuple):
+    """Entrada de la caché: valor, instante de guardado y si es negativa."""
+    value: Any
+    stored_at: float
+    negative: bool
+
+
+class _SQLiteTier:
+    """Nivel de caché persistente en SQLite, compartido entre procesos."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS convocatorias_cache ("
+                "clave TEXT PRIMARY KEY, valor TEXT NOT NULL, "
+                "guardado REAL NOT NULL, negativo INTEGER NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Recupera una entrada o None si no existe."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT valor, guardado, negativo FROM convocatorias_cache "
+                "WHERE clave = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return CacheEntry(json.loads(row[0]), row[1], bool(row[2]))
+
+    def set(self, key: str, entry: CacheEntry):
+        """Guarda (o reemplaza) una entrada."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO convocatorias_cache "
+                "(clave, valor, guardado, negativo) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(entry.value, ensure_ascii=False),
+                 entry.stored_at, int(entry.negative))
+            )
+            self._conn.commit()
+
+    def delete(self, key: str):
+        """Elimina una entrada."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM convocatorias_cache WHERE clave = ?", (key,)
+            )
+            self._conn.commit()
+
+    def purge(self, positive_before: float, negative_before: float) -> int:
+        """Elimina las entradas guardadas antes de los instantes indicados."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM convocatorias_cache WHERE "
+                "(negativo = 0 AND guardado < ?) OR (negativo = 1 AND guardado < ?)",
+                (positive_before, negative_before)
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+
+class ConvocatoriaCache:
+    """
+    Caché de detalles de convocatorias indexada por `numConv`.
+
+    - Dentro del TTL la entrada se sirve directamente.
+    - Entre el TTL y TTL + stale_ttl se sirve la entrada caducada y se
+      refresca en segundo plano (stale-while-revalidate).
+    - Los "no encontrado" se guardan como entradas negativas con su propio TTL.
+    - Las entradas que ya no se pueden servir se purgan del nivel SQLite al
+      arrancar y cada PURGE_EVERY escrituras.
+    """
+
+    # pylint: disable=too-many-arguments,too-many-instance-attributes
+    def __init__(self, maxsize: int = None, ttl: float = None,
+                 stale_ttl: float = None, negative_ttl: float = None,
+                 sqlite_path: str = None,
+                 negative_error: type = KeyError):
+        """
+        Args:
+            maxsize: Número máximo de entradas en memoria.
+            ttl: Segundos durante los que una entrada se considera fresca.
+            stale_ttl: Segundos adicionales en los que se sirve caducada
+                mientras se refresca.
+            negative_ttl: Segundos durante los que se recuerda un 404.
+            sqlite_path: Ruta de la base de datos compartida (None la desactiva).
+            negative_error: Excepción del loader que indica "no encontrado";
+                se relanza al servir una entrada negativa.
+        """
+        env = os.environ.get
+        self.ttl = ttl if ttl is not None else float(
+            env('CONVOCATORIAS_CACHE_TTL', '86400'))
+        self.stale_ttl = stale_ttl if stale_ttl is not None else float(
+            env('CONVOCATORIAS_CACHE_STALE_TTL', '604800'))
+        self.negative_ttl = negative_ttl if negative_ttl is not None else float(
+            env('CONVOCATORIAS_CACHE_NEGATIVE_TTL', '300'))
+        maxsize = maxsize or int(env('CONVOCATORIAS_CACHE_MAXSIZE', '2048'))
+        sqlite_path = sqlite_path or env('CONVOCATORIAS_CACHE_DB')
+
+        self.negative_error = negative_error
+        self._memory = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._revalidating = set()
+        self._loading = {}
+        self._writes = 0
+        self._disk = _SQLiteTier(sqlite_path) if sqlite_path else None
+        self._stats = {
+            "hits": 0, "stale_hits": 0, "negative_hits": 0, "misses": 0,
+            "disk_hits": 0, "revalidations": 0, "load_errors": 0,
+            "shared_loads": 0, "purged": 0
+        }
+        self.purge()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _lookup(self, key: str) -> Optional[CacheEntry]:
+        """Busca la entrada en memoria y, si no está, en el nivel SQLite."""
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is not None or self._disk is None:
+            return entry
+        try:
+            entry = self._disk.get(key)
+        except sqlite3.Error as e:
+            logger.warning("Error leyendo la caché SQLite para %s: %s", key, e)
+            return None
+        if entry is not None:
+            self._count("disk_hits")
+            with self._lock:
+                self._memory[key] = entry
+        return entry
+
+    def _store(self, key: str, entry: CacheEntry):
+        with self._lock:
+            self._memory[key] = entry
+            self._writes += 1
+            purgar = self._writes % PURGE_EVERY == 0
+        if self._disk is not None:
+            try:
+                self._disk.set(key, entry)
+            except sqlite3.Error as e:
+                logger.warning("Error escribiendo la caché SQLite para %s: %s", key, e)
+            if purgar:
+                self.purge()
+
+    def purge(self) -> int:
+        """
+        Elimina del nivel SQLite las entradas que ya no se pueden servir
+        (positivas más antiguas que TTL + stale_ttl, negativas que negative_ttl).
+
+        Returns:
+            Número de entradas eliminadas.
+        """
+        if self._disk is None:
+            return 0
+        now = time.time()
+        try:
+            purged = self._disk.purge(now - self.ttl - self.stale_ttl,
+                                      now - self.negative_ttl)
+        except sqlite3.Error as e:
+            logger.warning("Error purgando la caché SQLite: %s", e)
+            return 0
+        with self._lock:
+            self._stats["purged"] += purged
+        return purged
+
+    def _load(self, key: str, loader: Callable[[str], Any]) -> Any:
+        """
+        Ejecuta el loader y guarda el resultado (positivo o negativo). Si ya
+        hay una descarga de la misma clave en curso, espera a su resultado.
+        """
+        with self._lock:
+            pending = self._loading.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._loading[key] = Future()
+            else:
+                self._stats["shared_loads"] += 1
+        if not owner:
+            return pending.result()
+        try:
+            value = loader(key)
+            self.put(key, value)
+        except self.negative_error as e:
+            self.put(key, str(e), negative=True)
+            pending.set_exception(e)
+            raise
+        except Exception as e:
+            self.record_load_error()
+            pending.set_exception(e)
+            raise
+        else:
+            pending.set_result(value)
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+        return value
+
+    def record_load_error(self):
+        """Contabiliza un fallo al descargar un valor."""
+        self._count("load_errors")
+
+    def begin_revalidation(self, key: Any) -> bool:
+        """
+        Marca una clave como en refresco. Devuelve False si ya lo estaba,
+        para que sólo un llamador refresque cada entrada caducada.
+        """
+        key = str(key)
+        with self._lock:
+            if key in self._revalidating:
+                return False
+            self._revalidating.add(key)
+            self._stats["revalidations"] += 1
+            return True
+
+    def end_revalidation(self, key: Any):
+        """Libera la marca de refresco de una clave."""
+        with self._lock:
+            self._revalidating.discard(str(key))
+
+    def _revalidate(self, key: str, loader: Callable[[str], Any]):
+        """Refresca una entrada caducada en segundo plano, una vez por clave."""
+        if not self.begin_revalidation(key):
+            return
+
+        def run():
+            try:
+                self._load(key, loader)
+            # pylint: disable=broad-exception-caught
+            except Exception as e:
+                logger.warning("Fallo al refrescar la convocatoria %s: %s", key, e)
+            finally:
+                self.end_revalidation(key)
+
+        try:
+            shared_executor.submit(run, group="revalidacion")
+        except ServicioSaturadoError:
+            logger.debug("Pool saturado; se aplaza el refresco de %s.", key)
+            self.end_revalidation(key)
+
+    def peek(self, key: Any) -> Tuple[str, Any]:
+        """
+        Consulta la caché sin cargar ni refrescar la entrada.
+
+        Args:
+            key: Identificador de la convocatoria (numConv).
+        Returns:
+            Tupla (estado, valor) con estado 'fresh', 'stale', 'negative' o 'miss'.
+        """
+        entry = self._lookup(str(key))
+        if entry is None:
+            return "miss", None
+        age = time.time() - entry.stored_at
+        if entry.negative:
+            if age < self.negative_ttl:
+                return "negative", entry.value
+        elif age < self.ttl:
+            return "fresh", entry.value
+        elif age < self.ttl + self.stale_ttl:
+            return "stale", entry.value
+        return "miss", None
+
+    def put(self, key: Any, value: Any, negative: bool = False):
+        """Guarda un valor (o un "no encontrado" si negative=True)."""
+        self._store(str(key), CacheEntry(value, time.time(), negative))
+
+    def record(self, state: str):
+        """Contabiliza el resultado de una consulta hecha con peek()."""
+        name = {"fresh": "hits", "stale": "stale_hits",
+                "negative": "negative_hits"}.get(state, "misses")
+        self._count(name)
+
+    def get_or_load(self, key: Any, loader: Callable[[str], Any]) -> Any:
+        """
+        Devuelve el valor cacheado para `key` o lo obtiene con `loader`.
+
+        Args:
+            key: Identificador de la convocatoria (numConv).
+            loader: Función que descarga el valor a partir de la clave.
+        Returns:
+            El valor cacheado o recién descargado.
+        Raises:
+            negative_error: Si la clave está cacheada como no encontrada.
+        """
+        key = str(key)
+        state, value = self.peek(key)
+        self.record(state)
+        if state == "negative":
+            raise self.negative_error(value)
+        if state == "fresh":
+            return value
+        if state == "stale":
+            self._revalidate(key, loader)
+            return value
+        return self._load(key, loader)
+
+    def invalidate(self, key: Any):
+        """Elimina una clave de ambos niveles."""
+        key = str(key)
+        with self._lock:
+            self._memory.pop(key, None)
+        if self._disk is not None:
+            self._disk.delete(key)
+
+    def stats(self) -> dict:
+        """Devuelve las métricas de aciertos y fallos de la caché."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_size"] = len(self._memory)
+            stats["memory_maxsize"] = self._memory.maxsize
+        served = stats["hits"] + stats["stale_hits"] + stats["negative_hits"]
+        total = served + stats["misses"]
+        stats["hit_ratio"] = round(served / total, 4) if total else 0.0
+        stats["disk_enabled"] = self._disk is not None
+        return stats
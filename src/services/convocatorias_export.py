@@ -0,0 +1,82 @@
+"""
+Este módulo lee la exportación CSV de convocatorias de la API
+(`/convocatorias/exportar?tipoDoc=csv`) y la convierte, fila a fila y sin
+cargar el fichero entero, en la misma estructura que devuelve
+`/convocatorias/busqueda`.
+
+Así, una búsqueda muy amplia se descarga con una sola petición en lugar de
+recorrer cientos de páginas de JSON.
+"""
+import csv
+import re
+from typing import Iterator, TextIO
+from .convocatorias_mirror import normalizar_texto
+
+# Cabecera del CSV (normalizada) -> campo de los resultados de búsqueda.
+CABECERAS = {
+    "codigo bdns": "numeroConvocatoria",
+    "numero convocatoria": "numeroConvocatoria",
+    "id": "id",
+    "mrr": "mrr",
+    "administracion": "nivel1",
+    "departamento": "nivel2",
+    "organo": "nivel3",
+    "fecha de registro": "fechaRecepcion",
+    "fecha de recepcion": "fechaRecepcion",
+    "titulo": "descripcion",
+    "titulo cooficial": "descripcionLeng",
+    "codigo invente": "codigoINVENTE",
+}
+_FECHA_RE = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})$")
+
+
+class ExportacionNoReconocidaError(ValueError):
+    """El CSV no tiene la cabecera esperada."""
+
+
+def _campo(cabecera: str) -> str:
+    """Campo de una columna; las desconocidas se pasan a camelCase."""
+    texto = " ".join(re.sub(r"[^a-z0-9]+", " ", normalizar_texto(cabecera)).split())
+    if texto in CABECERAS:
+        return CABECERAS[texto]
+    palabras = texto.split() or ["columna"]
+    return palabras[0] + "".join(p.capitalize() for p in palabras[1:])
+
+
+def _valor(campo: str, valor: str):
+    """Convierte una celda al tipo que tiene el campo en el JSON de la API."""
+    valor = valor.strip()
+    if not valor:
+        return None
+    if campo == "mrr":
+        return normalizar_texto(valor) in ("si", "s", "true", "1")
+    if campo == "id":
+        return int(valor) if valor.isdigit() else valor
+    if campo == "fechaRecepcion":
+        fecha = _FECHA_RE.match(valor)
+        if fecha:
+            dia, mes, anno = fecha.groups()
+            return f"{anno}-{int(mes):02d}-{int(dia):02d}"
+    return valor
+
+
+def leer_exportacion(fichero: TextIO) -> Iterator[dict]:
+    """
+    Recorre el CSV exportado (separado por ';' o por ',') y devuelve cada
+    convocatoria con las claves de `/convocatorias/busqueda`.
+
+    Raises:
+        ExportacionNoReconocidaError: Si no hay columna con el código BDNS.
+    """
+    primera = ""
+    for primera in fichero:
+        if primera.strip():
+            break
+    delimitador = ";" if primera.count(";") >= primera.count(",") else ","
+    campos = [_campo(c) for c in next(csv.reader([primera], delimiter=delimitador), [])]
+    if "numeroConvocatoria" not in campos:
+        raise ExportacionNoReconocidaError(f"Cabecera no reconocida: {primera[:200]!r}")
+    for fila in csv.reader(fichero, delimiter=delimitador):
+        if not any(celda.strip() for celda in fila):
+            continue
+        yield {campo: _valor(campo, celda) for campo, celda in zip(campos, fila)}
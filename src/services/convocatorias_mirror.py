@@ -0,0 +1,365 @@
+"""
+Este módulo mantiene un espejo local (SQLite) del catálogo de convocatorias
+de `/convocatorias/busqueda`.
+
+La sincronización recorre la API por ventanas de fechas (`fechaDesde` /
+`fechaHasta`) y guarda una marca de agua sobre `fechaRecepcion`, de modo que
+cada ejecución continúa donde terminó la anterior. Con el espejo al día, las
+búsquedas se responden en local con el mismo formato que la API.
+
+Uso (desde `src/`):
+    python -m services.convocatorias_mirror sync [--desde DD/MM/YYYY]
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_START_DATE = "01/01/2018"
+# Parámetros de búsqueda que el espejo sabe responder por sí mismo.
+SUPPORTED_PARAMS = {
+    "page", "pageSize", "descripcion", "descripcionTipoBusqueda",
+    "fechaDesde", "fechaHasta"
+}
+
+
+def normalizar_texto(texto: str) -> str:
+    """Pasa a minúsculas y elimina tildes para comparar sin acentos."""
+    descompuesto = unicodedata.normalize("NFKD", texto or "")
+    sin_tildes = "".join(c for c in descompuesto if not unicodedata.combining(c))
+    return sin_tildes.lower()
+
+
+def _parse_fecha_api(fecha: str) -> date:
+    """Convierte una fecha DD/MM/YYYY (formato de los filtros) a date."""
+    return datetime.strptime(fecha, "%d/%m/%Y").date()
+
+
+def fechas_validas(params: dict) -> bool:
+    """
+    Indica si `fechaDesde`/`fechaHasta`, si vienen, tienen el formato
+    DD/MM/YYYY; con otro formato la búsqueda se deja a la API.
+    """
+    for clave in ("fechaDesde", "fechaHasta"):
+        if params.get(clave):
+            try:
+                _parse_fecha_api(str(params[clave]))
+            except ValueError:
+                return False
+    return True
+
+
+def _patron_like(texto: str) -> str:
+    """Patrón LIKE '%texto%' con los comodines del texto escapados."""
+    escapado = texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escapado}%"
+
+
+def _fmt_fecha_api(fecha: date) -> str:
+    """Convierte un date al formato DD/MM/YYYY de los filtros de la API."""
+    return fecha.strftime("%d/%m/%Y")
+
+
+def _max_fecha(a: Optional[str], b: Optional[str]) -> Optional[str]:
+    """Máximo de dos fechas ISO que pueden ser None."""
+    return max(filter(None, (a, b)), default=None)
+
+
+class ConvocatoriasMirror:
+    """Espejo local del catálogo de convocatorias."""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Ruta de la base de datos SQLite del espejo.
+        """
+        self.path = path
+        self.max_age = float(os.environ.get('CONVOCATORIAS_MIRROR_MAX_AGE', '26')) * 3600
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS convocatorias ("
+                " id INTEGER PRIMARY KEY,"
+                " numero TEXT,"
+                " descripcion_norm TEXT NOT NULL,"
+                " fecha_recepcion TEXT,"
+                " datos TEXT NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS idx_convocatorias_fecha"
+                " ON convocatorias (fecha_recepcion);"
+                "CREATE TABLE IF NOT EXISTS sync_estado ("
+                " clave TEXT PRIMARY KEY, valor TEXT NOT NULL);"
+            )
+            self._conn.commit()
+
+    # --- Estado de sincronización ---
+
+    def _get_estado(self, clave: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT valor FROM sync_estado WHERE clave = ?", (clave,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set_estado(self, clave: str, valor: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_estado (clave, valor) VALUES (?, ?)",
+                (clave, valor)
+            )
+            self._conn.commit()
+
+    @property
+    def marca_agua(self) -> Optional[date]:
+        """Fecha de recepción más reciente ya sincronizada."""
+        valor = self._get_estado("marca_agua")
+        return date.fromisoformat(valor) if valor else None
+
+    @property
+    def ultima_sync(self) -> Optional[float]:
+        """Instante (epoch) de la última sincronización completada."""
+        valor = self._get_estado("ultima_sync")
+        return float(valor) if valor else None
+
+    def is_fresh(self) -> bool:
+        """Indica si la última sincronización es más reciente que `max_age`."""
+        ultima = self.ultima_sync
+        return ultima is not None and time.time() - ultima < self.max_age
+
+    # --- Sincronización ---
+
+    def upsert(self, items: Iterable[dict]) -> Optional[str]:
+        """
+        Inserta o actualiza convocatorias tal como las devuelve la API.
+
+        Returns:
+            La fecha de recepción más reciente del lote (ISO) o None.
+        """
+        filas, max_fecha = [], None
+        for item in items:
+            if item.get("id") is None:
+                continue
+            fecha = (item.get("fechaRecepcion") or "")[:10] or None
+            if fecha and (max_fecha is None or fecha > max_fecha):
+                max_fecha = fecha
+            filas.append((
+                item["id"], item.get("numeroConvocatoria"),
+                normalizar_texto(item.get("descripcion")), fecha,
+                json.dumps(item, ensure_ascii=False)
+            ))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO convocatorias "
+                "(id, numero, descripcion_norm, fecha_recepcion, datos) "
+                "VALUES (?, ?, ?, ?, ?)", filas
+            )
+            self._conn.commit()
+        return max_fecha
+
+    def sync(self, service, desde: str = None, hasta: str = None,
+             window_days: int = None) -> int:
+        """
+        Sincroniza el espejo con la API por ventanas de fechas.
+
+        Sin `desde`, continúa desde la marca de agua (con un día de solape
+        para recoger registros tardíos) o desde DEFAULT_START_DATE.
+
+        Args:
+            service: InfosubvencionesService con el que consultar la API.
+            desde: Fecha inicial DD/MM/YYYY.
+            hasta: Fecha final DD/MM/YYYY (por defecto, hoy).
+            window_days: Días por ventana de consulta.
+        Returns:
+            Número de convocatorias descargadas.
+        """
+        window_days = window_days or int(
+            os.environ.get('CONVOCATORIAS_MIRROR_WINDOW_DAYS', '31'))
+        if desde:
+            inicio = _parse_fecha_api(desde)
+        elif self.marca_agua:
+            inicio = self.marca_agua - timedelta(days=1)
+        else:
+            inicio = _parse_fecha_api(DEFAULT_START_DATE)
+        fin = _parse_fecha_api(hasta) if hasta else date.today()
+
+        total = 0
+        while inicio <= fin:
+            fin_ventana = min(inicio + timedelta(days=window_days - 1), fin)
+            params = {
+                "fechaDesde": _fmt_fecha_api(inicio),
+                "fechaHasta": _fmt_fecha_api(fin_ventana),
+                "pageSize": "1000"
+            }
+            paginador = service.iterar_convocatorias(params, usar_espejo=False)
+            lote, max_fecha = [], None
+            for item in paginador:
+                lote.append(item)
+                if len(lote) >= 1000:
+                    max_fecha = _max_fecha(max_fecha, self.upsert(lote))
+                    total += len(lote)
+                    lote = []
+            if lote:
+                max_fecha = _max_fecha(max_fecha, self.upsert(lote))
+                total += len(lote)
+            if not paginador.completo:
+                # No avanzar la marca de agua: la próxima ejecución reintenta
+                # esta ventana.
+                logger.warning("Ventana %s-%s incompleta; se reintentará.",
+                               params["fechaDesde"], params["fechaHasta"])
+                return total
+            marca = self.marca_agua
+            if max_fecha and (marca is None or max_fecha > marca.isoformat()):
+                self._set_estado("marca_agua", max_fecha)
+            logger.info("Espejo: ventana %s-%s sincronizada (%d acumuladas).",
+                        params["fechaDesde"], params["fechaHasta"], total)
+            inicio = fin_ventana + timedelta(days=1)
+
+        self._set_estado("ultima_sync", str(time.time()))
+        return total
+
+    # --- Consultas ---
+
+    def can_answer(self, params: dict) -> bool:
+        """Indica si el espejo está al día y admite todos los filtros pedidos."""
+        claves = {k for k, v in params.items() if v not in (None, "")}
+        return claves <= SUPPORTED_PARAMS and fechas_validas(params) and self.is_fresh()
+
+    def buscar(self, params: dict) -> dict:
+        """
+        Responde una búsqueda con el mismo formato que `/convocatorias/busqueda`.
+
+        La descripción admite los mismos modos que la API: '1' todas las
+        palabras, '2' alguna de ellas y '0' frase exacta, sin distinguir tildes.
+
+        Raises:
+            ValueError: Si una fecha no tiene el formato DD/MM/YYYY.
+        """
+        condiciones, valores = [], []
+        descripcion = normalizar_texto(params.get("descripcion", "")).strip()
+        if descripcion:
+            tipo = str(params.get("descripcionTipoBusqueda", "1"))
+            if tipo == "0":
+                condiciones.append("descripcion_norm LIKE ? ESCAPE '\\'")
+                valores.append(_patron_like(descripcion))
+            else:
+                palabras = descripcion.split()
+                union = " AND " if tipo == "1" else " OR "
+                condiciones.append("(" + union.join(
+                    "descripcion_norm LIKE ? ESCAPE '\\'" for _ in palabras) + ")")
+                valores.extend(_patron_like(p) for p in palabras)
+        if params.get("fechaDesde"):
+            condiciones.append("fecha_recepcion >= ?")
+            valores.append(_parse_fecha_api(params["fechaDesde"]).isoformat())
+        if params.get("fechaHasta"):
+            condiciones.append("fecha_recepcion <= ?")
+            valores.append(_parse_fecha_api(params["fechaHasta"]).isoformat())
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+
+        page = int(params.get("page") or 0)
+        page_size = int(params.get("pageSize") or 10)
+        with self._lock:
+            total = self._conn.execute(
+                f"SELECT COUNT(*) FROM convocatorias {where}", valores
+            ).fetchone()[0]
+            filas = self._conn.execute(
+                f"SELECT datos FROM convocatorias {where} "
+                "ORDER BY fecha_recepcion DESC, id DESC LIMIT ? OFFSET ?",
+                [*valores, page_size, page * page_size]
+            ).fetchall()
+        return {
+            "content": [json.loads(fila[0]) for fila in filas],
+            "totalElements": total,
+            "totalPages": math.ceil(total / page_size) if page_size else 0,
+            "number": page,
+            "size": page_size,
+            "origen": "espejo"
+        }
+
+    def iterar_filas(self, desde: str = None) -> Iterator[dict]:
+        """
+        Recorre las convocatorias del espejo en el formato de la API.
+
+        Args:
+            desde: Fecha de recepción mínima (ISO); None recorre todo el espejo.
+        """
+        sql, valores = "SELECT datos FROM convocatorias", []
+        if desde:
+            sql += " WHERE fecha_recepcion >= ?"
+            valores.append(desde)
+        with self._lock:
+            filas = self._conn.execute(sql + " ORDER BY id", valores).fetchall()
+        for fila in filas:
+            yield json.loads(fila[0])
+
+    def obtener(self, ids: Iterable[int]) -> Dict[int, dict]:
+        """Devuelve las convocatorias del espejo con esos ids, indexadas por id."""
+        ids = list(ids)
+        if not ids:
+            return {}
+        marcadores = ", ".join("?" for _ in ids)
+        with self._lock:
+            filas = self._conn.execute(
+                f"SELECT id, datos FROM convocatorias WHERE id IN ({marcadores})", ids
+            ).fetchall()
+        return {fila[0]: json.loads(fila[1]) for fila in filas}
+
+    def stats(self) -> dict:
+        """Devuelve el tamaño y el estado de sincronización del espejo."""
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM convocatorias").fetchone()[0]
+        marca = self.marca_agua
+        return {
+            "convocatorias": total,
+            "marca_agua": marca.isoformat() if marca else None,
+            "ultima_sync": self.ultima_sync,
+            "fresco": self.is_fresh()
+        }
+
+
+def main():
+    """Punto de entrada de la línea de comandos del espejo."""
+    # pylint: disable=import-outside-toplevel
+    from .infosubvenciones_service import info_subvenciones_service
+
+    parser = argparse.ArgumentParser(description="Espejo local de convocatorias BDNS")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sync_parser = sub.add_parser("sync", help="Sincroniza el espejo con la API")
+    sync_parser.add_argument("--desde", help="Fecha inicial DD/MM/YYYY")
+    sync_parser.add_argument("--hasta", help="Fecha final DD/MM/YYYY")
+    sub.add_parser("estado", help="Muestra el estado del espejo")
+    args = parser.parse_args()
+
+    mirror = info_subvenciones_service.mirror
+    if mirror is None:
+        parser.error("Define CONVOCATORIAS_MIRROR_DB con la ruta del espejo.")
+    if args.comando == "sync":
+        marca_previa = mirror.marca_agua
+        total = mirror.sync(info_subvenciones_service, args.desde, args.hasta)
+        logger.info("Sincronización terminada: %d convocatorias.", total)
+        if info_subvenciones_service.text_index is not None:
+            info_subvenciones_service.text_index.sincronizar_desde_espejo(mirror)
+        if info_subvenciones_service.semantic_index is not None:
+            info_subvenciones_service.semantic_index.sincronizar_desde_espejo(mirror)
+        if os.environ.get('DIGEST_DB'):
+            # pylint: disable=import-outside-toplevel
+            from .digest_store import digest_store, encolar_nuevas
+            if digest_store is not None:
+                # Precalcula los digests de las convocatorias recién publicadas.
+                encolar_nuevas(mirror, digest_store,
+                               marca_previa.isoformat() if marca_previa else None)
+    print(json.dumps(mirror.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
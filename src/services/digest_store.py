@@ -0,0 +1,419 @@
+"""
+Este módulo precalcula y guarda resúmenes estructurados ("digests") de las
+convocatorias: fechas clave, presupuesto, beneficiarios y requisitos,
+extraídos del detalle de la API y de las bases reguladoras que resume el
+scraper MCP (`mcp/info_convocatoria_mcp.py`).
+
+Scrapear las bases es demasiado lento para hacerlo durante una consulta, así
+que una cola persistente (SQLite) recibe las convocatorias recién publicadas
+(tras `make sync`) y las que se piden a menudo en el chat, y un hilo de
+fondo las va procesando. Las respuestas de detalle usan el digest cuando ya
+existe.
+
+Uso (desde `src/`):
+    python -m services.digest_store encolar [--desde DD/MM/YYYY] [--max N]
+    python -m services.digest_store estado
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+from .context_builder import context_builder
+from .gemini_helpers import generate_content_non_stream, parse_json_from_text
+
+logger = logging.getLogger(__name__)
+
+# Prioridades de la cola: primero lo que piden los usuarios.
+PRIORIDAD_PEDIDA = 10
+PRIORIDAD_NUEVA = 0
+DIGEST_FIELDS = ("fechas_clave", "presupuesto", "beneficiarios", "requisitos", "resumen")
+
+
+class DigestStore:
+    """Digests de convocatorias y cola de trabajos pendientes, en SQLite."""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Ruta de la base de datos SQLite (":memory:" para un solo proceso).
+        """
+        env = os.environ.get
+        self.path = path
+        self.ttl = float(env('DIGEST_TTL_DAYS', '30')) * 86400
+        self.min_requests = int(env('DIGEST_MIN_REQUESTS', '2'))
+        self.max_attempts = int(env('DIGEST_MAX_ATTEMPTS', '3'))
+        # Un trabajo en curso más antiguo se da por abandonado (proceso caído).
+        self.job_timeout = float(env('DIGEST_JOB_TIMEOUT', '1800'))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS digests ("
+                " numero TEXT PRIMARY KEY,"
+                " datos TEXT NOT NULL,"
+                " creado REAL NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS digest_peticiones ("
+                " numero TEXT PRIMARY KEY,"
+                " total INTEGER NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS digest_cola ("
+                " numero TEXT PRIMARY KEY,"
+                " prioridad INTEGER NOT NULL,"
+                " encolado REAL NOT NULL,"
+                " intentos INTEGER NOT NULL DEFAULT 0,"
+                " en_curso INTEGER NOT NULL DEFAULT 0,"
+                " iniciado REAL,"
+                " error TEXT);"
+                "CREATE INDEX IF NOT EXISTS idx_digest_cola_orden"
+                " ON digest_cola (prioridad DESC, encolado);"
+            )
+            self._conn.commit()
+        self._nuevo_trabajo = threading.Event()
+
+    # --- Digests ---
+
+    def get(self, numero: str) -> Optional[dict]:
+        """Digest guardado de una convocatoria, o None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT datos, creado FROM digests WHERE numero = ?", (str(numero),)
+            ).fetchone()
+        if row is None:
+            return None
+        return {**json.loads(row[0]), "creado": row[1]}
+
+    def put(self, numero: str, digest: dict):
+        """Guarda el digest de una convocatoria."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO digests (numero, datos, creado) VALUES (?, ?, ?)",
+                (str(numero), json.dumps(digest, ensure_ascii=False), time.time())
+            )
+            self._conn.commit()
+
+    def solicitar(self, numero: str) -> Optional[dict]:
+        """
+        Registra que se ha pedido el detalle de una convocatoria.
+
+        Si no tiene digest (o está caducado) y se ha pedido al menos
+        DIGEST_MIN_REQUESTS veces, la encola con prioridad alta.
+
+        Returns:
+            El digest guardado, aunque esté caducado, o None.
+        """
+        numero = str(numero)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO digest_peticiones (numero, total) VALUES (?, 1) "
+                "ON CONFLICT(numero) DO UPDATE SET total = total + 1", (numero,)
+            )
+            self._conn.commit()
+            total = self._conn.execute(
+                "SELECT total FROM digest_peticiones WHERE numero = ?", (numero,)
+            ).fetchone()[0]
+        digest = self.get(numero)
+        caducado = digest is not None and time.time() - digest["creado"] > self.ttl
+        if (digest is None or caducado) and total >= self.min_requests:
+            self.encolar([numero], PRIORIDAD_PEDIDA + total)
+        return digest
+
+    # --- Cola ---
+
+    def encolar(self, numeros: Iterable[str], prioridad: int = PRIORIDAD_NUEVA) -> int:
+        """
+        Añade convocatorias a la cola (o sube su prioridad si ya estaban).
+        Se omiten las que ya tienen un digest vigente.
+
+        Returns:
+            Número de convocatorias encoladas por primera vez.
+        """
+        ahora, nuevas = time.time(), 0
+        with self._lock:
+            for numero in map(str, numeros):
+                vigente = self._conn.execute(
+                    "SELECT 1 FROM digests WHERE numero = ? AND creado > ?",
+                    (numero, ahora - self.ttl)
+                ).fetchone()
+                if vigente:
+                    continue
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO digest_cola (numero, prioridad, encolado) "
+                    "VALUES (?, ?, ?)", (numero, prioridad, ahora)
+                )
+                if cursor.rowcount:
+                    nuevas += 1
+                else:
+                    self._conn.execute(
+                        "UPDATE digest_cola SET prioridad = MAX(prioridad, ?) "
+                        "WHERE numero = ?", (prioridad, numero)
+                    )
+            self._conn.commit()
+        if nuevas:
+            self.avisar()
+        return nuevas
+
+    def siguiente(self) -> Optional[str]:
+        """Marca como en curso y devuelve el trabajo más prioritario, o None."""
+        ahora = time.time()
+        with self._lock:
+            while True:
+                row = self._conn.execute(
+                    "SELECT numero, iniciado FROM digest_cola"
+                    " WHERE en_curso = 0 OR iniciado < ?"
+                    " ORDER BY prioridad DESC, encolado LIMIT 1", (ahora - self.job_timeout,)
+                ).fetchone()
+                if row is None:
+                    return None
+                # Otro proceso que comparta la base puede haberlo tomado ya.
+                cursor = self._conn.execute(
+                    "UPDATE digest_cola SET en_curso = 1, iniciado = ?,"
+                    " intentos = intentos + 1 WHERE numero = ? AND iniciado IS ?",
+                    (ahora, row[0], row[1])
+                )
+                self._conn.commit()
+                if cursor.rowcount:
+                    return row[0]
+
+    def terminar(self, numero: str, error: Optional[str] = None):
+        """
+        Cierra un trabajo. Si falló, se reintenta más tarde (al final de su
+        prioridad) hasta DIGEST_MAX_ATTEMPTS veces.
+        """
+        with self._lock:
+            if error is None:
+                self._conn.execute("DELETE FROM digest_cola WHERE numero = ?", (numero,))
+            else:
+                self._conn.execute(
+                    "UPDATE digest_cola SET en_curso = 0, error = ?, encolado = ? "
+                    "WHERE numero = ?", (error, time.time(), numero)
+                )
+                self._conn.execute(
+                    "DELETE FROM digest_cola WHERE numero = ? AND intentos >= ?",
+                    (numero, self.max_attempts)
+                )
+            self._conn.commit()
+
+    def avisar(self):
+        """Despierta al hilo que espera trabajo en este proceso."""
+        self._nuevo_trabajo.set()
+
+    def esperar_trabajo(self, timeout: float) -> bool:
+        """Espera hasta que se encole algo en este proceso o pase `timeout`."""
+        hay = self._nuevo_trabajo.wait(timeout)
+        self._nuevo_trabajo.clear()
+        return hay
+
+    def stats(self) -> dict:
+        """Devuelve el número de digests y el estado de la cola."""
+        with self._lock:
+            digests = self._conn.execute("SELECT COUNT(*) FROM digests").fetchone()[0]
+            pendientes, en_curso, con_error = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(en_curso), 0),"
+                " COALESCE(SUM(error IS NOT NULL), 0) FROM digest_cola"
+            ).fetchone()
+        return {"digests": digests, "pendientes": pendientes, "en_curso": en_curso,
+                "reintentando": con_error}
+
+
+def _texto_herramienta(resultado) -> str:
+    """Texto de la respuesta de una herramienta MCP (según la versión de fastmcp)."""
+    contenido = getattr(resultado, "content", resultado)
+    if isinstance(contenido, str):
+        return contenido
+    return "".join(getattr(parte, "text", "") for parte in contenido or [])
+
+
+class DigestBuilder:
+    """Construye el digest de una convocatoria."""
+
+    def __init__(self, model, prompt: str, service, mcp_url: str = None):
+        """
+        Args:
+            model: Modelo de Gemini con el que se extrae el digest.
+            prompt: Plantilla 'generate_digest'.
+            service: InfosubvencionesService para obtener el detalle.
+            mcp_url: URL del servidor MCP de scraping (vacía: sin bases).
+        """
+        self._model = model
+        self.prompt = prompt
+        self.service = service
+        self.mcp_url = (mcp_url if mcp_url is not None
+                        else os.environ.get('DIGEST_MCP_URL', 'http://127.0.0.1:8000/mcp'))
+        self.mcp_timeout = float(os.environ.get('DIGEST_MCP_TIMEOUT', '600'))
+
+    def resumir_bases(self, url: str) -> str:
+        """Resume la página de bases reguladoras y sus PDFs con el scraper MCP."""
+        # pylint: disable=import-outside-toplevel
+        from fastmcp import Client
+
+        async def llamar():
+            async with Client(self.mcp_url) as client:
+                return await client.call_tool("get_info_convo", {"url": url})
+
+        resultado = asyncio.run(asyncio.wait_for(llamar(), self.mcp_timeout))
+        texto = _texto_herramienta(resultado)
+        if texto.startswith("Error al procesar la URL"):
+            raise RuntimeError(texto)
+        return texto
+
+    def build(self, numero: str) -> dict:
+        """
+        Descarga el detalle, resume las bases reguladoras (si las hay) y
+        extrae el digest con el LLM.
+
+        Raises:
+            RuntimeError: Si el LLM no devuelve un digest válido.
+        """
+        detalle = self.service.obtener_convocatoria(numero)
+        url = (detalle or {}).get("urlBasesReguladoras") if isinstance(detalle, dict) else None
+        bases = ""
+        if url and self.mcp_url:
+            bases = self.resumir_bases(url)
+            if self.service.text_index is not None:
+                self.service.text_index.actualizar_bases(numero, bases)
+        detalles_texto, _ = context_builder.pack_object('detailed_response', detalle)
+        prompt = (self.prompt
+                  .replace("DETALLES_TEXTO", detalles_texto)
+                  .replace("BASES_TEXTO", bases or "(no disponibles)"))
+        respuesta = generate_content_non_stream(self._model, prompt)
+        datos = parse_json_from_text(respuesta, default_if_error={})
+        if respuesta.startswith("ERROR_") or not isinstance(datos, dict) or not datos:
+            raise RuntimeError(f"Digest no válido: {respuesta[:200]}")
+        digest = {campo: datos.get(campo) for campo in DIGEST_FIELDS}
+        digest["url_bases"] = url
+        digest["con_bases"] = bool(bases)
+        return digest
+
+
+class DigestWorker:
+    """Hilo de fondo que vacía la cola de digests."""
+
+    def __init__(self, store: DigestStore, builder: DigestBuilder):
+        self.store = store
+        self.builder = builder
+        self.poll_interval = float(os.environ.get('DIGEST_POLL_INTERVAL', '30'))
+        self._stop = threading.Event()
+        self._thread = None
+        self.procesados = 0
+        self.fallidos = 0
+
+    def start(self):
+        """Arranca el hilo si no está en marcha."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="digest-worker",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Pide al hilo que termine tras el trabajo en curso."""
+        self._stop.set()
+        self.store.avisar()
+
+    def _run(self):
+        while not self._stop.is_set():
+            numero = self.store.siguiente()
+            if numero is None:
+                # La cola también la alimentan otros procesos (`make sync`).
+                self.store.esperar_trabajo(self.poll_interval)
+            elif not self.procesar(numero):
+                # Suele ser el servidor MCP caído: no reintentar en bucle.
+                self._stop.wait(self.poll_interval)
+
+    def procesar(self, numero: str) -> bool:
+        """Construye y guarda el digest de una convocatoria ya sacada de la cola."""
+        try:
+            inicio = time.time()
+            self.store.put(numero, self.builder.build(numero))
+            self.store.terminar(numero)
+            self.procesados += 1
+            logger.info("Digest de la convocatoria %s generado en %.1f s.", numero,
+                        time.time() - inicio)
+            return True
+        # pylint: disable=broad-exception-caught
+        except Exception as e:
+            logger.warning("No se pudo generar el digest de %s: %s", numero, e)
+            self.store.terminar(numero, str(e)[:500])
+            self.fallidos += 1
+            return False
+
+    def stats(self) -> dict:
+        """Estado de la cola y trabajos procesados por este proceso."""
+        return {**self.store.stats(), "procesados": self.procesados,
+                "fallidos": self.fallidos,
+                "activo": self._thread is not None and self._thread.is_alive()}
+
+
+def build_digest_store(path: Optional[str] = None) -> Optional[DigestStore]:
+    """
+    Crea el almacén de DIGEST_DB; sin ruta, uno en memoria para este proceso.
+    Devuelve None si DIGESTS_ENABLED=0.
+    """
+    if os.environ.get('DIGESTS_ENABLED', '1') != '1':
+        return None
+    path = path or os.environ.get('DIGEST_DB')
+    if not path:
+        logger.warning("Digests activos sin DIGEST_DB: la cola y los digests viven en "
+                       "memoria y no se comparten con `make sync` ni sobreviven "
+                       "a un reinicio.")
+    return DigestStore(path or ":memory:")
+
+
+digest_store = build_digest_store()
+
+
+def encolar_nuevas(mirror, store: DigestStore, desde: str = None,
+                   maximo: int = None) -> int:
+    """
+    Encola las convocatorias del espejo recibidas desde `desde` (ISO; por
+    defecto, los últimos DIGEST_NEW_DAYS días), hasta `maximo`.
+    """
+    if desde is None:
+        dias = int(os.environ.get('DIGEST_NEW_DAYS', '2'))
+        desde = (datetime.now() - timedelta(days=dias)).date().isoformat()
+    maximo = maximo or int(os.environ.get('DIGEST_NEW_MAX', '200'))
+    numeros = []
+    for item in mirror.iterar_filas(desde):
+        if item.get("numeroConvocatoria"):
+            numeros.append(item["numeroConvocatoria"])
+    # Las más recientes primero.
+    numeros = numeros[::-1][:maximo]
+    nuevas = store.encolar(numeros, PRIORIDAD_NUEVA)
+    logger.info("Digests: %d convocatorias nuevas encoladas (%d revisadas).",
+                nuevas, len(numeros))
+    return nuevas
+
+
+def main():
+    """Punto de entrada de la línea de comandos de los digests."""
+    # pylint: disable=import-outside-toplevel
+    from .infosubvenciones_service import info_subvenciones_service
+
+    parser = argparse.ArgumentParser(description="Digests precalculados de convocatorias")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    encolar = sub.add_parser("encolar", help="Encola las convocatorias recién publicadas")
+    encolar.add_argument("--desde", help="Fecha de recepción mínima DD/MM/YYYY")
+    encolar.add_argument("--max", type=int, help="Convocatorias máximas a encolar")
+    sub.add_parser("estado", help="Muestra el estado de la cola")
+    args = parser.parse_args()
+
+    if digest_store is None or not os.environ.get('DIGEST_DB'):
+        parser.error("Define DIGEST_DB con la ruta compartida con la aplicación.")
+    if args.comando == "encolar":
+        if info_subvenciones_service.mirror is None:
+            parser.error("Encolar las novedades necesita CONVOCATORIAS_MIRROR_DB.")
+        desde = (datetime.strptime(args.desde, "%d/%m/%Y").date().isoformat()
+                 if args.desde else None)
+        encolar_nuevas(info_subvenciones_service.mirror, digest_store, desde, args.max)
+    print(json.dumps(digest_store.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -8,10 +8,11 @@ import logging
 import json
 import os
 import re
-from typing import Iterable, Union, Any
+from typing import AsyncIterator, Iterable, Optional, Union, Any
 import google.generativeai as genai
 from opik import track
 from dotenv import load_dotenv
+from .llm_cache import llm_response_cache
 load_dotenv()
 
 
@@ -35,10 +36,15 @@ def get_gemini_model(model_name: str = None) -> genai.GenerativeModel:
 @track
 def decode_gemini_stream(
     prompt_text: Union[str, list],
-    stream_response_iterable: Iterable[genai.types.GenerateContentResponse]
+    stream_response_iterable: Iterable[genai.types.GenerateContentResponse],
+    errores: Optional[list] = None
 ) -> Iterable[str]:
     """
     Decodifica un stream de Gemini y produce los chunks de texto.
+
+    Los chunks que fallan se registran y se saltan; si se pasa `errores`, se
+    añade a esa lista cada excepción para que el llamante sepa que la
+    respuesta está incompleta.
     """
     logger.info("Question: %s", str(prompt_text))
     final_response = ''
@@ -64,16 +70,45 @@ def decode_gemini_stream(
                 "Error procesando chunk de Gemini en decode_gemini_stream: %s",
                 e, exc_info=True
             )
+            if errores is not None:
+                errores.append(e)
     return final_response
 
 
+def _model_name(model: genai.GenerativeModel) -> str:
+    return getattr(model, "model_name", "") or ""
+
+
+def replay_cached_stream(text: str, chunk_size: int = None) -> Iterable[str]:
+    """Reproduce una respuesta cacheada como un stream de fragmentos."""
+    chunk_size = chunk_size or int(os.environ.get('LLM_CACHE_REPLAY_CHUNK', '80'))
+    for start in range(0, len(text), chunk_size):
+        yield text[start:start + chunk_size]
+
+
 def generate_content_stream(
-    model: genai.GenerativeModel, prompt_text: Union[str, list]
+    model: genai.GenerativeModel, prompt_text: Union[str, list],
+    cache_template: Optional[str] = None
 ) -> Iterable[str]:
-    """Genera contenido como un stream (generador)."""
+    """
+    Genera contenido como un stream (generador).
+
+    Si `cache_template` está activada en la caché de respuestas, un prompt
+    ya respondido se reproduce por fragmentos sin llamar al modelo.
+    """
+    cacheable = isinstance(prompt_text, str) and llm_response_cache.caches(cache_template)
+    if cacheable:
+        cached = llm_response_cache.get(cache_template, _model_name(model), prompt_text)
+        if cached is not None:
+            logger.info("Respuesta STREAM servida desde caché (%s).", cache_template)
+            yield from replay_cached_stream(cached)
+            return
+    chunks, errores = [], []
     try:
         response_iterable = model.generate_content(prompt_text, stream=True)
-        yield from decode_gemini_stream(prompt_text, response_iterable)
+        for chunk in decode_gemini_stream(prompt_text, response_iterable, errores):
+            chunks.append(chunk)
+            yield chunk
     # pylint: disable=broad-exception-caught
     except Exception as e:
         logger.error(
@@ -81,14 +116,87 @@ def generate_content_stream(
             str(prompt_text)[:100], str(e), exc_info=True
         )
         yield f"Error al generar contenido con el modelo (stream): {str(e)}"
+        return
+    # Una respuesta con chunks perdidos no se reutiliza.
+    if cacheable and not errores:
+        llm_response_cache.put(cache_template, _model_name(model), prompt_text, "".join(chunks))
+
+
+def _chunk_text(response_chunk: genai.types.GenerateContentResponse) -> Optional[str]:
+    """Texto de un chunk de Gemini, o None si no trae contenido."""
+    if not response_chunk.candidates:
+        return None
+    candidate = response_chunk.candidates[0]
+    if candidate.content and candidate.content.parts:
+        return candidate.content.parts[0].text or None
+    return None
+
+
+async def agenerate_content_stream(
+    model: genai.GenerativeModel, prompt_text: Union[str, list],
+    cache_template: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Variante asíncrona de `generate_content_stream` para el servidor ASGI:
+    la espera a Gemini no ocupa ningún hilo.
+    """
+    cacheable = isinstance(prompt_text, str) and llm_response_cache.caches(cache_template)
+    if cacheable:
+        cached = llm_response_cache.get(cache_template, _model_name(model), prompt_text)
+        if cached is not None:
+            logger.info("Respuesta STREAM (async) servida desde caché (%s).", cache_template)
+            for chunk in replay_cached_stream(cached):
+                yield chunk
+            return
+    chunks = []
+    try:
+        response = await model.generate_content_async(prompt_text, stream=True)
+        async for response_chunk in response:
+            text_part = _chunk_text(response_chunk)
+            if text_part:
+                chunks.append(text_part)
+                yield text_part
+    # pylint: disable=broad-exception-caught
+    except Exception as e:
+        logger.error(
+            "Error crítico al generar contenido STREAM async con Gemini (Prompt: '%s...'): %s",
+            str(prompt_text)[:100], str(e), exc_info=True
+        )
+        yield f"Error al generar contenido con el modelo (stream): {str(e)}"
+        return
+    if cacheable:
+        llm_response_cache.put(cache_template, _model_name(model), prompt_text, "".join(chunks))
 
 
 def generate_content_non_stream(
-    model: genai.GenerativeModel, prompt_text: Union[str, list]
+    model: genai.GenerativeModel, prompt_text: Union[str, list],
+    cache_template: Optional[str] = None, cache_query: Optional[str] = None
 ) -> str:
     """
     Genera contenido como una cadena de texto completa (no stream).
+
+    Con `cache_template`, reutiliza la respuesta cacheada de ese prompt; con
+    `cache_query` (la consulta del usuario incluida en el prompt) también la
+    de una consulta muy similar, si la plantilla lo tiene activado.
     """
+    cacheable = isinstance(prompt_text, str) and llm_response_cache.caches(cache_template)
+    if cacheable:
+        cached = llm_response_cache.get(
+            cache_template, _model_name(model), prompt_text, cache_query)
+        if cached is not None:
+            logger.info("Respuesta NO-STREAM servida desde caché (%s).", cache_template)
+            return cached
+    text_result = _generate_content_non_stream(model, prompt_text)
+    if cacheable and not text_result.startswith("ERROR_"):
+        llm_response_cache.put(
+            cache_template, _model_name(model), prompt_text, text_result, cache_query)
+    return text_result
+
+
+def _generate_content_non_stream(
+    model: genai.GenerativeModel, prompt_text: Union[str, list]
+) -> str:
+    """Llama al modelo en modo no-stream y extrae el texto de la respuesta."""
     try:
         response = model.generate_content(prompt_text, stream=False)
         text_result = None
@@ -28,3 +28,4 @@ class GraphState(TypedDict):
     agent_response_text: Optional[str]
     stream_generation_prompt: Optional[str]
     stream_generation_node_name: Optional[str]
+    stream_prefix_text: Optional[str]
@@ -0,0 +1,219 @@
+"""
+Este módulo compacta el historial de chat que se incluye en los prompts.
+
+Los turnos recientes se pasan literalmente (con las respuestas largas
+acortadas) y los antiguos se condensan en un resumen acumulado que el LLM
+actualiza en segundo plano, cuando la respuesta ya se ha enviado. Las
+entidades clave (IDs BDNS, años y partidos políticos) se extraen de forma
+determinista y se fijan literalmente junto al resumen, de modo que el tamaño
+del historial en los prompts se mantiene estable aunque la conversación crezca.
+"""
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from .gemini_helpers import generate_content_non_stream
+from .intent_router import extraer_annos
+from .convocatorias_mirror import normalizar_texto
+from .session_store import SessionStore, session_store
+
+logger = logging.getLogger(__name__)
+
+# Hilos propios para las compactaciones: cada una ocupa su hilo durante una
+# llamada completa a Gemini y no debe competir con las descargas de la API
+# en el pool compartido.
+HISTORY_COMPACTION_WORKERS = int(os.environ.get('HISTORY_COMPACTION_WORKERS', '2'))
+
+_BDNS_RE = re.compile(r"\b\d{5,7}\b")
+_PARTIDOS_RE = re.compile(
+    r"\b(psoe|partido socialista(?: obrero espanol)?|pp|partido popular|vox|podemos|"
+    r"unidas podemos|sumar|ciudadanos|erc|esquerra republicana|junts|pnv|"
+    r"partido nacionalista vasco|eh bildu|bildu|bng|coalicion canaria|compromis|"
+    r"mas pais|izquierda unida|cup|upn|teruel existe)\b"
+)
+_NO_HISTORY = "No previous chat history."
+
+
+def _recientes(valores: List, maximo: int) -> List:
+    """Quita duplicados conservando el orden y deja los `maximo` más recientes."""
+    vistos = list(dict.fromkeys(reversed(valores)))[:maximo]
+    return list(reversed(vistos))
+
+
+def pin_entities(turnos: List[Tuple[str, str]], previas: dict = None,
+                 maximo: int = 10) -> dict:
+    """
+    Extrae las entidades que deben conservarse literalmente.
+
+    Los IDs BDNS y los años sólo se toman de las consultas (las respuestas
+    de búsqueda incluyen decenas de ellos); los partidos, de ambos.
+    """
+    previas = previas or {}
+    bdns = list(previas.get("bdns", []))
+    annos = list(previas.get("annos", []))
+    partidos = list(previas.get("partidos", []))
+    for consulta, respuesta in turnos:
+        bdns.extend(_BDNS_RE.findall(consulta))
+        annos.extend(str(a) for a in extraer_annos(normalizar_texto(consulta)))
+        for texto in (consulta, respuesta):
+            partidos.extend(m.upper() if len(m) <= 5 else m.title()
+                            for m in _PARTIDOS_RE.findall(normalizar_texto(texto)))
+    return {"bdns": _recientes(bdns, maximo), "annos": _recientes(annos, maximo),
+            "partidos": _recientes(partidos, maximo)}
+
+
+def turnos_compactados(original: List, actual: List, n: int) -> int:
+    """
+    Cuántos turnos del principio de `actual` son los `n` primeros de
+    `original`, ya resumidos. Entre ambas lecturas sólo se añaden turnos al
+    final y, al superar `max_turns`, se descartan del principio; se compara
+    por posición para no confundir turnos con el mismo texto.
+    """
+    for desplazamiento in range(len(original) + 1):
+        restantes = original[desplazamiento:]
+        if actual[:len(restantes)] == restantes:
+            return max(0, n - desplazamiento)
+    return 0
+
+
+def _acortar(texto: str, max_chars: int) -> str:
+    texto = texto.strip()
+    return texto if len(texto) <= max_chars else texto[:max_chars].rstrip() + "…"
+
+
+class HistoryCompactor:
+    """Formatea el historial para los prompts y compacta los turnos antiguos."""
+
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, model, prompt: str, store: SessionStore = None,
+                 keep_recent: int = None, max_answer_chars: int = None):
+        """
+        Args:
+            model: Modelo de Gemini con el que se resume.
+            prompt: Plantilla 'summarize_history'.
+            store: Almacén de sesiones; por defecto el compartido.
+            keep_recent: Turnos recientes que se pasan literalmente.
+            max_answer_chars: Longitud máxima de cada respuesta reciente.
+        """
+        env = os.environ.get
+        self._model = model
+        self.prompt = prompt
+        self.store = store or session_store
+        self.enabled = (env('HISTORY_COMPACTION', '1') == '1'
+                        and not prompt.startswith("ERROR"))
+        self.keep_recent = keep_recent or int(env('HISTORY_KEEP_RECENT', '2'))
+        self.max_answer_chars = max_answer_chars or int(
+            env('HISTORY_MAX_ANSWER_CHARS', '600'))
+        self.max_summary_chars = int(env('HISTORY_SUMMARY_MAX_CHARS', '1200'))
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._stats = Counter()
+        # Como mucho una tarea por sesión en cola (ver `_pending`).
+        self._executor = ThreadPoolExecutor(max_workers=HISTORY_COMPACTION_WORKERS,
+                                            thread_name_prefix="historial")
+
+    def format(self, chat_history: List[Tuple[str, str]],
+               summary: Optional[dict] = None) -> str:
+        """Texto del historial para los prompts: resumen, entidades y turnos recientes."""
+        if not self.enabled:
+            if not chat_history:
+                return _NO_HISTORY
+            return "\n".join(f"User: {q}\nAssistant: {a}" for q, a in chat_history)
+        partes = []
+        if summary and summary.get("texto"):
+            partes.append(f"Resumen de la conversación anterior: {summary['texto']}")
+        entidades = (summary or {}).get("entidades") or {}
+        fijadas = [f"{nombre} {', '.join(entidades[clave])}"
+                   for clave, nombre in (("bdns", "convocatorias BDNS"), ("annos", "años"),
+                                         ("partidos", "partidos"))
+                   if entidades.get(clave)]
+        if fijadas:
+            partes.append("Datos clave mencionados: " + "; ".join(fijadas) + ".")
+        # Tras cada turno se compacta en segundo plano, así que aquí suelen
+        # quedar sólo los `keep_recent` últimos.
+        partes.extend(f"User: {q}\nAssistant: {_acortar(a, self.max_answer_chars)}"
+                      for q, a in chat_history)
+        return "\n".join(partes) or _NO_HISTORY
+
+    def format_for_thread(self, chat_history: List[Tuple[str, str]], thread_id: str) -> str:
+        """Como `format`, con el resumen guardado de la sesión."""
+        summary = self.store.get_summary(thread_id) if self.enabled else None
+        return self.format(chat_history, summary)
+
+    def schedule(self, thread_id: str):
+        """Compacta la sesión en segundo plano si tiene turnos antiguos."""
+        if not self.enabled or len(self.store.get(thread_id)) <= self.keep_recent:
+            return
+        with self._lock:
+            if thread_id in self._pending:
+                return
+            self._pending.add(thread_id)
+        self._executor.submit(self._compact_and_release, thread_id)
+
+    def _compact_and_release(self, thread_id: str):
+        try:
+            self.compact(thread_id)
+        # pylint: disable=broad-exception-caught
+        except Exception as e:
+            logger.error("Error compactando el historial de %s: %s", thread_id, e,
+                         exc_info=True)
+            self._count("failed")
+        finally:
+            with self._lock:
+                self._pending.discard(thread_id)
+
+    def compact(self, thread_id: str) -> bool:
+        """
+        Incorpora al resumen los turnos anteriores a los `keep_recent` últimos
+        y los elimina del historial.
+
+        Returns:
+            True si se compactó algún turno.
+        """
+        history = self.store.get(thread_id)
+        antiguos = history[:-self.keep_recent]
+        if not antiguos:
+            return False
+        summary = self.store.get_summary(thread_id) or {}
+        turnos_texto = "\n".join(
+            f"User: {q}\nAssistant: {_acortar(a, self.max_answer_chars * 2)}"
+            for q, a in antiguos
+        )
+        prompt = (self.prompt
+                  .replace("RESUMEN_ANTERIOR", summary.get("texto") or "(ninguno)")
+                  .replace("TURNOS_ANTIGUOS", turnos_texto))
+        texto = generate_content_non_stream(self._model, prompt,
+                                            cache_template="summarize_history")
+        if texto.startswith("ERROR_") or not texto.strip():
+            logger.warning("No se pudo resumir el historial de %s: %s", thread_id, texto)
+            self._count("failed")
+            return False
+
+        with self.store.locked(thread_id):
+            # Mientras se resumía pueden haber llegado turnos nuevos; se
+            # quitan sólo los resumidos, por posición.
+            actual = self.store.get(thread_id)
+            self.store.set_summary(thread_id, {
+                "texto": _acortar(texto, self.max_summary_chars),
+                "entidades": pin_entities(antiguos, summary.get("entidades")),
+                "turnos": summary.get("turnos", 0) + len(antiguos)
+            })
+            self.store.replace(thread_id,
+                               actual[turnos_compactados(history, actual, len(antiguos)):])
+        self._count("compactions")
+        self._count("turns_compacted", len(antiguos))
+        return True
+
+    def _count(self, nombre: str, n: int = 1):
+        with self._lock:
+            self._stats[nombre] += n
+
+    def stats(self) -> dict:
+        """Devuelve las compactaciones hechas, fallidas y en curso."""
+        with self._lock:
+            return {"compactions": 0, "turns_compacted": 0, "failed": 0,
+                    **self._stats, "pending": len(self._pending),
+                    "enabled": self.enabled}
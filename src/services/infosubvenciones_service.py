@@ -2,91 +2,610 @@
 Este módulo proporciona un servicio para interactuar con la API del
 Sistema Nacional de Ayudas y Subvenciones de España.
 """
+import csv
+import io
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures import as_completed
+from typing import Optional
 import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from urllib3.util.retry import Retry
+from .busqueda_semantica import HybridRetriever, build_semantic_index
+from .busqueda_texto import FullTextIndex
+from .convocatoria_cache import ConvocatoriaCache
+from .convocatorias_export import leer_exportacion
+from .convocatorias_mirror import ConvocatoriasMirror
+from .worker_pool import ServicioSaturadoError, get_rate_limiter, shared_executor
+
+
+# Timeouts (conexión, lectura) en segundos para cada endpoint de la API.
+DEFAULT_TIMEOUTS = {
+    "convocatorias/busqueda": (3.05, 15),
+    "convocatorias/exportar": (3.05, 60),
+    "convocatorias": (3.05, 10),
+    "grandesbeneficiarios/busqueda": (3.05, 20),
+    "partidospoliticos/busqueda": (3.05, 10),
+    "concesiones/busqueda": (3.05, 30),
+    "ayudasestado/busqueda": (3.05, 30),
+}
+# Endpoints de registros de concesiones que admiten la descarga masiva.
+ENDPOINTS_REGISTROS = ("concesiones/busqueda", "ayudasestado/busqueda")
+FALLBACK_TIMEOUT = (3.05, 10)
+# Segundos máximos de espera por una página pedida por adelantado (incluye
+# la cola del pool compartido y los reintentos de la petición).
+PAGE_WAIT_TIMEOUT = float(os.environ.get('PAGINADOR_PAGE_TIMEOUT', '120'))
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
 
 
 class ApiServiceError(Exception):
     """Excepción personalizada para errores ocurridos en el servicio de la API."""
 
+
+class ConvocatoriaNoEncontradaError(ApiServiceError):
+    """La API respondió 404 para la convocatoria solicitada."""
+
+
+def resumen_detalle(detalle: dict) -> dict:
+    """
+    Extrae de un detalle de convocatoria los campos con los que se
+    enriquecen los resultados de búsqueda.
+    """
+    return {
+        'presupuestoTotal': detalle['presupuestoTotal'],
+        'regiones': detalle['regiones'],
+        'tiposBeneficiarios': detalle['tiposBeneficiarios']
+    }
+
+
+class _JitterRetry(Retry):
+    """
+    Política de reintentos con backoff exponencial y jitter aleatorio, para
+    evitar que varios workers reintenten a la vez contra la API.
+    """
+    # Atributo de clase: Retry.new() no propaga atributos de instancia.
+    MAX_JITTER = float(os.environ.get('INFOSUBVENCIONES_RETRY_JITTER', '0.5'))
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return backoff
+        return backoff + random.uniform(0, self.MAX_JITTER)
+
+
 class InfosubvencionesService:
     """
     Servicio para comunicarse con la API del Sistema Nacional de Ayudas y Subvenciones.
+
+    Las peticiones JSON, incluidos los detalles cacheados de convocatorias, se
+    delegan en el cliente asíncrono (`api`), que las ejecuta en un bucle de
+    fondo compartido con un límite de concurrencia global y conexiones
+    keep-alive. Las descargas en streaming (exportación
+    CSV) usan una sesión de requests con pool de conexiones.
     """
-    def __init__(self):
-        """Inicializa el servicio con la URL base de la API."""
+    def __init__(self, pool_maxsize=None, max_retries=None, backoff_factor=None,
+                 timeouts=None, cache=None):
+        """
+        Inicializa el servicio con la URL base de la API y la sesión HTTP.
+
+        Args:
+            pool_maxsize (int): Conexiones simultáneas máximas por host.
+            max_retries (int): Reintentos ante errores 5xx/429 o de conexión.
+            backoff_factor (float): Factor del backoff exponencial entre reintentos.
+            timeouts (dict): Timeouts (conexión, lectura) por endpoint.
+            cache (ConvocatoriaCache): Caché de detalles de convocatorias.
+        """
         self.base_url = "https://www.infosubvenciones.es/bdnstrans/api"
         self.logger = logging.getLogger(__name__)
+        self.pool_maxsize = pool_maxsize or int(
+            os.environ.get('INFOSUBVENCIONES_POOL_MAXSIZE', '10')
+        )
+        self.max_retries = max_retries if max_retries is not None else int(
+            os.environ.get('INFOSUBVENCIONES_MAX_RETRIES', '3')
+        )
+        self.backoff_factor = backoff_factor if backoff_factor is not None else float(
+            os.environ.get('INFOSUBVENCIONES_BACKOFF_FACTOR', '0.5')
+        )
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self._in_flight = 0
+        self._stats_lock = threading.Lock()
+        self.session = self._build_session()
+        self._api = None
+        self.cache = cache or ConvocatoriaCache(
+            negative_error=ConvocatoriaNoEncontradaError
+        )
+        mirror_path = os.environ.get('CONVOCATORIAS_MIRROR_DB')
+        self.mirror = ConvocatoriasMirror(mirror_path) if mirror_path else None
+        index_path = os.environ.get('BUSQUEDA_TEXTO_DB') or mirror_path
+        self.text_index = FullTextIndex(index_path) if index_path else None
+        self.semantic_index = build_semantic_index()
+        self.retriever = (HybridRetriever(self.semantic_index, self.mirror)
+                          if self.semantic_index is not None and self.mirror else None)
+        # Por encima de este número de resultados, /api/buscar se sirve desde
+        # la exportación CSV (una petición) en lugar de paginar (0 = nunca).
+        self.export_threshold = int(
+            os.environ.get('CONVOCATORIAS_EXPORT_THRESHOLD', '5000'))
+        self.export_max_filas = int(
+            os.environ.get('CONVOCATORIAS_EXPORT_MAX_ROWS', '50000'))
+        self.export_timeout = float(
+            os.environ.get('CONVOCATORIAS_EXPORT_TIMEOUT', '300'))
+        export_maxsize = int(os.environ.get('CONVOCATORIAS_EXPORT_CACHE_MAXSIZE', '4'))
+        # Sólo se guardan exportaciones terminadas: (filas, completa). Las que
+        # están en curso viven aparte para que la caché no las expulse.
+        self._exportaciones = TTLCache(
+            maxsize=export_maxsize,
+            ttl=float(os.environ.get('CONVOCATORIAS_EXPORT_TTL', '3600'))
+        )
+        self._exportando = {}
+        self.max_exportando = max(1, export_maxsize)
+        self._export_lock = threading.Lock()
+        self._export_stats = Counter()
 
-    def buscar_convocatorias(self, params, max_workers=5):
+    def _build_session(self) -> requests.Session:
+        """Crea la sesión HTTP con pool de conexiones y política de reintentos."""
+        retry = _JitterRetry(
+            total=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        # pool_block=True hace que el límite por host sea estricto: las
+        # peticiones que exceden pool_maxsize esperan una conexión libre.
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retry,
+            pool_block=True
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            "Accept": "application/json",
+            "Connection": "keep-alive"
+        })
+        return session
+
+    @property
+    def api(self):
+        """Cliente asíncrono en el que se delegan las peticiones JSON."""
+        if self._api is None:
+            # pylint: disable=import-outside-toplevel
+            from .async_infosubvenciones_service import AsyncInfosubvencionesService
+            self._api = AsyncInfosubvencionesService(
+                self.base_url, self.pool_maxsize, self.max_retries,
+                self.backoff_factor, self.timeouts, self.cache
+            )
+        return self._api
+
+    def _run(self, coro):
+        """Ejecuta una corrutina del cliente asíncrono en su bucle de fondo."""
+        # pylint: disable=import-outside-toplevel
+        from .async_infosubvenciones_service import run_sync
+        return run_sync(coro)
+
+    def _get(self, endpoint: str, params=None, stream=False) -> requests.Response:
+        """
+        Realiza una petición GET en streaming a un endpoint de la API usando
+        la sesión de requests, respetando el límite de tasa de la familia
+        del endpoint. Las peticiones JSON van por `api`.
+
+        Args:
+            endpoint (str): Ruta relativa a la URL base (p. ej. 'convocatorias').
+            params (dict): Parámetros de la petición.
+            stream (bool): Si True, el cuerpo se lee después, a medida que llega.
+        Returns:
+            requests.Response: Respuesta HTTP ya validada con raise_for_status.
+        Raises:
+            ApiServiceError: Si el limitador de tasa está saturado.
+        """
+        url = f"{self.base_url}/{endpoint}"
+        timeout = self.timeouts.get(endpoint, FALLBACK_TIMEOUT)
+        try:
+            get_rate_limiter(endpoint).acquire()
+        except ServicioSaturadoError as e:
+            self.logger.warning("Petición a %s rechazada: %s", endpoint, e)
+            raise ApiServiceError(str(e)) from e
+        with self._stats_lock:
+            self._in_flight += 1
+        try:
+            response = self.session.get(url, params=params, timeout=timeout,
+                                        stream=stream)
+            response.raise_for_status()
+            return response
+        finally:
+            with self._stats_lock:
+                self._in_flight -= 1
+
+    def pool_stats(self) -> dict:
+        """
+        Devuelve estadísticas del pool de conexiones de las descargas en
+        streaming y del cliente asíncrono de las peticiones JSON.
+
+        Returns:
+            dict: Conexiones abiertas, reutilizadas, inactivas, peticiones en
+            espera y, en `async`, las métricas del cliente asíncrono.
+        """
+        opened = requests_made = idle = 0
+        adapter = self.session.get_adapter(self.base_url)
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            requests_made += pool.num_requests
+            if pool.pool is not None:
+                # La cola del pool se rellena con None hasta pool_maxsize.
+                idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        with self._stats_lock:
+            in_flight = self._in_flight
+        return {
+            "connections_opened": opened,
+            "connections_reused": max(requests_made - opened, 0),
+            "connections_idle": idle,
+            "requests_in_flight": in_flight,
+            "requests_waiting": max(in_flight - self.pool_maxsize, 0),
+            "pool_maxsize": self.pool_maxsize,
+            "async": self.api.stats()
+        }
+
+    def buscar_convocatorias(self, params):
         """
         Busca convocatorias en la API utilizando los parámetros proporcionados,
-        y recupera los detalles en paralelo con threads.
+        y recupera los detalles en paralelo con el cliente asíncrono.
+        Si la búsqueda supera CONVOCATORIAS_EXPORT_THRESHOLD resultados, la
+        página se sirve desde la exportación CSV en cuanto está descargada (ver
+        `buscar_exportacion`); mientras tanto se sirve la página JSON.
         Args:
             params (dict): Diccionario con los parámetros de búsqueda.
-            max_workers (int): Número máximo de hilos concurrentes.
         Returns:
             dict: Resultados de la búsqueda con detalle de cada convocatoria.
         """
-        url = f"{self.base_url}/convocatorias/busqueda"
-        self.logger.info("Buscando convocatorias con params: %s y URL: %s", params, url)
+        data = self.buscar_pagina(params)
+        if self._admite_exportacion(data):
+            exportada = self.buscar_exportacion(params, total=data.get("totalElements"))
+            if exportada is not None:
+                return exportada
+        return self._run(self.api.buscar_convocatorias(params, pagina=data))
+
+    def _admite_exportacion(self, pagina: dict) -> bool:
+        """Indica si una búsqueda de la API es tan amplia que compensa exportarla."""
+        return (self.export_threshold > 0 and "origen" not in pagina
+                and (pagina.get("totalElements") or 0) > self.export_threshold)
+
+    def buscar_exportacion(self, params, total: int = None) -> Optional[dict]:
+        """
+        Sirve una página de una búsqueda amplia desde la exportación CSV, con
+        el mismo formato que `buscar_convocatorias`. Si la exportación aún no
+        está descargada, lanza su descarga en segundo plano y devuelve None
+        para que la página se sirva desde el JSON. Para no lanzar miles de
+        peticiones de detalle, sólo se enriquecen los resultados cuyo detalle
+        ya está en caché.
+        Args:
+            params (dict): Parámetros de búsqueda, incluidos 'page' y 'pageSize'.
+            total (int): totalElements de la búsqueda JSON, para las
+                exportaciones recortadas a CONVOCATORIAS_EXPORT_MAX_ROWS.
+        Returns:
+            dict: Página de resultados con `origen` = 'exportacion', o None si
+            la exportación no está lista o no llega a esa página.
+        """
+        future = self._futuro_exportacion(params)
+        if future is None or not future.done() or future.exception() is not None:
+            self._contar_exportacion("paginas_json")
+            return None
+        filas, completa = future.result()
+        tamano = max(1, int(params.get("pageSize") or 10))
+        pagina = int(params.get("page") or 0)
+        if not completa and (pagina + 1) * tamano > len(filas):
+            self._contar_exportacion("paginas_json")
+            return None
+        contenido = [dict(item) for item in filas[pagina * tamano:(pagina + 1) * tamano]]
+        detalles = {}
+        for item in contenido:
+            estado, detalle = self.cache.peek(item.get("numeroConvocatoria"))
+            if estado in ("fresh", "stale") and isinstance(detalle, dict) and "id" in detalle:
+                detalles[str(detalle["id"])] = resumen_detalle(detalle)
+        total_elements = len(filas) if completa else max(int(total or 0), len(filas))
+        with self._stats_lock:
+            self._export_stats["paginas_servidas"] += 1
+        return {
+            "content": contenido,
+            "totalElements": total_elements,
+            "totalPages": math.ceil(total_elements / tamano),
+            "number": pagina,
+            "size": tamano,
+            "origen": "exportacion",
+            "convocatoriasDetails": detalles
+        }
 
+    def exportar_convocatorias(self, params) -> list:
+        """
+        Devuelve las convocatorias de una búsqueda a partir de la exportación
+        CSV (como mucho CONVOCATORIAS_EXPORT_MAX_ROWS). Las peticiones
+        simultáneas con los mismos filtros comparten la descarga, que se
+        reutiliza CONVOCATORIAS_EXPORT_TTL segundos.
+        Args:
+            params (dict): Parámetros de búsqueda ('page' y 'pageSize' se ignoran).
+        Returns:
+            list: Convocatorias con las claves de `/convocatorias/busqueda`.
+        Raises:
+            ApiServiceError: Si la exportación no se puede descargar o leer, o
+            no termina en CONVOCATORIAS_EXPORT_TIMEOUT segundos.
+        """
+        future = self._futuro_exportacion(params)
+        if future is None:
+            raise ApiServiceError("Demasiadas exportaciones en curso")
         try:
-            resp = requests.get(url, params=params, timeout=10)
-            resp.raise_for_status()
-            data = resp.json()
-            numeros = [
-                item.get("numeroConvocatoria")
-                for item in data.get("content", [])
-                if item.get("numeroConvocatoria") is not None
-            ]
-
-            # Ahora es un dict en lugar de lista
-            convocatorias_details = {}
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                future_to_num = {
-                    executor.submit(self.obtener_convocatoria, num): num
-                    for num in numeros
-                }
-                for future in as_completed(future_to_num):
-                    num = future_to_num[future]
-                    try:
-                        future_result = future.result()
-                        convocatorias_details[str(future_result['id'])] = {
-                            'presupuestoTotal': future_result['presupuestoTotal'],
-                            'regiones': future_result['regiones'],
-                            'tiposBeneficiarios': future_result['tiposBeneficiarios']
-                        }
-                    except ApiServiceError as e:
-                        self.logger.error("Error al obtener convocatoria %s: %s", num, e)
-
-            data["convocatoriasDetails"] = convocatorias_details
-            return data
-        except requests.RequestException as e:
-            self.logger.error("Error en la petición de búsqueda: %s", e)
-            raise ApiServiceError("No se pudo buscar convocatorias") from e
+            filas, _ = future.result(timeout=self.export_timeout)
+        except FuturesTimeoutError as e:
+            raise ApiServiceError(
+                f"La exportación no terminó en {self.export_timeout:.0f} s") from e
+        return filas
+
+    def _futuro_exportacion(self, params) -> Optional[Future]:
+        """
+        Future con las filas de la exportación de unos filtros: la guardada,
+        la que está en curso o una nueva descarga en el pool compartido.
+        Devuelve None si ya hay CONVOCATORIAS_EXPORT_CACHE_MAXSIZE descargas
+        en curso o el pool está saturado.
+        """
+        filtros = {k: v for k, v in params.items() if k not in ("page", "pageSize")}
+        clave = tuple(sorted((k, str(v)) for k, v in filtros.items()))
+        with self._export_lock:
+            guardada = self._exportaciones.get(clave)
+            if guardada is not None:
+                future = Future()
+                future.set_result(guardada)
+                return future
+            future = self._exportando.get(clave)
+            if future is not None or len(self._exportando) >= self.max_exportando:
+                return future
+            try:
+                future = shared_executor.submit(self._completar_exportacion, clave,
+                                                filtros, group="exportacion")
+            except ServicioSaturadoError:
+                self.logger.debug("Pool saturado; se aplaza la exportación CSV.")
+                return None
+            self._exportando[clave] = future
+        return future
+
+    def _completar_exportacion(self, clave: tuple, filtros: dict) -> tuple:
+        """Descarga una exportación y la pasa de en curso a guardada."""
+        resultado = None
+        try:
+            resultado = self._descargar_exportacion(filtros)
+            return resultado
+        finally:
+            with self._export_lock:
+                self._exportando.pop(clave, None)
+                if resultado is not None:
+                    self._exportaciones[clave] = resultado
+
+    def _descargar_exportacion(self, filtros: dict) -> tuple:
+        """
+        Descarga la exportación CSV y la lee a medida que llega, hasta
+        CONVOCATORIAS_EXPORT_MAX_ROWS filas.
+
+        Returns:
+            tuple: (filas, completa); `completa` es False si se recortó.
+        """
+        endpoint = "convocatorias/exportar"
+        params = {**filtros, "tipoDoc": "csv", "vpd": filtros.get("vpd", "GE")}
+        self.logger.info("Descargando la exportación CSV de convocatorias: %s", params)
+        inicio = time.monotonic()
+        filas, completa = [], True
+        try:
+            with self._get(endpoint, params=params, stream=True) as response:
+                response.raw.decode_content = True
+                # Sin auto_close, el texto ya leído sigue disponible al agotarse el cuerpo.
+                response.raw.auto_close = False
+                encoding = "utf-8-sig"
+                if "charset=" in response.headers.get("Content-Type", "").lower():
+                    encoding = response.encoding
+                    if encoding.lower().replace("-", "") == "utf8":
+                        encoding = "utf-8-sig"
+                texto = io.TextIOWrapper(response.raw, encoding=encoding,
+                                         errors="replace", newline="")
+                for fila in leer_exportacion(texto):
+                    if len(filas) >= self.export_max_filas:
+                        completa = False
+                        break
+                    if time.monotonic() - inicio > self.export_timeout:
+                        raise TimeoutError(
+                            f"la descarga superó {self.export_timeout:.0f} s")
+                    filas.append(fila)
+        except (requests.exceptions.RequestException, Urllib3HTTPError, OSError) as e:
+            self._contar_exportacion("errores")
+            self.logger.error("Error al descargar la exportación CSV: %s", e)
+            raise ApiServiceError(f"No se pudo descargar la exportación: {e}") from e
+        except (ValueError, csv.Error) as e:
+            self._contar_exportacion("errores")
+            self.logger.error("Exportación CSV no válida: %s", e)
+            raise ApiServiceError(f"Exportación CSV no válida: {e}") from e
+        self._contar_exportacion("descargas")
+        self._contar_exportacion("filas", len(filas))
+        if not completa:
+            self._contar_exportacion("recortadas")
+            self.logger.warning("Exportación CSV recortada a %d convocatorias.", len(filas))
+        self.logger.info("Exportación CSV: %d convocatorias en %.1f s.",
+                         len(filas), time.monotonic() - inicio)
+        return filas, completa
+
+    def _contar_exportacion(self, nombre: str, cantidad: int = 1):
+        with self._stats_lock:
+            self._export_stats[nombre] += cantidad
+
+    def export_stats(self) -> dict:
+        """
+        Devuelve estadísticas de las búsquedas servidas desde la exportación CSV.
+
+        Returns:
+            dict: Umbral, descargas, filas, páginas servidas desde la
+            exportación o desde el JSON mientras se descarga, exportaciones
+            recortadas, errores y exportaciones en memoria y en curso.
+        """
+        with self._stats_lock:
+            stats = {"descargas": 0, "filas": 0, "paginas_servidas": 0,
+                     "paginas_json": 0, "recortadas": 0, "errores": 0,
+                     **self._export_stats}
+        with self._export_lock:
+            stats["en_memoria"] = len(self._exportaciones)
+            stats["en_curso"] = len(self._exportando)
+        stats["umbral"] = self.export_threshold
+        return stats
+
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-arguments
+    def abrir_busqueda(self, params, max_items=None, hibrida=False,
+                       pagina=None, cancelado=None,
+                       exportacion=False) -> "BusquedaEnriquecida":
+        """
+        Lanza una búsqueda y devuelve un cursor que expone la página base de
+        inmediato mientras los detalles se descargan en segundo plano.
+        Args:
+            params (dict): Diccionario con los parámetros de búsqueda.
+            max_items (int): Si se indica, recorre páginas sucesivas hasta
+                reunir como máximo este número de resultados.
+            hibrida (bool): Si True y hay índice semántico, añade y reordena
+                los resultados con las convocatorias semánticamente similares.
+            pagina (dict): Página base ya descargada, si la hay.
+            cancelado (threading.Event): Si se activa, se dejan de recorrer
+                páginas y de pedir detalles.
+            exportacion (bool): Si True y la búsqueda supera
+                CONVOCATORIAS_EXPORT_THRESHOLD, la página se sirve desde la
+                exportación CSV (ver `buscar_exportacion`) y sólo se emiten
+                los detalles que ya están en caché.
+        Returns:
+            BusquedaEnriquecida: Cursor sobre los resultados enriquecidos.
+        """
+        if max_items is None:
+            data = pagina if pagina is not None else self.buscar_pagina(params)
+            if exportacion and self._admite_exportacion(data):
+                exportada = self.buscar_exportacion(params,
+                                                    total=data.get("totalElements"))
+                if exportada is not None:
+                    detalles = exportada.pop("convocatoriasDetails")
+                    return BusquedaEnriquecida(exportada, {}, resueltos=detalles)
+        elif pagina is not None:
+            data = pagina
+        else:
+            paginador = self.iterar_convocatorias(params, max_items=max_items,
+                                                  cancelado=cancelado)
+            data = dict(paginador.primera_pagina)
+            data["content"] = list(paginador)
+            data["harvestCompleto"] = paginador.completo
+        if hibrida and self.retriever is not None and self.retriever.admite(params):
+            data = self.retriever.fusionar(data, params)
+
+        if cancelado is not None and cancelado.is_set():
+            return BusquedaEnriquecida(data, {})
+        numeros = [
+            item.get("numeroConvocatoria")
+            for item in data.get("content", [])
+            if item.get("numeroConvocatoria") is not None
+        ]
+        return BusquedaEnriquecida(data, self._submit_detalles(numeros), cancelado)
+
+    # pylint: disable=too-many-arguments
+    def iterar_convocatorias(self, params, max_items=None, prefetch=None,
+                             usar_espejo=True, cancelado=None) -> "PaginadorConvocatorias":
+        """
+        Devuelve un iterador sobre los resultados de todas las páginas de una
+        búsqueda, descargando por adelantado las siguientes páginas en paralelo.
+        Args:
+            params (dict): Parámetros de búsqueda; 'page' indica la página inicial.
+            max_items (int): Presupuesto máximo de resultados (None = todos).
+            prefetch (int): Páginas que se descargan por adelantado.
+            usar_espejo (bool): Si False, consulta siempre la API.
+            cancelado (threading.Event): Si se activa, la iteración termina.
+        Returns:
+            PaginadorConvocatorias: Iterable de resultados con los metadatos
+            de la primera página ya disponibles.
+        """
+        prefetch = prefetch or int(os.environ.get('SEARCH_HARVEST_PREFETCH', '3'))
+        return PaginadorConvocatorias(self, params, max_items, prefetch, usar_espejo,
+                                      cancelado)
+
+    def buscar_pagina(self, params, page=None, usar_espejo=True) -> dict:
+        """
+        Obtiene una página de resultados de búsqueda (sin detalles). Si el
+        índice de texto o el espejo local están al día y admiten los filtros,
+        responde desde ellos; las búsquedas por texto se ordenan por relevancia.
+        Args:
+            params (dict): Parámetros de búsqueda.
+            page (int): Página a descargar; por defecto la de `params`.
+            usar_espejo (bool): Si False, consulta siempre la API.
+        Returns:
+            dict: Respuesta JSON de la API (o equivalente del espejo).
+        """
+        if page is not None:
+            params = {**params, "page": str(page)}
+        try:
+            if usar_espejo and self.text_index is not None \
+                    and self.text_index.can_answer(params):
+                self.logger.info("Buscando convocatorias en el índice de texto: %s", params)
+                return self.text_index.buscar(params)
+            if usar_espejo and self.mirror is not None and self.mirror.can_answer(params):
+                self.logger.info("Buscando convocatorias en el espejo local: %s", params)
+                return self.mirror.buscar(params)
+        except ValueError as e:
+            # Filtros que el espejo no sabe interpretar: los resuelve la API.
+            self.logger.warning("Búsqueda local descartada (%s); se consulta la API.", e)
+        data = self._run(self.api.buscar_pagina(params))
+        self._indexar_resultados(data.get("content") or [])
+        return data
+
+    def _indexar_resultados(self, items: list):
+        """Añade al índice de texto, en segundo plano, los resultados de la API."""
+        if self.text_index is None or not items:
+            return
 
+        def run():
+            try:
+                self.text_index.indexar(items)
+            except sqlite3.Error as e:
+                self.logger.warning("No se pudo actualizar el índice de texto: %s", e)
+
+        try:
+            shared_executor.submit(run, group="busqueda_texto")
+        except ServicioSaturadoError:
+            self.logger.debug("Pool saturado; se omite la indexación de resultados.")
+
+    def _submit_detalles(self, numeros) -> dict:
+        """
+        Lanza en el cliente asíncrono la descarga del detalle de cada número,
+        sin ocupar hilos: las limita el semáforo global.
+
+        Returns:
+            dict: Future -> número de convocatoria.
+        """
+        # pylint: disable=import-outside-toplevel
+        from .async_infosubvenciones_service import submit_async
+        return {submit_async(self.api.obtener_convocatoria(num)): num for num in numeros}
 
     def obtener_convocatoria(self, id_convocatoria):
         """
-        Obtiene los detalles de una convocatoria específica.
+        Obtiene los detalles de una convocatoria específica, sirviéndolos
+        desde la caché cuando es posible.
         Args:
             id_convocatoria (str): ID de la convocatoria a consultar.
         Returns:
             dict: Detalles de la convocatoria.
         """
-        try:
-            url = f"{self.base_url}/convocatorias"
-            params = {"numConv": id_convocatoria}
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            msg = f"Error al obtener detalles de la convocatoria: {str(e)}"
-            self.logger.error("Error al obtener convocatoria %s: %s",
-                              id_convocatoria, str(e))
-            raise ApiServiceError(msg) from e
+        return self._run(self.api.obtener_convocatoria(id_convocatoria))
 
     def obtener_beneficiarios_por_anno(self, lista_annos):
         """
@@ -96,18 +615,7 @@ class InfosubvencionesService:
         Returns:
             dict: Beneficiarios por año.
         """
-        try:
-            url = f"{self.base_url}/grandesbeneficiarios/busqueda"
-            params = {"anios": list(map(int, lista_annos))}
-            self.logger.info("Obteniendo beneficiarios para años: %s con URL: %s",
-                             lista_annos, url)
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            msg = f"Error al comunicarse con la API de Infosubvenciones: {str(e)}"
-            self.logger.error("Error al obtener beneficiarios por año: %s", str(e))
-            raise ApiServiceError(msg) from e
+        return self._run(self.api.obtener_beneficiarios_por_anno(lista_annos))
 
     def buscar_partidos_politicos(self, params):
         """
@@ -117,18 +625,323 @@ class InfosubvencionesService:
         Returns:
             dict: Resultados de la búsqueda de partidos políticos.
         """
+        return self._run(self.api.buscar_partidos_politicos(params))
+
+    def buscar_registros(self, endpoint: str, params: dict, page=None) -> dict:
+        """
+        Obtiene una página de concesiones o de ayudas de estado.
+        Args:
+            endpoint (str): Uno de ENDPOINTS_REGISTROS.
+            params (dict): Filtros de la búsqueda (nifCif, numeroConvocatoria...).
+            page (int): Página a descargar; por defecto la de `params`.
+        Returns:
+            dict: Respuesta JSON de la API.
+        """
+        if page is not None:
+            params = {**params, "page": str(page)}
+        self.logger.info("Buscando en %s con params: %s", endpoint, params)
+        return self._run(self.api.buscar_registros(endpoint, params))
+
+    def buscar_concesiones(self, params):
+        """
+        Busca concesiones (por nifCif, numeroConvocatoria, fechas...).
+        Args:
+            params (dict): Diccionario con los parámetros de búsqueda.
+        Returns:
+            dict: Una página de resultados de la búsqueda de concesiones.
+        """
+        return self.buscar_registros("concesiones/busqueda", params)
+
+    def buscar_ayudas_estado(self, params):
+        """
+        Busca concesiones clasificadas como ayudas de estado.
+        Args:
+            params (dict): Diccionario con los parámetros de búsqueda.
+        Returns:
+            dict: Una página de resultados de la búsqueda de ayudas de estado.
+        """
+        return self.buscar_registros("ayudasestado/busqueda", params)
+
+    def iterar_registros(self, endpoint: str, params: dict, max_items=None,
+                         prefetch=None) -> "PaginadorRegistros":
+        """
+        Devuelve un iterador sobre todos los registros de una búsqueda de
+        concesiones o de ayudas de estado, con páginas grandes descargadas
+        en paralelo.
+        Args:
+            endpoint (str): Uno de ENDPOINTS_REGISTROS.
+            params (dict): Filtros; 'page' y 'pageSize' son opcionales.
+            max_items (int): Presupuesto máximo de registros (None = todos).
+            prefetch (int): Páginas que se descargan a la vez.
+        Returns:
+            PaginadorRegistros: Iterable de registros con los metadatos de
+            la primera página ya disponibles.
+        """
+        if endpoint not in ENDPOINTS_REGISTROS:
+            raise ValueError(f"Endpoint de registros no soportado: {endpoint}")
+        prefetch = prefetch or int(os.environ.get('REGISTROS_PREFETCH', '4'))
+        params = {"pageSize": os.environ.get('REGISTROS_PAGE_SIZE', '1000'), **params}
+        return PaginadorRegistros(self, endpoint, params, max_items, prefetch)
+
+class PaginadorConvocatorias:
+    """
+    Iterable sobre los resultados de una búsqueda a lo largo de varias
+    páginas. La primera página se descarga al crearlo (y con ella
+    `total_elements` y `total_pages`); las siguientes se piden por adelantado
+    al pool compartido, manteniendo `prefetch` páginas en vuelo. La
+    iteración termina al agotar las páginas o el presupuesto `max_items`, o
+    cuando se activa el evento `cancelado`.
+    """
+    # pylint: disable=too-many-arguments
+    def __init__(self, service: InfosubvencionesService, params: dict,
+                 max_items: int = None, prefetch: int = 3,
+                 usar_espejo: bool = True, cancelado: threading.Event = None):
+        self._service = service
+        self._params = dict(params)
+        self._usar_espejo = usar_espejo
+        self._cancelado = cancelado
+        self.max_items = max_items
+        self.prefetch = max(1, prefetch)
+        self.pagina_inicial = int(self._params.get("page") or 0)
+        self.primera_pagina = service.buscar_pagina(
+            self._params, self.pagina_inicial, usar_espejo
+        )
+        self.total_elements = self.primera_pagina.get("totalElements", 0)
+        self.total_pages = self.primera_pagina.get("totalPages", 1)
+        # Con presupuesto, no se piden páginas que no se van a emitir.
+        self._ultima = self.total_pages
+        por_pagina = len(self.primera_pagina.get("content") or [])
+        if max_items is not None and por_pagina:
+            necesarias = self.pagina_inicial + math.ceil(max_items / por_pagina)
+            self._ultima = min(self._ultima, necesarias)
+        # False si se cortó por presupuesto o por un error en alguna página.
+        self.completo = True
+        self.logger = logging.getLogger(__name__)
+
+    def __iter__(self):
+        emitidos = 0
+        pendientes = deque()
+        siguiente = self.pagina_inicial + 1
+        grupo = object()  # Un grupo de equidad propio en el pool compartido.
+        pagina = self.primera_pagina
         try:
-            url = f"{self.base_url}/partidospoliticos/busqueda"
-            self.logger.info(
-                "Buscando partidos políticos con params: %s y URL: %s",
-                params, url
+            while True:
+                for item in pagina.get("content", []):
+                    if self.max_items is not None and emitidos >= self.max_items:
+                        self.completo = False
+                        return
+                    emitidos += 1
+                    yield item
+                if self._cancelado is not None and self._cancelado.is_set():
+                    self.logger.info("Recolección cancelada tras %d resultados.", emitidos)
+                    self.completo = False
+                    return
+                while len(pendientes) < self.prefetch and siguiente < self._ultima:
+                    try:
+                        pendientes.append(shared_executor.submit(
+                            self._service.buscar_pagina, self._params, siguiente,
+                            self._usar_espejo, group=grupo
+                        ))
+                    except ServicioSaturadoError:
+                        # Se reintenta al liberar hueco con las páginas en vuelo.
+                        if not pendientes:
+                            self.logger.error("Pool saturado: recolección interrumpida "
+                                              "tras %d resultados.", emitidos)
+                            self.completo = False
+                            return
+                        break
+                    siguiente += 1
+                if not pendientes:
+                    if self._ultima < self.total_pages:
+                        # Cortado por el presupuesto antes de la última página.
+                        self.completo = False
+                    return
+                try:
+                    pagina = pendientes.popleft().result(timeout=PAGE_WAIT_TIMEOUT)
+                except (ApiServiceError, FuturesTimeoutError) as e:
+                    self.logger.error("Recolección interrumpida tras %d resultados: %r",
+                                      emitidos, e)
+                    self.completo = False
+                    return
+                if not pagina.get("content"):
+                    return
+        finally:
+            for future in pendientes:
+                future.cancel()
+
+
+class PaginadorRegistros:
+    """
+    Iterable sobre todos los registros de una búsqueda de concesiones o de
+    ayudas de estado. Mantiene `prefetch` páginas en vuelo en el pool
+    compartido y emite los registros en el orden de las páginas. Si la API
+    no informa del número de páginas, sigue pidiendo hasta recibir una
+    página vacía.
+    """
+    # pylint: disable=too-many-arguments
+    def __init__(self, service: InfosubvencionesService, endpoint: str, params: dict,
+                 max_items: int = None, prefetch: int = 4):
+        self._service = service
+        self.endpoint = endpoint
+        self._params = dict(params)
+        self.max_items = max_items
+        self.prefetch = max(1, prefetch)
+        self.pagina_inicial = int(self._params.get("page") or 0)
+        self.primera_pagina = service.buscar_registros(
+            endpoint, self._params, self.pagina_inicial
+        )
+        self.total_elements = self.primera_pagina.get("totalElements")
+        self.total_pages = self.primera_pagina.get("totalPages")
+        por_pagina = len(self.primera_pagina.get("content") or [])
+        if self.total_pages is None and self.total_elements is not None and por_pagina:
+            self.total_pages = math.ceil(self.total_elements / por_pagina)
+        # Con presupuesto, no se piden páginas que no se van a emitir.
+        self._ultima = self.total_pages
+        if max_items is not None and por_pagina:
+            necesarias = self.pagina_inicial + math.ceil(max_items / por_pagina)
+            self._ultima = min(self._ultima or necesarias, necesarias)
+        # False si se cortó por presupuesto o por un error en alguna página.
+        self.completo = True
+        self.paginas = 1
+        self.logger = logging.getLogger(__name__)
+
+    def __iter__(self):
+        emitidos = 0
+        pendientes = deque()
+        siguiente = self.pagina_inicial + 1
+        grupo = object()  # Un grupo de equidad propio en el pool compartido.
+        pagina = self.primera_pagina
+        try:
+            while True:
+                contenido = pagina.get("content") or []
+                if not contenido:
+                    return
+                for item in contenido:
+                    if self.max_items is not None and emitidos >= self.max_items:
+                        self.completo = False
+                        return
+                    emitidos += 1
+                    yield item
+                while len(pendientes) < self.prefetch and (
+                        self._ultima is None or siguiente < self._ultima):
+                    try:
+                        pendientes.append(shared_executor.submit(
+                            self._service.buscar_registros, self.endpoint,
+                            self._params, siguiente, group=grupo
+                        ))
+                    except ServicioSaturadoError:
+                        # Se reintenta al liberar hueco con las páginas en vuelo.
+                        if not pendientes:
+                            self.logger.error("Pool saturado: descarga de %s interrumpida "
+                                              "tras %d registros.", self.endpoint, emitidos)
+                            self.completo = False
+                            return
+                        break
+                    siguiente += 1
+                if not pendientes:
+                    if self._ultima != self.total_pages:
+                        # Cortado por el presupuesto antes de la última página.
+                        self.completo = False
+                    return
+                try:
+                    pagina = pendientes.popleft().result(timeout=PAGE_WAIT_TIMEOUT)
+                except (ApiServiceError, FuturesTimeoutError) as e:
+                    self.logger.error("Descarga de %s interrumpida tras %d registros: %r",
+                                      self.endpoint, emitidos, e)
+                    self.completo = False
+                    return
+                self.paginas += 1
+        finally:
+            for future in pendientes:
+                future.cancel()
+
+
+class BusquedaEnriquecida:
+    """
+    Cursor sobre una búsqueda de convocatorias. La página base está
+    disponible en `pagina` desde el principio; los detalles de cada
+    resultado se obtienen en orden de llegada al iterar o con `take`.
+    """
+    def __init__(self, pagina: dict, future_to_num: dict,
+                 cancelado: threading.Event = None, resueltos: dict = None):
+        """
+        Args:
+            pagina (dict): Respuesta de la búsqueda sin enriquecer.
+            future_to_num (dict): Future de cada detalle -> número de convocatoria.
+            cancelado (threading.Event): Si se activa, la iteración termina y
+                se cancelan los detalles pendientes.
+            resueltos (dict): Resúmenes ya disponibles por id, que se emiten
+                antes que los descargados.
+        """
+        self.pagina = pagina
+        self._resueltos = iter(list((resueltos or {}).items()))
+        self._future_to_num = future_to_num
+        self._cancelado = cancelado
+        self._pendientes = iter(as_completed(future_to_num))
+        self._vistos = set()
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def total(self) -> int:
+        """Número de detalles solicitados para esta página."""
+        return len(self._future_to_num)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """
+        Devuelve el siguiente detalle descargado como (id, resumen). Los
+        detalles que fallan se registran y se omiten.
+        """
+        resuelto = next(self._resueltos, None)
+        if resuelto is not None:
+            return resuelto
+        while True:
+            if self._cancelado is not None and self._cancelado.is_set():
+                self.close()
+                raise StopIteration
+            future = next(self._pendientes)
+            num = self._future_to_num[future]
+            if future in self._vistos or future.cancelled():
+                continue
+            self._vistos.add(future)
+            try:
+                detalle = future.result()
+                return str(detalle['id']), resumen_detalle(detalle)
+            except (ApiServiceError, KeyError, TypeError) as e:
+                self.logger.error("Error al obtener convocatoria %s: %s", num, e)
+
+    def take(self, limite: int = None, timeout: float = None) -> dict:
+        """
+        Recoge los primeros detalles que lleguen y cancela el resto si se
+        alcanza el límite o el tiempo máximo.
+        Args:
+            limite (int): Número máximo de detalles (None = todos).
+            timeout (float): Segundos máximos de espera (None = sin límite).
+        Returns:
+            dict: Resumen de detalle por id de convocatoria.
+        """
+        detalles = {}
+        if timeout is not None:
+            self._pendientes = iter(
+                as_completed(self._future_to_num, timeout=timeout)
             )
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()  # Lanza excepción si hay error HTTP
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            msg = f"Error al comunicarse con la API de Infosubvenciones: {str(e)}"
-            self.logger.error("Error al buscar partidos políticos: %s", str(e))
-            raise ApiServiceError(msg) from e
+        try:
+            for id_, resumen in self:
+                detalles[id_] = resumen
+                if limite is not None and len(detalles) >= limite:
+                    break
+        except FuturesTimeoutError:
+            self.logger.info("Tiempo agotado: %d de %d detalles obtenidos.",
+                             len(detalles), self.total)
+        self.close()
+        return detalles
+
+    def close(self):
+        """Cancela las descargas de detalle que aún no han empezado."""
+        for future in self._future_to_num:
+            future.cancel()
+
 
 info_subvenciones_service = InfosubvencionesService()
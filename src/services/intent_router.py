@@ -0,0 +1,331 @@
+"""
+Este módulo implementa un enrutador local de intenciones que se consulta
+antes de llamar al LLM.
+
+Resuelve en microsegundos los casos evidentes (saludos, un número BDNS
+suelto, "beneficiarios 2023"...) mediante reglas y, opcionalmente, con un
+clasificador Naive Bayes entrenado sobre las consultas ya clasificadas por
+el LLM. Si la confianza no alcanza el umbral, devuelve None y la decisión
+queda en manos del LLM.
+
+Uso (desde `src/`):
+    python -m services.intent_router train
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import List, NamedTuple, Optional
+from .busqueda_texto import analizar
+from .concesiones_export import normalizar_nif
+from .convocatorias_mirror import normalizar_texto
+
+logger = logging.getLogger(__name__)
+
+VALID_INTENTS = (
+    "OBTENER_CONVOCATORIA_DETALLES",
+    "BUSCAR_CONVOCATORIAS_GENERAL",
+    "BUSCAR_BENEFICIARIOS_POR_ANNO",
+    "GENERAL_CONVERSATION",
+    "BUSCAR_PARTIDOS_POLITICOS",
+    "BUSCAR_CONCESIONES",
+    "BUSCAR_AYUDAS_ESTADO"
+)
+
+_SALUDO_RE = re.compile(
+    r"^[¡¿\s]*(hola|buenas|buenos dias|buenas tardes|buenas noches|hey|saludos|gracias|"
+    r"muchas gracias|adios|hasta luego|chao|ok|vale|perfecto|genial|que tal)"
+    r"(\s+(hola|gracias|que tal|a todos))*[\s!.?,]*$"
+)
+_BDNS_RE = re.compile(
+    r"^[¡¿\s]*(?:(?:dame|muestrame|ver|quiero ver|informacion|info|detalles?)\s+)?"
+    r"(?:(?:de|sobre)\s+)?(?:la\s+)?(?:convocatoria|bdns|codigo bdns)?\s*"
+    r"(?:n(?:umero|o|º)?\.?\s*)?(\d{5,7})[\s?.!]*$"
+)
+_ANNO_RE = re.compile(r"\b(19[89]\d|20\d\d)\b")
+_RANGO_RE = re.compile(r"\b(19[89]\d|20\d\d)\s*(?:-|a|al|hasta)\s*(19[89]\d|20\d\d)\b")
+_PARTIDO_RE = re.compile(r"\bpartidos?\s+politicos?\b")
+# Palabras de búsqueda de convocatorias: con ellas, "partidos políticos"
+# puede ser sólo el beneficiario o el tema, y la consulta se deja al LLM...
+_BUSQUEDA_CONVOCATORIAS_RE = re.compile(
+    r"\b(?:convocatorias?|ayudas?|subvencion(?:es)?|becas?|fundacion(?:es)?)\b"
+)
+# ...salvo que pregunte explícitamente por los partidos.
+_PARTIDO_EXPLICITO_RE = re.compile(
+    r"\b(?:que|cuales|cuantos)\s+partidos?\b"
+    r"|\b(?:subvencion(?:es)?|ayudas?)\s+(?:\w+\s+)?a\s+(?:los\s+)?partidos?\b"
+)
+_BENEFICIARIO_RE = re.compile(r"\bbeneficiari[oa]s?\b")
+# Palabras que pueden acompañar a "beneficiarios + años" sin cambiar la
+# consulta; cualquier otra (ayudas, pymes, un sector...) la deja al LLM.
+_RELLENO_BENEFICIARIOS = frozenset(
+    "dame muestrame muestra ver quiero saber lista listado listar consultar buscar "
+    "busca obtener cuales quienes quien son fueron hay todos todas los las el la "
+    "de del en el para por y e a al hasta desde entre durante ano anos ejercicio "
+    "ejercicios periodo beneficiario beneficiaria beneficiarios beneficiarias".split()
+)
+_PALABRA_RE = re.compile(r"[a-z]+")
+_CONCESION_RE = re.compile(r"\bconcesion(?:es)?\b|\bconcedid[oa]s?\b")
+_AYUDA_ESTADO_RE = re.compile(r"\bayudas? (?:de )?estado\b")
+_SA_RE = re.compile(r"\bsa\.?\s?(\d{5,6})\b")
+_NIF_RE = re.compile(
+    r"\b(?:[a-hjnp-suvw]-?\d{7}-?[0-9a-j]|[xyz]-?\d{7}-?[a-z]|\d{8}-?[a-z])\b"
+)
+_NUMERO_CONVOCATORIA_RE = re.compile(r"\b(?:convocatoria|bdns)\D{0,10}(\d{5,7})\b")
+_FECHA_RE = re.compile(r"\b\d{1,2}/\d{1,2}/\d{4}\b")
+
+
+class RouteDecision(NamedTuple):
+    """Decisión del enrutador: intención, confianza, huecos y origen."""
+    intent: str
+    confidence: float
+    slots: dict
+    origen: str
+
+
+def extraer_annos(texto: str) -> List[int]:
+    """Años mencionados, expandiendo rangos como '2020 a 2022'."""
+    annos = set()
+    for inicio, fin in _RANGO_RE.findall(texto):
+        inicio, fin = sorted((int(inicio), int(fin)))
+        if fin - inicio <= 10:
+            annos.update(range(inicio, fin + 1))
+    annos.update(int(a) for a in _ANNO_RE.findall(texto))
+    return sorted(annos)
+
+
+def route_by_rules(query: str) -> Optional[RouteDecision]:
+    """Aplica las reglas deterministas; None si ninguna es concluyente."""
+    texto = normalizar_texto(query).strip()
+    if not texto:
+        return None
+    if _SALUDO_RE.match(texto):
+        return RouteDecision("GENERAL_CONVERSATION", 1.0, {}, "regla")
+    match = _BDNS_RE.match(texto)
+    if match:
+        return RouteDecision("OBTENER_CONVOCATORIA_DETALLES", 1.0,
+                             {"extracted_convocatoria_id": match.group(1)}, "regla")
+    if _PARTIDO_RE.search(texto) and (_PARTIDO_EXPLICITO_RE.search(texto)
+                                      or not _BUSQUEDA_CONVOCATORIAS_RE.search(texto)):
+        # El nombre del partido lo sigue extrayendo el LLM.
+        return RouteDecision("BUSCAR_PARTIDOS_POLITICOS", 0.95, {}, "regla")
+    decision = _route_concesiones(texto)
+    if decision is not None:
+        return decision
+    if _BENEFICIARIO_RE.search(texto):
+        annos = extraer_annos(texto)
+        if annos and _solo_beneficiarios_y_annos(texto):
+            return RouteDecision(
+                "BUSCAR_BENEFICIARIOS_POR_ANNO", 0.95,
+                {"extracted_years": ",".join(str(a) for a in annos)}, "regla"
+            )
+    return None
+
+
+def _solo_beneficiarios_y_annos(texto: str) -> bool:
+    """Indica si la consulta no dice nada más que "beneficiarios" y años."""
+    return all(p in _RELLENO_BENEFICIARIOS for p in _PALABRA_RE.findall(texto))
+
+
+def _route_concesiones(texto: str) -> Optional[RouteDecision]:
+    """
+    Reglas de concesiones y ayudas de estado. Sólo se aplican si la consulta
+    trae un identificador (NIF/CIF, referencia SA o número de convocatoria);
+    los filtros se rellenan si no menciona fechas, que sigue interpretando el
+    LLM.
+    """
+    sa = _SA_RE.search(texto)
+    nif = _NIF_RE.search(texto)
+    numero = _NUMERO_CONVOCATORIA_RE.search(texto)
+    if sa or (_AYUDA_ESTADO_RE.search(texto) and (nif or numero)):
+        intent = "BUSCAR_AYUDAS_ESTADO"
+    elif _CONCESION_RE.search(texto) and (nif or numero):
+        intent = "BUSCAR_CONCESIONES"
+    else:
+        return None
+    params = {}
+    if nif:
+        params["nifCif"] = normalizar_nif(nif.group(0))
+    if numero:
+        params["numeroConvocatoria"] = numero.group(1)
+    if sa:
+        params["ayudaEstado"] = sa.group(1)
+    if _ANNO_RE.search(texto) or _FECHA_RE.search(texto):
+        return RouteDecision(intent, 0.95, {}, "regla")
+    return RouteDecision(intent, 0.95, {"api_call_params": params}, "regla")
+
+
+class NaiveBayesIntentClassifier:
+    """Clasificador Naive Bayes multinomial sobre stems de la consulta."""
+
+    def __init__(self, priors: dict = None, counts: dict = None, vocab_size: int = 0):
+        self.priors = priors or {}
+        self.counts = counts or {}
+        self.totals = {intent: sum(c.values()) for intent, c in self.counts.items()}
+        self.vocab_size = vocab_size
+
+    @classmethod
+    def train(cls, ejemplos: List[tuple]) -> "NaiveBayesIntentClassifier":
+        """Entrena el clasificador con pares (consulta, intención)."""
+        docs = Counter()
+        counts = defaultdict(Counter)
+        vocab = set()
+        for query, intent in ejemplos:
+            if intent not in VALID_INTENTS:
+                continue
+            tokens = analizar(query)
+            docs[intent] += 1
+            counts[intent].update(tokens)
+            vocab.update(tokens)
+        total = sum(docs.values())
+        priors = {intent: n / total for intent, n in docs.items()} if total else {}
+        return cls(priors, {i: dict(c) for i, c in counts.items()}, len(vocab))
+
+    def predict(self, query: str) -> Optional[tuple]:
+        """Devuelve (intención, probabilidad a posteriori) o None."""
+        tokens = analizar(query)
+        if not self.priors or not tokens:
+            return None
+        log_probs = {}
+        for intent, prior in self.priors.items():
+            conteos = self.counts.get(intent, {})
+            denominador = self.totals.get(intent, 0) + self.vocab_size + 1
+            log_probs[intent] = math.log(prior) + sum(
+                math.log((conteos.get(t, 0) + 1) / denominador) for t in tokens
+            )
+        maximo = max(log_probs.values())
+        norma = sum(math.exp(lp - maximo) for lp in log_probs.values())
+        intent = max(log_probs, key=log_probs.get)
+        return intent, 1.0 / norma
+
+    def to_dict(self) -> dict:
+        """Serializa el modelo para guardarlo en JSON."""
+        return {"priors": self.priors, "counts": self.counts,
+                "vocab_size": self.vocab_size}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "NaiveBayesIntentClassifier":
+        """Reconstruye el modelo a partir de su versión serializada."""
+        return cls(data["priors"], data["counts"], data["vocab_size"])
+
+
+class IntentRouter:
+    """
+    Enrutador local: reglas primero y, después, el clasificador opcional.
+    Registra las decisiones del LLM para reentrenar el clasificador.
+    """
+
+    def __init__(self, model_path: str = None, log_path: str = None,
+                 min_confidence: float = None):
+        """
+        Args:
+            model_path: JSON con el clasificador entrenado (None = sólo reglas).
+            log_path: JSONL donde se registran las consultas clasificadas por el LLM.
+            min_confidence: Confianza mínima para no consultar al LLM.
+        """
+        env = os.environ.get
+        self.enabled = env('INTENT_ROUTER_ENABLED', '1') != '0'
+        self.model_path = model_path or env('INTENT_ROUTER_MODEL')
+        self.log_path = log_path or env('INTENT_ROUTER_LOG')
+        self.min_confidence = min_confidence if min_confidence is not None else float(
+            env('INTENT_ROUTER_MIN_CONFIDENCE', '0.9'))
+        self._lock = threading.Lock()
+        self._stats = Counter()
+        self.classifier = self._load_classifier()
+
+    def _load_classifier(self) -> Optional[NaiveBayesIntentClassifier]:
+        if not self.model_path or not os.path.exists(self.model_path):
+            return None
+        try:
+            with open(self.model_path, encoding="utf-8") as f:
+                return NaiveBayesIntentClassifier.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("No se pudo cargar el clasificador de intenciones: %s", e)
+            return None
+
+    def route(self, query: str) -> Optional[RouteDecision]:
+        """
+        Intenta decidir la intención sin LLM.
+
+        Returns:
+            La decisión si su confianza alcanza el umbral, o None.
+        """
+        if not self.enabled:
+            return None
+        decision = route_by_rules(query)
+        if decision is None and self.classifier is not None:
+            prediccion = self.classifier.predict(query)
+            if prediccion is not None:
+                decision = RouteDecision(prediccion[0], prediccion[1], {}, "clasificador")
+        if decision is None or decision.confidence < self.min_confidence:
+            with self._lock:
+                self._stats["llm"] += 1
+            return None
+        with self._lock:
+            self._stats[decision.origen] += 1
+        return decision
+
+    def record(self, query: str, intent: str):
+        """Registra una consulta clasificada por el LLM como ejemplo de entrenamiento."""
+        if not self.log_path or intent not in VALID_INTENTS:
+            return
+        linea = json.dumps({"query": query, "intent": intent}, ensure_ascii=False)
+        try:
+            with self._lock, open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(linea + "\n")
+        except OSError as e:
+            logger.warning("No se pudo registrar la consulta para el enrutador: %s", e)
+
+    def stats(self) -> dict:
+        """Devuelve cuántas consultas resolvió cada etapa."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["clasificador_cargado"] = self.classifier is not None
+        return stats
+
+
+def train_from_log(log_path: str, model_path: str) -> int:
+    """
+    Entrena el clasificador con el registro de consultas y lo guarda.
+
+    Returns:
+        Número de ejemplos usados.
+    """
+    ejemplos = []
+    with open(log_path, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                registro = json.loads(linea)
+                ejemplos.append((registro["query"], registro["intent"]))
+            except (ValueError, KeyError):
+                continue
+    modelo = NaiveBayesIntentClassifier.train(ejemplos)
+    with open(model_path, "w", encoding="utf-8") as f:
+        json.dump(modelo.to_dict(), f, ensure_ascii=False)
+    return len(ejemplos)
+
+
+intent_router = IntentRouter()
+
+
+def main():
+    """Punto de entrada de la línea de comandos del enrutador."""
+    parser = argparse.ArgumentParser(description="Enrutador local de intenciones")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("train", help="Entrena el clasificador con INTENT_ROUTER_LOG")
+    args = parser.parse_args()
+
+    if args.comando == "train":
+        if not intent_router.log_path or not intent_router.model_path:
+            parser.error("Define INTENT_ROUTER_LOG e INTENT_ROUTER_MODEL.")
+        total = train_from_log(intent_router.log_path, intent_router.model_path)
+        logger.info("Clasificador entrenado con %d consultas.", total)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -4,22 +4,31 @@ Este módulo define el LangGraphService, que orquesta la lógica del chatbot.
 Inicializa los agentes, construye el grafo de LangGraph y procesa las
 consultas del usuario, gestionando el estado y el flujo de ejecución.
 """
+import asyncio
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple, Optional, Any
-from langgraph.checkpoint.memory import MemorySaver
 from agents.extractor_agent import ExtractorAgent
 from agents.api_caller_agent import ApiCallerAgent
 from agents.generator_agent import GeneratorAgent
 from agents.error_handler_agent import ErrorHandlerAgent
 from agents.beneficiaries_agent import BeneficiariesAgent
 from agents.political_parties_agent import PoliticalPartiesAgent
+from agents.concessions_agent import ConcessionsAgent
+from agents.speculative_agent import SpeculativeIntentAgent
+from agents.structured_answer_agent import StructuredAnswerAgent
 from graph.graph import build_agent_graph
 from .graph_state import GraphState
 from .infosubvenciones_service import info_subvenciones_service
+from .session_store import PruningMemorySaver
+from .history_compactor import HistoryCompactor
+from .digest_store import DigestBuilder, DigestWorker, digest_store
 from .gemini_helpers import (get_gemini_model,
                            generate_content_non_stream,
-                           generate_content_stream)
+                           generate_content_stream,
+                           agenerate_content_stream)
 import opik
 
 logger = logging.getLogger(__name__)
@@ -27,6 +36,15 @@ opik.configure(use_local=False)
 opik_client = opik.Opik()
 os.environ["OPIK_PROJECT_NAME"] = "orellana"
 
+# Resultados de búsqueda que se adelantan al cliente en los eventos de progreso.
+RESULTS_PREVIEW = int(os.environ.get('CHAT_EVENTS_RESULTS_PREVIEW', '10'))
+# Grafos ejecutándose a la vez en el servidor ASGI. Los nodos son síncronos:
+# cada conversación ocupa un hilo mientras recorre el grafo (extracción y
+# llamadas a la API) y lo libera al retransmitir la respuesta del LLM. Por
+# encima de este número, las conversaciones esperan en la cola del executor.
+CHAT_GRAPH_WORKERS = int(os.environ.get('CHAT_GRAPH_WORKERS', '16'))
+_FIN_GRAFO = object()
+
 
 # pylint: disable=too-few-public-methods
 class LangGraphService:
@@ -46,7 +64,9 @@ class LangGraphService:
                 "extractor": prompts["convocatoria_extractor"],
                 "search_params": prompts["extract_params"],
                 "extract_years": prompts["extract_years"],
-                "extract_party_params": prompts["extract_party_params"]
+                "extract_party_params": prompts["extract_party_params"],
+                "extract_concession_params": prompts["extract_concession_params"],
+                "intent_and_slots": prompts["extract_intent_and_slots"]
             }),
             "api_caller": ApiCallerAgent(info_subvenciones_service),
             "generator": GeneratorAgent(
@@ -56,20 +76,46 @@ class LangGraphService:
                     "search_summary": prompts["generate_search_summary"],
                     "general_response": prompts["generate_general_response"],
                     "beneficiaries_summary": prompts["generate_beneficiaries_summary"],
-                    "parties_summary": prompts["generate_parties_summary"]
+                    "parties_summary": prompts["generate_parties_summary"],
+                    "concessions_summary": prompts["generate_concessions_summary"]
                 },
                 llm_helper_non_stream=self._call_llm_for_generation_non_stream,
-                llm_helper_stream=self._call_llm_for_generation_stream
+                llm_helper_stream=self._call_llm_for_generation_stream,
+                digest_store=digest_store
             ),
             "beneficiaries": BeneficiariesAgent(),
             "political_parties": PoliticalPartiesAgent(),
+            "concessions": ConcessionsAgent(),
             "error_handler": ErrorHandlerAgent()
         }
+        if os.environ.get('SPECULATIVE_EXECUTION', '0') == '1':
+            agents["speculative"] = SpeculativeIntentAgent(
+                agents["extractor"], agents["api_caller"]
+            )
+
+        if os.environ.get('STRUCTURED_ANSWERS', '1') == '1':
+            agents["structured"] = StructuredAnswerAgent({
+                "table_narrative": prompts["generate_table_narrative"]
+            })
+
+        self.speculative = agents.get("speculative")
+        self.compactor = HistoryCompactor(self._model, prompts["summarize_history"])
+        # Digests de convocatorias precalculados en segundo plano.
+        self.digest_worker = None
+        if digest_store is not None and not prompts["generate_digest"].startswith("ERROR"):
+            self.digest_worker = DigestWorker(digest_store, DigestBuilder(
+                self._model, prompts["generate_digest"], info_subvenciones_service))
+            self.digest_worker.start()
 
         graph = build_agent_graph(agents)
-        self.memory = MemorySaver()
+        # Checkpointer acotado: poda checkpoints antiguos e hilos inactivos.
+        self.memory = PruningMemorySaver()
         self.app = graph.compile(checkpointer=self.memory)
-        logger.info("LangGraphService initialized: compiled graph + MemorySaver.")
+        # Executor propio de las variantes asíncronas: el techo real de
+        # conversaciones ASGI recorriendo el grafo a la vez.
+        self._graph_executor = ThreadPoolExecutor(max_workers=CHAT_GRAPH_WORKERS,
+                                                  thread_name_prefix="grafo-chat")
+        logger.info("LangGraphService initialized: compiled graph + PruningMemorySaver.")
 
     def _load_prompts(self) -> dict:
         base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -85,27 +131,42 @@ class LangGraphService:
             "generate_beneficiaries_summary":
                 "generate_beneficiaries_summary_prompt",
             "extract_party_params": "extract_party_params_prompt",
-            "generate_parties_summary": "generate_parties_summary_prompt"
+            "generate_parties_summary": "generate_parties_summary_prompt",
+            "extract_concession_params": "extract_concession_params_prompt",
+            "generate_concessions_summary": "generate_concessions_summary_prompt",
+            "extract_intent_and_slots": "extract_intent_and_slots_prompt",
+            "generate_table_narrative": "generate_table_narrative_prompt",
+            "summarize_history": "summarize_history_prompt",
+            "generate_digest": "generate_digest_prompt"
         }
         loaded_prompts = {}
         for name, fname in prompt_files.items():
+            opik_prompt = opik_client.get_prompt(name=fname)
+            if opik_prompt is not None:
+                loaded_prompts[name] = opik_prompt.prompt
+                continue
+            # Si el prompt aún no está en Opik, se usa la copia local.
             try:
-                loaded_prompts[name] = opik_client.get_prompt(name=fname).prompt
+                with open(os.path.join(prompt_dir, f"{fname}.txt"), encoding="utf-8") as f:
+                    loaded_prompts[name] = f.read()
+                logger.info("Prompt '%s' cargado desde el fichero local.", fname)
             except FileNotFoundError:
                 error_msg = f"ERROR: Prompt '{name}' ({fname}) not found."
                 loaded_prompts[name] = error_msg
         return loaded_prompts
 
-    def _format_chat_history(self, chat_history: List[Tuple[str, str]]) -> str:
-        if not chat_history:
-            return "No previous chat history."
-        return "\n".join([f"User: {q}\nAssistant: {a}" for q, a in chat_history])
+    def _format_chat_history(self, chat_history: List[Tuple[str, str]],
+                             thread_id: str) -> str:
+        # Resumen de los turnos antiguos más los recientes, acortados.
+        return self.compactor.format_for_thread(chat_history, thread_id)
 
     def _call_llm_for_generation_non_stream(
         self, model, prompt: str, node_name: str
     ) -> Tuple[str, bool, Optional[str]]:
         """Genera una respuesta no-stream y maneja errores."""
-        full_response = generate_content_non_stream(model, prompt)
+        full_response = generate_content_non_stream(
+            model, prompt, cache_template=node_name.removesuffix('_node')
+        )
         if "ERROR_" in full_response or not full_response.strip():
             error_msg = (f"Invalid response from model (non-stream) for "
                          f"{node_name}: {full_response}")
@@ -114,21 +175,36 @@ class LangGraphService:
             return err_text, False, error_msg
         return full_response.strip(), True, None
 
-    def _call_llm_for_generation_stream(self, prompt: str, node_name: str):
-        """Genera una respuesta en modo stream."""
+    def _call_llm_for_generation_stream(self, prompt: str, node_name: str,
+                                        prefix: Optional[str] = None):
+        """Genera una respuesta en modo stream, precedida de `prefix` si se indica."""
         logger.info("Initiating LLM stream for node %s with prompt: %s...",
                      node_name, prompt[:100])
-        yield from generate_content_stream(self._model, prompt)
+        if prefix:
+            yield prefix
+        yield from generate_content_stream(
+            self._model, prompt, cache_template=node_name.removesuffix('_node')
+        )
 
-    def process_chat_query(self, query: str,
-                           chat_history: List[Tuple[str, str]],
-                           thread_id: str) -> Any:
-        """Procesa una consulta de chat, ejecuta el grafo y devuelve la respuesta."""
-        logger.info("Processing query: '%s', Thread ID: %s", query, thread_id)
+    async def _acall_llm_for_generation_stream(self, prompt: str, node_name: str,
+                                               prefix: Optional[str] = None):
+        """Variante asíncrona de `_call_llm_for_generation_stream`."""
+        logger.info("Initiating async LLM stream for node %s with prompt: %s...",
+                    node_name, prompt[:100])
+        if prefix:
+            yield prefix
+        async for chunk in agenerate_content_stream(
+            self._model, prompt, cache_template=node_name.removesuffix('_node')
+        ):
+            yield chunk
+
+    def _initial_state(self, query: str, chat_history: List[Tuple[str, str]],
+                       thread_id: str) -> dict:
+        """Construye el estado inicial del grafo para una consulta."""
         initial_state_dict = {
             "original_query": query,
             "chat_history": chat_history,
-            "formatted_chat_history": self._format_chat_history(chat_history),
+            "formatted_chat_history": self._format_chat_history(chat_history, thread_id),
             "intent": None,
             "extracted_convocatoria_id": None,
             "extracted_years": None,
@@ -139,7 +215,8 @@ class LangGraphService:
             "stream_completed_successfully": None,
             "agent_response_text": None,
             "stream_generation_prompt": None,
-            "stream_generation_node_name": None
+            "stream_generation_node_name": None,
+            "stream_prefix_text": None
         }
         for key in GraphState.__annotations__.keys():
             if key not in initial_state_dict:
@@ -148,17 +225,19 @@ class LangGraphService:
                     "Setting to None.", key
                 )
                 initial_state_dict[key] = None
+        return initial_state_dict
 
-        config = {"configurable": {"thread_id": thread_id}}
-
-        final_state = self.app.invoke(initial_state_dict, config=config)
-        logger.debug("Final state from graph invoke for thread '%s': %s",
-                     thread_id, final_state)
-
+    def _response_from_state(self, final_state: dict, stream_fn) -> Any:
+        """
+        Convierte el estado final en la respuesta: el stream que devuelve
+        `stream_fn` si hay un prompt pendiente, o el texto directo.
+        """
         if final_state.get("stream_generation_prompt"):
             prompt_stream = final_state["stream_generation_prompt"]
             node_name = final_state.get("stream_generation_node_name", "unknown")
-            return self._call_llm_for_generation_stream(prompt_stream, node_name)
+            return stream_fn(
+                prompt_stream, node_name, final_state.get("stream_prefix_text")
+            )
 
         if final_state.get("agent_response_text"):
             logger.info("Returning non-stream text response from final_state.")
@@ -169,3 +248,134 @@ class LangGraphService:
 
         logger.error("Graph finished but no response text or error message found.")
         return "I'm sorry, I couldn't process your request adequately."
+
+    def _progress_events(self, mode: str, chunk: Any) -> List[dict]:
+        """
+        Traduce un fragmento de `stream(stream_mode=["custom", "updates"])`
+        a eventos de progreso para el cliente.
+        """
+        if mode == "custom":
+            return [chunk]
+        events = []
+        for node_name, update in chunk.items():
+            update = update or {}
+            events.append({"tipo": "nodo", "estado": "fin",
+                           "nodo": update.get("last_stream_event_node") or node_name})
+            if update.get("intent"):
+                events.append({"tipo": "intencion", "intent": update["intent"]})
+            datos = update.get("api_response_data")
+            # Con especulación, la búsqueda llega ya en el nodo de intención.
+            if (node_name in ("call_infosubvenciones_search_node", "determine_intent_node")
+                    and isinstance(datos, dict) and isinstance(datos.get("content"), list)):
+                campos = ("id", "numeroConvocatoria", "descripcion", "fechaRecepcion", "nivel2")
+                events.append({
+                    "tipo": "resultados",
+                    "totalElements": datos.get("totalElements", len(datos["content"])),
+                    "content": [{k: item.get(k) for k in campos}
+                                for item in datos["content"][:RESULTS_PREVIEW]]
+                })
+        return events
+
+    def _token_events(self, response: Any):
+        if isinstance(response, str):
+            yield {"tipo": "token", "texto": response}
+            return
+        for chunk in response:
+            yield {"tipo": "token", "texto": chunk}
+
+    def stream_chat_events(self, query: str, chat_history: List[Tuple[str, str]],
+                           thread_id: str):
+        """
+        Procesa una consulta emitiendo eventos a medida que avanza el grafo:
+        inicio y fin de cada nodo, intención, resultados de búsqueda y, por
+        último, los fragmentos de texto de la respuesta.
+        """
+        logger.info("Processing query (events): '%s', Thread ID: %s", query, thread_id)
+        initial_state_dict = self._initial_state(query, chat_history, thread_id)
+        config = {"configurable": {"thread_id": thread_id}}
+        for mode, chunk in self.app.stream(initial_state_dict, config=config,
+                                           stream_mode=["custom", "updates"]):
+            yield from self._progress_events(mode, chunk)
+        final_state = self.app.get_state(config).values
+        yield from self._token_events(
+            self._response_from_state(final_state, self._call_llm_for_generation_stream)
+        )
+
+    async def astream_chat_events(self, query: str, chat_history: List[Tuple[str, str]],
+                                  thread_id: str):
+        """
+        Variante asíncrona de `stream_chat_events` para el servidor ASGI. El
+        grafo se recorre en el executor propio (CHAT_GRAPH_WORKERS hilos) y
+        sus eventos se pasan al bucle por una cola.
+        """
+        logger.info("Processing query (async events): '%s', Thread ID: %s", query, thread_id)
+        loop = asyncio.get_running_loop()
+        cola = asyncio.Queue()
+        detenido = threading.Event()
+        config = {"configurable": {"thread_id": thread_id}}
+
+        def recorrer():
+            try:
+                initial_state_dict = self._initial_state(query, chat_history, thread_id)
+                for mode, chunk in self.app.stream(initial_state_dict, config=config,
+                                                   stream_mode=["custom", "updates"]):
+                    if detenido.is_set():
+                        return None
+                    for event in self._progress_events(mode, chunk):
+                        loop.call_soon_threadsafe(cola.put_nowait, event)
+                return self.app.get_state(config).values
+            finally:
+                loop.call_soon_threadsafe(cola.put_nowait, _FIN_GRAFO)
+
+        recorrido = loop.run_in_executor(self._graph_executor, recorrer)
+        try:
+            while (event := await cola.get()) is not _FIN_GRAFO:
+                yield event
+        finally:
+            # Si el cliente se va, el grafo se detiene en el siguiente paso.
+            detenido.set()
+        final_state = await recorrido
+        response = self._response_from_state(final_state,
+                                             self._acall_llm_for_generation_stream)
+        if isinstance(response, str):
+            yield {"tipo": "token", "texto": response}
+            return
+        async for chunk in response:
+            yield {"tipo": "token", "texto": chunk}
+
+    def process_chat_query(self, query: str,
+                           chat_history: List[Tuple[str, str]],
+                           thread_id: str) -> Any:
+        """Procesa una consulta de chat, ejecuta el grafo y devuelve la respuesta."""
+        logger.info("Processing query: '%s', Thread ID: %s", query, thread_id)
+        initial_state_dict = self._initial_state(query, chat_history, thread_id)
+        config = {"configurable": {"thread_id": thread_id}}
+
+        final_state = self.app.invoke(initial_state_dict, config=config)
+        logger.debug("Final state from graph invoke for thread '%s': %s",
+                     thread_id, final_state)
+        return self._response_from_state(final_state, self._call_llm_for_generation_stream)
+
+    async def aprocess_chat_query(self, query: str,
+                                  chat_history: List[Tuple[str, str]],
+                                  thread_id: str) -> Any:
+        """
+        Variante asíncrona de `process_chat_query` para el servidor ASGI. El
+        grafo se recorre en el executor propio (CHAT_GRAPH_WORKERS hilos); la
+        respuesta del LLM se retransmite después sin ocupar ningún hilo.
+
+        Returns:
+            El texto de la respuesta o un generador asíncrono de fragmentos.
+        """
+        logger.info("Processing query (async): '%s', Thread ID: %s", query, thread_id)
+        config = {"configurable": {"thread_id": thread_id}}
+
+        def recorrer():
+            initial_state_dict = self._initial_state(query, chat_history, thread_id)
+            return self.app.invoke(initial_state_dict, config=config)
+
+        final_state = await asyncio.get_running_loop().run_in_executor(
+            self._graph_executor, recorrer)
+        logger.debug("Final state from graph invoke (async) for thread '%s': %s",
+                     thread_id, final_state)
+        return self._response_from_state(final_state, self._acall_llm_for_generation_stream)
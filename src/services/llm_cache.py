@@ -0,0 +1,207 @@
+"""
+Este módulo proporciona la caché de respuestas del LLM que usan los helpers
+de Gemini.
+
+Tiene dos niveles, ambos con TTL y tamaño acotado:
+
+- Exacto: clave hash del modelo y el prompt completo.
+- Por similitud (opcional): para las plantillas de extracción, reutiliza la
+  respuesta de una consulta casi idéntica ("ayudas para autónomos" / "ayuda
+  para los autónomos") siempre que el resto del prompt (plantilla e
+  historial) coincida. Las negaciones y preposiciones forman parte de la
+  clave, así que "ayudas con autónomos" y "ayudas sin autónomos" no se
+  confunden.
+
+Cada plantilla se activa explícitamente con LLM_CACHE_TEMPLATES y
+LLM_CACHE_SIMILAR_TEMPLATES.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Optional
+import numpy as np
+from cachetools import TTLCache
+from .convocatorias_mirror import normalizar_texto
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TEMPLATES = (
+    "orchestrator,convocatoria_extractor,extract_params,extract_years,"
+    "extract_party_params,extract_concession_params,extract_intent_and_slots"
+)
+# Palabras que el embedder descarta como vacías pero que cambian el sentido
+# de la consulta; se exigen idénticas en el nivel por similitud.
+MARCADORES = frozenset("""
+a al ante bajo con contra de del desde durante en entre excepto hacia hasta
+mediante menos ni no nunca para por salvo segun sin sobre tampoco tras
+""".split())
+_PALABRA_RE = re.compile(r"[a-z0-9]+")
+
+
+def _hash(*partes: str) -> str:
+    return hashlib.sha256("\x1f".join(partes).encode("utf-8")).hexdigest()
+
+
+def marcadores(query: str) -> str:
+    """Negaciones y preposiciones de la consulta, en orden."""
+    return " ".join(p for p in _PALABRA_RE.findall(normalizar_texto(query))
+                    if p in MARCADORES)
+
+
+def _env_set(nombre: str, defecto: str) -> frozenset:
+    valores = os.environ.get(nombre, defecto).split(",")
+    return frozenset(v.strip() for v in valores if v.strip())
+
+
+class _SimilarityBucket:
+    """Consultas cacheadas de una misma plantilla y contexto, con su vector."""
+
+    def __init__(self):
+        self.entradas: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def purgar(self, ttl: float) -> int:
+        """Elimina las entradas caducadas y devuelve cuántas había."""
+        ahora = time.time()
+        caducadas = [c for c, e in self.entradas.items() if ahora - e[2] >= ttl]
+        for clave in caducadas:
+            del self.entradas[clave]
+        return len(caducadas)
+
+    def buscar(self, vector: np.ndarray, umbral: float) -> Optional[str]:
+        """Devuelve la respuesta de la consulta más parecida por encima del umbral."""
+        if not self.entradas:
+            return None
+        claves = list(self.entradas)
+        matriz = np.stack([self.entradas[c][0] for c in claves])
+        scores = matriz @ vector
+        mejor = int(np.argmax(scores))
+        if scores[mejor] < umbral:
+            return None
+        self.entradas.move_to_end(claves[mejor])
+        return self.entradas[claves[mejor]][1]
+
+
+class LLMResponseCache:
+    """Caché de respuestas del LLM con nivel exacto y nivel por similitud."""
+
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, maxsize: int = None, ttl: float = None,
+                 similarity: float = None):
+        """
+        Args:
+            maxsize: Respuestas máximas guardadas en cada nivel.
+            ttl: Segundos durante los que una respuesta es reutilizable.
+            similarity: Similitud coseno mínima para el nivel por similitud.
+        """
+        env = os.environ.get
+        self.enabled = env('LLM_CACHE_ENABLED', '1') != '0'
+        self.maxsize = maxsize or int(env('LLM_CACHE_MAXSIZE', '1024'))
+        self.ttl = ttl if ttl is not None else float(env('LLM_CACHE_TTL', '3600'))
+        self.similarity = similarity if similarity is not None else float(
+            env('LLM_CACHE_SIMILARITY', '0.95'))
+        self.templates = _env_set('LLM_CACHE_TEMPLATES', DEFAULT_TEMPLATES)
+        self.similar_templates = _env_set('LLM_CACHE_SIMILAR_TEMPLATES', 'extract_params')
+        self._exact = TTLCache(maxsize=self.maxsize, ttl=self.ttl)
+        self._buckets: "OrderedDict[str, _SimilarityBucket]" = OrderedDict()
+        self._similar_size = 0
+        self._embedder = None
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def caches(self, template: Optional[str]) -> bool:
+        """Indica si las respuestas de esta plantilla se cachean."""
+        return self.enabled and template is not None and template in self.templates
+
+    def _vector(self, texto: str) -> np.ndarray:
+        if self._embedder is None:
+            # pylint: disable=import-outside-toplevel
+            from .busqueda_semantica import HashingEmbedder
+            self._embedder = HashingEmbedder()
+        return self._embedder.embed([texto])[0]
+
+    def _bucket_key(self, template: str, model_name: str, prompt: str, query: str) -> str:
+        # El contexto es el prompt sin la consulta (plantilla e historial)
+        # más los marcadores de la consulta.
+        return _hash(template, model_name, prompt.replace(query, "\x00"),
+                     marcadores(query))
+
+    def get(self, template: Optional[str], model_name: str, prompt: str,
+            query: str = None) -> Optional[str]:
+        """
+        Busca una respuesta cacheada.
+
+        Args:
+            template: Nombre de la plantilla del prompt.
+            model_name: Modelo que generaría la respuesta.
+            prompt: Prompt completo.
+            query: Consulta del usuario incluida en el prompt; necesaria
+                para el nivel por similitud.
+        """
+        if not self.caches(template):
+            return None
+        with self._lock:
+            respuesta = self._exact.get(_hash(template, model_name, prompt))
+        if respuesta is not None:
+            self._count("hits")
+            return respuesta
+        if query and query in prompt and template in self.similar_templates:
+            vector = self._vector(query)
+            with self._lock:
+                bucket = self._buckets.get(
+                    self._bucket_key(template, model_name, prompt, query))
+                if bucket is not None:
+                    self._similar_size -= bucket.purgar(self.ttl)
+                    respuesta = bucket.buscar(vector, self.similarity)
+            if respuesta is not None:
+                self._count("similar_hits")
+                return respuesta
+        self._count("misses")
+        return None
+
+    def put(self, template: Optional[str], model_name: str, prompt: str,
+            respuesta: str, query: str = None):
+        """Guarda una respuesta válida del LLM en los niveles que correspondan."""
+        if not self.caches(template) or not respuesta:
+            return
+        with self._lock:
+            self._exact[_hash(template, model_name, prompt)] = respuesta
+        if not (query and query in prompt and template in self.similar_templates):
+            return
+        vector = self._vector(query)
+        clave = self._bucket_key(template, model_name, prompt, query)
+        with self._lock:
+            bucket = self._buckets.setdefault(clave, _SimilarityBucket())
+            self._buckets.move_to_end(clave)
+            if query not in bucket.entradas:
+                self._similar_size += 1
+            bucket.entradas[query] = (vector, respuesta, time.time())
+            # Expulsa las consultas más antiguas de los contextos menos usados.
+            while self._similar_size > self.maxsize:
+                _, viejo = next(iter(self._buckets.items()))
+                if viejo.entradas:
+                    viejo.entradas.popitem(last=False)
+                    self._similar_size -= 1
+                if not viejo.entradas:
+                    self._buckets.popitem(last=False)
+
+    def _count(self, nombre: str):
+        with self._lock:
+            self._stats[nombre] += 1
+
+    def stats(self) -> dict:
+        """Devuelve aciertos, fallos y ocupación de la caché."""
+        with self._lock:
+            stats = {"hits": 0, "similar_hits": 0, "misses": 0, **self._stats}
+            stats["exact_size"] = len(self._exact)
+            stats["similar_size"] = self._similar_size
+        total = stats["hits"] + stats["similar_hits"] + stats["misses"]
+        stats["hit_ratio"] = round(
+            (stats["hits"] + stats["similar_hits"]) / total, 4) if total else 0.0
+        return stats
+
+
+llm_response_cache = LLMResponseCache()
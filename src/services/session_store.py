@@ -0,0 +1,376 @@
+"""
+Este módulo proporciona el almacén de sesiones de chat (historial por
+`thread_id`) y un checkpointer de LangGraph acotado.
+
+Backends del almacén (SESSION_STORE_URL):
+
+- Vacío: memoria del proceso, LRU con TTL.
+- `sqlite:///ruta.db`: base de datos SQLite compartida por los workers del nodo.
+- `redis://...`: Redis (requiere el paquete `redis`), compartido entre nodos.
+
+Los backends persistentes usan una interfaz clave-valor mínima compatible con
+Redis (`get`, `set(..., ex=ttl)`, `delete`), de modo que `SQLiteKV` sirve de
+sustituto local de Redis y viceversa.
+
+`PruningMemorySaver` poda el estado interno de `MemorySaver` (`storage`,
+`writes`, `blobs`), que no forma parte de su API pública: la versión de
+`langgraph-checkpoint` está acotada en requirements.txt y, si el formato no
+es el esperado, la poda por checkpoint se desactiva y sólo se olvidan hilos
+completos con `delete_thread`.
+"""
+import abc
+import contextlib
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+from typing import Any, List, Optional, Tuple
+from cachetools import TTLCache
+from langgraph.checkpoint.memory import MemorySaver
+
+logger = logging.getLogger(__name__)
+
+History = List[Tuple[str, str]]
+SUMMARY_PREFIX = "resumen:"
+# Cerrojos por sesión: cada `thread_id` usa siempre uno de estos.
+SESSION_LOCK_STRIPES = 64
+
+
+class SQLiteKV:
+    """Almacén clave-valor en SQLite con caducidad, con la interfaz de Redis."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sesiones ("
+                "clave TEXT PRIMARY KEY, valor TEXT NOT NULL, expira REAL)"
+            )
+            self._conn.commit()
+        self._writes = 0
+        self.purge()
+
+    def get(self, key: str) -> Optional[str]:
+        """Devuelve el valor o None si no existe o ha caducado."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT valor FROM sesiones WHERE clave = ? "
+                "AND (expira IS NULL OR expira > ?)", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ex: Optional[float] = None):
+        """Guarda un valor que caduca a los `ex` segundos (None = nunca)."""
+        expira = time.time() + ex if ex else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sesiones (clave, valor, expira) VALUES (?, ?, ?)",
+                (key, value, expira)
+            )
+            self._conn.commit()
+            self._writes += 1
+            purgar = self._writes % 1000 == 0
+        if purgar:
+            self.purge()
+
+    def delete(self, key: str):
+        """Elimina una clave."""
+        with self._lock:
+            self._conn.execute("DELETE FROM sesiones WHERE clave = ?", (key,))
+            self._conn.commit()
+
+    def purge(self) -> int:
+        """Elimina las claves caducadas y devuelve cuántas había."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM sesiones WHERE expira IS NOT NULL AND expira <= ?",
+                (time.time(),)
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+
+class SessionStore(abc.ABC):
+    """
+    Historial de chat por `thread_id`, acotado en turnos y con TTL.
+
+    Las modificaciones del historial (leer, cambiar y guardar) se hacen bajo
+    un cerrojo de la sesión, de modo que dentro de un proceso no se pierden
+    turnos aunque se añadan mientras se compacta.
+    """
+
+    def __init__(self, max_turns: int = None, ttl: float = None):
+        """
+        Args:
+            max_turns: Pares (consulta, respuesta) que se conservan por sesión.
+            ttl: Segundos de inactividad tras los que se olvida una sesión.
+        """
+        env = os.environ.get
+        self.max_turns = max_turns or int(env('SESSION_MAX_TURNS', '10'))
+        self.ttl = ttl if ttl is not None else float(env('SESSION_TTL', '86400'))
+        self._lock = threading.Lock()
+        self._session_locks = [threading.RLock() for _ in range(SESSION_LOCK_STRIPES)]
+        self._stats = Counter()
+
+    @abc.abstractmethod
+    def _load(self, key: str) -> Any:
+        """Lee un valor del backend (None si no existe)."""
+
+    @abc.abstractmethod
+    def _save(self, key: str, value: Any):
+        """Guarda un valor en el backend renovando su TTL."""
+
+    @abc.abstractmethod
+    def _remove(self, key: str):
+        """Elimina un valor del backend."""
+
+    def get(self, thread_id: str) -> History:
+        """Devuelve el historial de la sesión (vacío si no existe o caducó)."""
+        history = self._load(thread_id)
+        with self._lock:
+            self._stats["hits" if history else "misses"] += 1
+        return [tuple(turno) for turno in history or []]
+
+    def locked(self, thread_id: str) -> contextlib.AbstractContextManager:
+        """
+        Cerrojo (reentrante) de la sesión, para leer y reescribir su historial
+        de forma atómica.
+        """
+        return self._session_locks[zlib.crc32(thread_id.encode("utf-8"))
+                                   % SESSION_LOCK_STRIPES]
+
+    def append(self, thread_id: str, query: str, response: str):
+        """Añade un turno al historial, conservando los `max_turns` últimos."""
+        with self.locked(thread_id):
+            history = self._load(thread_id) or []
+            history.append((query, response))
+            self._save(thread_id, history[-self.max_turns:])
+
+    def replace(self, thread_id: str, history: History):
+        """Sustituye el historial de la sesión (p. ej. tras compactarlo)."""
+        with self.locked(thread_id):
+            self._save(thread_id, list(history)[-self.max_turns:])
+
+    def get_summary(self, thread_id: str) -> Optional[dict]:
+        """Devuelve el resumen acumulado de los turnos antiguos, si lo hay."""
+        return self._load(SUMMARY_PREFIX + thread_id)
+
+    def set_summary(self, thread_id: str, summary: dict):
+        """Guarda el resumen acumulado de la sesión."""
+        self._save(SUMMARY_PREFIX + thread_id, summary)
+
+    def delete(self, thread_id: str):
+        """Olvida una sesión y su resumen."""
+        self._remove(thread_id)
+        self._remove(SUMMARY_PREFIX + thread_id)
+
+    def stats(self) -> dict:
+        """Devuelve el backend y los aciertos y fallos de lectura."""
+        with self._lock:
+            stats = {"hits": 0, "misses": 0, **self._stats}
+        stats.update(backend=type(self).__name__, max_turns=self.max_turns, ttl=self.ttl)
+        return stats
+
+
+class InMemorySessionStore(SessionStore):
+    """Sesiones en la memoria del proceso: LRU acotada con TTL."""
+
+    def __init__(self, maxsize: int = None, **kwargs):
+        """
+        Args:
+            maxsize: Sesiones máximas en memoria; se expulsan las menos usadas.
+        """
+        super().__init__(**kwargs)
+        maxsize = maxsize or int(os.environ.get('SESSION_MAXSIZE', '10000'))
+        self._sessions = TTLCache(maxsize=maxsize, ttl=self.ttl)
+
+    def _load(self, key: str) -> Any:
+        with self._lock:
+            value = self._sessions.get(key)
+        return copy.deepcopy(value)
+
+    def _save(self, key: str, value: Any):
+        with self._lock:
+            self._sessions[key] = value
+
+    def _remove(self, key: str):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        with self._lock:
+            stats["sessions"] = len(self._sessions)
+        return stats
+
+
+class KeyValueSessionStore(SessionStore):
+    """
+    Sesiones en un almacén clave-valor compartido (Redis o SQLiteKV). El TTL
+    se renueva con cada turno.
+    """
+
+    def __init__(self, client: Any, prefix: str = "chat:", **kwargs):
+        """
+        Args:
+            client: Objeto con `get`, `set(key, value, ex=)` y `delete`.
+            prefix: Prefijo de las claves.
+        """
+        super().__init__(**kwargs)
+        self.client = client
+        self.prefix = prefix
+
+    def _load(self, key: str) -> Any:
+        try:
+            valor = self.client.get(self.prefix + key)
+        # pylint: disable=broad-exception-caught
+        except Exception as e:
+            logger.warning("No se pudo leer la sesión %s: %s", key, e)
+            return None
+        return json.loads(valor) if valor else None
+
+    def _save(self, key: str, value: Any):
+        try:
+            self.client.set(self.prefix + key, json.dumps(value, ensure_ascii=False),
+                            ex=int(self.ttl) or None)
+        # pylint: disable=broad-exception-caught
+        except Exception as e:
+            logger.warning("No se pudo guardar la sesión %s: %s", key, e)
+
+    def _remove(self, key: str):
+        try:
+            self.client.delete(self.prefix + key)
+        # pylint: disable=broad-exception-caught
+        except Exception as e:
+            logger.warning("No se pudo borrar la sesión %s: %s", key, e)
+
+
+def build_session_store(url: str = None) -> SessionStore:
+    """Crea el almacén de sesiones indicado por SESSION_STORE_URL."""
+    url = url if url is not None else os.environ.get('SESSION_STORE_URL', '')
+    if url.startswith("sqlite:///"):
+        return KeyValueSessionStore(SQLiteKV(url[len("sqlite:///"):]))
+    if url.startswith(("redis://", "rediss://")):
+        try:
+            # pylint: disable=import-outside-toplevel
+            import redis
+        except ImportError as e:
+            logger.error("SESSION_STORE_URL es Redis pero falta el paquete 'redis': %s", e)
+        else:
+            return KeyValueSessionStore(redis.Redis.from_url(url, decode_responses=True))
+    elif url:
+        logger.warning("SESSION_STORE_URL no reconocida (%s); se usa memoria.", url)
+    return InMemorySessionStore()
+
+
+class PruningMemorySaver(MemorySaver):
+    """
+    MemorySaver acotado: conserva sólo los últimos checkpoints de cada hilo
+    y olvida los hilos inactivos (TTL) o menos usados (LRU).
+    """
+
+    def __init__(self, keep_last: int = None, max_threads: int = None,
+                 ttl: float = None, **kwargs):
+        """
+        Args:
+            keep_last: Checkpoints que se conservan por hilo y espacio de nombres.
+            max_threads: Hilos máximos en memoria.
+            ttl: Segundos de inactividad tras los que se borra un hilo.
+        """
+        super().__init__(**kwargs)
+        env = os.environ.get
+        self.keep_last = max(1, keep_last or int(env('CHECKPOINT_KEEP_LAST', '2')))
+        self.max_threads = max_threads or int(env('CHECKPOINT_MAX_THREADS', '1000'))
+        self.ttl = ttl if ttl is not None else float(
+            env('SESSION_TTL', '86400'))
+        self._threads: "OrderedDict[str, float]" = OrderedDict()
+        self._prune_lock = threading.Lock()
+        self._pruned = Counter()
+        self._poda_checkpoints = all(
+            isinstance(getattr(self, attr, None), dict)
+            for attr in ("storage", "writes", "blobs"))
+        if not self._poda_checkpoints:
+            logger.warning("MemorySaver sin el formato esperado; sólo se olvidan "
+                           "hilos completos.")
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        """Guarda el checkpoint y poda los antiguos del hilo."""
+        result = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._prune_lock:
+            if self._poda_checkpoints:
+                try:
+                    self._prune_checkpoints(thread_id, checkpoint_ns)
+                except (KeyError, IndexError, TypeError, ValueError) as e:
+                    logger.warning("Formato de checkpoints inesperado; se desactiva "
+                                   "la poda por checkpoint: %s", e)
+                    self._poda_checkpoints = False
+            self._touch(thread_id)
+        return result
+
+    def _prune_checkpoints(self, thread_id: str, checkpoint_ns: str):
+        """Elimina los checkpoints, escrituras y blobs que ya no se usan."""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.keep_last:
+            return
+        # Los ids de checkpoint son ordenables en el tiempo.
+        ids = sorted(checkpoints)
+        podadas = set()
+        for checkpoint_id in ids[:-self.keep_last]:
+            saved = checkpoints.pop(checkpoint_id)
+            podadas.update(self._channel_versions(saved))
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            self._pruned["checkpoints"] += 1
+        vigentes = set()
+        for saved in checkpoints.values():
+            vigentes.update(self._channel_versions(saved))
+        for channel, version in podadas - vigentes:
+            if self.blobs.pop((thread_id, checkpoint_ns, channel, version), None) is not None:
+                self._pruned["blobs"] += 1
+
+    def _channel_versions(self, saved: tuple) -> set:
+        """Pares (canal, versión) a los que apunta un checkpoint guardado."""
+        return set(self.serde.loads_typed(saved[0])["channel_versions"].items())
+
+    def _touch(self, thread_id: str):
+        """Marca el hilo como usado y expulsa los caducados o sobrantes."""
+        ahora = time.time()
+        self._threads[thread_id] = ahora
+        self._threads.move_to_end(thread_id)
+        while self._threads:
+            viejo, visto = next(iter(self._threads.items()))
+            if len(self._threads) <= self.max_threads and ahora - visto < self.ttl:
+                break
+            del self._threads[viejo]
+            super().delete_thread(viejo)
+            self._pruned["threads"] += 1
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._prune_lock:
+            self._threads.pop(thread_id, None)
+            super().delete_thread(thread_id)
+
+    def stats(self) -> dict:
+        """Devuelve los hilos, checkpoints y blobs en memoria y los podados."""
+        with self._prune_lock:
+            return {
+                "threads": len(self._threads),
+                "checkpoints": sum(len(ns) for hilo in self.storage.values()
+                                   for ns in hilo.values())
+                if self._poda_checkpoints else None,
+                "blobs": len(self.blobs) if self._poda_checkpoints else None,
+                "pruned": {"threads": 0, "checkpoints": 0, "blobs": 0, **self._pruned},
+                "keep_last": self.keep_last,
+            }
+
+
+session_store = build_session_store()
@@ -0,0 +1,276 @@
+"""
+Este módulo proporciona el pool de hilos compartido por todo el proceso y
+los limitadores de tasa (token bucket) por familia de endpoints de la API
+de InfoSubvenciones.
+
+El pool reparte los hilos de forma equitativa entre grupos de tareas (por
+defecto, un grupo por hilo llamador), de modo que una búsqueda con cientos
+de detalles no bloquea a las peticiones que llegan después. Cuando la cola
+o la espera estimada superan su límite, se rechaza la tarea inmediatamente.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+# Familia de límite de tasa a la que pertenece cada endpoint.
+ENDPOINT_FAMILIES = {
+    "convocatorias/busqueda": "convocatorias",
+    "convocatorias/exportar": "convocatorias",
+    "convocatorias": "convocatorias",
+    "grandesbeneficiarios/busqueda": "grandesbeneficiarios",
+    "partidospoliticos/busqueda": "partidospoliticos",
+    "concesiones/busqueda": "concesiones",
+    "ayudasestado/busqueda": "ayudasestado",
+}
+# Peticiones por segundo y ráfaga máxima por familia.
+DEFAULT_RATES = {
+    "convocatorias": (10.0, 10),
+    "grandesbeneficiarios": (2.0, 2),
+    "partidospoliticos": (2.0, 2),
+    "concesiones": (5.0, 5),
+    "ayudasestado": (5.0, 5),
+}
+
+
+class ServicioSaturadoError(Exception):
+    """La cola de trabajo o la espera del limitador superan el máximo permitido."""
+
+
+class _WaitStats:
+    """Acumula estadísticas de tiempos de espera."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        """Registra una espera."""
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> dict:
+        """Devuelve la media y el máximo en milisegundos."""
+        avg = self.total / self.count if self.count else 0.0
+        return {"avg_wait_ms": round(avg * 1000, 2),
+                "max_wait_ms": round(self.max * 1000, 2)}
+
+
+class TokenBucket:
+    """
+    Limitador de tasa tipo token bucket implementado como GCRA: cada llamada
+    reserva el siguiente hueco libre, por lo que las esperas se atienden en
+    orden de llegada (FIFO).
+    """
+
+    def __init__(self, rate: float, burst: int, max_wait: float):
+        """
+        Args:
+            rate: Peticiones por segundo sostenidas.
+            burst: Peticiones que pueden salir de golpe sin esperar.
+            max_wait: Espera máxima admitida antes de rechazar la petición.
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_wait = max_wait
+        self._interval = 1.0 / rate
+        self._tat = 0.0  # Instante teórico de llegada de la próxima petición.
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._rejected = 0
+        self._waits = _WaitStats()
+
+    def reserve(self) -> float:
+        """
+        Reserva un hueco y devuelve los segundos que hay que esperar hasta él.
+
+        Raises:
+            ServicioSaturadoError: Si la espera superaría `max_wait`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            tat = max(self._tat, now)
+            delay = max(0.0, tat - (self.burst - 1) * self._interval - now)
+            if delay > self.max_wait:
+                self._rejected += 1
+                raise ServicioSaturadoError(
+                    f"Límite de tasa saturado: espera estimada {delay:.1f}s"
+                )
+            self._tat = tat + self._interval
+            self._waits.add(delay)
+            return delay
+
+    def acquire(self) -> float:
+        """Reserva un hueco y duerme hasta él. Devuelve los segundos esperados."""
+        delay = self.reserve()
+        if delay > 0:
+            with self._lock:
+                self._waiting += 1
+            try:
+                time.sleep(delay)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+        return delay
+
+    def stats(self) -> dict:
+        """Devuelve las métricas del limitador."""
+        with self._lock:
+            return {
+                "rate_per_s": self.rate, "burst": self.burst,
+                "waiting": self._waiting, "rejected": self._rejected,
+                **self._waits.as_dict()
+            }
+
+
+def _build_rate_limiters() -> Dict[str, TokenBucket]:
+    """Crea un limitador por familia, configurable con variables de entorno."""
+    max_wait = float(os.environ.get('RATE_LIMIT_MAX_WAIT', '10'))
+    limiters = {}
+    for family, (rate, burst) in DEFAULT_RATES.items():
+        prefix = f"RATE_LIMIT_{family.upper()}"
+        limiters[family] = TokenBucket(
+            rate=float(os.environ.get(prefix, rate)),
+            burst=int(os.environ.get(f"{prefix}_BURST", burst)),
+            max_wait=max_wait
+        )
+    return limiters
+
+
+rate_limiters = _build_rate_limiters()
+
+
+def get_rate_limiter(endpoint: str) -> TokenBucket:
+    """Devuelve el limitador de la familia a la que pertenece un endpoint."""
+    family = ENDPOINT_FAMILIES.get(endpoint, endpoint.split("/", 1)[0])
+    if family not in rate_limiters:
+        logger.warning("Endpoint sin familia de límite de tasa: %s", endpoint)
+        family = "convocatorias"
+    return rate_limiters[family]
+
+
+class SharedExecutor:
+    """
+    Pool de hilos único para todo el proceso con cola equitativa por grupos.
+
+    Las tareas de cada grupo se atienden en orden, y los grupos se turnan
+    (round-robin) al tomar hilos libres.
+    """
+
+    def __init__(self, max_workers: int = None, max_queue: int = None):
+        """
+        Args:
+            max_workers: Número de hilos del pool.
+            max_queue: Tareas pendientes máximas antes de rechazar nuevas.
+        """
+        self.max_workers = max_workers or int(
+            os.environ.get('WORKER_POOL_MAX_WORKERS', '16'))
+        self.max_queue = max_queue or int(
+            os.environ.get('WORKER_POOL_MAX_QUEUE', '2000'))
+        self._cond = threading.Condition()
+        self._queues: "OrderedDict[Hashable, deque]" = OrderedDict()
+        self._queued = 0
+        self._running = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._waits = _WaitStats()
+        self._threads = []
+
+    def _start_workers(self):
+        """Arranca los hilos la primera vez que se envía una tarea."""
+        for i in range(self.max_workers):
+            thread = threading.Thread(
+                target=self._worker, name=f"shared-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, fn: Callable, *args: Any, group: Hashable = None) -> Future:
+        """
+        Encola una tarea y devuelve su Future.
+
+        Args:
+            fn: Función a ejecutar.
+            *args: Argumentos posicionales de la función.
+            group: Grupo de equidad; por defecto el hilo que llama.
+        Raises:
+            ServicioSaturadoError: Si la cola está llena.
+        """
+        group = group if group is not None else threading.get_ident()
+        future = Future()
+        with self._cond:
+            if self._queued >= self.max_queue:
+                self._rejected += 1
+                raise ServicioSaturadoError(
+                    f"Cola de trabajo saturada ({self._queued} tareas pendientes)"
+                )
+            if not self._threads:
+                self._start_workers()
+            self._queues.setdefault(group, deque()).append(
+                (future, fn, args, time.monotonic())
+            )
+            self._queued += 1
+            self._submitted += 1
+            self._cond.notify()
+        return future
+
+    def _next_task(self):
+        """Extrae la siguiente tarea turnando entre grupos."""
+        with self._cond:
+            while not self._queues:
+                self._cond.wait()
+            group, tasks = next(iter(self._queues.items()))
+            task = tasks.popleft()
+            if tasks:
+                self._queues.move_to_end(group)
+            else:
+                del self._queues[group]
+            self._queued -= 1
+            self._running += 1
+            self._waits.add(time.monotonic() - task[3])
+            return task
+
+    def _worker(self):
+        while True:
+            future, fn, args, _ = self._next_task()
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args))
+                    # pylint: disable=broad-exception-caught
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running -= 1
+
+    def stats(self) -> dict:
+        """Devuelve profundidad de cola, hilos ocupados y tiempos de espera."""
+        with self._cond:
+            return {
+                "max_workers": self.max_workers, "max_queue": self.max_queue,
+                "queue_depth": self._queued, "running": self._running,
+                "groups_waiting": len(self._queues),
+                "submitted": self._submitted, "rejected": self._rejected,
+                **self._waits.as_dict()
+            }
+
+
+shared_executor = SharedExecutor()
+
+
+def pool_metrics() -> dict:
+    """Métricas del pool compartido y de todos los limitadores de tasa."""
+    return {
+        "executor": shared_executor.stats(),
+        "rate_limiters": {
+            family: limiter.stats() for family, limiter in rate_limiters.items()
+        }
+    }
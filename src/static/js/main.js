@@ -65,6 +65,99 @@ document.addEventListener('DOMContentLoaded', function () {
         return contentWrapperDiv; // Devolver el div de contenido para el streaming
     }
 
+    // --- Eventos de progreso del chat (Server-Sent Events) ---
+    const NODE_LABELS = {
+        determine_intent_node: 'Analizando tu consulta...',
+        extract_convocatoria_id_node: 'Identificando la convocatoria...',
+        extract_search_params_node: 'Preparando la búsqueda...',
+        extract_years_node: 'Identificando los años...',
+        extract_party_params_node: 'Identificando el partido...',
+        call_infosubvenciones_get_details_node: 'Consultando la convocatoria en la BDNS...',
+        call_infosubvenciones_search_node: 'Buscando convocatorias en la BDNS...',
+        get_beneficiaries_node: 'Consultando los beneficiarios...',
+        search_political_parties_node: 'Consultando las concesiones...',
+        extract_concession_params_node: 'Identificando el beneficiario...',
+        search_concessions_node: 'Descargando las concesiones...',
+    };
+    const DEFAULT_PROGRESS_LABEL = 'Redactando la respuesta...';
+
+    // Extrae los eventos completos del buffer y devuelve el resto sin procesar.
+    function parseSseBuffer(buffer, onEvent) {
+        const blocks = buffer.split('\n\n');
+        const rest = blocks.pop();
+        for (const block of blocks) {
+            const dataLines = block.split('\n')
+                .filter(line => line.startsWith('data:'))
+                .map(line => line.slice(5).trim());
+            if (!dataLines.length) continue;
+            try {
+                onEvent(JSON.parse(dataLines.join('\n')));
+            } catch (e) {
+                console.error('Evento SSE no válido:', block, e);
+            }
+        }
+        return rest;
+    }
+
+    function renderMarkdown(div, markdown) {
+        try {
+            div.innerHTML = marked.parse(markdown || "");
+        } catch (e) {
+            console.error("Error al parsear Markdown en stream:", e);
+            div.textContent = markdown || ""; // Fallback
+        }
+        chatMessagesContainer.scrollTop = chatMessagesContainer.scrollHeight;
+    }
+
+    function renderSearchPreview(div, evento) {
+        const items = (evento.content || []).map(item =>
+            `- **${item.numeroConvocatoria || item.id}** ${item.descripcion || ''}` +
+            (item.nivel2 ? ` _(${item.nivel2})_` : ''));
+        const total = evento.totalElements || items.length;
+        renderMarkdown(div, `**${total} convocatorias encontradas**\n\n${items.join('\n')}`);
+    }
+
+    async function readChatEvents(response, contentDiv) {
+        const progressDiv = document.createElement('div');
+        progressDiv.classList.add('chat-progress');
+        const previewDiv = document.createElement('div');
+        previewDiv.classList.add('chat-preview');
+        contentDiv.before(progressDiv, previewDiv);
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder("utf-8");
+        let buffer = "";
+        let accumulatedResponse = "";
+
+        const onEvent = (evento) => {
+            if (evento.tipo === 'nodo' && evento.estado === 'inicio') {
+                progressDiv.textContent = NODE_LABELS[evento.nodo] || DEFAULT_PROGRESS_LABEL;
+            } else if (evento.tipo === 'resultados') {
+                renderSearchPreview(previewDiv, evento);
+            } else if (evento.tipo === 'token') {
+                // Con el primer fragmento de la respuesta sobra el progreso.
+                progressDiv.remove();
+                previewDiv.remove();
+                accumulatedResponse += evento.texto;
+                renderMarkdown(contentDiv, accumulatedResponse);
+            } else if (evento.tipo === 'error') {
+                progressDiv.remove();
+                accumulatedResponse += `\n\n${evento.mensaje}`;
+                renderMarkdown(contentDiv, accumulatedResponse);
+            } else if (evento.tipo === 'fin') {
+                progressDiv.remove();
+            }
+        };
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer = parseSseBuffer(buffer + decoder.decode(value, { stream: true }), onEvent);
+        }
+        parseSseBuffer(buffer + '\n\n', onEvent);
+        progressDiv.remove();
+    }
+
     async function handleChatSubmit() {
         if (!chatInput || !sendChatButton || !chatMessagesContainer) {
             console.error("Elementos del chat no encontrados en el DOM.");
@@ -86,6 +179,8 @@ document.addEventListener('DOMContentLoaded', function () {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    // Pide eventos de progreso; el servidor puede responder con texto plano.
+                    'Accept': 'text/event-stream, text/plain',
                 },
                 body: JSON.stringify({ consulta: query, thread_id: chatThreadId }),
             });
@@ -103,6 +198,12 @@ document.addEventListener('DOMContentLoaded', function () {
             
             systemMessageContentDiv = addMessageToChat("", 'system');
 
+            const contentType = response.headers.get('Content-Type') || '';
+            if (contentType.includes('text/event-stream')) {
+                await readChatEvents(response, systemMessageContentDiv);
+                return;
+            }
+
             const reader = response.body.getReader();
             const decoder = new TextDecoder("utf-8");
             let accumulatedResponse = "";
@@ -303,6 +404,48 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     }
     
+    async function leerEventosNdjson(response, onEvento) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder("utf-8");
+        let buffer = "";
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lineas = buffer.split("\n");
+            buffer = lineas.pop();
+            lineas.filter(linea => linea.trim()).forEach(linea => onEvento(JSON.parse(linea)));
+        }
+        if (buffer.trim()) onEvento(JSON.parse(buffer));
+    }
+
+    function enriquecerItemConvocatoria(id, detalle) {
+        if (!resultadosList || !detalle) return;
+        const itemDiv = resultadosList.querySelector(`.convocatoria-item[data-id="${CSS.escape(String(id))}"]`);
+        if (!itemDiv || itemDiv.querySelector('.convocatoria-detalle-extra')) return;
+
+        const presupuesto = detalle.presupuestoTotal != null
+            ? Number(detalle.presupuestoTotal).toLocaleString('es-ES', { style: 'currency', currency: 'EUR' })
+            : 'No especificado';
+        const regiones = Array.isArray(detalle.regiones)
+            ? detalle.regiones.map(r => r.descripcion || r).join(', ')
+            : '';
+        const extra = document.createElement('small');
+        extra.className = 'd-block text-muted convocatoria-detalle-extra';
+        // Los textos vienen de la API: se añaden como texto, nunca como HTML.
+        const anadirDato = (icono, texto) => {
+            const i = document.createElement('i');
+            i.className = `bi ${icono} me-1`;
+            extra.append(i, ` ${texto}`);
+        };
+        anadirDato('bi-cash-coin', presupuesto);
+        if (regiones) {
+            extra.append(' · ');
+            anadirDato('bi-geo-alt', regiones);
+        }
+        itemDiv.appendChild(extra);
+    }
+
     async function realizarBusqueda(page = 0) {
         if (!searchForm || !resultadosInfo || !resultadosList) return;
         
@@ -333,12 +476,19 @@ document.addEventListener('DOMContentLoaded', function () {
         if (paginacionUl) paginacionUl.innerHTML = '';
         
         try {
-            const response = await fetch(`/api/buscar?${params.toString()}`);
+            // La búsqueda llega como NDJSON: primero la página base y después
+            // el detalle de cada convocatoria a medida que se descarga.
+            const response = await fetch(`/api/buscar/stream?${params.toString()}`);
             if (!response.ok) {
                 throw new Error(`Error HTTP: ${response.status} ${response.statusText}`);
             }
-            const data = await response.json();
-            mostrarResultados(data, page);
+            await leerEventosNdjson(response, evento => {
+                if (evento.tipo === 'pagina') {
+                    mostrarResultados(evento.data, page);
+                } else if (evento.tipo === 'detalle') {
+                    enriquecerItemConvocatoria(evento.id, evento.detalle);
+                }
+            });
         } catch (error) {
             console.error('Error en la búsqueda:', error);
             if(resultadosInfo) resultadosInfo.textContent = 'Error al realizar la búsqueda.';
@@ -0,0 +1,8 @@
+"""Configuración común de los tests: el código vive en `src/`."""
+import os
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+for ruta in (SRC, os.path.join(SRC, "mcp")):
+    if ruta not in sys.path:
+        sys.path.insert(0, ruta)
@@ -0,0 +1,122 @@
+"""Tests de la delegación del servicio síncrono en el cliente asíncrono."""
+import asyncio
+import threading
+import pytest
+from aiohttp import web
+from services import async_infosubvenciones_service as cliente
+from services.async_infosubvenciones_service import run_sync
+from services.infosubvenciones_service import (ApiServiceError,
+                                               ConvocatoriaNoEncontradaError,
+                                               InfosubvencionesService)
+
+
+@pytest.fixture
+def api():
+    """
+    API falsa en un bucle propio: devuelve su URL base, las peticiones vistas
+    y el máximo de peticiones de detalle atendidas a la vez.
+    """
+    vistas = []
+    fallos = {"concesiones/busqueda": 1}
+    carga = {"activas": 0, "pico": 0}
+
+    async def manejar(request):
+        ruta = request.match_info["ruta"]
+        vistas.append((ruta, list(request.query.items())))
+        if fallos.get(ruta):
+            fallos[ruta] -= 1
+            return web.Response(status=503, headers={"Retry-After": "0"})
+        if ruta == "convocatorias":
+            if request.query["numConv"] == "404":
+                return web.Response(status=404)
+            carga["activas"] += 1
+            carga["pico"] = max(carga["pico"], carga["activas"])
+            await asyncio.sleep(0.05)
+            carga["activas"] -= 1
+            return web.json_response({"id": int(request.query["numConv"])})
+        if ruta == "partidospoliticos/busqueda":
+            return web.Response(status=400)
+        if ruta == "convocatorias/busqueda":
+            return web.json_response({"content": [{"numeroConvocatoria": "7"},
+                                                  {"numeroConvocatoria": "404"}]})
+        return web.json_response({"content": [], "ruta": ruta})
+
+    app = web.Application()
+    app.router.add_get("/{ruta:.*}", manejar)
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    sitio = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(sitio.start())
+    puerto = sitio._server.sockets[0].getsockname()[1]  # pylint: disable=protected-access
+    hilo = threading.Thread(target=loop.run_forever, daemon=True)
+    hilo.start()
+    yield f"http://127.0.0.1:{puerto}", vistas, carga
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    hilo.join(5)
+    loop.close()
+
+
+@pytest.fixture
+def servicio(api):
+    servicio = InfosubvencionesService(max_retries=2, backoff_factor=0, pool_maxsize=50)
+    servicio.base_url = api[0]
+    return servicio
+
+
+def test_las_peticiones_json_van_por_el_cliente_asincrono(servicio, api):
+    assert servicio.obtener_convocatoria("123") == {"id": 123}
+    servicio.obtener_beneficiarios_por_anno(["2023", 2024])
+    assert ("grandesbeneficiarios/busqueda", [("anios", "2023"), ("anios", "2024")]) \
+        in api[1]
+    assert servicio.pool_stats()["async"]["peticiones"] == 2
+
+
+def test_404_es_convocatoria_no_encontrada_y_se_cachea(servicio, api):
+    with pytest.raises(ConvocatoriaNoEncontradaError):
+        servicio.obtener_convocatoria("404")
+    with pytest.raises(ConvocatoriaNoEncontradaError):
+        servicio.obtener_convocatoria("404")
+    assert [ruta for ruta, _ in api[1]] == ["convocatorias"]
+
+
+def test_reintenta_los_5xx_y_traduce_los_errores(servicio):
+    assert servicio.buscar_concesiones({"nifCif": "B1"})["ruta"] == "concesiones/busqueda"
+    assert servicio.pool_stats()["async"]["reintentos"] == 1
+    with pytest.raises(ApiServiceError):
+        servicio.buscar_partidos_politicos({})
+
+
+def test_obtener_convocatoria_comparte_la_descarga(servicio, api):
+    async def pedir():
+        return await asyncio.gather(*(servicio.api.obtener_convocatoria("5")
+                                      for _ in range(4)))
+    assert run_sync(pedir()) == [{"id": 5}] * 4
+    assert [ruta for ruta, _ in api[1]] == ["convocatorias"]
+    # La copia devuelta no altera la entrada cacheada.
+    servicio.obtener_convocatoria("5")["id"] = 0
+    assert servicio.obtener_convocatoria("5") == {"id": 5}
+
+
+def test_buscar_convocatorias_con_detalles(servicio, monkeypatch):
+    monkeypatch.setattr(cliente, "resumen_detalle", lambda d: {"id": d["id"]})
+    data = run_sync(servicio.api.buscar_convocatorias({"descripcion": "pymes"}))
+    assert data["convocatoriasDetails"] == {"7": {"id": 7}}
+
+
+def test_el_semaforo_es_global_entre_llamadas(servicio, api, monkeypatch):
+    monkeypatch.setattr(cliente, "MAX_CONCURRENCY", 3)
+    cliente._semaphores.clear()  # pylint: disable=protected-access
+    try:
+        hilos = [threading.Thread(target=lambda inicio=inicio: run_sync(
+            servicio.api.gather_details(range(inicio, inicio + 5))))
+            for inicio in (100, 200)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join(10)
+    finally:
+        cliente._semaphores.clear()  # pylint: disable=protected-access
+    assert api[2]["pico"] == 3
+    assert servicio.pool_stats()["async"]["peticiones"] == 10
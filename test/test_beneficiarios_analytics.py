@@ -0,0 +1,46 @@
+"""Tests de la agregación columnar de beneficiarios."""
+import pytest
+from services.beneficiarios_analytics import BeneficiariosAnalytics, ColumnarTable
+
+
+def _registro(anno, beneficiario, importe):
+    return {"ejercicio": anno, "beneficiario": beneficiario, "importe": importe}
+
+
+def test_por_anno_totales_variacion_y_percentiles():
+    tabla = ColumnarTable.from_registros([
+        _registro(2022, "A", 100.0), _registro(2022, "B", 300.0),
+        _registro(2023, "A", 200.0), _registro(2023, "A", 400.0),
+        _registro(2025, "C", 50.0),
+    ])
+    filas = {f["anno"]: f for f in tabla.por_anno(percentiles=(50,))}
+    assert sorted(filas) == [2022, 2023, 2025]
+    assert filas[2022]["total"] == 400.0 and filas[2022]["beneficiarios"] == 2
+    assert filas[2023]["registros"] == 2 and filas[2023]["beneficiarios"] == 1
+    assert filas[2023]["variacion"] == 200.0
+    assert filas[2023]["variacion_pct"] == pytest.approx(50.0)
+    assert filas[2023]["percentiles"] == {"p50": 300.0}
+    assert "variacion" not in filas[2022] and "variacion" not in filas[2025]
+
+
+def test_concat_recodifica_vocabularios_distintos():
+    a = ColumnarTable.from_registros([_registro(2022, "A", 1.0)])
+    b = ColumnarTable.from_registros([_registro(2023, "B", 2.0), _registro(2023, "A", 3.0)])
+    tabla = ColumnarTable.concat([a, b])
+    assert tabla.top("beneficiario", 2) == [("A", 4.0, 2), ("B", 2.0, 1)]
+
+
+class _Servicio:
+    def obtener_beneficiarios_por_anno(self, annos):
+        return {"content": [_registro(a, f"B{a}-{i}", 1.0) for a in annos for i in range(3)]}
+
+
+def test_vocabularios_se_renuevan_al_superar_el_maximo():
+    analytics = BeneficiariosAnalytics(_Servicio(), ttl=60, maxsize=4)
+    analytics.max_vocabulario = 5
+    analytics.tabla([2020, 2021])
+    assert analytics.stats()["vocabularios"]["beneficiario"] == 6
+    tabla = analytics.tabla([2020, 2021, 2022])
+    assert analytics.stats()["vocabularios"]["beneficiario"] == 3
+    assert len(tabla) == 9
+    assert len(set(tabla.top("beneficiario", 20))) == 9
@@ -0,0 +1,71 @@
+"""Tests del índice vectorial en disco y de su reconstrucción."""
+import numpy as np
+import pytest
+from services.busqueda_semantica import HashingEmbedder, HybridRetriever, VectorIndex
+
+
+class _Espejo:
+    def __init__(self, items):
+        self.items = items
+
+    def iterar_filas(self, desde=None):
+        return iter([i for i in self.items
+                     if desde is None or i["fechaRecepcion"] >= desde])
+
+
+def _item(id_, descripcion, fecha="2024-01-01"):
+    return {"id": id_, "descripcion": descripcion, "fechaRecepcion": fecha}
+
+
+@pytest.fixture
+def directorio(tmp_path):
+    return str(tmp_path / "semantico")
+
+
+def test_otra_instancia_ve_las_altas(directorio):
+    escritor = VectorIndex(directorio, HashingEmbedder())
+    lector = VectorIndex(directorio, HashingEmbedder())
+    escritor.indexar([_item(1, "ayudas a la digitalización de pymes")])
+    assert lector.buscar("digitalización de pymes", 1)[0][0] == 1
+    escritor.indexar([_item(2, "subvenciones para placas solares")])
+    assert lector.buscar("placas solares", 1)[0][0] == 2
+    assert len(lector) == 2
+
+
+def test_reconstruir_con_un_lector_abierto(directorio):
+    escritor = VectorIndex(directorio, HashingEmbedder())
+    escritor.indexar([_item(i, f"convocatoria antigua {i}") for i in range(1, 50)])
+    lector = VectorIndex(directorio, HashingEmbedder())
+    assert len(lector) == 49
+    mapa_viejo = lector._vectores  # pylint: disable=protected-access
+
+    espejo = _Espejo([_item(100, "ayudas al alquiler joven", "2024-05-01"),
+                      _item(101, "becas de investigación", "2024-06-01")])
+    assert escritor.reconstruir(espejo) == 2
+    # El mapa de la generación anterior sigue siendo legible.
+    assert np.isfinite(np.asarray(mapa_viejo).sum())
+    assert lector.buscar("alquiler joven", 1)[0][0] == 100
+    assert len(lector) == 2
+    assert lector.meta["marca_agua"] == "2024-06-01"
+    assert sorted(f for f in __import__("os").listdir(directorio)
+                  if f.endswith((".f32", ".i64"))) == ["ids.2.i64", "vectores.2.f32"]
+
+
+def test_cambio_de_embedder_no_borra_el_indice(directorio):
+    actual = VectorIndex(directorio, HashingEmbedder())
+    actual.indexar([_item(1, "ayudas a la digitalización")])
+    otro = VectorIndex(directorio, HashingEmbedder(dim=64))
+    assert not otro.compatible
+    assert otro.buscar("digitalización") == []
+    assert actual.buscar("digitalización", 1)[0][0] == 1
+
+    otro.sincronizar_desde_espejo(_Espejo([_item(7, "becas de investigación")]))
+    assert otro.buscar("becas", 1)[0][0] == 7
+    assert not actual.buscar("digitalización")
+    assert actual.stats()["compatible"] is False
+
+
+def test_hibrido_descarta_fechas_mal_formadas(directorio):
+    retriever = HybridRetriever(VectorIndex(directorio, HashingEmbedder()), None)
+    assert retriever.admite({"descripcion": "becas", "fechaDesde": "01/01/2024"})
+    assert not retriever.admite({"descripcion": "becas", "fechaDesde": "2024-01-01"})
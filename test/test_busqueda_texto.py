@@ -0,0 +1,35 @@
+"""Tests del índice de texto completo de convocatorias."""
+import pytest
+from services.busqueda_texto import FullTextIndex, analizar
+from services.convocatorias_mirror import ConvocatoriasMirror
+
+
+@pytest.fixture
+def indice(tmp_path):
+    index = FullTextIndex(str(tmp_path / "indice.db"))
+    index.indexar([
+        {"id": 1, "numeroConvocatoria": "100001", "descripcion": "Ayudas a la digitalización",
+         "fechaRecepcion": "2024-03-01"},
+        {"id": 2, "numeroConvocatoria": "100002", "descripcion": "Subvenciones agrícolas",
+         "fechaRecepcion": "2024-02-01"},
+    ])
+    return index
+
+
+def test_analizar_quita_vacias_y_tildes():
+    assert analizar("Ayudas para la digitalización") == analizar("ayuda digitalizacion")
+
+
+def test_ingesta_de_resultados_no_marca_fresco(indice):
+    assert not indice.is_fresh()
+    assert not indice.can_answer({"descripcion": "digitalizacion"})
+
+
+def test_fresco_tras_sincronizar_con_espejo(indice, tmp_path):
+    espejo = ConvocatoriasMirror(str(tmp_path / "espejo.db"))
+    espejo._set_estado("ultima_sync", "9999999999")  # pylint: disable=protected-access
+    indice.sincronizar_desde_espejo(espejo)
+    assert indice.can_answer({"descripcion": "digitalizacion", "fechaDesde": "01/01/2024"})
+    assert not indice.can_answer({"descripcion": "digitalizacion", "fechaDesde": "2024-01-01"})
+    datos = indice.buscar({"descripcion": "digitalizacion"})
+    assert [c["id"] for c in datos["content"]] == [1]
@@ -0,0 +1,19 @@
+"""Tests del empaquetado de contexto con presupuesto de tokens."""
+from services.context_builder import ContextBuilder
+
+
+def test_pack_rows_corta_en_la_primera_fila_que_no_cabe():
+    builder = ContextBuilder({"prueba": 10})
+    filas = ["a" * 10, "b" * 40, "c"]
+    texto, report = builder.pack_rows("prueba", filas, render=str)
+    assert texto == "a" * 10
+    assert report.filas_incluidas == 1
+    assert report.recortado
+
+
+def test_pack_rows_sin_recorte():
+    builder = ContextBuilder({"prueba": 100})
+    texto, report = builder.pack_rows("prueba", [3, 1, 2], render=str,
+                                      sort_key=float)
+    assert texto == "3\n2\n1"
+    assert not report.recortado
@@ -0,0 +1,148 @@
+"""Tests de la caché de detalles de convocatoria."""
+import threading
+from concurrent.futures import Future
+import pytest
+from services import convocatoria_cache
+from services.convocatoria_cache import ConvocatoriaCache
+from services.worker_pool import ServicioSaturadoError
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    """Reloj detenido que el test avanza a mano."""
+    ahora = [1000.0]
+    monkeypatch.setattr(convocatoria_cache.time, "time", lambda: ahora[0])
+    return ahora
+
+
+class _PoolInmediato:
+    """Ejecuta en el acto lo que se envía y anota los grupos."""
+
+    def __init__(self, saturado=False):
+        self.saturado = saturado
+        self.grupos = []
+
+    def submit(self, fn, *args, group=None):
+        if self.saturado:
+            raise ServicioSaturadoError("pool lleno")
+        self.grupos.append(group)
+        futuro = Future()
+        futuro.set_result(fn(*args))
+        return futuro
+
+
+def _cache(**kwargs):
+    opciones = {"maxsize": 10, "ttl": 60, "stale_ttl": 120, "negative_ttl": 30}
+    opciones.update(kwargs)
+    return ConvocatoriaCache(**opciones)
+
+
+def test_entrada_fresca_no_vuelve_a_descargar_y_caduca(reloj):
+    cache = _cache(stale_ttl=0)
+    llamadas = []
+    cargar = lambda k: llamadas.append(k) or {"id": k, "v": len(llamadas)}
+    assert cache.get_or_load(1, cargar)["v"] == 1
+    reloj[0] += 59
+    assert cache.get_or_load(1, cargar)["v"] == 1
+    reloj[0] += 2
+    assert cache.peek(1) == ("miss", None)
+    assert cache.get_or_load(1, cargar)["v"] == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_caducada_se_sirve_y_se_refresca_en_el_pool(reloj, monkeypatch):
+    pool = _PoolInmediato()
+    monkeypatch.setattr(convocatoria_cache, "shared_executor", pool)
+    cache = _cache()
+    cache.put("7", "viejo")
+    reloj[0] += 90
+    assert cache.get_or_load("7", lambda k: "nuevo") == "viejo"
+    assert pool.grupos == ["revalidacion"]
+    assert cache.peek("7") == ("fresh", "nuevo")
+    reloj[0] += 60 + 120
+    assert cache.peek("7") == ("miss", None)
+
+
+def test_refresco_con_pool_saturado_libera_la_marca(reloj, monkeypatch):
+    monkeypatch.setattr(convocatoria_cache, "shared_executor",
+                        _PoolInmediato(saturado=True))
+    cache = _cache()
+    cache.put("7", "viejo")
+    reloj[0] += 90
+    assert cache.get_or_load("7", lambda k: "nuevo") == "viejo"
+    assert cache.begin_revalidation("7")
+
+
+def test_no_encontrado_se_recuerda_durante_negative_ttl(reloj):
+    cache = _cache()
+    llamadas = []
+
+    def cargar(clave):
+        llamadas.append(clave)
+        raise KeyError(clave)
+
+    for _ in range(3):
+        with pytest.raises(KeyError):
+            cache.get_or_load("404", cargar)
+    assert len(llamadas) == 1
+    assert cache.stats()["negative_hits"] == 2
+    reloj[0] += 31
+    with pytest.raises(KeyError):
+        cache.get_or_load("404", cargar)
+    assert len(llamadas) == 2
+
+
+def test_memoria_acotada_por_lru():
+    cache = _cache(maxsize=3)
+    for clave in range(4):
+        cache.put(clave, clave)
+    cache.peek(1)
+    cache.put(4, 4)
+    assert cache.stats()["memory_size"] == 3
+    assert cache.peek(0) == ("miss", None)
+    assert cache.peek(2) == ("miss", None)
+    assert cache.peek(1)[0] == "fresh"
+
+
+def test_fallos_simultaneos_descargan_una_sola_vez():
+    cache = _cache()
+    dentro = threading.Event()
+    soltar = threading.Event()
+    llamadas = []
+
+    def cargar(clave):
+        llamadas.append(clave)
+        dentro.set()
+        soltar.wait(5)
+        return {"id": clave}
+
+    resultados = []
+    hilos = [threading.Thread(target=lambda: resultados.append(
+        cache.get_or_load("9", cargar))) for _ in range(4)]
+    hilos[0].start()
+    assert dentro.wait(5)
+    for hilo in hilos[1:]:
+        hilo.start()
+    while cache.stats()["shared_loads"] < 3:
+        threading.Event().wait(0.01)
+    soltar.set()
+    for hilo in hilos:
+        hilo.join(5)
+    assert llamadas == ["9"]
+    assert resultados == [{"id": "9"}] * 4
+
+
+def test_sqlite_purga_entradas_caducadas_al_arrancar(reloj, tmp_path):
+    ruta = str(tmp_path / "cache.db")
+    cache = _cache(sqlite_path=ruta)
+    cache.put("viva", 1)
+    cache.put("vieja", 2)
+    cache.put("404", "no", negative=True)
+    reloj[0] += 40
+    cache.put("viva", 3)
+    reloj[0] += 150
+
+    reabierta = _cache(sqlite_path=ruta)
+    assert reabierta.stats()["purged"] == 2
+    assert reabierta.peek("viva") == ("stale", 3)
+    assert reabierta.peek("vieja") == ("miss", None)
@@ -0,0 +1,117 @@
+"""Tests de la lectura de la exportación CSV y de su uso en /api/buscar."""
+import io
+import threading
+import pytest
+from services.convocatorias_export import ExportacionNoReconocidaError, leer_exportacion
+from services.infosubvenciones_service import InfosubvencionesService
+
+CSV = ("\n"
+       "Código BDNS;MRR;Administración;Fecha de registro;Título\n"
+       "700001;Sí;ESTADO;05/03/2024;Ayudas a pymes\n"
+       ";;;;\n"
+       "700002;No;ANDALUCÍA;1/12/2023;\n")
+
+
+def test_leer_exportacion_convierte_las_filas():
+    filas = list(leer_exportacion(io.StringIO(CSV)))
+    assert filas == [
+        {"numeroConvocatoria": "700001", "mrr": True, "nivel1": "ESTADO",
+         "fechaRecepcion": "2024-03-05", "descripcion": "Ayudas a pymes"},
+        {"numeroConvocatoria": "700002", "mrr": False, "nivel1": "ANDALUCÍA",
+         "fechaRecepcion": "2023-12-01", "descripcion": None},
+    ]
+
+
+def test_leer_exportacion_con_comas_y_columnas_desconocidas():
+    filas = list(leer_exportacion(io.StringIO("Código BDNS,Sector Económico\n9,A\n")))
+    assert filas == [{"numeroConvocatoria": "9", "sectorEconomico": "A"}]
+
+
+def test_leer_exportacion_rechaza_otra_cabecera():
+    with pytest.raises(ExportacionNoReconocidaError):
+        list(leer_exportacion(io.StringIO("nombre;apellidos\na;b\n")))
+
+
+class _Respuesta:
+    headers = {"Content-Type": "text/csv"}
+    encoding = None
+
+    def __init__(self, cuerpo: str):
+        self.raw = io.BytesIO(cuerpo.encode("utf-8"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Servicio(InfosubvencionesService):
+    """Sirve una exportación de `n` filas cuando se abre `liberar`."""
+
+    def __init__(self, n):
+        super().__init__()
+        self.n = n
+        self.descargas = 0
+        self.liberar = threading.Event()
+
+    def _get(self, endpoint, params=None, stream=False):
+        assert endpoint == "convocatorias/exportar"
+        self.descargas += 1
+        assert self.liberar.wait(5)
+        filas = "".join(f"{700000 + i};Título {i}\n" for i in range(self.n))
+        return _Respuesta("Código BDNS;Título\n" + filas)
+
+
+def _esperar(servicio, params):
+    servicio.liberar.set()
+    servicio.exportar_convocatorias(params)
+
+
+def test_la_pagina_se_sirve_del_json_mientras_se_descarga():
+    servicio = _Servicio(n=25)
+    params = {"descripcion": "pymes", "page": 0, "pageSize": 10}
+    assert servicio.buscar_exportacion(params) is None
+    assert servicio.buscar_exportacion({**params, "page": 1}) is None
+    assert servicio.export_stats()["en_curso"] == 1
+    _esperar(servicio, params)
+    pagina = servicio.buscar_exportacion({**params, "page": 2})
+    assert [i["numeroConvocatoria"] for i in pagina["content"]] == [
+        str(700000 + i) for i in range(20, 25)]
+    assert pagina["totalElements"] == 25 and pagina["totalPages"] == 3
+    assert servicio.descargas == 1
+    stats = servicio.export_stats()
+    assert stats["en_curso"] == 0 and stats["en_memoria"] == 1
+
+
+def test_la_exportacion_se_recorta(monkeypatch):
+    monkeypatch.setenv("CONVOCATORIAS_EXPORT_MAX_ROWS", "15")
+    servicio = _Servicio(n=40)
+    params = {"descripcion": "pymes", "page": 0, "pageSize": 10}
+    _esperar(servicio, params)
+    pagina = servicio.buscar_exportacion(params, total=40)
+    assert len(pagina["content"]) == 10 and pagina["totalElements"] == 40
+    # La segunda página ya no cabe entera en lo guardado: se sirve del JSON.
+    assert servicio.buscar_exportacion({**params, "page": 1}, total=40) is None
+    assert servicio.export_stats()["recortadas"] == 1
+
+
+def test_la_busqueda_en_streaming_usa_la_exportacion(monkeypatch):
+    servicio = _Servicio(n=25)
+    pagina_json = {"content": [{"id": 1}], "totalElements": 25, "totalPages": 3}
+    monkeypatch.setattr(servicio, "buscar_pagina", lambda params: dict(pagina_json))
+    monkeypatch.setattr(servicio, "export_threshold", 20)
+    servicio.cache.put("700001", {"id": 1, "presupuestoTotal": 100, "regiones": [],
+                                  "tiposBeneficiarios": []})
+    params = {"descripcion": "pymes", "page": 0, "pageSize": 10}
+
+    busqueda = servicio.abrir_busqueda(params, exportacion=True)
+    assert "origen" not in busqueda.pagina
+    _esperar(servicio, params)
+    busqueda = servicio.abrir_busqueda(params, exportacion=True)
+    assert busqueda.pagina["origen"] == "exportacion"
+    assert len(busqueda.pagina["content"]) == 10
+    assert list(busqueda) == [("1", {"presupuestoTotal": 100, "regiones": [],
+                                     "tiposBeneficiarios": []})]
+    # Sin `exportacion`, la página sigue saliendo del JSON.
+    assert "origen" not in servicio.abrir_busqueda(params).pagina
@@ -0,0 +1,47 @@
+"""Tests de las consultas del espejo local de convocatorias."""
+import time
+import pytest
+from services.convocatorias_mirror import ConvocatoriasMirror, fechas_validas
+
+
+@pytest.fixture
+def espejo(tmp_path):
+    mirror = ConvocatoriasMirror(str(tmp_path / "espejo.db"))
+    mirror.upsert([
+        {"id": 1, "numeroConvocatoria": "100001", "descripcion": "Ayudas al 100% para pymes",
+         "fechaRecepcion": "2024-03-01"},
+        {"id": 2, "numeroConvocatoria": "100002", "descripcion": "Ayudas al 1000 por cien",
+         "fechaRecepcion": "2024-02-01"},
+        {"id": 3, "numeroConvocatoria": "100003", "descripcion": "Plan_Renove",
+         "fechaRecepcion": "2023-02-01"},
+    ])
+    mirror._set_estado("ultima_sync", str(time.time()))  # pylint: disable=protected-access
+    return mirror
+
+
+def test_like_escapa_comodines(espejo):
+    ids = [c["id"] for c in espejo.buscar({"descripcion": "100%"})["content"]]
+    assert ids == [1]
+    assert not espejo.buscar({"descripcion": "pla_"})["content"]
+    ids = [c["id"] for c in espejo.buscar({"descripcion": "n_r"})["content"]]
+    assert ids == [3]
+
+
+def test_filtro_de_fechas(espejo):
+    datos = espejo.buscar({"descripcion": "ayudas", "fechaDesde": "15/02/2024"})
+    assert [c["id"] for c in datos["content"]] == [1]
+
+
+@pytest.mark.parametrize("params, valido", [
+    ({}, True),
+    ({"fechaDesde": "01/01/2024", "fechaHasta": "31/12/2024"}, True),
+    ({"fechaDesde": "2024-01-01"}, False),
+    ({"fechaHasta": "31/13/2024"}, False),
+])
+def test_fechas_validas(params, valido):
+    assert fechas_validas(params) is valido
+
+
+def test_fecha_iso_se_deja_a_la_api(espejo):
+    assert espejo.can_answer({"descripcion": "ayudas", "fechaDesde": "01/01/2024"})
+    assert not espejo.can_answer({"descripcion": "ayudas", "fechaDesde": "2024-01-01"})
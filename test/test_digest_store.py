@@ -0,0 +1,91 @@
+"""Tests de la cola de digests de convocatorias."""
+import logging
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+# pylint: disable=wrong-import-position
+from services import digest_store as digest_module  # noqa: E402
+from services.digest_store import (  # noqa: E402
+    PRIORIDAD_NUEVA, PRIORIDAD_PEDIDA, DigestStore, build_digest_store
+)
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    """Reloj detenido que el test avanza a mano."""
+    ahora = [1000.0]
+    monkeypatch.setattr(digest_module.time, "time", lambda: ahora[0])
+    return ahora
+
+
+@pytest.fixture
+def store(monkeypatch, reloj):
+    del reloj
+    monkeypatch.setenv("DIGEST_MIN_REQUESTS", "2")
+    monkeypatch.setenv("DIGEST_MAX_ATTEMPTS", "2")
+    monkeypatch.setenv("DIGEST_JOB_TIMEOUT", "60")
+    return DigestStore(":memory:")
+
+
+def test_siguiente_respeta_prioridad_y_orden_de_llegada(store, reloj):
+    store.encolar(["a"], PRIORIDAD_NUEVA)
+    reloj[0] += 1
+    store.encolar(["b", "c"], PRIORIDAD_NUEVA)
+    store.encolar(["d"], PRIORIDAD_PEDIDA)
+    store.encolar(["b"], PRIORIDAD_PEDIDA + 5)
+    assert [store.siguiente() for _ in range(5)] == ["b", "d", "a", "c", None]
+
+
+def test_solicitar_encola_al_llegar_al_minimo(store):
+    assert store.solicitar("42") is None
+    assert store.stats()["pendientes"] == 0
+    store.solicitar("42")
+    assert store.stats()["pendientes"] == 1
+    store.encolar(["otra"], PRIORIDAD_NUEVA)
+    assert store.siguiente() == "42"
+
+
+def test_solicitar_no_encola_si_hay_digest_vigente(store, reloj):
+    store.put("42", {"resumen": "ok"})
+    for _ in range(3):
+        assert store.solicitar("42")["resumen"] == "ok"
+    assert store.stats()["pendientes"] == 0
+    reloj[0] += store.ttl + 1
+    store.solicitar("42")
+    assert store.stats()["pendientes"] == 1
+
+
+def test_trabajo_fallido_se_descarta_tras_el_maximo_de_intentos(store):
+    store.encolar(["x"])
+    assert store.siguiente() == "x"
+    store.terminar("x", error="timeout")
+    assert store.stats() == {"digests": 0, "pendientes": 1, "en_curso": 0,
+                             "reintentando": 1}
+    assert store.siguiente() == "x"
+    store.terminar("x", error="timeout")
+    assert store.stats()["pendientes"] == 0
+    assert store.siguiente() is None
+
+
+def test_trabajo_abandonado_se_recupera_tras_job_timeout(store, reloj):
+    store.encolar(["x"])
+    assert store.siguiente() == "x"
+    reloj[0] += 30
+    assert store.siguiente() is None
+    reloj[0] += 31
+    assert store.siguiente() == "x"
+    # Quien lo tomó primero ya no puede reclamarlo con su marca antigua.
+    cursor = store._conn.execute(  # pylint: disable=protected-access
+        "UPDATE digest_cola SET en_curso = 1 WHERE numero = 'x' AND iniciado IS ?",
+        (1000.0,)
+    )
+    assert cursor.rowcount == 0
+
+
+def test_aviso_si_no_hay_digest_db(monkeypatch, caplog):
+    monkeypatch.setenv("DIGESTS_ENABLED", "1")
+    monkeypatch.delenv("DIGEST_DB", raising=False)
+    with caplog.at_level(logging.WARNING, logger=digest_module.__name__):
+        assert build_digest_store().path == ":memory:"
+    assert "DIGEST_DB" in caplog.text
@@ -0,0 +1,31 @@
+"""Tests de la construcción de filtros de concesiones y ayudas de estado."""
+import pytest
+
+pytest.importorskip("google.generativeai")
+pytest.importorskip("opik")
+
+# pylint: disable=wrong-import-position
+from agents.extractor_agent import _build_concession_params  # noqa: E402
+
+
+def test_concesiones_normaliza_nif_y_fechas():
+    params, error = _build_concession_params(
+        {"nifCif": "b-1234567-8", "fechaDesde": "01/01/2023", "ayudaEstado": "SA.12345"},
+        "BUSCAR_CONCESIONES")
+    assert error is None
+    assert params == {"nifCif": "B12345678", "fechaDesde": "01/01/2023"}
+
+
+def test_ayudas_estado_admite_referencia_sa():
+    params, error = _build_concession_params({"ayudaEstado": "SA.12345"},
+                                             "BUSCAR_AYUDAS_ESTADO")
+    assert error is None
+    assert params == {"ayudaEstado": "12345"}
+
+
+@pytest.mark.parametrize("datos", [None, {}, {"numeroConvocatoria": "abc"},
+                                   {"fechaDesde": "01/01/2023"}])
+def test_sin_identificador_devuelve_error(datos):
+    params, error = _build_concession_params(datos, "BUSCAR_CONCESIONES")
+    assert params is None
+    assert error
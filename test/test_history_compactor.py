@@ -0,0 +1,61 @@
+"""Tests de la compactación del historial de chat."""
+import threading
+import pytest
+
+pytest.importorskip("google.generativeai")
+pytest.importorskip("opik")
+
+# pylint: disable=wrong-import-position
+from services import history_compactor  # noqa: E402
+from services.history_compactor import HistoryCompactor, turnos_compactados  # noqa: E402
+from services.session_store import InMemorySessionStore  # noqa: E402
+
+
+@pytest.mark.parametrize("original, actual, n, esperado", [
+    (["a", "b", "c"], ["a", "b", "c"], 1, 1),
+    (["a", "b", "c"], ["a", "b", "c", "d"], 1, 1),
+    (["a", "b", "c", "d"], ["b", "c", "d", "e"], 2, 1),
+    (["x", "x", "x"], ["x", "x", "z"], 2, 1),
+    (["a", "b"], [], 1, 0),
+])
+def test_turnos_compactados(original, actual, n, esperado):
+    assert turnos_compactados(original, actual, n) == esperado
+
+
+def test_compactar_conserva_turnos_llegados_durante_el_resumen(monkeypatch):
+    store = InMemorySessionStore(max_turns=10, ttl=60)
+    for _ in range(3):
+        store.append("hilo", "otra", "vale")
+
+    def resumir(*args, **kwargs):
+        del args, kwargs
+        # Llega un turno con el mismo texto mientras el LLM resume.
+        store.append("hilo", "otra", "vale")
+        return "El usuario repite."
+
+    monkeypatch.setattr(history_compactor, "generate_content_non_stream", resumir)
+    compactor = HistoryCompactor(None, "RESUMEN_ANTERIOR TURNOS_ANTIGUOS", store,
+                                 keep_recent=2)
+    assert compactor.compact("hilo")
+    assert store.get("hilo") == [("otra", "vale")] * 3
+    assert store.get_summary("hilo")["turnos"] == 1
+
+
+def test_schedule_usa_su_propio_executor(monkeypatch):
+    store = InMemorySessionStore(max_turns=10, ttl=60)
+    for i in range(4):
+        store.append("hilo", f"pregunta {i}", "respuesta")
+    hilos = []
+
+    def resumir(*args, **kwargs):
+        del args, kwargs
+        hilos.append(threading.current_thread().name)
+        return "Resumen."
+
+    monkeypatch.setattr(history_compactor, "generate_content_non_stream", resumir)
+    compactor = HistoryCompactor(None, "RESUMEN_ANTERIOR TURNOS_ANTIGUOS", store,
+                                 keep_recent=2)
+    compactor.schedule("hilo")
+    compactor._executor.shutdown(wait=True)  # pylint: disable=protected-access
+    assert len(hilos) == 1 and hilos[0].startswith("historial")
+    assert len(store.get("hilo")) == 2
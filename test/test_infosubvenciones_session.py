@@ -0,0 +1,38 @@
+"""Tests de la sesión HTTP con pool y reintentos con jitter."""
+import pytest
+from urllib3.util.retry import RequestHistory, Retry
+from services.infosubvenciones_service import (
+    RETRY_STATUS_CODES, InfosubvencionesService, _JitterRetry
+)
+
+
+def test_sesion_monta_adaptador_con_pool_y_reintentos():
+    servicio = InfosubvencionesService(pool_maxsize=7, max_retries=4, backoff_factor=0.2)
+    for url in (servicio.base_url, "http://localhost/api"):
+        adapter = servicio.session.get_adapter(url)
+        assert adapter._pool_maxsize == 7  # pylint: disable=protected-access
+        assert adapter._pool_block is True  # pylint: disable=protected-access
+        retry = adapter.max_retries
+        assert isinstance(retry, _JitterRetry)
+        assert retry.total == 4
+        assert retry.backoff_factor == 0.2
+        assert tuple(retry.status_forcelist) == RETRY_STATUS_CODES
+    assert servicio.session.headers["Connection"] == "keep-alive"
+
+
+@pytest.mark.parametrize("errores", [2, 3, 4])
+def test_backoff_con_jitter_acotado(errores):
+    historial = tuple(RequestHistory("GET", "/", None, 503, None)
+                      for _ in range(errores))
+    base = Retry(total=10, backoff_factor=0.5, history=historial).get_backoff_time()
+    retry = _JitterRetry(total=10, backoff_factor=0.5, history=historial)
+    tiempos = [retry.get_backoff_time() for _ in range(200)]
+    assert base > 0
+    assert all(base <= t <= base + _JitterRetry.MAX_JITTER for t in tiempos)
+    assert len(set(tiempos)) > 1
+    # El jitter se conserva al encadenar reintentos (Retry.new).
+    assert isinstance(retry.new(), _JitterRetry)
+
+
+def test_sin_backoff_no_anade_jitter():
+    assert _JitterRetry(total=3, backoff_factor=0.5).get_backoff_time() == 0
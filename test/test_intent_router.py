@@ -0,0 +1,81 @@
+"""Tests de las reglas deterministas del enrutador de intenciones."""
+import pytest
+from services.intent_router import extraer_annos, route_by_rules
+
+
+@pytest.mark.parametrize("consulta, annos", [
+    ("beneficiarios 2023", "2023"),
+    ("Dame los beneficiarios del año 2020 al 2022", "2020,2021,2022"),
+    ("¿Quiénes fueron los beneficiarios en 2021 y 2023?", "2021,2023"),
+])
+def test_beneficiarios_por_anno(consulta, annos):
+    decision = route_by_rules(consulta)
+    assert decision.intent == "BUSCAR_BENEFICIARIOS_POR_ANNO"
+    assert decision.slots == {"extracted_years": annos}
+
+
+@pytest.mark.parametrize("consulta", [
+    "ayudas para beneficiarios autónomos en 2024",
+    "convocatorias de 2023 cuyos beneficiarios sean pymes",
+    "subvenciones de digitalización con beneficiarios en 2022",
+    "beneficiarios",
+])
+def test_beneficiarios_con_busqueda_queda_para_el_llm(consulta):
+    assert route_by_rules(consulta) is None
+
+
+@pytest.mark.parametrize("consulta", [
+    "partidos políticos 2023",
+    "¿Qué partidos políticos recibieron subvenciones en 2022?",
+    "subvenciones a partidos políticos",
+    "ayudas concedidas a los partidos políticos en 2021",
+])
+def test_partidos_politicos(consulta):
+    assert route_by_rules(consulta).intent == "BUSCAR_PARTIDOS_POLITICOS"
+
+
+@pytest.mark.parametrize("consulta", [
+    "convocatorias de ayudas para partidos políticos en 2024",
+    "subvenciones a fundaciones de partidos políticos",
+    "becas de formación sobre partidos políticos",
+])
+def test_partidos_como_tema_queda_para_el_llm(consulta):
+    assert route_by_rules(consulta) is None
+
+
+def test_extraer_annos_expande_rangos():
+    assert extraer_annos("de 2019 a 2021 y 2024") == [2019, 2020, 2021, 2024]
+
+
+def test_saludo_y_bdns():
+    assert route_by_rules("¡Hola!").intent == "GENERAL_CONVERSATION"
+    decision = route_by_rules("convocatoria 654321")
+    assert decision.intent == "OBTENER_CONVOCATORIA_DETALLES"
+    assert decision.slots == {"extracted_convocatoria_id": "654321"}
+
+
+@pytest.mark.parametrize("consulta, intent, params", [
+    ("ayudas de estado SA.12345", "BUSCAR_AYUDAS_ESTADO", {"ayudaEstado": "12345"}),
+    ("ayudas de estado de la convocatoria 654321", "BUSCAR_AYUDAS_ESTADO",
+     {"numeroConvocatoria": "654321"}),
+    ("concesiones a B-1234567-8", "BUSCAR_CONCESIONES", {"nifCif": "B12345678"}),
+])
+def test_concesiones_con_identificador(consulta, intent, params):
+    decision = route_by_rules(consulta)
+    assert decision.intent == intent
+    assert decision.slots == {"api_call_params": params}
+
+
+def test_concesiones_con_fecha_deja_los_filtros_al_llm():
+    decision = route_by_rules("concesiones a B12345678 en 2023")
+    assert decision.intent == "BUSCAR_CONCESIONES"
+    assert decision.slots == {}
+
+
+@pytest.mark.parametrize("consulta", [
+    "qué es una ayuda de estado",
+    "convocatorias de ayudas de estado para pymes",
+    "concesiones de ayudas a la digitalización",
+])
+def test_concesiones_sin_identificador_queda_para_el_llm(consulta):
+    assert route_by_rules(consulta) is None
@@ -0,0 +1,43 @@
+"""Tests de la caché de respuestas del LLM."""
+from services.llm_cache import LLMResponseCache, marcadores
+
+PLANTILLA = "Extrae los filtros de: {}"
+
+
+def _cache():
+    cache = LLMResponseCache(maxsize=16, ttl=60, similarity=0.8)
+    cache.templates = frozenset({"extract_params"})
+    cache.similar_templates = frozenset({"extract_params"})
+    return cache
+
+
+def _guardar(cache, query, respuesta):
+    cache.put("extract_params", "modelo", PLANTILLA.format(query), respuesta, query)
+
+
+def _buscar(cache, query):
+    return cache.get("extract_params", "modelo", PLANTILLA.format(query), query)
+
+
+def test_similitud_reutiliza_consultas_casi_iguales():
+    cache = _cache()
+    _guardar(cache, "ayudas para autónomos", "{}")
+    assert _buscar(cache, "ayuda para los autónomos") == "{}"
+    assert cache.stats()["similar_hits"] == 1
+
+
+def test_negaciones_y_preposiciones_no_se_confunden():
+    cache = _cache()
+    _guardar(cache, "ayudas con autónomos", '{"con": true}')
+    assert _buscar(cache, "ayudas sin autónomos") is None
+    assert _buscar(cache, "ayudas con autónomos") == '{"con": true}'
+
+
+def test_marcadores():
+    assert marcadores("Ayudas SIN autónomos, no para pymes") == "sin no para"
+
+
+def test_plantilla_no_cacheada():
+    cache = _cache()
+    cache.put("generate_search_summary", "modelo", "prompt", "respuesta")
+    assert cache.get("generate_search_summary", "modelo", "prompt") is None
@@ -0,0 +1,103 @@
+"""Tests de los paginadores con páginas pedidas por adelantado."""
+import threading
+from concurrent.futures import Future
+from services import infosubvenciones_service
+from services.infosubvenciones_service import PaginadorConvocatorias, PaginadorRegistros
+from services.worker_pool import ServicioSaturadoError
+
+
+class _ServicioFalso:
+    """Sirve `total` resultados en páginas de `por_pagina` y anota las pedidas."""
+
+    def __init__(self, total, por_pagina):
+        self.total = total
+        self.por_pagina = por_pagina
+        self.pedidas = []
+        self._lock = threading.Lock()
+
+    def _pagina(self, page):
+        with self._lock:
+            self.pedidas.append(page)
+        inicio = page * self.por_pagina
+        contenido = [{"id": i} for i in range(inicio, min(inicio + self.por_pagina,
+                                                          self.total))]
+        return {"content": contenido, "totalElements": self.total,
+                "totalPages": -(-self.total // self.por_pagina), "number": page}
+
+    def buscar_pagina(self, params, page=None, usar_espejo=True):
+        del params, usar_espejo
+        return self._pagina(page or 0)
+
+    def buscar_registros(self, endpoint, params, page=None):
+        del endpoint, params
+        return self._pagina(page or 0)
+
+
+def test_convocatorias_no_pide_paginas_fuera_del_presupuesto():
+    servicio = _ServicioFalso(total=500, por_pagina=50)
+    paginador = PaginadorConvocatorias(servicio, {}, max_items=60, prefetch=3)
+    assert len(list(paginador)) == 60
+    assert sorted(servicio.pedidas) == [0, 1]
+    assert not paginador.completo
+
+
+def test_convocatorias_recorre_todo_sin_presupuesto():
+    servicio = _ServicioFalso(total=120, por_pagina=50)
+    paginador = PaginadorConvocatorias(servicio, {}, prefetch=2)
+    assert [i["id"] for i in paginador] == list(range(120))
+    assert paginador.completo
+
+
+def test_registros_respeta_el_presupuesto():
+    servicio = _ServicioFalso(total=5000, por_pagina=1000)
+    paginador = PaginadorRegistros(servicio, "concesiones/busqueda", {}, max_items=1500)
+    assert len(list(paginador)) == 1500
+    assert sorted(servicio.pedidas) == [0, 1]
+    assert not paginador.completo
+
+
+def test_convocatorias_se_detiene_al_cancelar():
+    servicio = _ServicioFalso(total=1000, por_pagina=10)
+    cancelado = threading.Event()
+    paginador = PaginadorConvocatorias(servicio, {}, max_items=1000, prefetch=2,
+                                       cancelado=cancelado)
+    emitidos = 0
+    for _ in paginador:
+        emitidos += 1
+        if emitidos == 15:
+            cancelado.set()
+    assert emitidos == 20
+    assert len(servicio.pedidas) <= 4
+    assert not paginador.completo
+
+
+class _PoolSaturado:
+    """Pool que acepta `huecos` tareas (ejecutándolas al momento) y luego rechaza."""
+
+    def __init__(self, huecos):
+        self.huecos = huecos
+
+    def submit(self, fn, *args, group=None):
+        del group
+        if self.huecos <= 0:
+            raise ServicioSaturadoError("Cola de trabajo saturada")
+        self.huecos -= 1
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+def test_convocatorias_con_el_pool_saturado(monkeypatch):
+    monkeypatch.setattr(infosubvenciones_service, "shared_executor", _PoolSaturado(2))
+    servicio = _ServicioFalso(total=100, por_pagina=10)
+    paginador = PaginadorConvocatorias(servicio, {}, prefetch=3)
+    assert [i["id"] for i in paginador] == list(range(30))
+    assert not paginador.completo
+
+
+def test_registros_con_el_pool_saturado(monkeypatch):
+    monkeypatch.setattr(infosubvenciones_service, "shared_executor", _PoolSaturado(0))
+    servicio = _ServicioFalso(total=5000, por_pagina=1000)
+    paginador = PaginadorRegistros(servicio, "concesiones/busqueda", {})
+    assert len(list(paginador)) == 1000
+    assert not paginador.completo
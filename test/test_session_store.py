@@ -0,0 +1,80 @@
+"""Tests del almacén de sesiones y del checkpointer acotado."""
+import operator
+import threading
+from typing import Annotated, List, TypedDict
+import pytest
+from services.session_store import (InMemorySessionStore, KeyValueSessionStore,
+                                    PruningMemorySaver, SessionStore, SQLiteKV)
+
+
+def test_session_store_es_abstracto():
+    with pytest.raises(TypeError):
+        SessionStore()  # pylint: disable=abstract-class-instantiated
+
+
+@pytest.fixture(params=["memoria", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memoria":
+        return InMemorySessionStore(max_turns=3, ttl=60)
+    return KeyValueSessionStore(SQLiteKV(str(tmp_path / "sesiones.db")), max_turns=3, ttl=60)
+
+
+def test_append_conserva_los_ultimos_turnos(store):
+    for i in range(5):
+        store.append("hilo", f"q{i}", f"r{i}")
+    assert store.get("hilo") == [("q2", "r2"), ("q3", "r3"), ("q4", "r4")]
+    store.delete("hilo")
+    assert store.get("hilo") == []
+
+
+class _ClienteRoto:
+    def get(self, key):
+        raise ConnectionError(key)
+
+    def set(self, key, value, ex=None):
+        raise ConnectionError(key)
+
+    def delete(self, key):
+        raise ConnectionError(key)
+
+
+def test_backend_caido_no_propaga_errores():
+    store = KeyValueSessionStore(_ClienteRoto())
+    store.append("hilo", "q", "r")
+    assert store.get("hilo") == []
+    store.delete("hilo")
+
+
+def test_pruning_memory_saver_conserva_los_ultimos_checkpoints():
+    pytest.importorskip("langgraph.graph")
+    # pylint: disable=import-outside-toplevel
+    from langgraph.graph import END, StateGraph
+
+    class Estado(TypedDict):
+        turnos: Annotated[List[int], operator.add]
+
+    grafo = StateGraph(Estado)
+    grafo.add_node("turno", lambda estado: {"turnos": [len(estado["turnos"])]})
+    grafo.set_entry_point("turno")
+    grafo.add_edge("turno", END)
+    saver = PruningMemorySaver(keep_last=2, max_threads=10, ttl=60)
+    app = grafo.compile(checkpointer=saver)
+    config = {"configurable": {"thread_id": "hilo"}}
+    for _ in range(4):
+        resultado = app.invoke({"turnos": []}, config)
+    assert resultado["turnos"] == [0, 1, 2, 3]
+    stats = saver.stats()
+    assert stats["checkpoints"] == 2
+    assert stats["pruned"]["checkpoints"] > 0
+
+
+def test_append_concurrente_no_pierde_turnos():
+    store = InMemorySessionStore(max_turns=1000, ttl=60)
+    hilos = [threading.Thread(target=lambda n=n: [store.append("hilo", f"q{n}-{i}", "r")
+                                                   for i in range(50)])
+             for n in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert len(store.get("hilo")) == 400
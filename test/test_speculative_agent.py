@@ -0,0 +1,58 @@
+"""Tests de la ejecución especulativa de la rama de búsqueda."""
+import threading
+from agents.speculative_agent import SpeculativeIntentAgent
+
+
+class _Extractor:
+    fused_extraction = False
+
+    def __init__(self, intent):
+        self.intent = intent
+        self.clasificando = threading.Event()
+
+    def route_intent_locally(self, state):
+        del state
+
+    def extract_search_params(self, state):
+        del state
+        return {"api_call_params": {"descripcion": "digitalizacion"}}
+
+    def classify_intent(self, state):
+        del state
+        self.clasificando.wait(1)
+        return {"intent": self.intent}
+
+
+class _ApiCaller:
+    def __init__(self, extractor):
+        self.extractor = extractor
+        self.cancelado = None
+
+    def search(self, state, cancelado=None):
+        del state
+        self.cancelado = cancelado
+        self.extractor.clasificando.set()
+        return {"api_response_data": {"content": [1, 2]}}
+
+
+def _agente(intent):
+    extractor = _Extractor(intent)
+    api_caller = _ApiCaller(extractor)
+    agente = SpeculativeIntentAgent(extractor, api_caller)
+    agente.speculate_api = True
+    return agente, api_caller
+
+
+def test_especulacion_usada_si_gana_la_busqueda():
+    agente, _ = _agente("BUSCAR_CONVOCATORIAS_GENERAL")
+    resultado = agente.determine_intent({"original_query": "ayudas"})
+    assert resultado["api_response_data"] == {"content": [1, 2]}
+    assert agente.stats()["used"] == 1
+
+
+def test_especulacion_cancelada_si_no_es_busqueda():
+    agente, api_caller = _agente("GENERAL_CONVERSATION")
+    resultado = agente.determine_intent({"original_query": "hola"})
+    assert resultado == {"intent": "GENERAL_CONVERSATION"}
+    assert api_caller.cancelado.is_set()
+    assert agente.stats()["discarded"] == 1
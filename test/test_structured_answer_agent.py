@@ -0,0 +1,49 @@
+"""Tests de las respuestas estructuradas (tablas sin LLM)."""
+import pytest
+from agents import structured_answer_agent
+from agents.structured_answer_agent import StructuredAnswerAgent, formatear_importe
+from services.beneficiarios_analytics import BeneficiariosAnalytics
+
+
+def _registro(anno, beneficiario, importe):
+    return {"ejercicio": anno, "beneficiario": beneficiario, "importe": importe}
+
+
+class _Servicio:
+    def obtener_beneficiarios_por_anno(self, annos):
+        datos = {2022: [("A", 100.0), ("B", 300.0)], 2023: [("A", 500.0)]}
+        return {"content": [_registro(a, b, i) for a in annos for b, i in datos[a]]}
+
+
+@pytest.fixture
+def agente(monkeypatch):
+    monkeypatch.setattr(structured_answer_agent, "beneficiarios_analytics",
+                        BeneficiariosAnalytics(_Servicio(), ttl=60, maxsize=4))
+    return StructuredAnswerAgent({}, top_n=5, narrative=False)
+
+
+def test_formatear_importe():
+    assert formatear_importe(1234567.5) == "1.234.567,50 €"
+
+
+def test_tabla_de_beneficiarios_por_anno(agente):
+    estado = {"original_query": "beneficiarios 2022 y 2023",
+              "api_response_data": {"2023": [{}], "2022": [{}]}}
+    texto = agente.generate_beneficiaries_summary(estado)["agent_response_text"]
+    assert texto.index("### Beneficiarios 2022") < texto.index("### Beneficiarios 2023")
+    assert "| 1 | B | 300,00 € |" in texto
+    assert "### Totales por año" in texto
+    assert "### Mayores beneficiarios 2022-2023" in texto
+    assert "| 1 | A | 600,00 € | 2 |" in texto
+
+
+def test_claves_no_numericas_no_rompen_la_tabla(agente):
+    estado = {"original_query": "beneficiarios",
+              "api_response_data": {"error": "Año no válido", "2022": [{}],
+                                    "2023": [], "N/D": [{}]}}
+    texto = agente.generate_beneficiaries_summary(estado)["agent_response_text"]
+    assert (texto.index("### Beneficiarios 2022") < texto.index("### Beneficiarios N/D")
+            < texto.index("### Beneficiarios error"))
+    assert "No se encontraron datos para el año 2023." in texto
+    assert "Año no válido" in texto
+    assert "### Totales por año" not in texto
@@ -0,0 +1,75 @@
+"""Tests del troceado de textos y del resumen map-reduce."""
+import asyncio
+from types import SimpleNamespace
+from summarizer import CHARS_PER_TOKEN, MapReduceSummarizer, count_tokens, split_chunks
+
+
+def _max_chars(tokens):
+    return int(tokens * CHARS_PER_TOKEN)
+
+
+def test_agrupa_lineas_sin_pasarse():
+    lineas = [f"línea {i:02d} " + "x" * 20 for i in range(30)]
+    fragmentos = split_chunks("\n".join(lineas), max_tokens=30)
+    assert all(len(f) <= _max_chars(30) for f in fragmentos)
+    assert "\n".join(fragmentos).split("\n") == lineas
+    assert len(fragmentos) > 1
+
+
+def test_corta_las_lineas_que_no_caben():
+    texto = "a" * (_max_chars(10) * 2 + 5)
+    fragmentos = split_chunks(texto, max_tokens=10)
+    assert [len(f) for f in fragmentos] == [_max_chars(10), _max_chars(10), 5]
+    assert "".join(fragmentos) == texto
+
+
+def test_omite_fragmentos_vacios():
+    assert split_chunks("\n\n   \n") == []
+    assert split_chunks("") == []
+
+
+class _CacheVacia:
+    def resumen(self, clave):
+        del clave
+
+    def guardar_resumen(self, clave, texto):
+        del clave, texto
+
+
+class _ClienteFalso:
+    """Responde a cada prompt con `responder(prompt)` y anota los prompts."""
+
+    def __init__(self, responder):
+        self.prompts = []
+
+        async def generate_content(model, contents):
+            del model
+            self.prompts.append(contents)
+            return SimpleNamespace(text=responder(contents))
+
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content=generate_content))
+
+
+def _summarizer(cliente, **kwargs):
+    return MapReduceSummarizer(cliente, "modelo", cache=_CacheVacia(),
+                               chunk_tokens=50, max_concurrency=2, **kwargs)
+
+
+def test_reduce_termina_aunque_el_llm_devuelva_textos_largos():
+    cliente = _ClienteFalso(lambda prompt: "largo " * 200)
+    summarizer = _summarizer(cliente, max_reduce_levels=3)
+    parciales = [f"parte {i} " + "x" * 150 for i in range(4)]
+    resultado = asyncio.run(summarizer._reduce(  # pylint: disable=protected-access
+        parciales, asyncio.Semaphore(2)))
+    assert count_tokens(resultado) <= 50
+    assert len(cliente.prompts) <= 3 * len(parciales)
+
+
+def test_secciones_con_el_mismo_titulo_no_se_mezclan():
+    cliente = _ClienteFalso(lambda prompt: "ok")
+    summarizer = _summarizer(cliente)
+    secciones = [("Anexo", "primero " * 60), ("Anexo", "segundo " * 60)]
+    asyncio.run(summarizer.resumir(secciones))
+    mapeados = [p for p in cliente.prompts if p.startswith("Resume el siguiente")]
+    assert any("primero" in p for p in mapeados)
+    assert any("segundo" in p for p in mapeados)
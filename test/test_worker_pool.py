@@ -0,0 +1,40 @@
+"""Tests del limitador de tasa compartido."""
+import pytest
+from services import worker_pool
+from services.worker_pool import ServicioSaturadoError, TokenBucket
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    """Reloj monotónico detenido que el test avanza a mano."""
+    ahora = [1000.0]
+    monkeypatch.setattr(worker_pool.time, "monotonic", lambda: ahora[0])
+    return ahora
+
+
+def test_rafaga_sin_espera_y_luego_huecos_en_orden(reloj):
+    bucket = TokenBucket(rate=2.0, burst=3, max_wait=10)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert [bucket.reserve() for _ in range(3)] == pytest.approx([0.5, 1.0, 1.5])
+    reloj[0] += 10
+    assert bucket.reserve() == 0.0
+
+
+def test_rechaza_si_la_espera_supera_el_maximo(reloj):
+    del reloj
+    bucket = TokenBucket(rate=1.0, burst=1, max_wait=2)
+    for esperado in (0.0, 1.0, 2.0):
+        assert bucket.reserve() == pytest.approx(esperado)
+    with pytest.raises(ServicioSaturadoError):
+        bucket.reserve()
+    stats = bucket.stats()
+    assert stats["rejected"] == 1 and stats["max_wait_ms"] == pytest.approx(2000)
+
+
+def test_los_rechazos_no_consumen_hueco(reloj):
+    bucket = TokenBucket(rate=1.0, burst=1, max_wait=0.5)
+    bucket.reserve()
+    with pytest.raises(ServicioSaturadoError):
+        bucket.reserve()
+    reloj[0] += 1
+    assert bucket.reserve() == 0.0